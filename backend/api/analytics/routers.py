@@ -13,6 +13,7 @@ from database.db import (
     users_cboxes_relation,
 )
 from fastapi import APIRouter, Depends, HTTPException
+from functions.auth_cache import resolve_token
 from functions.helpers import get_filters_analytics
 from sqlalchemy import func, select
 
@@ -30,8 +31,7 @@ async def analytics(
     type: str = f"{PaymentType.incoming}, {PaymentType.outgoing}",
 ):
     """Аналитика платежей"""
-    query_user = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query_user)
+    user = await resolve_token(token)
     if user:
         if user.status:
             filters = get_filters_analytics(filter_schema)
@@ -128,8 +128,7 @@ async def analytics(
             yield start_date + timedelta(n)
 
     """Аналитика карт лояльности"""
-    query_user = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query_user)
+    user = await resolve_token(token)
     if user:
         if user.status:
             start_date = datetime.fromtimestamp(date_from)
@@ -202,9 +201,7 @@ async def contragents_duplicates_analytics(
     limit: int = 100,
     sort_asc: bool = True,
 ):
-    user = await database.fetch_one(
-        users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    )
+    user = await resolve_token(token)
     if not user or not user.status:
         raise HTTPException(status_code=403, detail="Вы ввели некорректный токен!")
 
@@ -12,9 +12,9 @@ from database.db import (
     apple_push_tokens,
     database,
     loyality_cards,
-    users_cboxes_relation,
 )
 from fastapi import APIRouter, HTTPException, Request, Response
+from functions.auth_cache import resolve_token
 from sqlalchemy import String, cast, select
 
 router = APIRouter(tags=["apple-wallet"])
@@ -24,10 +24,7 @@ router = APIRouter(tags=["apple-wallet"])
 
 @router.post("/create_apple_wallet_card")
 async def create_apple_wallet_card(token: str, card_id: int):
-    user_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    user = await database.fetch_one(user_query)
+    user = await resolve_token(token)
 
     if not user:
         raise HTTPException(status_code=401, detail="Неверный токен")
@@ -190,10 +187,7 @@ async def get_passes_for_device(
 
 @router.post("/ask_update_pass")
 async def renew_pass(token: str, card_id: int):
-    user_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    user = await database.fetch_one(user_query)
+    user = await resolve_token(token)
 
     if not user:
         raise HTTPException(status_code=401, detail="Неверный токен")
@@ -206,10 +200,7 @@ async def renew_pass(token: str, card_id: int):
 
 @router.get("/link_to_card")
 async def link_to_card(token: str, card_id: int):
-    user_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    user = await database.fetch_one(user_query)
+    user = await resolve_token(token)
 
     if not user:
         raise HTTPException(status_code=401, detail="Неверный токен")
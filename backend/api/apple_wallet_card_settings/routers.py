@@ -14,10 +14,10 @@ from database.db import (
     apple_wallet_card_settings,
     database,
     loyality_cards,
-    users_cboxes_relation,
 )
 from fastapi import APIRouter, File, HTTPException, Response, UploadFile
 from fastapi.responses import JSONResponse
+from functions.auth_cache import resolve_token
 from producer import publish_apple_wallet_pass_update
 from sqlalchemy import select
 from starlette.staticfiles import StaticFiles
@@ -82,10 +82,7 @@ async def upload_file(file: UploadFile = File(...)):
 
 @router.get("", response_model=WalletCardSettings)
 async def get_apple_wallet_card_settings(token: str):
-    user_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    user = await database.fetch_one(user_query)
+    user = await resolve_token(token)
 
     if not user:
         raise HTTPException(status_code=401, detail="Неверный токен")
@@ -103,10 +100,7 @@ async def get_apple_wallet_card_settings(token: str):
 
 @router.post("", response_model=WalletCardSettings)
 async def create_apple_wallet_card_settings(token: str, settings: WalletCardSettings):
-    user_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    user = await database.fetch_one(user_query)
+    user = await resolve_token(token)
 
     if not user:
         raise HTTPException(status_code=401, detail="Неверный токен")
@@ -126,10 +120,7 @@ async def create_apple_wallet_card_settings(token: str, settings: WalletCardSett
 @router.patch("", response_model=WalletCardSettings)
 async def update_apple_wallet_card_settings(token: str, settings: WalletCardSettings):
     # Найти пользователя по токену
-    user_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    user = await database.fetch_one(user_query)
+    user = await resolve_token(token)
 
     if not user:
         raise HTTPException(status_code=401, detail="Неверный токен")
@@ -3,8 +3,9 @@ from datetime import datetime
 import aiofiles
 import api.articles.schemas as article_schemas
 import functions.filter_schemas as filter_schemas
-from database.db import articles, database, users_cboxes_relation
+from database.db import articles, database
 from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from functions.auth_cache import resolve_token
 from functions.helpers import check_article_exists, get_filters_articles
 from sqlalchemy import asc, desc, func, select
 from ws_manager import manager
@@ -15,8 +16,7 @@ router = APIRouter(tags=["articles"])
 @router.get("/articles/{id}/", response_model=article_schemas.Article)
 async def get_article_by_id(token: str, id: int):
     """Получение статьи по ID"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             query = articles.select().where(
@@ -40,8 +40,7 @@ async def get_articles(
     filters: filter_schemas.ArticlesFiltersQuery = Depends(),
 ):
     """Получение статей кассы"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             filters = get_filters_articles(articles, filters)
@@ -91,8 +90,7 @@ async def get_articles(
 @router.post("/articles/")
 async def new_article(token: str, article: article_schemas.ArticleCreate):
     """Создание статьи"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             created = int(datetime.utcnow().timestamp())
@@ -130,8 +128,7 @@ async def new_article(token: str, article: article_schemas.ArticleCreate):
 @router.patch("/articles/")
 async def edit_article(token: str, article: article_schemas.ArticleEdit):
     """Редактирование статьи"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             query = articles.select().where(
@@ -202,8 +199,7 @@ async def add_icon_to_article(
     token: str, article_id: int, icon_file: UploadFile = File(...)
 ):
     """Изменить иконку статьи"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if user:
         if user.status:
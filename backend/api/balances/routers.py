@@ -10,6 +10,7 @@ from database.db import (
     users_cboxes_relation,
 )
 from fastapi import APIRouter, HTTPException
+from functions.auth_cache import resolve_token
 from sqlalchemy import func, select
 from texts import url_link_pay
 
@@ -19,8 +20,7 @@ router = APIRouter(tags=["account"])
 @router.get("/account/info/", response_model=AccountInfo)
 async def get_account_info(token: str):
     """Получение информации об аккаунте и оплате"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             balance = await database.fetch_one(
@@ -82,8 +82,7 @@ async def get_account_info(token: str):
 
 @router.post("/account/balance/create", status_code=201)
 async def create_balance(token: str, balance_data: BalanceCreate = None):
-    query = users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if not user or not user.status:
         raise HTTPException(status_code=403, detail="Вы ввели некорректный токен!")
@@ -160,8 +159,7 @@ async def create_balance(token: str, balance_data: BalanceCreate = None):
 
 @router.get("/tariffs/")
 async def get_tariffs(token: str):
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if not user or not user.status:
         raise HTTPException(status_code=403, detail="Вы ввели некорректный токен!")
@@ -27,23 +27,17 @@ from database.db import (
     tariffs,
     transactions,
     users,
-    users_cboxes_relation,
     users_cboxes_relation as ucr,
 )
+from functions.auth_cache import resolve_token
 
 router = APIRouter(prefix="/transactions", tags=["transactions"])
 tinkoff_router = APIRouter(prefix="/payments/tinkoff", tags=["tinkoff"])
 
 
-def get_user_from_token(token: str):
-    query = users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    return query
-
-
 async def verify_user(token: str):
     """Verify user token and return user relation"""
-    query = get_user_from_token(token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if not user or not user.status:
         raise HTTPException(status_code=403, detail="Invalid or inactive token")
     return user
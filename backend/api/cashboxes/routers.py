@@ -5,6 +5,7 @@ import functions.filter_schemas as filter_schemas
 from api.cashboxes.schemas import CashboxUpdate
 from database.db import cboxes, database, users, users_cboxes_relation
 from fastapi import APIRouter, Depends, HTTPException
+from functions.auth_cache import invalidate_token_cache, resolve_token
 from functions.helpers import get_filters_users, raise_wrong_token
 from sqlalchemy import asc, desc
 from ws_manager import manager
@@ -21,8 +22,7 @@ async def read_cashbox_users(
     filters: filter_schemas.UsersFiltersQuery = Depends(),
 ):
     """Получение юзеров кассы"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if not user or not user.status:
         raise_wrong_token()
@@ -104,8 +104,7 @@ async def edit_cashbox_user(
     status: Optional[bool] = None,
 ):
     """Обновление статуса юзера кассы"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if not data:
         data = {}
     else:
@@ -125,6 +124,9 @@ async def edit_cashbox_user(
                     .values(**data)
                 )
                 await database.execute(q)
+                await invalidate_token_cache(
+                    cashbox_id=user.cashbox_id, user_id=user_id
+                )
 
             q = users_cboxes_relation.select().where(
                 users_cboxes_relation.c.cashbox_id == user.cashbox_id,
@@ -164,8 +166,7 @@ async def edit_cashbox_user(
 @router.get("/cashboxes_meta/")
 async def read_payments_meta(token: str, limit: int = 100, offset: int = 0):
     """Мета юзеров кассы"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             cboxes_list = []
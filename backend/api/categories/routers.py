@@ -1,7 +1,6 @@
-import asyncio
-
 import api.categories.schemas as schemas
-from database.db import categories, database, nomenclature, pictures
+from api.categories.tree import invalidate_categories_tree
+from database.db import categories, database, pictures
 from fastapi import APIRouter, HTTPException
 from functions.helpers import (
     check_entity_exists,
@@ -9,8 +8,6 @@ from functions.helpers import (
     get_entity_by_id,
     get_user_by_token,
 )
-from memoization import CachingAlgorithmFlag, cached
-from sqlalchemy import func, select
 from ws_manager import manager
 
 router = APIRouter(tags=["categories"])
@@ -67,6 +64,7 @@ async def delete_category_photo(token: str, idx: int):
     )
 
     picture_db = await database.fetch_one(query)
+    invalidate_categories_tree(user.cashbox_id)
 
     if not picture_db:
         raise HTTPException(
@@ -79,50 +77,6 @@ async def delete_category_photo(token: str, idx: int):
     return category_db
 
 
-async def build_hierarchy(data, parent_id=None, name=None):
-    @cached(max_size=128, algorithm=CachingAlgorithmFlag.FIFO, thread_safe=False)
-    async def build_children(parent_id):
-
-        children = []
-        for item in data:
-            item = datetime_to_timestamp(item)
-            item["children"] = []
-            item["key"] = item["id"]
-
-            nomenclature_in_category = (
-                select(func.count(nomenclature.c.id).label("nom_count"))
-                .where(
-                    nomenclature.c.category == item.get("id"),
-                    nomenclature.c.name.ilike(f"%{name}%") if name else True,
-                )
-                .group_by(nomenclature.c.category)
-            )
-            nomenclature_in_category_result = await database.fetch_one(
-                nomenclature_in_category
-            )
-
-            item["nom_count"] = (
-                0
-                if not nomenclature_in_category_result
-                else nomenclature_in_category_result.nom_count
-            )
-
-            item["expanded_flag"] = False
-            if item["parent"] == parent_id:
-                grandchildren = await build_children(item["id"])
-                if grandchildren:
-                    item["children"] = grandchildren
-
-                if (item["nom_count"] == 0) and (name is not None):
-                    continue
-                children.append(item)
-        return children
-
-    tasks = [build_children(parent_id)]
-    results = await asyncio.gather(*tasks)
-    return results[0]
-
-
 @router.post("/categories/", response_model=schemas.CategoryList)
 async def new_categories(token: str, categories_data: schemas.CategoryCreateMass):
     """Создание категорий"""
@@ -150,6 +104,8 @@ async def new_categories(token: str, categories_data: schemas.CategoryCreateMass
         category_id = await database.execute(query)
         inserted_ids.add(category_id)
 
+    invalidate_categories_tree(user.cashbox_id)
+
     query = categories.select().where(
         categories.c.owner == user.id, categories.c.id.in_(inserted_ids)
     )
@@ -194,6 +150,7 @@ async def edit_category(
             .values(category_values)
         )
         await database.execute(query)
+        invalidate_categories_tree(user.cashbox_id)
         category_db = await get_entity_by_id(categories, idx, user.id)
 
     category_db = datetime_to_timestamp(category_db)
@@ -219,6 +176,7 @@ async def delete_category(token: str, idx: int):
         .values({"is_deleted": True})
     )
     await database.execute(query)
+    invalidate_categories_tree(user.cashbox_id)
 
     query = categories.select().where(
         categories.c.id == idx, categories.c.cashbox == user.cashbox_id
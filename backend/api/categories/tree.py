@@ -0,0 +1,178 @@
+"""
+Дерево категорий кассы.
+
+Категории кассы загружаются одним запросом, количество номенклатуры -
+одним GROUP BY по категориям, дерево собирается за линейное время по
+индексу parent -> children.
+
+Снимок кассы хранится в памяти процесса CATEGORIES_TREE_CACHE_SECONDS
+и сбрасывается при записи категорий и номенклатуры этим процессом
+(invalidate_categories_tree). Остальные воркеры API увидят изменения по
+истечении TTL
+"""
+
+import os
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional
+
+from database.db import categories, database, nomenclature, pictures
+from functions.helpers import datetime_to_timestamp
+from sqlalchemy import func, select
+
+CATEGORIES_TREE_CACHE_SECONDS = int(os.getenv("CATEGORIES_TREE_CACHE_SECONDS", 60))
+CATEGORIES_TREE_CACHE_SIZE = int(os.getenv("CATEGORIES_TREE_CACHE_SIZE", 256))
+# Наборы nom_count по фильтру названия, хранимые в снимке кассы
+CATEGORIES_TREE_NAME_FILTERS = 32
+
+
+def picture_url(picture: Optional[str]) -> Optional[str]:
+    """Путь из БД в абсолютный URL /api/v1/photos/{file_key}"""
+    if not picture or picture.startswith(("http://", "https://")):
+        return picture
+    file_key = picture.replace("\\", "/").lstrip()
+    if file_key.startswith("photos/"):
+        file_key = file_key[len("photos/") :]
+    base_url = os.getenv("BASE_URL", "https://app.tablecrm.com")
+    return base_url.rstrip("/") + "/api/v1/photos/" + file_key.lstrip("/")
+
+
+class CategoriesTree:
+    """Снимок категорий кассы с индексом parent -> children"""
+
+    def __init__(self, cashbox_id: int, rows: List[dict]):
+        self.cashbox_id = cashbox_id
+        self.nodes: Dict[int, dict] = {row["id"]: row for row in rows}
+        self.children: Dict[Optional[int], List[int]] = defaultdict(list)
+        for row in rows:
+            self.children[row["parent"]].append(row["id"])
+        self.nom_counts: Dict[Optional[str], Dict[int, int]] = OrderedDict()
+        self.expires_at = time.monotonic() + CATEGORIES_TREE_CACHE_SECONDS
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def roots(self) -> List[dict]:
+        """Неудаленные категории верхнего уровня"""
+        return [
+            self.nodes[idx]
+            for idx in self.children.get(None, [])
+            if not self.nodes[idx]["is_deleted"]
+        ]
+
+    def count(self) -> int:
+        return sum(1 for node in self.nodes.values() if not node["is_deleted"])
+
+    async def get_nom_counts(self, name: Optional[str] = None) -> Dict[int, int]:
+        key = name or None
+        if key in self.nom_counts:
+            self.nom_counts.move_to_end(key)
+            return self.nom_counts[key]
+
+        query = (
+            select(
+                nomenclature.c.category,
+                func.count(nomenclature.c.id).label("nom_count"),
+            )
+            .where(
+                nomenclature.c.category.in_(
+                    select(categories.c.id).where(
+                        categories.c.cashbox == self.cashbox_id
+                    )
+                ),
+                nomenclature.c.name.ilike(f"%{name}%") if name else True,
+            )
+            .group_by(nomenclature.c.category)
+        )
+        rows = await database.fetch_all(query)
+        counts = {row.category: row.nom_count for row in rows}
+
+        self.nom_counts[key] = counts
+        if len(self.nom_counts) > CATEGORIES_TREE_NAME_FILTERS:
+            self.nom_counts.popitem(last=False)
+        return counts
+
+    def node(
+        self, idx: int, nom_counts: Dict[int, int], include_photo: bool = True
+    ) -> dict:
+        item = datetime_to_timestamp(self.nodes[idx])
+        item["key"] = item["id"]
+        item["nom_count"] = nom_counts.get(idx, 0)
+        item["expanded_flag"] = False
+        item["children"] = []
+        if include_photo:
+            item["picture"] = picture_url(item.get("picture"))
+        else:
+            item.pop("picture", None)
+        return item
+
+    def build_children(
+        self,
+        parent_id: int,
+        nom_counts: Dict[int, int],
+        name: Optional[str] = None,
+        include_photo: bool = True,
+        _path: frozenset = frozenset(),
+    ) -> List[dict]:
+        """
+        Поддерево категории. При фильтре по названию категории без
+        подходящей номенклатуры пропускаются
+        """
+        path = _path | {parent_id}
+        result = []
+        for idx in self.children.get(parent_id, []):
+            if idx in path:
+                # Цикл в parent: категория уже есть выше по ветке
+                continue
+            item = self.node(idx, nom_counts, include_photo)
+            item["children"] = self.build_children(
+                idx, nom_counts, name, include_photo, path
+            )
+            if item["nom_count"] == 0 and name is not None:
+                continue
+            result.append(item)
+        return result
+
+
+class CategoriesTreeCache:
+    def __init__(self, max_size: int = CATEGORIES_TREE_CACHE_SIZE):
+        self.max_size = max_size
+        self.trees: "OrderedDict[int, CategoriesTree]" = OrderedDict()
+
+    async def get(self, cashbox_id: int) -> CategoriesTree:
+        tree = self.trees.get(cashbox_id)
+        if tree is not None and not tree.expired:
+            self.trees.move_to_end(cashbox_id)
+            return tree
+
+        query = (
+            select(categories, pictures.c.url.label("picture"))
+            .select_from(
+                categories.outerjoin(pictures, categories.c.photo_id == pictures.c.id)
+            )
+            .where(categories.c.cashbox == cashbox_id)
+            .order_by(categories.c.id)
+        )
+        rows = await database.fetch_all(query)
+        tree = CategoriesTree(cashbox_id, [dict(row) for row in rows])
+
+        self.trees[cashbox_id] = tree
+        self.trees.move_to_end(cashbox_id)
+        if len(self.trees) > self.max_size:
+            self.trees.popitem(last=False)
+        return tree
+
+    def invalidate(self, cashbox_id: Optional[int] = None):
+        if cashbox_id is None:
+            self.trees.clear()
+        else:
+            self.trees.pop(cashbox_id, None)
+
+
+categories_tree_cache = CategoriesTreeCache()
+
+
+def invalidate_categories_tree(cashbox_id: Optional[int] = None):
+    """Сброс снимка дерева после записи категорий или номенклатуры"""
+    categories_tree_cache.invalidate(cashbox_id)
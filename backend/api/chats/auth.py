@@ -1,9 +1,8 @@
 from typing import Optional
 
-from database.db import database, users_cboxes_relation
 from fastapi import Header, HTTPException, Query, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy import select
+from functions.auth_cache import resolve_token
 
 security_scheme = HTTPBearer(auto_error=False)
 
@@ -26,17 +25,7 @@ async def get_current_user(
             detail="Token required. Provide token as query parameter (?token=...) or Authorization header (Bearer ...)",
         )
 
-    query = select(
-        [
-            users_cboxes_relation.c.id,
-            users_cboxes_relation.c.user,
-            users_cboxes_relation.c.cashbox_id,
-            users_cboxes_relation.c.token,
-            users_cboxes_relation.c.status,
-            users_cboxes_relation.c.is_owner,
-        ]
-    ).where(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
@@ -82,17 +71,7 @@ async def get_current_user_for_avito(
             detail="Token required. Provide token as query parameter (?token=...) or Authorization header (Bearer ...)",
         )
 
-    query = select(
-        [
-            users_cboxes_relation.c.id,
-            users_cboxes_relation.c.user,
-            users_cboxes_relation.c.cashbox_id,
-            users_cboxes_relation.c.token,
-            users_cboxes_relation.c.status,
-            users_cboxes_relation.c.is_owner,
-        ]
-    ).where(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
@@ -659,6 +659,7 @@ class AvitoHandler:
                                 cashbox=cashbox_id_for_picture,
                             )
                         )
+                        await crud.set_chat_last_message_file(message["id"], file_url)
                     else:
                         logger.warning(
                             f"No file_url found for image message {message['id']}"
@@ -737,6 +738,7 @@ class AvitoHandler:
                                 cashbox=cashbox_id_for_picture,
                             )
                         )
+                        await crud.set_chat_last_message_file(message["id"], file_url)
                 except Exception as e:
                     logger.warning(
                         f"Failed to save {message_type} file for message {message['id']}: {e}"
@@ -1356,6 +1358,9 @@ class AvitoHandler:
                                             cashbox=cashbox_id,
                                         )
                                     )
+                                    await crud.set_chat_last_message_file(
+                                        db_message_id, file_url
+                                    )
                             except Exception as pic_error:
                                 logger.warning(
                                     f"Failed to save {message_type_str} for message {message_id}: {pic_error}"
@@ -20,9 +20,9 @@ from api.chats.avito.schemas import (
     AvitoHistoryLoadResponse,
     AvitoOAuthCallbackResponse,
 )
-from database.db import channel_credentials, channels, chat_messages, chats, database
+from database.db import channel_credentials, channels, chats, database
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import and_, desc, select, update
+from sqlalchemy import and_, desc, select
 
 logger = logging.getLogger(__name__)
 
@@ -777,6 +777,9 @@ async def process_single_chat(
                                                         cashbox=cashbox_id,
                                                     )
                                                 )
+                                                await crud.set_chat_last_message_file(
+                                                    existing_message["id"], file_url
+                                                )
 
                             continue
 
@@ -904,6 +907,9 @@ async def process_single_chat(
                                                 cashbox=cashbox_id,
                                             )
                                         )
+                                        await crud.set_chat_last_message_file(
+                                            message_id, file_url
+                                        )
                                 except Exception as e:
                                     logger.warning(
                                         f"Failed to save {message_type_str} file for message {external_message_id}: {e}"
@@ -1273,18 +1279,7 @@ async def mark_avito_chat_as_read(
 
         if success:
             try:
-                update_query = (
-                    update(chat_messages)
-                    .where(
-                        and_(
-                            chat_messages.c.chat_id == chat["id"],
-                            chat_messages.c.sender_type == "CLIENT",
-                            chat_messages.c.status != "READ",
-                        )
-                    )
-                    .values(status="READ")
-                )
-                await database.execute(update_query)
+                await crud.mark_chat_messages_read(chat["id"])
             except Exception as e:
                 logger.warning(f"Failed to update message statuses: {e}")
 
@@ -92,6 +92,140 @@ def _is_preview_placeholder(preview: Optional[str]) -> bool:
     }
 
 
+def _chat_summary_columns(chat_table) -> Dict[str, Any]:
+    """
+    Подзапросы для пересчета денормализованных полей chats по chat_messages:
+    счетчик непрочитанных и последнее сообщение с первым его файлом
+    """
+    unread_count = (
+        select([func.count(chat_messages.c.id)])
+        .where(
+            and_(
+                chat_messages.c.chat_id == chat_table.c.id,
+                chat_messages.c.sender_type == "CLIENT",
+                chat_messages.c.status != "READ",
+            )
+        )
+        .correlate(chat_table)
+        .scalar_subquery()
+    )
+
+    def last_message(column):
+        return (
+            select([column])
+            .where(chat_messages.c.chat_id == chat_table.c.id)
+            .order_by(desc(chat_messages.c.created_at), desc(chat_messages.c.id))
+            .limit(1)
+            .correlate(chat_table)
+            .scalar_subquery()
+        )
+
+    last_message_id = last_message(chat_messages.c.id)
+    last_message_file_url = (
+        select([pictures.c.url])
+        .where(
+            and_(
+                pictures.c.entity == "messages",
+                pictures.c.entity_id == last_message_id,
+                pictures.c.is_deleted.is_not(True),
+            )
+        )
+        .order_by(pictures.c.created_at.asc())
+        .limit(1)
+        .correlate(chat_table)
+        .scalar_subquery()
+    )
+
+    return {
+        "unread_count": unread_count,
+        "last_message_id": last_message_id,
+        "last_message_preview": last_message(
+            func.left(func.coalesce(cast(chat_messages.c.content, String), ""), 100)
+        ),
+        "last_message_file_url": last_message_file_url,
+    }
+
+
+async def refresh_chat_summary(chat_id: int):
+    """Пересчитывает денормализованные поля одного чата"""
+    await database.execute(
+        chats.update()
+        .where(chats.c.id == chat_id)
+        .values(**_chat_summary_columns(chats))
+    )
+
+
+async def repair_chat_summaries(updated_since: Optional[datetime] = None) -> int:
+    """
+    Сверяет денормализованные поля chats с chat_messages и исправляет
+    расхождения. updated_since ограничивает проверку недавно обновленными
+    чатами. Возвращает количество исправленных чатов
+    """
+    chat_alias = chats.alias("c")
+    columns = _chat_summary_columns(chat_alias)
+    actual = select(
+        [chat_alias.c.id.label("chat_id")]
+        + [expression.label(name) for name, expression in columns.items()]
+    )
+    if updated_since is not None:
+        actual = actual.where(chat_alias.c.updated_at >= updated_since)
+    actual = actual.subquery("actual")
+
+    query = (
+        chats.update()
+        .where(chats.c.id == actual.c.chat_id)
+        .where(
+            or_(*[chats.c[name].is_distinct_from(actual.c[name]) for name in columns])
+        )
+        .values(**{name: actual.c[name] for name in columns})
+        .returning(chats.c.id)
+    )
+    return len(await database.fetch_all(query))
+
+
+async def mark_chat_messages_read(chat_id: int):
+    """Отмечает входящие сообщения чата прочитанными и обнуляет счетчик"""
+    await database.execute(
+        chat_messages.update()
+        .where(
+            and_(
+                chat_messages.c.chat_id == chat_id,
+                chat_messages.c.sender_type == "CLIENT",
+                chat_messages.c.status != "READ",
+            )
+        )
+        .values(status="READ")
+    )
+    await refresh_chat_summary(chat_id)
+
+
+async def set_chat_last_message_file(message_id: int, file_url: str):
+    """Первый файл последнего сообщения чата для превью в списке чатов"""
+    await database.execute(
+        chats.update()
+        .where(
+            and_(
+                chats.c.last_message_id == message_id,
+                chats.c.last_message_file_url.is_(None),
+            )
+        )
+        .values(last_message_file_url=file_url)
+    )
+
+
+def _set_last_message_preview(chat_dict: Dict[str, Any]):
+    preview = chat_dict.get("last_message_preview")
+    if _is_preview_placeholder(preview) and chat_dict.get("last_message_file_url"):
+        preview = chat_dict.get("last_message_file_url")
+
+    if preview:
+        chat_dict["last_message_preview"] = _normalize_public_file_url(preview)
+    else:
+        chat_dict["last_message_preview"] = None
+
+    chat_dict.pop("last_message_file_url", None)
+
+
 async def create_channel(
     name: str,
     type: str,
@@ -576,6 +710,9 @@ async def get_chat(chat_id: int):
                 chats.c.metadata,
                 chats.c.created_at,
                 chats.c.updated_at,
+                chats.c.unread_count,
+                chats.c.last_message_preview,
+                chats.c.last_message_file_url,
                 channels.c.name.label("channel_name"),
                 channels.c.type.label("channel_type"),
                 channels.c.svg_icon.label("channel_icon"),
@@ -659,51 +796,7 @@ async def get_chat(chat_id: int):
             chat_dict["contact"]["avatar"]
         )
 
-    last_message_query = (
-        select([chat_messages.c.id, chat_messages.c.content])
-        .where(chat_messages.c.chat_id == chat_id)
-        .order_by(desc(chat_messages.c.created_at))
-        .limit(1)
-    )
-    last_message = await database.fetch_one(last_message_query)
-
-    preview = None
-    last_message_id = None
-    if last_message:
-        last_message_id = last_message["id"]
-        if last_message["content"]:
-            preview = last_message["content"][:100]
-
-    if last_message_id and _is_preview_placeholder(preview):
-        last_picture = await database.fetch_one(
-            select([pictures.c.url])
-            .where(
-                and_(
-                    pictures.c.entity == "messages",
-                    pictures.c.entity_id == last_message_id,
-                    pictures.c.is_deleted.is_not(True),
-                )
-            )
-            .order_by(pictures.c.created_at.asc())
-            .limit(1)
-        )
-        if last_picture and last_picture.get("url"):
-            preview = last_picture["url"]
-
-    if preview:
-        chat_dict["last_message_preview"] = _normalize_public_file_url(preview)
-    else:
-        chat_dict["last_message_preview"] = None
-
-    unread_query = select([func.count(chat_messages.c.id)]).where(
-        and_(
-            chat_messages.c.chat_id == chat_id,
-            chat_messages.c.sender_type == "CLIENT",
-            chat_messages.c.status != "READ",
-        )
-    )
-    unread_count = await database.fetch_val(unread_query) or 0
-    chat_dict["unread_count"] = unread_count
+    _set_last_message_preview(chat_dict)
 
     is_avito_chat = chat_dict.get("channel_type") == "AVITO" or (
         chat_dict.get("external_chat_id")
@@ -909,58 +1002,6 @@ async def get_chats(
     limit: int = 100,
     with_avito_info: bool = False,
 ) -> List[Dict[str, Any]]:
-    last_msg_correlated = (
-        select(
-            [func.left(func.coalesce(cast(chat_messages.c.content, String), ""), 100)]
-        )
-        .where(chat_messages.c.chat_id == chats.c.id)
-        .order_by(desc(chat_messages.c.created_at))
-        .limit(1)
-        .correlate(chats)
-        .scalar_subquery()
-    )
-
-    last_message_id_subquery = (
-        select([chat_messages.c.id])
-        .where(chat_messages.c.chat_id == chats.c.id)
-        .order_by(desc(chat_messages.c.created_at))
-        .limit(1)
-        .correlate(chats)
-        .scalar_subquery()
-    )
-
-    last_picture_url_subquery = (
-        select([pictures.c.url])
-        .where(
-            and_(
-                pictures.c.entity == "messages",
-                pictures.c.entity_id == last_message_id_subquery,
-                pictures.c.is_deleted.is_not(True),
-            )
-        )
-        .order_by(pictures.c.created_at.asc())
-        .limit(1)
-        .correlate(chats)
-        .scalar_subquery()
-    )
-
-    unread_count_subquery = (
-        select(
-            [
-                chat_messages.c.chat_id,
-                func.count(chat_messages.c.id).label("unread_count"),
-            ]
-        )
-        .where(
-            and_(
-                chat_messages.c.sender_type == "CLIENT",
-                chat_messages.c.status != "READ",
-            )
-        )
-        .group_by(chat_messages.c.chat_id)
-        .subquery("unread")
-    )
-
     query = select(
         [
             chats.c.id,
@@ -985,16 +1026,14 @@ async def get_chats(
             chat_contacts.c.email.label("contact_email"),
             chat_contacts.c.avatar.label("contact_avatar"),
             chat_contacts.c.contragent_id.label("contact_contragent_id"),
-            last_msg_correlated.label("last_message_preview"),
-            last_picture_url_subquery.label("last_message_file_url"),
-            func.coalesce(unread_count_subquery.c.unread_count, 0).label(
-                "unread_count"
-            ),
+            chats.c.last_message_preview,
+            chats.c.last_message_file_url,
+            chats.c.unread_count,
         ]
     ).select_from(
-        chats.join(channels, chats.c.channel_id == channels.c.id)
-        .outerjoin(chat_contacts, chats.c.chat_contact_id == chat_contacts.c.id)
-        .outerjoin(unread_count_subquery, unread_count_subquery.c.chat_id == chats.c.id)
+        chats.join(channels, chats.c.channel_id == channels.c.id).outerjoin(
+            chat_contacts, chats.c.chat_contact_id == chat_contacts.c.id
+        )
     )
 
     conditions = [chats.c.cashbox_id == cashbox_id]
@@ -1201,16 +1240,7 @@ async def get_chats(
                 chat_dict["contact"]["avatar"]
             )
 
-        preview = chat_dict.get("last_message_preview")
-        if _is_preview_placeholder(preview) and chat_dict.get("last_message_file_url"):
-            preview = chat_dict.get("last_message_file_url")
-
-        if preview:
-            chat_dict["last_message_preview"] = _normalize_public_file_url(preview)
-        else:
-            chat_dict["last_message_preview"] = None
-
-        chat_dict.pop("last_message_file_url", None)
+        _set_last_message_preview(chat_dict)
 
         is_avito_chat = chat_dict.get("channel_type") == "AVITO" or (
             chat_dict.get("external_chat_id")
@@ -1473,6 +1503,16 @@ async def create_message_and_update_chat(
     if not chat_updates.get("last_message_time") and not existing_last_message_time:
         chat_updates["last_message_time"] = current_time
 
+    if sender_type == "CLIENT" and status != "READ":
+        chat_updates["unread_count"] = chats.c.unread_count + 1
+
+    # Сообщение новее текущего последнего: превью списка чатов переходит на него,
+    # файл появится после сохранения вложений (set_chat_last_message_file)
+    if "last_message_time" in chat_updates:
+        chat_updates["last_message_id"] = message_id
+        chat_updates["last_message_preview"] = (content or "")[:100]
+        chat_updates["last_message_file_url"] = None
+
     if chat_updates:
         await update_chat(chat_id, **chat_updates)
 
@@ -1527,6 +1567,8 @@ async def update_message(message_id: int, **kwargs):
         chat_messages.update().where(chat_messages.c.id == message_id).values(**kwargs)
     )
     await database.execute(query)
+    if "status" in kwargs or "content" in kwargs:
+        await refresh_chat_summary(message["chat_id"])
     return await get_message(message_id)
 
 
@@ -1538,6 +1580,7 @@ async def delete_message(message_id: int):
 
     query = chat_messages.delete().where(chat_messages.c.id == message_id)
     await database.execute(query)
+    await refresh_chat_summary(message["chat_id"])
     return {"success": True}
 
 
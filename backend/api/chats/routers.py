@@ -21,9 +21,9 @@ from api.chats.schemas import (
 from api.chats.telegram.telegram_handler import refresh_telegram_avatar
 from api.chats.websocket import chat_manager
 from common.utils.url_helper import get_app_url_for_environment
-from database.db import chat_contacts, chat_messages, database, pictures
+from database.db import chat_contacts, database, pictures
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
-from sqlalchemy import and_, select, update
+from sqlalchemy import select
 
 logger = logging.getLogger(__name__)
 
@@ -620,6 +620,9 @@ async def create_message(
                                         size=len(image_data) if image_data else None,
                                     )
                                 )
+                                await crud.set_chat_last_message_file(
+                                    db_message["id"], image_url_for_db
+                                )
                             except Exception as e:
                                 logger.warning(
                                     f"Failed to save file for message {db_message['id']}: {e}"
@@ -830,6 +833,7 @@ async def create_message(
                                     cashbox=user.cashbox_id,
                                 )
                             )
+                            await crud.set_chat_last_message_file(db_message["id"], url)
                         except Exception:
                             pass
 
@@ -1054,19 +1058,7 @@ async def get_chat_messages(
                 if client:
                     try:
                         await client.mark_chat_as_read(chat["external_chat_id"])
-
-                        update_query = (
-                            update(chat_messages)
-                            .where(
-                                and_(
-                                    chat_messages.c.chat_id == chat_id,
-                                    chat_messages.c.sender_type == "CLIENT",
-                                    chat_messages.c.status != "READ",
-                                )
-                            )
-                            .values(status="READ")
-                        )
-                        await database.execute(update_query)
+                        await crud.mark_chat_messages_read(chat_id)
                     except Exception as e:
                         logger.warning(
                             f"Failed to mark chat {chat['external_chat_id']} as read: {e}"
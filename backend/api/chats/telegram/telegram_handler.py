@@ -324,6 +324,7 @@ async def _store_picture(
             size=size,
         )
     )
+    await crud.set_chat_last_message_file(message_id, file_url)
 
 
 async def _ensure_chat(
@@ -645,12 +646,10 @@ async def handle_update(
                             size=len(file_bytes),
                         )
                         if message_text.startswith("[") and message_text.endswith("]"):
-                            await database.execute(
-                                chat_messages.update()
-                                .where(chat_messages.c.id == message_db["id"])
-                                .values(
-                                    content=public_url, updated_at=datetime.utcnow()
-                                )
+                            await crud.update_message(
+                                message_db["id"],
+                                content=public_url,
+                                updated_at=datetime.utcnow(),
                             )
                             message_text = public_url
             except Exception as e:
@@ -10,6 +10,7 @@ from api.chats.producer import chat_producer
 from common.utils.url_helper import get_app_url_for_environment
 from database.db import channel_credentials, chat_messages, database, pictures
 from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from ws_manager import bus
 
 router = APIRouter(prefix="/ws", tags=["chats-ws"])
 logger = logging.getLogger(__name__)
@@ -97,14 +98,13 @@ class ChatConnectionInfo:
 
 class ChatConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[int, List[ChatConnectionInfo]] = {}
+        # chat_id -> {id(websocket): info}
+        self.active_connections: Dict[int, Dict[int, ChatConnectionInfo]] = {}
+        bus.register("chat", self.deliver)
 
     async def connect(
         self, chat_id: int, websocket: WebSocket, user_id: int, user_type: str
     ):
-        if chat_id not in self.active_connections:
-            self.active_connections[chat_id] = []
-
         connection_info = ChatConnectionInfo(
             websocket=websocket,
             user_id=user_id,
@@ -112,68 +112,58 @@ class ChatConnectionManager:
             connected_at=datetime.utcnow(),
         )
 
-        self.active_connections[chat_id].append(connection_info)
+        self.active_connections.setdefault(chat_id, {})[id(websocket)] = connection_info
 
     async def disconnect(
         self, chat_id: int, websocket: WebSocket
     ) -> Optional[ChatConnectionInfo]:
-        if chat_id in self.active_connections:
-            connection_info = None
-            for conn_info in self.active_connections[chat_id]:
-                if conn_info.websocket == websocket:
-                    connection_info = conn_info
-                    self.active_connections[chat_id].remove(conn_info)
-                    break
-
-            if not self.active_connections[chat_id]:
-                del self.active_connections[chat_id]
-
-            if connection_info:
-                return connection_info
-            else:
-                return None
-        else:
+        connections = self.active_connections.get(chat_id)
+        if connections is None:
             return None
 
+        connection_info = connections.pop(id(websocket), None)
+        if not connections:
+            del self.active_connections[chat_id]
+        return connection_info
+
     def get_connection_info(
         self, chat_id: int, websocket: WebSocket
     ) -> Optional[ChatConnectionInfo]:
-        if chat_id in self.active_connections:
-            for conn_info in self.active_connections[chat_id]:
-                if conn_info.websocket == websocket:
-                    return conn_info
-        return None
+        return self.active_connections.get(chat_id, {}).get(id(websocket))
 
     def get_connected_users(self, chat_id: int) -> List[Dict]:
-        if chat_id not in self.active_connections:
-            return []
+        return [
+            {
+                "user_id": conn_info.user_id,
+                "user_type": conn_info.user_type,
+                "connected_at": conn_info.connected_at.isoformat(),
+            }
+            for conn_info in self.active_connections.get(chat_id, {}).values()
+        ]
 
-        users = []
-        for conn_info in self.active_connections[chat_id]:
-            users.append(
-                {
-                    "user_id": conn_info.user_id,
-                    "user_type": conn_info.user_type,
-                    "connected_at": conn_info.connected_at.isoformat(),
-                }
-            )
+    async def broadcast_to_chat(self, chat_id: int, message: dict):
+        await bus.publish("chat", chat_id, message)
 
-        return users
+    async def deliver(self, chat_id: int, message: dict):
+        await _send_to_connections(self.active_connections, chat_id, message)
 
-    async def broadcast_to_chat(self, chat_id: int, message: dict):
-        if chat_id in self.active_connections:
-            disconnected_clients = []
-            for i, conn_info in enumerate(self.active_connections[chat_id]):
-                try:
-                    await conn_info.websocket.send_json(message)
-                except Exception as e:
-                    disconnected_clients.append(i)
 
-            for i in reversed(disconnected_clients):
-                try:
-                    self.active_connections[chat_id].pop(i)
-                except Exception:
-                    pass
+async def _send_to_connections(active_connections: Dict, key: int, message: dict):
+    connections = active_connections.get(key)
+    if not connections:
+        return
+
+    disconnected_clients = []
+    for socket_id, conn_info in list(connections.items()):
+        try:
+            await conn_info.websocket.send_json(message)
+        except Exception:
+            disconnected_clients.append(socket_id)
+
+    for socket_id in disconnected_clients:
+        connections.pop(socket_id, None)
+    if not connections:
+        active_connections.pop(key, None)
 
 
 chat_manager = ChatConnectionManager()
@@ -189,12 +179,11 @@ class CashboxConnectionInfo:
 
 class CashboxConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[int, List[CashboxConnectionInfo]] = {}
+        # cashbox_id -> {id(websocket): info}
+        self.active_connections: Dict[int, Dict[int, CashboxConnectionInfo]] = {}
+        bus.register("cashbox", self.deliver)
 
     async def connect(self, cashbox_id: int, websocket: WebSocket, user_id: int):
-        if cashbox_id not in self.active_connections:
-            self.active_connections[cashbox_id] = []
-
         connection_info = CashboxConnectionInfo(
             websocket=websocket,
             user_id=user_id,
@@ -202,39 +191,27 @@ class CashboxConnectionManager:
             connected_at=datetime.utcnow(),
         )
 
-        self.active_connections[cashbox_id].append(connection_info)
+        self.active_connections.setdefault(cashbox_id, {})[
+            id(websocket)
+        ] = connection_info
 
     async def disconnect(
         self, cashbox_id: int, websocket: WebSocket
     ) -> Optional[CashboxConnectionInfo]:
-        if cashbox_id in self.active_connections:
-            connection_info = None
-            for conn_info in self.active_connections[cashbox_id]:
-                if conn_info.websocket == websocket:
-                    connection_info = conn_info
-                    self.active_connections[cashbox_id].remove(conn_info)
-                    break
-
-            if not self.active_connections[cashbox_id]:
-                del self.active_connections[cashbox_id]
+        connections = self.active_connections.get(cashbox_id)
+        if connections is None:
+            return None
 
-            return connection_info
-        return None
+        connection_info = connections.pop(id(websocket), None)
+        if not connections:
+            del self.active_connections[cashbox_id]
+        return connection_info
 
     async def broadcast_to_cashbox(self, cashbox_id: int, message: dict):
-        if cashbox_id in self.active_connections:
-            disconnected_clients = []
-            for i, conn_info in enumerate(self.active_connections[cashbox_id]):
-                try:
-                    await conn_info.websocket.send_json(message)
-                except Exception as e:
-                    disconnected_clients.append(i)
+        await bus.publish("cashbox", cashbox_id, message)
 
-            for i in reversed(disconnected_clients):
-                try:
-                    self.active_connections[cashbox_id].pop(i)
-                except Exception:
-                    pass
+    async def deliver(self, cashbox_id: int, message: dict):
+        await _send_to_connections(self.active_connections, cashbox_id, message)
 
 
 cashbox_manager = CashboxConnectionManager()
@@ -466,6 +443,7 @@ async def websocket_chat(chat_id: int, websocket: WebSocket, token: str):
                                     cashbox=user.cashbox_id,
                                 )
                             )
+                            await crud.set_chat_last_message_file(db_message["id"], url)
                         except Exception:
                             pass
 
@@ -5,8 +5,9 @@ from typing import Optional
 import api.cheques.schemas as cheque_schemas
 import functions.filter_schemas as filter_schemas
 import requests
-from database.db import cheques, database, users_cboxes_relation
+from database.db import cheques, database
 from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from functions.auth_cache import resolve_token
 from functions.helpers import get_filters_cheques
 from sqlalchemy import func, select
 
@@ -16,8 +17,7 @@ router = APIRouter(tags=["FNS-Check"])
 @router.get("/cheques/{id}/", response_model=cheque_schemas.Cheque)
 async def get_cheque_by_id(token: str, id: int):
     """Получение чека по ID"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             query = cheques.select().where(
@@ -43,8 +43,7 @@ async def get_cheques(
     filters: filter_schemas.ChequesFiltersQuery = Depends(),
 ):
     """Получение чеков кассы"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             filters = get_filters_cheques(cheques, filters)
@@ -75,8 +74,7 @@ async def new_cheque(
     token: str, raw_qr: str = "", qrfile: Optional[UploadFile] = File(None)
 ):
     """Создание чека"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             req_data = {"token": os.getenv("CHEQUES_TOKEN")}
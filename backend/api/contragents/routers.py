@@ -10,10 +10,10 @@ from database.db import (
     contragents_tags,
     database,
     tags,
-    users_cboxes_relation,
 )
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import Response
+from functions.auth_cache import resolve_token
 from functions.helpers import build_filters, get_filters_ca
 from phonenumbers import geocoder
 from sqlalchemy import asc, cast, desc, func, literal_column, select
@@ -34,8 +34,7 @@ async def read_contragents_meta(
     cu_filters: filter_schemas.CUIntegerFilters = Depends(),
 ):
     """Получение меты контрагентов"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     filters = get_filters_ca(contragents, filters)
     filters += build_filters(contragents, cu_filters)
     if user:
@@ -129,8 +128,7 @@ async def create_contragent(
     ca_body: Union[ca_schemas.ContragentCreate, List[ca_schemas.ContragentCreate]],
 ):
     """Создание контрагента"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             is_multi_create = type(ca_body) is list
@@ -208,8 +206,7 @@ async def create_contragent(
 @router.get("/contragents/{id}/")
 async def get_contragent_by_id(token: str, id: int):
     """Получение контрагента по ID"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
 
@@ -234,8 +231,7 @@ async def update_contragent_data(
     token: str, ca_body: ca_schemas.ContragentEdit, id: int
 ):
     """Обновление контрагента"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
 
@@ -277,8 +273,7 @@ async def update_contragent_data(
 @router.delete("/contragents/{id}/")
 async def delete_contragent(token: str, id: int):
     """Удаление контрагента"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
 
@@ -3,9 +3,10 @@ from typing import List, Union
 
 import api.contragents.schemas as ca_schemas
 import phonenumbers
-from database.db import contragents, database, users_cboxes_relation
+from database.db import contragents, database
 from fastapi import HTTPException
 from fastapi.responses import Response
+from functions.auth_cache import resolve_token
 from phonenumbers import geocoder
 from sqlalchemy import select
 from ws_manager import manager
@@ -18,9 +19,7 @@ class CreateContragentsView:
         token: str,
         body: Union[ca_schemas.ContragentCreate, List[ca_schemas.ContragentCreate]],
     ):
-        user = await database.fetch_one(
-            users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-        )
+        user = await resolve_token(token)
         if not user:
             raise HTTPException(403, "Неверный токен")
         if not user.status:
@@ -0,0 +1,10 @@
+"""
+Конвертация HTML в PDF через wkhtmltopdf. Модуль выполняется в
+процессах пула рендеринга, поэтому импортирует только pdfkit
+"""
+
+import pdfkit
+
+
+def convert_html_to_pdf(doc_render: str) -> bytes:
+    return pdfkit.from_string(doc_render, options={"enable-local-file-access": ""})
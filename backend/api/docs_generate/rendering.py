@@ -0,0 +1,169 @@
+"""
+Рендеринг документов по шаблонам.
+
+Скомпилированные шаблоны Jinja2 кэшируются по id и updated_at шаблона
+(с проверкой хэша текста - updated_at хранится в секундах). HTML
+рендерится в пуле потоков, HTML -> PDF (wkhtmltopdf) - в пуле из
+DOCS_PDF_WORKERS процессов, так что генерация не блокирует event loop.
+Готовые документы кэшируются по хэшу шаблона и данных, в пределах
+DOCS_RENDER_CACHE_BYTES
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+import qrcode
+from api.docs_generate.pdf import convert_html_to_pdf
+from api.docs_generate.schemas import TypeDoc
+from jinja2 import Template
+from jinja2.filters import FILTERS
+from starlette.concurrency import run_in_threadpool
+
+DOCS_TEMPLATES_CACHE_SIZE = int(os.getenv("DOCS_TEMPLATES_CACHE_SIZE", 256))
+DOCS_PDF_WORKERS = int(os.getenv("DOCS_PDF_WORKERS", 2))
+DOCS_RENDER_CACHE_BYTES = int(os.getenv("DOCS_RENDER_CACHE_BYTES", 64 * 1024 * 1024))
+
+
+def render_qrcode(value):
+    qr_image = qrcode.make(value, box_size=15)
+    qr_image_pil = qr_image.get_image()
+    stream = BytesIO()
+    qr_image_pil.save(stream, format="PNG")
+    qr_image_data = stream.getvalue()
+    qr_image_base64 = base64.b64encode(qr_image_data).decode("utf-8")
+    return f"data:image/png;base64,{qr_image_base64}"
+
+
+FILTERS["render_qrcode"] = render_qrcode
+
+
+class TemplateRenderError(Exception):
+    pass
+
+
+def template_digest(template_data: Optional[str]) -> str:
+    return hashlib.sha256((template_data or "").encode("utf-8")).hexdigest()
+
+
+class TemplatesCache:
+    """LRU скомпилированных шаблонов по (id, updated_at)"""
+
+    def __init__(self, max_size: int = DOCS_TEMPLATES_CACHE_SIZE):
+        self.max_size = max_size
+        self.templates: "OrderedDict[tuple, Tuple[str, Template]]" = OrderedDict()
+
+    def get(self, template, digest: str) -> Template:
+        key = (template["id"], template["updated_at"])
+        item = self.templates.get(key)
+        if item is not None and item[0] == digest:
+            self.templates.move_to_end(key)
+            return item[1]
+
+        try:
+            compiled = Template(template["template_data"] or "")
+        except Exception as error:
+            raise TemplateRenderError(str(error)) from error
+
+        self.templates[key] = (digest, compiled)
+        self.templates.move_to_end(key)
+        if len(self.templates) > self.max_size:
+            self.templates.popitem(last=False)
+        return compiled
+
+
+class RenderedCache:
+    """LRU готовых документов, ограниченный суммарным размером"""
+
+    def __init__(self, max_bytes: int = DOCS_RENDER_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self.items.get(key)
+        if data is not None:
+            self.items.move_to_end(key)
+        return data
+
+    def set(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        previous = self.items.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self.items[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self.items.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class DocumentRenderer:
+    def __init__(self, pdf_workers: int = DOCS_PDF_WORKERS):
+        self.pdf_workers = pdf_workers
+        self.templates = TemplatesCache()
+        self.rendered = RenderedCache()
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            # spawn: дочерние процессы не наследуют event loop и соединения
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.pdf_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self.pool
+
+    async def _convert_to_pdf(self, html: str) -> bytes:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._get_pool(), convert_html_to_pdf, html
+            )
+        except BrokenProcessPool:
+            # Упавший процесс ломает весь пул - следующий вызов создаст новый
+            self.pool = None
+            raise
+
+    async def render(self, template, variables: Dict, type_doc: TypeDoc) -> bytes:
+        """Документ по шаблону doc_template и переменным: HTML или PDF"""
+        digest = template_digest(template["template_data"])
+        key = hashlib.sha256(
+            json.dumps(
+                [digest, type_doc.value, variables], sort_keys=True, default=str
+            ).encode("utf-8")
+        ).hexdigest()
+        data = self.rendered.get(key)
+        if data is not None:
+            return data
+
+        compiled = self.templates.get(template, digest)
+        try:
+            html = await run_in_threadpool(compiled.render, variables)
+        except Exception as error:
+            raise TemplateRenderError(str(error)) from error
+
+        if type_doc is TypeDoc.pdf:
+            data = await self._convert_to_pdf(html)
+        else:
+            data = html.encode("utf-8")
+
+        self.rendered.set(key, data)
+        return data
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+
+document_renderer = DocumentRenderer()
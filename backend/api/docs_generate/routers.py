@@ -1,61 +1,28 @@
-import base64
-import datetime
-from io import BytesIO
-from os import environ
-from typing import Any, Dict
-from uuid import uuid4
-
-import aioboto3
-import pdfkit
-import qrcode
-from api.docs_generate.schemas import ReGenerateList, TypeDoc
-from database.db import database, doc_generated, doc_templates
+from typing import Dict
+
+from api.docs_generate.schemas import (
+    Generate,
+    ReGenerateList,
+    RegenerateProgress,
+    TypeDoc,
+)
+from api.docs_generate.service import (
+    bucket_name,
+    create_document,
+    get_templates,
+    regenerate_jobs,
+    s3_data,
+    s3_session,
+)
+from database.db import database, doc_generated
 from fastapi import APIRouter, HTTPException, status
 from fastapi.responses import Response
 from functions.helpers import get_user_by_token
-from jinja2 import Template
-from jinja2.filters import FILTERS
 from sqlalchemy import desc
 
-
-def render_qrcode(value):
-    qr_image = qrcode.make(value, box_size=15)
-    qr_image_pil = qr_image.get_image()
-    stream = BytesIO()
-    qr_image_pil.save(stream, format="PNG")
-    qr_image_data = stream.getvalue()
-    qr_image_base64 = base64.b64encode(qr_image_data).decode("utf-8")
-    return f"data:image/png;base64,{qr_image_base64}"
-
-
-FILTERS["render_qrcode"] = render_qrcode
-
-s3_session = aioboto3.Session()
-
-s3_data = {
-    "service_name": "s3",
-    "endpoint_url": environ.get("S3_URL"),
-    "aws_access_key_id": environ.get("S3_ACCESS"),
-    "aws_secret_access_key": environ.get("S3_SECRET"),
-}
-
-bucket_name = "5075293c-docs_generated"
-
 router = APIRouter(tags=["docgenerated"])
 
 
-def generate_doc(template, *kwargs) -> Any:
-    try:
-        tm = Template(template)
-        return tm.render(*kwargs)
-    except Exception as error:
-        return error
-
-
-def convert_html_to_pdf(doc_render):
-    return pdfkit.from_string(doc_render, options={"enable-local-file-access": ""})
-
-
 @router.post("/docgenerated/")
 async def doc_generate(
     token: str,
@@ -69,40 +36,19 @@ async def doc_generate(
     """Генерирование документа с загрузкой в S3 и фиксацией записи генерации"""
 
     user = await get_user_by_token(token)
-    query = doc_templates.select().where(
-        doc_templates.c.id == template_id, doc_templates.c.cashbox == user.cashbox_id
+    templates = await get_templates(user.cashbox_id, [template_id])
+    if template_id not in templates:
+        raise HTTPException(status_code=404, detail="Шаблон не найден")
+
+    data = Generate(
+        template_id=template_id,
+        variable=variable,
+        type_doc=type_doc,
+        entity=entity,
+        entity_id=entity_id,
+        tags=tags,
     )
-    template = await database.fetch_one(query)
-    data = generate_doc(template["template_data"], variable)
-
-    file_link = f"docsgenerate/{entity}_{entity_id}_{uuid4().hex[:8]}"
-    if type_doc is TypeDoc.html:
-        file_link += ".html"
-    if type_doc is TypeDoc.pdf:
-        data = convert_html_to_pdf(data)
-        file_link += ".pdf"
-
-    async with s3_session.client(**s3_data) as s3:
-        await s3.put_object(Body=data, Bucket=bucket_name, Key=file_link)
-
-    file_dict = {
-        "cashbox_id": user.cashbox_id,
-        "doc_link": file_link,
-        "created_at": datetime.datetime.now(),
-        "tags": None if not tags else tags.lower(),
-        "template_id": template_id,
-        "entity": entity,
-        "entity_id": entity_id,
-        "type_doc": type_doc,
-    }
-    query = doc_generated.insert().values(file_dict)
-    result_file_dict_id = await database.execute(query)
-    query = doc_generated.select().where(
-        doc_generated.c.id == result_file_dict_id,
-        doc_generated.c.cashbox_id == user.cashbox_id,
-    )
-    result = await database.fetch_one(query)
-    return result
+    return await create_document(user.cashbox_id, templates[template_id], data)
 
 
 @router.get("/docgenerated/{idx}", status_code=status.HTTP_200_OK)
@@ -178,6 +124,27 @@ async def get_doc_generate_list(
         return {"results": result}
 
 
-@router.post("/regenerated/", status_code=status.HTTP_200_OK)
+@router.post(
+    "/regenerated/",
+    status_code=status.HTTP_200_OK,
+    response_model=RegenerateProgress,
+)
 async def regenerated(token: str, generateList: ReGenerateList):
-    pass
+    """Пакетная генерация документов в фоне, прогресс - по id пакета"""
+    user = await get_user_by_token(token)
+    job = await regenerate_jobs.start(user.cashbox_id, generateList.__root__ or [])
+    return job.progress()
+
+
+@router.get(
+    "/regenerated/{job_id}",
+    status_code=status.HTTP_200_OK,
+    response_model=RegenerateProgress,
+)
+async def get_regenerated_progress(token: str, job_id: str):
+    """Прогресс пакетной генерации"""
+    user = await get_user_by_token(token)
+    progress = await regenerate_jobs.get(user.cashbox_id, job_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Пакет генерации не найден")
+    return progress
@@ -27,3 +27,18 @@ class Generate(BaseModel):
 
 class ReGenerateList(BaseModel):
     __root__: Optional[List[Generate]]
+
+
+class RegenerateError(BaseModel):
+    index: int
+    detail: str
+
+
+class RegenerateProgress(BaseModel):
+    id: str
+    status: str
+    total: int
+    done: int
+    failed: int
+    results: List[Optional[int]]
+    errors: List[RegenerateError]
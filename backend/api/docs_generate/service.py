@@ -0,0 +1,233 @@
+"""
+Генерация документов с загрузкой в S3 и фиксацией записи doc_generated,
+а также пакетная перегенерация.
+
+Пакет (RegenerateJob) выполняется фоновой задачей процесса API: до
+DOCS_REGENERATE_CONCURRENCY документов параллельно. Прогресс пишется в
+doc_regenerate_jobs, поэтому доступен по id пакета с любого воркера.
+Пакеты хранятся DOCS_REGENERATE_JOBS_KEEP_DAYS дней; незавершенный пакет
+без изменений дольше DOCS_REGENERATE_STALE_SECONDS (воркер перезапущен)
+отдается со статусом interrupted
+"""
+
+import asyncio
+import datetime
+import logging
+import os
+from os import environ
+from typing import Dict, Iterable, List, Optional
+from uuid import uuid4
+
+import aioboto3
+from api.docs_generate.rendering import TemplateRenderError, document_renderer
+from api.docs_generate.schemas import Generate, TypeDoc
+from database.db import database, doc_generated, doc_regenerate_jobs, doc_templates
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+DOCS_REGENERATE_CONCURRENCY = int(os.getenv("DOCS_REGENERATE_CONCURRENCY", 4))
+DOCS_REGENERATE_JOBS_KEEP_DAYS = int(os.getenv("DOCS_REGENERATE_JOBS_KEEP_DAYS", 7))
+DOCS_REGENERATE_STALE_SECONDS = int(os.getenv("DOCS_REGENERATE_STALE_SECONDS", 600))
+
+s3_session = aioboto3.Session()
+
+s3_data = {
+    "service_name": "s3",
+    "endpoint_url": environ.get("S3_URL"),
+    "aws_access_key_id": environ.get("S3_ACCESS"),
+    "aws_secret_access_key": environ.get("S3_SECRET"),
+}
+
+bucket_name = "5075293c-docs_generated"
+
+
+async def get_templates(cashbox_id: int, template_ids: Iterable[int]) -> Dict:
+    query = doc_templates.select().where(
+        doc_templates.c.id.in_(set(template_ids)),
+        doc_templates.c.cashbox == cashbox_id,
+    )
+    return {row.id: row for row in await database.fetch_all(query)}
+
+
+async def create_document(cashbox_id: int, template, data: Generate):
+    """Рендеринг документа, загрузка в S3 и запись doc_generated"""
+    try:
+        body = await document_renderer.render(template, data.variable, data.type_doc)
+    except TemplateRenderError as error:
+        raise HTTPException(status_code=400, detail=f"Ошибка шаблона: {error}")
+
+    file_link = f"docsgenerate/{data.entity}_{data.entity_id}_{uuid4().hex[:8]}"
+    if data.type_doc is TypeDoc.html:
+        file_link += ".html"
+    if data.type_doc is TypeDoc.pdf:
+        file_link += ".pdf"
+
+    async with s3_session.client(**s3_data) as s3:
+        await s3.put_object(Body=body, Bucket=bucket_name, Key=file_link)
+
+    file_dict = {
+        "cashbox_id": cashbox_id,
+        "doc_link": file_link,
+        "created_at": datetime.datetime.now(),
+        "tags": None if not data.tags else data.tags.lower(),
+        "template_id": template["id"],
+        "entity": data.entity,
+        "entity_id": data.entity_id,
+        "type_doc": data.type_doc,
+    }
+    query = doc_generated.insert().values(file_dict).returning(doc_generated)
+    return await database.fetch_one(query)
+
+
+class RegenerateJob:
+    def __init__(self, cashbox_id: int, items: List[Generate]):
+        self.id = uuid4().hex
+        self.cashbox_id = cashbox_id
+        self.items = items
+        self.status = "pending"
+        self.done = 0
+        self.failed = 0
+        self.results: List[Optional[int]] = [None] * len(items)
+        self.errors: List[dict] = []
+
+    def progress(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "total": len(self.items),
+            "done": self.done,
+            "failed": self.failed,
+            "results": self.results,
+            "errors": self.errors,
+        }
+
+    async def save(self):
+        # Документы пакета сохраняют прогресс параллельно: снимок с меньшим
+        # числом обработанных не должен перезаписать более поздний
+        processed = self.done + self.failed
+        query = (
+            doc_regenerate_jobs.update()
+            .where(
+                doc_regenerate_jobs.c.id == self.id,
+                doc_regenerate_jobs.c.done + doc_regenerate_jobs.c.failed <= processed,
+            )
+            .values(
+                status=self.status,
+                done=self.done,
+                failed=self.failed,
+                results=list(self.results),
+                errors=list(self.errors),
+            )
+        )
+        await database.execute(query)
+
+    def _fail(self, index: int, detail: str):
+        self.failed += 1
+        self.errors.append({"index": index, "detail": detail})
+
+    async def _process(self, semaphore, templates, index: int, item: Generate):
+        template = templates.get(item.template_id)
+        if template is None:
+            self._fail(index, "Шаблон не найден")
+            await self.save()
+            return
+        async with semaphore:
+            try:
+                document = await create_document(self.cashbox_id, template, item)
+            except HTTPException as error:
+                self._fail(index, error.detail)
+            except Exception as error:
+                logger.exception(f"Regenerate job {self.id}: item {index} failed")
+                self._fail(index, str(error))
+            else:
+                self.results[index] = document.id
+                self.done += 1
+            await self.save()
+
+    async def run(self):
+        self.status = "running"
+        try:
+            await self.save()
+            templates = await get_templates(
+                self.cashbox_id, (item.template_id for item in self.items)
+            )
+            semaphore = asyncio.Semaphore(DOCS_REGENERATE_CONCURRENCY)
+            await asyncio.gather(
+                *[
+                    self._process(semaphore, templates, index, item)
+                    for index, item in enumerate(self.items)
+                ]
+            )
+            self.status = "finished"
+        except Exception:
+            logger.exception(f"Regenerate job {self.id} failed")
+            self.status = "failed"
+        try:
+            await self.save()
+        except Exception:
+            logger.exception(f"Regenerate job {self.id}: failed to save status")
+
+
+class RegenerateJobs:
+    def __init__(self):
+        self.tasks = set()
+
+    async def start(self, cashbox_id: int, items: List[Generate]) -> RegenerateJob:
+        job = RegenerateJob(cashbox_id, items)
+        keep_since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+            days=DOCS_REGENERATE_JOBS_KEEP_DAYS
+        )
+        await database.execute(
+            doc_regenerate_jobs.delete().where(
+                doc_regenerate_jobs.c.created_at < keep_since
+            )
+        )
+        # Запись создается до ответа: прогресс сразу доступен другим воркерам
+        await database.execute(
+            doc_regenerate_jobs.insert().values(
+                id=job.id,
+                cashbox_id=cashbox_id,
+                status=job.status,
+                total=len(items),
+                done=0,
+                failed=0,
+                results=job.results,
+                errors=job.errors,
+            )
+        )
+
+        task = asyncio.create_task(job.run())
+        # Ссылка на задачу, чтобы ее не собрал сборщик мусора
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return job
+
+    async def get(self, cashbox_id: int, job_id: str) -> Optional[dict]:
+        query = doc_regenerate_jobs.select().where(
+            doc_regenerate_jobs.c.id == job_id,
+            doc_regenerate_jobs.c.cashbox_id == cashbox_id,
+        )
+        job = await database.fetch_one(query)
+        if job is None:
+            return None
+
+        status = job.status
+        stale_since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+            seconds=DOCS_REGENERATE_STALE_SECONDS
+        )
+        if status in ("pending", "running") and job.updated_at < stale_since:
+            # Воркер, выполнявший пакет, остановился
+            status = "interrupted"
+        return {
+            "id": job.id,
+            "status": status,
+            "total": job.total,
+            "done": job.done,
+            "failed": job.failed,
+            "results": job.results,
+            "errors": job.errors,
+        }
+
+
+regenerate_jobs = RegenerateJobs()
@@ -7,8 +7,8 @@ from database.db import (
     nomenclature,
     payments,
     pboxes,
-    users_cboxes_relation,
 )
+from functions.auth_cache import resolve_token
 from sqlalchemy import and_, text
 
 
@@ -116,9 +116,7 @@ class CreatePurchaseAutoExpenseHandler:
         should_post = bool(purchase["status"])
 
         # account берём так же, как create_payment(): user.user из users_cboxes_relation по token
-        user_row = await database.fetch_one(
-            users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-        )
+        user_row = await resolve_token(token)
         if not user_row or not user_row.get("status"):
             print(
                 f"[purchase-auto-expense] user by token not found/disabled for purchase={purchase_id}"
@@ -28,6 +28,7 @@ from functions.helpers import (
     datetime_to_timestamp,
     get_user_by_token,
 )
+from functions.warehouse_stock import replace_warehouse_balances
 from sqlalchemy import asc, desc, func, select
 from ws_manager import manager
 
@@ -288,15 +289,7 @@ async def create(token: str, docs_purchases_data: schemas.CreateMass):
                     else 0
                 )
 
-                query = warehouse_balances.delete().where(
-                    warehouse_balances.c.warehouse_id == instance_values["warehouse"],
-                    warehouse_balances.c.nomenclature_id == item["nomenclature"],
-                    warehouse_balances.c.organization_id
-                    == instance_values["organization"],
-                )
-                await database.execute(query)
-
-                query = warehouse_balances.insert().values(
+                await replace_warehouse_balances(
                     {
                         "organization_id": instance_values["organization"],
                         "warehouse_id": instance_values["warehouse"],
@@ -308,7 +301,6 @@ async def create(token: str, docs_purchases_data: schemas.CreateMass):
                         "cashbox_id": user.cashbox_id,
                     }
                 )
-                await database.execute(query)
 
         # обновляем сумму закупки
         query = (
@@ -490,15 +482,6 @@ async def update(token: str, docs_purchases_data: schemas.EditMass):
                     )
                     last_warehouse_balance = await database.fetch_one(query)
 
-                    query = warehouse_balances.delete().where(
-                        warehouse_balances.c.warehouse_id
-                        == instance_values["warehouse"],
-                        warehouse_balances.c.nomenclature_id == item["nomenclature"],
-                        warehouse_balances.c.organization_id
-                        == instance_values["organization"],
-                    )
-                    await database.execute(query)
-
                     warehouse_amount = (
                         last_warehouse_balance.current_amount
                         if last_warehouse_balance
@@ -517,7 +500,7 @@ async def update(token: str, docs_purchases_data: schemas.EditMass):
                         else 0
                     )
 
-                    query = warehouse_balances.insert().values(
+                    await replace_warehouse_balances(
                         {
                             "organization_id": instance_values["organization"],
                             "warehouse_id": instance_values["warehouse"],
@@ -530,7 +513,6 @@ async def update(token: str, docs_purchases_data: schemas.EditMass):
                             "cashbox_id": user.cashbox_id,
                         }
                     )
-                    await database.execute(query)
 
             query = (
                 docs_purchases.update()
@@ -29,7 +29,11 @@ from api.employee_shifts.service import (
     get_available_couriers_on_shift,
     get_available_pickers_on_shift,
 )
-from api.loyality_transactions.routers import raschet_bonuses
+from api.loyality_transactions.balances import (
+    apply_transactions,
+    insert_transactions,
+    publish_cards_changes,
+)
 from apps.yookassa.functions.impl.GetOauthCredentialFunction import (
     GetOauthCredentialFunction,
 )
@@ -88,6 +92,7 @@ from database.db import (
     users,
     users_cboxes_relation,
     warehouse_balances,
+    warehouse_stock_current,
     warehouses,
 )
 from fastapi import APIRouter, Depends, HTTPException, Query
@@ -104,7 +109,9 @@ from functions.helpers import (
     raschet_oplat,
 )
 from functions.users import raschet
+from functions.warehouse_stock import insert_warehouse_balances
 from producer import queue_notification
+from segments.events.producer import publish_segment_changes
 from sqlalchemy import and_, desc, func, or_, select
 from ws_manager import manager
 
@@ -588,7 +595,7 @@ async def create(
                     else 0
                 )
 
-                query = warehouse_balances.insert().values(
+                await insert_warehouse_balances(
                     {
                         "organization_id": instance_values["organization"],
                         "warehouse_id": instance_values["warehouse"],
@@ -599,7 +606,6 @@ async def create(
                         "cashbox_id": user.cashbox_id,
                     }
                 )
-                await database.execute(query)
 
         if paid_rubles > 0:
             if article_db:
@@ -738,11 +744,7 @@ async def create(
                             "status": True,
                         }
 
-                        lt_id = await database.execute(
-                            loyality_transactions.insert().values(rubles_body)
-                        )
-
-                        await asyncio.gather(asyncio.create_task(raschet_bonuses(lt)))
+                        await insert_transactions([rubles_body])
 
             await asyncio.gather(asyncio.create_task(raschet(user, token)))
         if lt:
@@ -767,16 +769,7 @@ async def create(
                     "status": True,
                 }
                 print("loyality_transactions insert")
-                lt_id = await database.execute(
-                    loyality_transactions.insert().values(rubles_body)
-                )
-                print("loyality_transactions insert")
-                await database.execute(
-                    loyality_cards.update()
-                    .where(loyality_cards.c.card_number == payboxes.card_number)
-                    .values({"balance": loyality_cards.c.balance - paid_lt})
-                )
-                print("loyality_transactions update")
+                (lt_id,) = await insert_transactions([rubles_body])
                 await database.execute(
                     entity_to_entity.insert().values(
                         {
@@ -792,8 +785,6 @@ async def create(
                     )
                 )
 
-                await asyncio.gather(asyncio.create_task(raschet_bonuses(lt)))
-
         query = (
             docs_sales.update()
             .where(docs_sales.c.id == instance_id)
@@ -850,6 +841,12 @@ async def create(
             "result": docs_sales_db,
         },
     )
+    await publish_segment_changes(
+        user.cashbox_id,
+        contragent_ids=[doc["contragent"] for doc in docs_sales_db],
+        docs_sales_ids=[doc["id"] for doc in docs_sales_db],
+        source="docs_sales.create",
+    )
 
     if exceptions:
         raise HTTPException(
@@ -1152,7 +1149,6 @@ async def update(token: str, docs_sales_data: schemas.EditMass):
     loyalty_transactions_to_update: list[dict[str, Any]] = []
     loyalty_transactions_to_insert: list[dict[str, Any]] = []
     loyalty_transactions_doc_ids: list[int] = []
-    cards_for_bonus: set[int] = set()
     docs_sales_updates: list[dict[str, Any]] = []
     docs_update_keys: set[str] = set()
     docs_goods_to_delete: set[int] = set()
@@ -1301,7 +1297,6 @@ async def update(token: str, docs_sales_data: schemas.EditMass):
                         }
                     )
                     loyalty_transactions_doc_ids.append(instance_id_db)
-                cards_for_bonus.add(lt)
 
             if lt and cashback_sum > 0:
                 lcard = loyalty_cards_map.get(lt)
@@ -1336,7 +1331,6 @@ async def update(token: str, docs_sales_data: schemas.EditMass):
                         }
                     )
                     loyalty_transactions_doc_ids.append(instance_id_db)
-                cards_for_bonus.add(lt)
 
         if instance_values.get("paid_rubles"):
             del instance_values["paid_rubles"]
@@ -1415,34 +1409,27 @@ async def update(token: str, docs_sales_data: schemas.EditMass):
         }
         balance_conditions = [
             and_(
-                warehouse_balances.c.warehouse_id == wh,
-                warehouse_balances.c.nomenclature_id == nom,
+                warehouse_stock_current.c.warehouse_id == wh,
+                warehouse_stock_current.c.nomenclature_id == nom,
             )
             for wh, nom in balance_pairs
         ]
         latest_map: Dict[tuple[int, int], float] = {}
         if balance_conditions:
-            subq = (
+            # Последние остатки из проекции; при нескольких организациях
+            # на одной паре побеждает самая свежая запись
+            latest_rows = await database.fetch_all(
                 select(
-                    warehouse_balances.c.warehouse_id,
-                    warehouse_balances.c.nomenclature_id,
-                    warehouse_balances.c.current_amount,
-                    func.row_number()
-                    .over(
-                        partition_by=(
-                            warehouse_balances.c.warehouse_id,
-                            warehouse_balances.c.nomenclature_id,
-                        ),
-                        order_by=warehouse_balances.c.created_at.desc(),
-                    )
-                    .label("rn"),
-                ).where(
-                    warehouse_balances.c.cashbox_id == user.cashbox_id,
+                    warehouse_stock_current.c.warehouse_id,
+                    warehouse_stock_current.c.nomenclature_id,
+                    warehouse_stock_current.c.current_amount,
+                )
+                .where(
+                    warehouse_stock_current.c.cashbox_id == user.cashbox_id,
                     or_(*balance_conditions),
                 )
-            ).subquery()
-
-            latest_rows = await database.fetch_all(select(subq).where(subq.c.rn == 1))
+                .order_by(warehouse_stock_current.c.warehouse_balance_id)
+            )
             latest_map = {
                 (row.warehouse_id, row.nomenclature_id): row.current_amount
                 for row in latest_rows
@@ -1500,9 +1487,7 @@ async def update(token: str, docs_sales_data: schemas.EditMass):
         await database.execute_many(docs_sales_goods.insert(), docs_goods_to_insert)
 
     if warehouse_balances_to_insert:
-        await database.execute_many(
-            warehouse_balances.insert(), warehouse_balances_to_insert
-        )
+        await insert_warehouse_balances(warehouse_balances_to_insert)
 
     if warehouse_updates_payload:
         await update_warehouse_doc(
@@ -1526,13 +1511,10 @@ async def update(token: str, docs_sales_data: schemas.EditMass):
 
     new_loyalty_links: list[dict[str, Any]] = []
     if loyalty_transactions_to_insert:
-        loyalty_insert_query = (
-            loyality_transactions.insert()
-            .values(loyalty_transactions_to_insert)
-            .returning(loyality_transactions.c.id)
-        )
-        inserted_loyalty = await database.fetch_all(loyalty_insert_query)
-        for doc_id, row in zip(loyalty_transactions_doc_ids, inserted_loyalty):
+        inserted_loyalty = await insert_transactions(loyalty_transactions_to_insert)
+        for doc_id, transaction_id in zip(
+            loyalty_transactions_doc_ids, inserted_loyalty
+        ):
             new_loyalty_links.append(
                 {
                     "from_entity": 7,
@@ -1540,7 +1522,7 @@ async def update(token: str, docs_sales_data: schemas.EditMass):
                     "cashbox_id": user.cashbox_id,
                     "type": "docs_sales_loyality_transactions",
                     "from_id": doc_id,
-                    "to_id": row.id,
+                    "to_id": transaction_id,
                     "status": True,
                     "delinked": False,
                 }
@@ -1569,17 +1551,16 @@ async def update(token: str, docs_sales_data: schemas.EditMass):
             "SET amount = :amount "
             "WHERE id = :transaction_id AND cashbox = :cashbox AND status = TRUE AND is_deleted = FALSE"
         )
-        await database.execute_many(
-            loyalty_update_query, loyalty_transactions_to_update
-        )
-
-    if cards_for_bonus:
-        await asyncio.gather(
-            *[
-                asyncio.create_task(raschet_bonuses(card_id))
-                for card_id in cards_for_bonus
-            ]
-        )
+        updated_transaction_ids = [
+            txn_row["transaction_id"] for txn_row in loyalty_transactions_to_update
+        ]
+        async with database.transaction():
+            cards = await apply_transactions(updated_transaction_ids, sign=-1)
+            await database.execute_many(
+                loyalty_update_query, loyalty_transactions_to_update
+            )
+            cards = [*cards, *await apply_transactions(updated_transaction_ids)]
+        await publish_cards_changes(cards)
 
     settings_keys = [
         "repeatability_period",
@@ -1647,6 +1628,12 @@ async def update(token: str, docs_sales_data: schemas.EditMass):
             "result": docs_sales_db,
         },
     )
+    await publish_segment_changes(
+        user.cashbox_id,
+        contragent_ids=[doc["contragent"] for doc in docs_sales_db],
+        docs_sales_ids=[doc["id"] for doc in docs_sales_db],
+        source="docs_sales.update",
+    )
 
     if exceptions:
         raise HTTPException(
@@ -1659,7 +1646,7 @@ async def update(token: str, docs_sales_data: schemas.EditMass):
 @router.delete("/docs_sales/", response_model=schemas.ListView)
 async def delete(token: str, ids: list[int]):
     """Пакетное удаление документов"""
-    await get_user_by_token(token)
+    user = await get_user_by_token(token)
 
     query = docs_sales.select().where(
         docs_sales.c.id.in_(ids), docs_sales.c.is_deleted.is_not(True)
@@ -1683,6 +1670,12 @@ async def delete(token: str, ids: list[int]):
                 "result": items_db,
             },
         )
+        await publish_segment_changes(
+            user.cashbox_id,
+            contragent_ids=[doc["contragent"] for doc in items_db],
+            docs_sales_ids=[doc["id"] for doc in items_db],
+            source="docs_sales.delete",
+        )
 
     return items_db
 
@@ -1690,7 +1683,7 @@ async def delete(token: str, ids: list[int]):
 @router.delete("/docs_sales/{idx}/", response_model=schemas.ListView)
 async def delete(token: str, idx: int):
     """Удаление документа"""
-    await get_user_by_token(token)
+    user = await get_user_by_token(token)
 
     query = docs_sales.select().where(
         docs_sales.c.id == idx, docs_sales.c.is_deleted.is_not(True)
@@ -1714,6 +1707,12 @@ async def delete(token: str, idx: int):
                 "result": items_db,
             },
         )
+        await publish_segment_changes(
+            user.cashbox_id,
+            contragent_ids=[doc["contragent"] for doc in items_db],
+            docs_sales_ids=[doc["id"] for doc in items_db],
+            source="docs_sales.delete",
+        )
 
     return items_db
 
@@ -2252,6 +2251,13 @@ async def update_order_status(
 
         await queue_notification(notification_data)
 
+    await publish_segment_changes(
+        user.cashbox_id,
+        contragent_ids=[order.contragent],
+        docs_sales_ids=[idx],
+        source="docs_sales.status",
+    )
+
     return updated_order
 
 
@@ -4,7 +4,10 @@ from aio_pika import IncomingMessage
 from api.docs_sales.messages.RecalculateLoyaltyPointsMessageModel import (
     RecalculateLoyaltyPointsMessageModel,
 )
-from api.loyality_transactions.routers import raschet_bonuses
+from api.loyality_transactions.balances import (
+    publish_cards_changes,
+    recalculate_cards,
+)
 from common.amqp_messaging.common.core.EventHandler import IEventHandler
 
 
@@ -19,7 +22,7 @@ class RecalculateLoyaltyPointsHandler(
             **event
         )
 
-        for (
-            loyalty_card_id
-        ) in recalculate_loyalty_points_message_model.loyalty_card_ids:
-            await raschet_bonuses(card_id=loyalty_card_id)
+        cards = await recalculate_cards(
+            recalculate_loyalty_points_message_model.loyalty_card_ids
+        )
+        await publish_cards_changes(cards)
@@ -8,6 +8,7 @@ from api.tech_cards.models import TechCardDB
 from api.tech_operations.models import TechOperationComponentDB, TechOperationDB
 from common.amqp_messaging.common.core.EventHandler import IEventHandler
 from database.db import database, warehouse_balances
+from functions.warehouse_stock import insert_warehouse_balances
 from sqlalchemy import select
 
 
@@ -67,8 +68,7 @@ class TechCardWarehouseOperationHandler(
                     )
 
                 if to_insert:
-                    query_to_insert = warehouse_balances.insert()
-                    await database.execute_many(query_to_insert, to_insert)
+                    await insert_warehouse_balances(to_insert)
 
             elif tech_card_type == "reference":
                 query_tech_card_operation_components = select(
@@ -110,8 +110,7 @@ class TechCardWarehouseOperationHandler(
                         }
                     )
                 if to_insert:
-                    query_to_insert = warehouse_balances.insert()
-                    await database.execute_many(query_to_insert, to_insert)
+                    await insert_warehouse_balances(to_insert)
 
                 query_current_amount = (
                     warehouse_balances.select()
@@ -127,14 +126,15 @@ class TechCardWarehouseOperationHandler(
                     warehouse_balances_db.current_amount if warehouse_balances_db else 0
                 )
 
-                incloming_produced_product_query = warehouse_balances.insert().values(
-                    cashbox_id=user_cashbox_id,
-                    warehouse_id=row["to_warehouse_id"],
-                    nomenclature_id=row["nomenclature_id"],
-                    incoming_amount=row["output_quantity"],
-                    current_amount=current_amount + row["output_quantity"],
+                await insert_warehouse_balances(
+                    {
+                        "cashbox_id": user_cashbox_id,
+                        "warehouse_id": row["to_warehouse_id"],
+                        "nomenclature_id": row["nomenclature_id"],
+                        "incoming_amount": row["output_quantity"],
+                        "current_amount": current_amount + row["output_quantity"],
+                    }
                 )
-                await database.execute(incloming_produced_product_query)
 
             else:
                 raise ValueError("Unknown tech card type")
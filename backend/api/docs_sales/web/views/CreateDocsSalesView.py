@@ -14,7 +14,10 @@ from api.docs_sales.messages.TechCardWarehouseOperationMessage import (
     TechCardWarehouseOperationMessage,
 )
 from api.docs_warehouses.utils import create_warehouse_docs
-from api.loyality_transactions.routers import raschet_bonuses
+from api.loyality_transactions.balances import (
+    apply_transactions,
+    publish_cards_changes,
+)
 from common.amqp_messaging.common.core.IRabbitFactory import IRabbitFactory
 from common.amqp_messaging.common.core.IRabbitMessaging import IRabbitMessaging
 from database.db import (
@@ -38,12 +41,14 @@ from database.db import (
     price_types,
     units,
     users_cboxes_relation,
-    warehouse_balances,
+    warehouse_stock_current,
     warehouses,
 )
 from fastapi import HTTPException
 from functions.helpers import datetime_to_timestamp, get_user_by_token
 from functions.users import raschet
+from functions.warehouse_stock import insert_warehouse_balances
+from segments.events.producer import publish_segment_changes
 from sqlalchemy import and_, func, or_, select
 from ws_manager import manager
 
@@ -469,17 +474,20 @@ class CreateDocsSalesView:
             )
 
         lt_ids_map = {}
+        changed_cards = []
         if lt_rows:
-            inserted_lt = await database.fetch_all(
-                loyality_transactions.insert()
-                .values(
-                    [
-                        {k: v for k, v in row.items() if k != "__tmp_id"}
-                        for row in lt_rows
-                    ]
+            async with database.transaction():
+                inserted_lt = await database.fetch_all(
+                    loyality_transactions.insert()
+                    .values(
+                        [
+                            {k: v for k, v in row.items() if k != "__tmp_id"}
+                            for row in lt_rows
+                        ]
+                    )
+                    .returning(loyality_transactions.c.id)
                 )
-                .returning(loyality_transactions.c.id)
-            )
+                changed_cards = await apply_transactions([r.id for r in inserted_lt])
             lt_ids_map = dict(
                 zip(
                     [i for i, t in enumerate(e2e_rows) if t[0] == "l"],
@@ -524,33 +532,26 @@ class CreateDocsSalesView:
         if wb_rows_dict:
             conditions = [
                 and_(
-                    warehouse_balances.c.warehouse_id == wh,
-                    warehouse_balances.c.nomenclature_id == nom,
+                    warehouse_stock_current.c.warehouse_id == wh,
+                    warehouse_stock_current.c.nomenclature_id == nom,
                 )
                 for wh, nom, _ in wb_rows_dict.keys()
             ]
 
-            subq = (
+            # Последние остатки берём из проекции; при нескольких организациях
+            # на одной паре (склад, номенклатура) побеждает самая свежая запись
+            latest = await database.fetch_all(
                 select(
-                    warehouse_balances.c.warehouse_id,
-                    warehouse_balances.c.nomenclature_id,
-                    warehouse_balances.c.current_amount,
-                    func.row_number()
-                    .over(
-                        partition_by=(
-                            warehouse_balances.c.warehouse_id,
-                            warehouse_balances.c.nomenclature_id,
-                        ),
-                        order_by=warehouse_balances.c.created_at.desc(),
-                    )
-                    .label("rn"),
-                ).where(
-                    warehouse_balances.c.cashbox_id == user.cashbox_id,
+                    warehouse_stock_current.c.warehouse_id,
+                    warehouse_stock_current.c.nomenclature_id,
+                    warehouse_stock_current.c.current_amount,
+                )
+                .where(
+                    warehouse_stock_current.c.cashbox_id == user.cashbox_id,
                     or_(*conditions),
                 )
-            ).subquery()
-
-            latest = await database.fetch_all(select(subq).where(subq.c.rn == 1))
+                .order_by(warehouse_stock_current.c.warehouse_balance_id)
+            )
             latest_map = {
                 (r.warehouse_id, r.nomenclature_id): r.current_amount for r in latest
             }
@@ -579,9 +580,7 @@ class CreateDocsSalesView:
                     filtered_wb_to_insert.append(record)
             # Вставляем только те записи, которые соответствуют условиям
             if filtered_wb_to_insert:
-                await database.execute_many(
-                    warehouse_balances.insert(), filtered_wb_to_insert
-                )
+                await insert_warehouse_balances(filtered_wb_to_insert)
 
         for payload, goods in out_docs:
             asyncio.create_task(
@@ -591,8 +590,7 @@ class CreateDocsSalesView:
             )
 
         asyncio.create_task(raschet(user, token))
-        for card_id in set(list(card_withdraw_total) + list(card_accrual_total)):
-            asyncio.create_task(raschet_bonuses(card_id))
+        asyncio.create_task(publish_cards_changes(changed_cards))
 
         # await rabbitmq_messaging.publish(
         #     RecalculateFinancialsMessageModel(
@@ -620,6 +618,14 @@ class CreateDocsSalesView:
                 token, {"action": "create", "target": "docs_sales", "result": result}
             )
         )
+        asyncio.create_task(
+            publish_segment_changes(
+                user.cashbox_id,
+                contragent_ids=[r.contragent for r in rows],
+                docs_sales_ids=[r.id for r in rows],
+                source="docs_sales.create",
+            )
+        )
 
         # Юкасса
 
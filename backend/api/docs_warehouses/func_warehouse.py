@@ -9,7 +9,6 @@ from database.db import (
     nomenclature,
     organizations,
     pictures,
-    users_cboxes_relation,
     warehouse_register_movement,
     warehouses,
 )
@@ -100,13 +99,7 @@ async def check_relationship(entity):
 
 
 async def set_data_doc_warehouse(**kwargs):
-    await get_user_by_token(kwargs.get("token"))
-
-    users_cboxes = await database.fetch_one(
-        users_cboxes_relation.select().where(
-            users_cboxes_relation.c.token == kwargs.get("token")
-        )
-    )
+    users_cboxes = await get_user_by_token(kwargs.get("token"))
 
     entity = kwargs.get("entity_values")
 
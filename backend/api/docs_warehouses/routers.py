@@ -32,6 +32,7 @@ from functions.helpers import (
     datetime_to_timestamp,
     get_user_by_token,
 )
+from functions.warehouse_stock import replace_warehouse_balances
 from sqlalchemy import asc, desc, func, select
 from ws_manager import manager
 
@@ -294,15 +295,7 @@ async def create(token: str, docs_warehouse_data: schemas.CreateMass):
                     else 0
                 )
 
-                query = warehouse_balances.delete().where(
-                    warehouse_balances.c.warehouse_id == instance_values["warehouse"],
-                    warehouse_balances.c.nomenclature_id == item["nomenclature"],
-                    warehouse_balances.c.organization_id
-                    == instance_values["organization"],
-                )
-                await database.execute(query)
-
-                query = warehouse_balances.insert().values(
+                await replace_warehouse_balances(
                     {
                         "organization_id": instance_values["organization"],
                         "warehouse_id": instance_values["warehouse"],
@@ -314,7 +307,6 @@ async def create(token: str, docs_warehouse_data: schemas.CreateMass):
                         "cashbox_id": user.id,
                     }
                 )
-                await database.execute(query)
         query = (
             docs_warehouse.update()
             .where(docs_warehouse.c.id == instance_id)
@@ -456,16 +448,7 @@ async def update(token: str, docs_warehouse_data: schemas.EditMass):
                         else 0
                     )
 
-                    query = warehouse_balances.delete().where(
-                        warehouse_balances.c.warehouse_id
-                        == instance_values["warehouse"],
-                        warehouse_balances.c.nomenclature_id == item["nomenclature"],
-                        warehouse_balances.c.organization_id
-                        == instance_values["organization"],
-                    )
-                    await database.execute(query)
-
-                    query = warehouse_balances.insert().values(
+                    await replace_warehouse_balances(
                         {
                             "organization_id": instance_values["organization"],
                             "warehouse_id": instance_values["warehouse"],
@@ -478,7 +461,6 @@ async def update(token: str, docs_warehouse_data: schemas.EditMass):
                             "cashbox_id": user.id,
                         }
                     )
-                    await database.execute(query)
 
             query = (
                 docs_warehouse.update()
@@ -13,6 +13,7 @@ from database.db import (
     users_cboxes_relation,
 )
 from fastapi import APIRouter, HTTPException
+from functions.auth_cache import resolve_token
 from sqlalchemy import and_, desc, func, or_, select
 from ws_manager import manager
 
@@ -59,10 +60,7 @@ async def start_shift(token: str):
     """Начать смену"""
 
     # Получаем пользователя по токену
-    user_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    user = await database.fetch_one(user_query)
+    user = await resolve_token(token)
 
     if not user:
         raise HTTPException(status_code=401, detail="Неверный токен")
@@ -183,10 +181,7 @@ async def start_shift(token: str):
 async def end_shift(token: str):
     """Завершить смену"""
 
-    user_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    user = await database.fetch_one(user_query)
+    user = await resolve_token(token)
 
     if not user:
         raise HTTPException(status_code=401, detail="Неверный токен")
@@ -268,10 +263,7 @@ async def end_shift(token: str):
 async def create_break(token: str, duration_minutes: int):
     """Создать перерыв"""
 
-    user_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    user = await database.fetch_one(user_query)
+    user = await resolve_token(token)
 
     if not user:
         raise HTTPException(status_code=401, detail="Неверный токен")
@@ -356,10 +348,7 @@ async def create_break(token: str, duration_minutes: int):
 async def get_shift_status(token: str):
     """Получить текущий статус смены пользователя"""
 
-    user_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    user = await database.fetch_one(user_query)
+    user = await resolve_token(token)
 
     if not user:
         raise HTTPException(status_code=401, detail="Неверный токен")
@@ -478,10 +467,7 @@ async def get_users_list_with_shift_info(
     """Получить список пользователей с информацией о сменах (админ)"""
 
     # Получаем текущего пользователя
-    current_user_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    current_user = await database.fetch_one(current_user_query)
+    current_user = await resolve_token(token)
 
     if not current_user:
         raise HTTPException(status_code=401, detail="Неверный токен")
@@ -581,10 +567,7 @@ async def get_shifts_statistics(token: str):
     """Получить статистику по сменам (админ)"""
 
     # Получаем текущего пользователя
-    current_user_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    current_user = await database.fetch_one(current_user_query)
+    current_user = await resolve_token(token)
 
     if not current_user:
         raise HTTPException(status_code=401, detail="Неверный токен")
@@ -640,10 +623,7 @@ async def get_shifts_statistics(token: str):
 async def end_break_early(token: str):
     """Завершить перерыв досрочно"""
 
-    user_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    user = await database.fetch_one(user_query)
+    user = await resolve_token(token)
 
     if not user:
         raise HTTPException(status_code=401, detail="Неверный токен")
@@ -717,10 +697,7 @@ async def end_break_early(token: str):
 
 @router.get("/get_shifts_events", response_model=ShiftEventsList)
 async def get_shifts_events(token: str, limit: int = 30, offset: int = 0):
-    user_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    user = await database.fetch_one(user_query)
+    user = await resolve_token(token)
 
     if not user:
         raise HTTPException(status_code=401, detail="Неверный токен")
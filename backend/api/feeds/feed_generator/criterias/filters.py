@@ -1,3 +1,6 @@
+import hashlib
+import json
+import os
 from collections import defaultdict
 
 from database.db import (
@@ -9,9 +12,12 @@ from database.db import (
     pictures,
     price_types,
     prices,
-    warehouse_register_movement,
+    warehouse_stock_current,
 )
-from sqlalchemy import and_, case, func, select
+from sqlalchemy import and_, func, select
+
+# Сколько номенклатур фида читается из БД за один запрос
+FEED_CHUNK_SIZE = int(os.getenv("FEED_CHUNK_SIZE", 500))
 
 
 class FeedCriteriaFilter:
@@ -19,14 +25,15 @@ class FeedCriteriaFilter:
     def __init__(self, criteria_data: dict, cashbox_id):
         self.criteria_data = criteria_data
         self.cashbox_id = cashbox_id
+        self.price_type_id = None
 
-    def add_filters(self, query, q):
+    def add_filters(self, query):
         """Добавляем фильтры к запросу"""
         criteria = self.criteria_data
 
         if criteria.get("warehouse_id"):
             query = query.where(
-                warehouse_register_movement.c.warehouse_id.in_(criteria["warehouse_id"])
+                warehouse_stock_current.c.warehouse_id.in_(criteria["warehouse_id"])
             )
 
         if criteria.get("category_id"):
@@ -39,30 +46,29 @@ class FeedCriteriaFilter:
                 query = query.where(prices.c.price <= criteria["prices"]["to"])
 
         if criteria.get("only_on_stock"):
-            query = query.having(func.sum(q) > 0)
+            query = query.where(warehouse_stock_current.c.current_amount > 0)
 
         return query
 
-    async def get_warehouse_balance(self):
-        price_type_id = self.criteria_data.get("price_types_id")
-        if not price_type_id:
-            query = select(price_types).where(price_types.c.cashbox == self.cashbox_id)
-            types = await database.fetch_all(query)
-            price_type_id = types[0].id if types else None
-
-        if not price_type_id:
-            return None
-
-        # считаем остаток (учёт минус/плюс)
-        q = case(
-            (
-                warehouse_register_movement.c.type_amount == "minus",
-                warehouse_register_movement.c.amount * -1,
-            ),
-            else_=warehouse_register_movement.c.amount,
-        )
+    async def get_price_type_id(self):
+        if self.price_type_id is None:
+            price_type_id = self.criteria_data.get("price_types_id")
+            if not price_type_id:
+                query = (
+                    select(price_types.c.id)
+                    .where(price_types.c.cashbox == self.cashbox_id)
+                    .order_by(price_types.c.id)
+                    .limit(1)
+                )
+                price_type_id = await database.fetch_val(query)
+            self.price_type_id = price_type_id
+        return self.price_type_id
 
-        # базовый запрос
+    def balance_query(self, price_type_id: int):
+        """
+        Остатки номенклатуры по складам из текущих остатков
+        (warehouse_stock_current), без суммирования регистра движений
+        """
         query = (
             select(
                 nomenclature.c.id.label("id"),
@@ -70,46 +76,100 @@ class FeedCriteriaFilter:
                 categories.c.name.label("category"),
                 nomenclature.c.description_short.label("description"),
                 prices.c.price.label("price"),
-                warehouse_register_movement.c.warehouse_id.label("warehouse_id"),
-                func.sum(q).label("current_amount"),
-            )
-            .join(
-                nomenclature,
-                warehouse_register_movement.c.nomenclature_id == nomenclature.c.id,
-            )
-            .join(
-                prices,
-                and_(
-                    prices.c.nomenclature == nomenclature.c.id,
-                    prices.c.price_type == price_type_id,
+                warehouse_stock_current.c.warehouse_id.label("warehouse_id"),
+                # одна строка остатка на организацию и склад, max убирает
+                # дубли от нескольких одинаковых цен
+                func.max(warehouse_stock_current.c.current_amount).label(
+                    "current_amount"
                 ),
             )
-            .join(
-                categories,
-                categories.c.id == nomenclature.c.category,
+            .select_from(
+                warehouse_stock_current.join(
+                    nomenclature,
+                    warehouse_stock_current.c.nomenclature_id == nomenclature.c.id,
+                )
+                .join(
+                    prices,
+                    and_(
+                        prices.c.nomenclature == nomenclature.c.id,
+                        prices.c.price_type == price_type_id,
+                    ),
+                )
+                .join(
+                    categories,
+                    categories.c.id == nomenclature.c.category,
+                )
             )
-            .where(warehouse_register_movement.c.cashbox_id == self.cashbox_id)
+            .where(warehouse_stock_current.c.cashbox_id == self.cashbox_id)
             .group_by(
                 nomenclature.c.id,
-                warehouse_register_movement.c.organization_id,
-                warehouse_register_movement.c.warehouse_id,
+                warehouse_stock_current.c.organization_id,
+                warehouse_stock_current.c.warehouse_id,
                 categories.c.name,
                 prices.c.price,
             )
         )
+        return self.add_filters(query)
 
-        # применяем фильтры
-        query = self.add_filters(query, q)
+    async def get_scope_version(self) -> str:
+        """
+        Версия данных фида: число строк и время последнего изменения
+        номенклатуры, категорий, картинок, атрибутов, цен и остатков в
+        пределах фида. Меняется при любой записи, влияющей на содержимое
+        """
+        price_type_id = await self.get_price_type_id()
+        criteria = self.criteria_data
 
-        # выполняем запрос
-        rows = await database.fetch_all(query)
-        results = [dict(row) for row in rows]
+        def state(name, updated_at, *conditions):
+            return (
+                select(func.concat(func.count(), "/", func.max(updated_at)))
+                .where(*conditions)
+                .scalar_subquery()
+                .label(name)
+            )
 
-        if not results:
-            return []
+        cashbox_nomenclature = [nomenclature.c.cashbox == self.cashbox_id]
+        if criteria.get("category_id"):
+            cashbox_nomenclature.append(
+                nomenclature.c.category.in_(criteria["category_id"])
+            )
+        stock = [warehouse_stock_current.c.cashbox_id == self.cashbox_id]
+        if criteria.get("warehouse_id"):
+            stock.append(
+                warehouse_stock_current.c.warehouse_id.in_(criteria["warehouse_id"])
+            )
 
-        # достаём все id номенклатур
-        nomenclature_ids = [r["id"] for r in results]
+        query = select(
+            state("nomenclature", nomenclature.c.updated_at, *cashbox_nomenclature),
+            state(
+                "categories",
+                categories.c.updated_at,
+                categories.c.cashbox == self.cashbox_id,
+            ),
+            state(
+                "pictures",
+                pictures.c.updated_at,
+                pictures.c.cashbox == self.cashbox_id,
+                pictures.c.entity == "nomenclature",
+            ),
+            state(
+                "attributes",
+                nomenclature_attributes_value.c.updated_at,
+                nomenclature_attributes_value.c.attribute_id.in_(
+                    select(nomenclature_attributes.c.id).where(
+                        nomenclature_attributes.c.cashbox == self.cashbox_id
+                    )
+                ),
+            ),
+            state("prices", prices.c.updated_at, prices.c.price_type == price_type_id),
+            state("stock", warehouse_stock_current.c.updated_at, *stock),
+        )
+        row = await database.fetch_one(query)
+        raw = json.dumps([price_type_id, *dict(row).values()], default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    async def _add_images_and_params(self, results):
+        nomenclature_ids = list({r["id"] for r in results})
 
         # тянем картинки пачкой
         images_query = select(pictures.c.entity_id, pictures.c.url).where(
@@ -159,3 +219,47 @@ class FeedCriteriaFilter:
             r["params"] = attrs_map.get(r["id"], None)
 
         return results
+
+    async def iterate_warehouse_balance(self, chunk_size: int = FEED_CHUNK_SIZE):
+        """
+        Строки фида пачками по chunk_size номенклатур в порядке id
+        (keyset-пагинация), чтобы не держать весь фид в памяти
+        """
+        price_type_id = await self.get_price_type_id()
+        if not price_type_id:
+            return
+
+        balance = self.balance_query(price_type_id).subquery("balance")
+        last_id = None
+        while True:
+            ids_query = (
+                select(balance.c.id)
+                .where(balance.c.id > last_id if last_id is not None else True)
+                .group_by(balance.c.id)
+                .order_by(balance.c.id)
+                .limit(chunk_size)
+            )
+            ids = [row.id for row in await database.fetch_all(ids_query)]
+            if not ids:
+                return
+
+            rows_query = (
+                select(balance)
+                .where(balance.c.id.in_(ids))
+                .order_by(balance.c.id, balance.c.warehouse_id)
+            )
+            results = [dict(row) for row in await database.fetch_all(rows_query)]
+            yield await self._add_images_and_params(results)
+
+            if len(ids) < chunk_size:
+                return
+            last_id = ids[-1]
+
+    async def get_warehouse_balance(self):
+        if not await self.get_price_type_id():
+            return None
+
+        results = []
+        async for chunk in self.iterate_warehouse_balance():
+            results.extend(chunk)
+        return results
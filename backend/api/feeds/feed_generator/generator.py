@@ -1,42 +1,66 @@
+"""
+Генерация XML-фида.
+
+Фид отдается потоком: строки читаются из БД пачками
+(FeedCriteriaFilter.iterate_warehouse_balance) и сразу пишутся в ответ.
+Параллельно поток сохраняется в файл в FEEDS_CACHE_DIR; следующие
+запросы получают этот файл, пока не изменится версия данных фида
+(get_scope_version) - товары, цены или остатки в его пределах. Версия
+же служит ETag, на совпадающий If-None-Match отдается 304
+"""
+
+import glob
+import hashlib
 import json
-from xml.sax.saxutils import escape
+import logging
+import os
+import tempfile
+import uuid
+from typing import Optional
+from xml.sax.saxutils import escape, quoteattr
 
 from api.feeds.feed_generator.criterias.filters import FeedCriteriaFilter
 from database.db import database, feeds
-from starlette.responses import Response
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse, Response, StreamingResponse
 
+logger = logging.getLogger(__name__)
 
-class FeedGenerator:
+FEEDS_CACHE_DIR = os.getenv(
+    "FEEDS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "feeds")
+)
+FEED_MEDIA_TYPE = "application/xml"
+FEED_CACHE_CONTROL = "public, max-age=60"
 
-    def __init__(self, url_token: str) -> None:
-        self.url_token = url_token
-        self.feed = None
 
-    async def get_feed(self):
-        if self.url_token:
-            query = feeds.select().where(feeds.c.url_token == self.url_token)
-            self.feed = await database.fetch_one(query)
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
 
-        return self.feed
 
-    async def generate(self):
-        feed = await self.get_feed()
-        if not feed:
-            return None
+class FeedWriter:
+    """Инкрементальная запись XML: заголовок, элементы, закрывающий тег"""
 
-        filter = FeedCriteriaFilter(
-            json.loads(self.feed.criteria), self.feed.cashbox_id
-        )
-        balance = await filter.get_warehouse_balance()
+    def __init__(self, root_tag: str, item_tag: str, tags_map: dict):
+        self.root_tag = root_tag
+        self.item_tag = item_tag
+        self.tags_map = tags_map
 
-        root_tag = feed["root_tag"]
-        item_tag = feed["item_tag"]
-        tags_map = feed["field_tags"]
+    def start(self) -> bytes:
+        return f'<?xml version="1.0" encoding="utf-8"?>\n<{self.root_tag}>\n'.encode(
+            "utf-8"
+        )
 
-        parts = [f'<?xml version="1.0" encoding="utf-8"?>\n<{root_tag}>\n']
-        for r in balance:
-            parts.append(f"  <{item_tag}>\n")
-            for xml_tag, field in tags_map.items():
+    def items(self, rows) -> bytes:
+        parts = []
+        for r in rows:
+            parts.append(f"  <{self.item_tag}>\n")
+            for xml_tag, field in self.tags_map.items():
                 val = r.get(field)
                 if val is None:
                     continue
@@ -48,15 +72,131 @@ class FeedGenerator:
                 elif isinstance(val, dict):
                     if field == "params":
                         for k, v in val.items():
-                            parts.append(f'    <{xml_tag} name="{k}">{v}</{xml_tag}>\n')
+                            name = quoteattr(str(k))
+                            text = escape(str(v))
+                            parts.append(
+                                f"    <{xml_tag} name={name}>{text}</{xml_tag}>\n"
+                            )
 
                 else:
                     text = escape(str(val))
                     parts.append(f"    <{xml_tag}>{text}</{xml_tag}>\n")
-            parts.append(f"  </{item_tag}>\n")
-        parts.append(f"</{root_tag}>")
-        xml_str = "".join(parts).encode("utf-8")
+            parts.append(f"  </{self.item_tag}>\n")
+        return "".join(parts).encode("utf-8")
 
-        response = Response(content=xml_str, media_type="application/xml")
-        response.headers["Cache-Control"] = "public, max-age=60"
-        return response
+    def end(self) -> bytes:
+        return f"</{self.root_tag}>".encode("utf-8")
+
+
+class FeedGenerator:
+
+    def __init__(self, url_token: str) -> None:
+        self.url_token = url_token
+        self.feed = None
+
+    async def get_feed(self):
+        if self.url_token and self.feed is None:
+            query = feeds.select().where(feeds.c.url_token == self.url_token)
+            self.feed = await database.fetch_one(query)
+
+        return self.feed
+
+    def _cache_path(self, version: str) -> str:
+        return os.path.join(FEEDS_CACHE_DIR, f"{self.feed.id}-{version}.xml")
+
+    async def get_version(self, filter: FeedCriteriaFilter) -> str:
+        """Версия фида: настройки фида и версия данных в его пределах"""
+        feed = self.feed
+        settings = json.dumps(
+            [
+                feed.root_tag,
+                feed.item_tag,
+                feed.field_tags,
+                feed.criteria,
+                feed.updated_at,
+            ],
+            default=str,
+            sort_keys=True,
+        )
+        scope_version = await filter.get_scope_version()
+        raw = f"{settings}:{scope_version}".encode("utf-8")
+        return hashlib.sha1(raw).hexdigest()
+
+    async def stream(self, filter: FeedCriteriaFilter, path: Optional[str] = None):
+        """
+        Поток байтов фида. С path поток дописывается во временный файл,
+        который после успешной записи заменяет прошлые версии фида
+        """
+        writer = FeedWriter(
+            self.feed["root_tag"], self.feed["item_tag"], self.feed["field_tags"]
+        )
+        file = None
+        tmp_path = None
+        if path is not None:
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                os.makedirs(FEEDS_CACHE_DIR, exist_ok=True)
+                file = open(tmp_path, "wb")
+            except OSError as e:
+                logger.warning(f"Feed cache is not writable: {e}")
+
+        async def emit(chunk: bytes):
+            nonlocal file
+            if file is not None:
+                try:
+                    await run_in_threadpool(file.write, chunk)
+                except OSError as e:
+                    logger.warning(f"Feed cache write failed: {e}")
+                    file.close()
+                    file = None
+            return chunk
+
+        try:
+            yield await emit(writer.start())
+            async for rows in filter.iterate_warehouse_balance():
+                yield await emit(writer.items(rows))
+            yield await emit(writer.end())
+
+            if file is not None:
+                file.close()
+                file = None
+                os.replace(tmp_path, path)
+                self._remove_stale(path)
+        finally:
+            # Клиент отключился или запрос к БД упал - недописанный файл
+            # не должен попасть в кэш
+            if file is not None:
+                file.close()
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _remove_stale(self, path: str):
+        for stale in glob.glob(os.path.join(FEEDS_CACHE_DIR, f"{self.feed.id}-*.xml")):
+            if stale != path:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+    async def generate(self, if_none_match: Optional[str] = None):
+        feed = await self.get_feed()
+        if not feed:
+            return None
+
+        filter = FeedCriteriaFilter(
+            json.loads(self.feed.criteria), self.feed.cashbox_id
+        )
+        version = await self.get_version(filter)
+        etag = f'"{version}"'
+        headers = {"Cache-Control": FEED_CACHE_CONTROL, "ETag": etag}
+
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+
+        path = self._cache_path(version)
+        if os.path.isfile(path):
+            return FileResponse(path, media_type=FEED_MEDIA_TYPE, headers=headers)
+
+        return StreamingResponse(
+            self.stream(filter, path), media_type=FEED_MEDIA_TYPE, headers=headers
+        )
@@ -3,7 +3,7 @@ import os
 import uuid
 
 from database.db import database, feeds
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from functions.helpers import get_user_by_token
 from starlette.responses import Response
 
@@ -40,15 +40,14 @@ async def create_feed(token: str, data: schemas.FeedCreate):
 @router.get("/feeds/{url_token}")
 async def get_feed(
     url_token: str,
+    request: Request,
 ):
-    query = feeds.select().where(feeds.c.url_token == url_token)
-    feed = await database.fetch_one(query)
+    generator = FeedGenerator(url_token)
+    feed = await generator.get_feed()
     if feed is None:
         raise HTTPException(status_code=404, detail="Feed not found")
 
-    generator = FeedGenerator(url_token)
-    result = await generator.generate()
-    return result if result is not None else None
+    return await generator.generate(request.headers.get("if-none-match"))
 
 
 @router.get("/feeds")
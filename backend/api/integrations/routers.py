@@ -1,5 +1,6 @@
-from database.db import database, integrations, pictures, users_cboxes_relation
+from database.db import database, integrations, pictures
 from fastapi import APIRouter, HTTPException
+from functions.auth_cache import resolve_token
 from sqlalchemy import func, select
 
 from ..oauth.utils import generate_rand_hex, ouath_response
@@ -10,8 +11,7 @@ router = APIRouter(prefix="/integrations", tags=["integrations"])
 
 @router.post("/")
 async def create_integration(token: str, integration: CreateApp):
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     print(integration)
     print(user)
     if user:
@@ -34,8 +34,7 @@ async def create_integration(token: str, integration: CreateApp):
 
 @router.get("/", response_model=ShowIntegrationGet)
 async def get_ints_by_token(token: str):
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             query = integrations.select().where(integrations.c.owner == user.id)
@@ -80,8 +79,7 @@ async def get_ints_by_token(token: str):
 
 @router.patch("/{intg_id}/")
 async def update_integration(intg_id: int, body: UpdateIntegration, token: str):
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     query = integrations.select(integrations.c.id == intg_id)
     integration = await database.fetch_one(query)
 
@@ -103,8 +101,7 @@ async def update_integration(intg_id: int, body: UpdateIntegration, token: str):
 
 @router.post("/install/{intg_id}/")
 async def install_app(intg_id: int, token: str):
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     query = integrations.select(integrations.c.id == intg_id)
     integration = await database.fetch_one(query)
     if user:
@@ -0,0 +1,113 @@
+"""
+Поиск пользователей кассы по телефону из тега USERPHONE_ карты.
+
+Телефоны всей пачки карт ищутся одним запросом по индексам
+tg_accounts.phone_normalized: точное совпадение цифр, затем совпадение
+последних 10 цифр (8XXXXXXXXXX и 7XXXXXXXXXX). Не найденные так
+телефоны ищутся нечетко по триграммному индексу phone_number, не более
+LOYALITY_CARDS_PHONE_FUZZY_LIMIT кандидатов на телефон с проверкой
+fuzz.ratio; 0 отключает нечеткий поиск
+"""
+
+import os
+from typing import Dict, Iterable, Optional
+
+from database.db import (
+    PHONE_SUFFIX_MODULO,
+    database,
+    users,
+    users_cboxes_relation,
+    users_phone_suffix,
+)
+from functions.helpers import clear_phone_number
+from fuzzywuzzy import fuzz
+from sqlalchemy import func, or_, select
+
+LOYALITY_CARDS_PHONE_FUZZY_LIMIT = int(
+    os.getenv("LOYALITY_CARDS_PHONE_FUZZY_LIMIT", 20)
+)
+PHONE_FUZZY_RATIO = 80
+# Совпадение по последним 10 цифрам только для полных номеров
+PHONE_SUFFIX_MIN = PHONE_SUFFIX_MODULO // 10
+
+TAG_PHONE_PREFIX = "USERPHONE_"
+
+
+def tag_phone(tags: Optional[str]) -> Optional[str]:
+    """Телефон из последнего тега USERPHONE_ карты"""
+    phone = None
+    for tag in (tags or "").split(","):
+        if tag.startswith(TAG_PHONE_PREFIX):
+            phone = tag.split("_")[-1]
+    return phone
+
+
+def _accounts_query(cashbox_id: int):
+    return (
+        select(users_cboxes_relation, users.c.phone_normalized)
+        .select_from(
+            users_cboxes_relation.join(
+                users, users.c.id == users_cboxes_relation.c.user
+            )
+        )
+        .where(
+            users_cboxes_relation.c.cashbox_id == cashbox_id,
+            users_cboxes_relation.c.status == True,
+        )
+    )
+
+
+async def _find_fuzzy(cashbox_id: int, phone: str):
+    similarity = func.similarity(users.c.phone_number, phone)
+    query = (
+        _accounts_query(cashbox_id)
+        .add_columns(users.c.phone_number)
+        .where(users.c.phone_number.op("%")(phone))
+        .order_by(similarity.desc())
+        .limit(LOYALITY_CARDS_PHONE_FUZZY_LIMIT)
+    )
+    for account in await database.fetch_all(query):
+        if fuzz.ratio(phone, account.phone_number) >= PHONE_FUZZY_RATIO:
+            return account
+    return None
+
+
+async def find_accounts_by_phones(cashbox_id: int, phones: Iterable[str]) -> Dict:
+    """
+    Активные аккаунты кассы (users_cboxes_relation) по телефонам.
+    Возвращает {телефон из тега: аккаунт} для найденных телефонов
+    """
+    normalized = {}
+    for phone in set(phones):
+        number = clear_phone_number(phone)
+        if number:
+            normalized[phone] = number
+    if not normalized:
+        return {}
+
+    numbers = set(normalized.values())
+    suffixes = {
+        number % PHONE_SUFFIX_MODULO for number in numbers if number >= PHONE_SUFFIX_MIN
+    }
+    query = _accounts_query(cashbox_id).where(
+        or_(
+            users.c.phone_normalized.in_(numbers),
+            users_phone_suffix.in_(suffixes),
+        )
+    )
+    by_number = {}
+    by_suffix = {}
+    for account in await database.fetch_all(query):
+        by_number.setdefault(account.phone_normalized, account)
+        by_suffix.setdefault(account.phone_normalized % PHONE_SUFFIX_MODULO, account)
+
+    accounts = {}
+    for phone, number in normalized.items():
+        account = by_number.get(number)
+        if account is None and number >= PHONE_SUFFIX_MIN:
+            account = by_suffix.get(number % PHONE_SUFFIX_MODULO)
+        if account is None and LOYALITY_CARDS_PHONE_FUZZY_LIMIT > 0:
+            account = await _find_fuzzy(cashbox_id, phone)
+        if account is not None:
+            accounts[phone] = account
+    return accounts
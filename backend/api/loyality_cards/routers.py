@@ -5,6 +5,7 @@ from typing import Optional
 import api.loyality_cards.schemas as schemas
 import phonenumbers
 from api.apple_wallet.utils import update_apple_wallet_pass
+from api.loyality_cards.phones import find_accounts_by_phones, tag_phone
 from common.apple_wallet_service.impl.WalletPassService import (
     WalletPassGeneratorService,
 )
@@ -30,7 +31,6 @@ from functions.helpers import (
     get_filters_cards,
     get_user_by_token,
 )
-from fuzzywuzzy import fuzz
 from phonenumbers import geocoder, region_code_for_number
 from sqlalchemy import Numeric, and_, cast, func, literal, or_, select
 from ws_manager import manager
@@ -244,36 +244,22 @@ async def new_loyality_card(
 
     inserted_ids = set()
 
-    for loyality_cards_values in loyality_card_data.dict()["__root__"]:
-        tag_phone = None
-        user_by_phone = None
+    cards_data = loyality_card_data.dict()["__root__"]
+    # Телефоны из тегов USERPHONE_ всей пачки - одним запросом
+    accounts_by_phone = await find_accounts_by_phones(
+        user.cashbox_id,
+        filter(None, (tag_phone(card.get("tags")) for card in cards_data)),
+    )
+
+    for loyality_cards_values in cards_data:
         loyality_cards_values["card_number"] = (
             int("".join(filter(str.isdigit, loyality_cards_values["card_number"])))
             if loyality_cards_values["card_number"]
             else None
         )
-        if loyality_cards_values.get("tags"):
-            tags_arr = loyality_cards_values["tags"].split(",")
-
-            for tag in tags_arr:
-                if tag.startswith("USERPHONE_"):
-                    tag_phone = tag.split("_")[-1]
-
-        if tag_phone:
-            q = users.select()
-            all_users = await database.fetch_all(q)
-
-            for phone_user in all_users:
-                similarity = fuzz.ratio(tag_phone, phone_user.phone_number)
-                if similarity >= 80:
-                    q = users_cboxes_relation.select().where(
-                        users_cboxes_relation.c.cashbox_id == user.cashbox_id,
-                        users_cboxes_relation.c.user == phone_user.id,
-                        users_cboxes_relation.c.status == True,
-                    )
-                    acc_by_phone = await database.fetch_one(q)
-                    if acc_by_phone:
-                        user_by_phone = acc_by_phone
+        user_by_phone = accounts_by_phone.get(
+            tag_phone(loyality_cards_values.get("tags"))
+        )
 
         if loyality_cards_values.get("organization_id"):
             loyality_card_org = await get_entity_by_id(
@@ -8,8 +8,8 @@ class LoyalityCardFilters(BaseModel):
     card_number: Optional[int]
     balance: Optional[float]
     tags: Optional[str]
-    income: Optional[int]
-    outcome: Optional[int]
+    income: Optional[float]
+    outcome: Optional[float]
     cashback_percent: Optional[int]
     minimal_checque_amount: Optional[int]
     max_percentage: Optional[int]
@@ -93,8 +93,8 @@ class LoyalityCardGet(BaseModel):
     card_number: int
     tags: Optional[str]
     balance: float
-    income: int
-    outcome: int
+    income: float
+    outcome: float
     contragent_id: int
     organization_id: int
     contragent: str
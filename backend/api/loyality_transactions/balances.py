@@ -0,0 +1,228 @@
+"""
+Баланс карт лояльности.
+
+income, outcome и balance карты ведутся дельтами: запись в
+loyality_transactions сопровождается apply_transactions в той же
+транзакции БД, и карта не пересчитывается по всей истории операций.
+Учитываются проведенные неудаленные начисления и списания, balance -
+неотрицательная разница income и outcome.
+
+Полный пересчет (recalculate_cards) остается для сверки расхождений
+джобой loyality_balance_verify и для массового пересчета карт
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from database.db import database, loyality_cards, loyality_transactions
+from segments.events.producer import publish_segment_changes
+from sqlalchemy import Numeric, and_, case, cast, func, literal, or_, select, true
+
+# Допустимое расхождение накопленных дельт с полным пересчетом
+BALANCE_TOLERANCE = 0.005
+# Карт за одну транзакцию полного пересчета: столько строк держится
+# заблокированными, пока считаются суммы
+RECALCULATE_CHUNK_SIZE = 1000
+
+
+def _card_sums(*conditions):
+    """Суммы начислений и списаний по картам"""
+    return (
+        select(
+            loyality_transactions.c.loyality_card_id.label("card_id"),
+            func.coalesce(
+                func.sum(
+                    case(
+                        (
+                            loyality_transactions.c.type == "accrual",
+                            loyality_transactions.c.amount,
+                        )
+                    )
+                ),
+                0,
+            ).label("income"),
+            func.coalesce(
+                func.sum(
+                    case(
+                        (
+                            loyality_transactions.c.type == "withdraw",
+                            loyality_transactions.c.amount,
+                        )
+                    )
+                ),
+                0,
+            ).label("outcome"),
+        )
+        .where(
+            and_(
+                loyality_transactions.c.status.is_(True),
+                loyality_transactions.c.is_deleted.is_(False),
+                *conditions,
+            )
+        )
+        .group_by(loyality_transactions.c.loyality_card_id)
+    )
+
+
+def _balance(income, outcome):
+    # ROUND(CASE WHEN income > outcome THEN income - outcome ELSE 0 END, 2)
+    return func.round(
+        cast(case((income > outcome, income - outcome), else_=0), Numeric), literal(2)
+    )
+
+
+async def apply_transactions(transaction_ids: Iterable[int], sign: int = 1):
+    """
+    Применяет операции к балансам их карт одним UPDATE.
+
+    sign=1 после вставки или изменения операций, sign=-1 до изменения
+    или удаления: операция вычитается в том виде, в каком она была
+    учтена. Строка карты блокируется UPDATE, параллельные записи по
+    карте не теряют дельты. Возвращает измененные карты
+    """
+    transaction_ids = list(transaction_ids)
+    if not transaction_ids:
+        return []
+
+    delta = _card_sums(loyality_transactions.c.id.in_(transaction_ids)).subquery(
+        "delta"
+    )
+    income = func.coalesce(loyality_cards.c.income, 0) + sign * delta.c.income
+    outcome = func.coalesce(loyality_cards.c.outcome, 0) + sign * delta.c.outcome
+    query = (
+        loyality_cards.update()
+        .where(loyality_cards.c.id == delta.c.card_id)
+        .values(income=income, outcome=outcome, balance=_balance(income, outcome))
+        .returning(
+            loyality_cards.c.id,
+            loyality_cards.c.cashbox_id,
+            loyality_cards.c.contragent_id,
+            loyality_cards.c.balance,
+        )
+    )
+    return await database.fetch_all(query)
+
+
+async def insert_transactions(values: List[dict]) -> List[int]:
+    """Вставка операций вместе с дельтами балансов их карт"""
+    if not values:
+        return []
+    async with database.transaction():
+        rows = await database.fetch_all(
+            loyality_transactions.insert()
+            .values(values)
+            .returning(loyality_transactions.c.id)
+        )
+        cards = await apply_transactions([row.id for row in rows])
+    await publish_cards_changes(cards)
+    return [row.id for row in rows]
+
+
+async def recalculate_cards(
+    card_ids: Optional[Iterable[int]] = None,
+    updated_since: Optional[datetime] = None,
+):
+    """
+    Полный пересчет балансов по истории операций.
+    card_ids ограничивает пересчет картами, updated_since - картами с
+    операциями, измененными после указанного времени. Обновляются только
+    разошедшиеся карты, они и возвращаются
+    """
+    card_filter = []
+    if card_ids is not None:
+        card_ids = list(card_ids)
+        if not card_ids:
+            return []
+        card_filter.append(loyality_cards.c.id.in_(card_ids))
+    if updated_since is not None:
+        card_filter.append(
+            loyality_cards.c.id.in_(
+                select(loyality_transactions.c.loyality_card_id).where(
+                    loyality_transactions.c.updated_at >= updated_since
+                )
+            )
+        )
+
+    rows = await database.fetch_all(
+        select(loyality_cards.c.id)
+        .where(and_(true(), *card_filter))
+        .order_by(loyality_cards.c.id)
+    )
+    ids = [row.id for row in rows]
+    cards = []
+    for offset in range(0, len(ids), RECALCULATE_CHUNK_SIZE):
+        cards += await _recalculate_chunk(ids[offset : offset + RECALCULATE_CHUNK_SIZE])
+    return cards
+
+
+async def _recalculate_chunk(card_ids: List[int]):
+    async with database.transaction():
+        # Сначала блокируем карты, и только следующим запросом считаем суммы:
+        # его снимок видит все дельты apply_transactions, зафиксированные до
+        # блокировки, а новые дождутся коммита и лягут поверх пересчета.
+        # UPDATE с суммами по снимку до блокировки затирал бы такие дельты
+        locked = await database.fetch_all(
+            select(loyality_cards.c.id)
+            .where(loyality_cards.c.id.in_(card_ids))
+            .order_by(loyality_cards.c.id)
+            .with_for_update()
+        )
+        locked_ids = [row.id for row in locked]
+        if not locked_ids:
+            return []
+
+        sums = _card_sums(
+            loyality_transactions.c.loyality_card_id.in_(locked_ids)
+        ).subquery("sums")
+        actual = (
+            select(
+                loyality_cards.c.id.label("card_id"),
+                func.coalesce(sums.c.income, 0).label("income"),
+                func.coalesce(sums.c.outcome, 0).label("outcome"),
+            )
+            .select_from(
+                loyality_cards.outerjoin(sums, sums.c.card_id == loyality_cards.c.id)
+            )
+            .where(loyality_cards.c.id.in_(locked_ids))
+            .subquery("actual")
+        )
+        balance = _balance(actual.c.income, actual.c.outcome)
+
+        def drifted(column, value):
+            return or_(
+                column.is_(None),
+                func.abs(column - value) > BALANCE_TOLERANCE,
+            )
+
+        query = (
+            loyality_cards.update()
+            .where(loyality_cards.c.id == actual.c.card_id)
+            .where(
+                or_(
+                    drifted(loyality_cards.c.income, actual.c.income),
+                    drifted(loyality_cards.c.outcome, actual.c.outcome),
+                    drifted(loyality_cards.c.balance, balance),
+                )
+            )
+            .values(income=actual.c.income, outcome=actual.c.outcome, balance=balance)
+            .returning(
+                loyality_cards.c.id,
+                loyality_cards.c.cashbox_id,
+                loyality_cards.c.contragent_id,
+                loyality_cards.c.balance,
+            )
+        )
+        return await database.fetch_all(query)
+
+
+async def publish_cards_changes(cards, source: str = "loyality_cards.balance"):
+    """Баланс карты участвует в критериях сегментов по лояльности"""
+    contragents_by_cashbox = defaultdict(set)
+    for card in cards:
+        if card.contragent_id:
+            contragents_by_cashbox[card.cashbox_id].add(card.contragent_id)
+    for cashbox_id, contragent_ids in contragents_by_cashbox.items():
+        await publish_segment_changes(
+            cashbox_id, contragent_ids=contragent_ids, source=source
+        )
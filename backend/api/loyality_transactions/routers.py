@@ -1,9 +1,11 @@
-import asyncio
 from datetime import datetime
 
 import api.loyality_transactions.schemas as schemas
+from api.loyality_transactions.balances import (
+    apply_transactions,
+    publish_cards_changes,
+)
 from database.db import (
-    async_session_maker,
     database,
     loyality_cards,
     loyality_transactions,
@@ -16,88 +18,12 @@ from functions.helpers import (
     get_filters_transactions,
     get_user_by_token,
 )
-from sqlalchemy import Numeric, case, cast, desc, func, literal, select, update
+from sqlalchemy import desc, func, select
 from ws_manager import manager
 
 router = APIRouter(tags=["loyality_transactions"])
 
 
-# Асинхронная функция подсчёта баланса бонусов по ID карты
-async def raschet_bonuses(card_id: int) -> None:
-    # Открываем асинхронную сессию SQLAlchemy
-    async with async_session_maker() as session:
-        # -----------------------------------------------
-        # Шаг 1. Формируем подзапрос для доходов (accrual)
-        # select SUM(amount) where type='accrual'
-        a_q = func.coalesce(
-            func.sum(
-                case(
-                    (
-                        loyality_transactions.c.type == "accrual",
-                        loyality_transactions.c.amount,
-                    )
-                )
-            ),
-            0,
-        ).label("income")
-
-        # -----------------------------------------------
-        # Шаг 2. Формируем подзапрос для расходов (withdraw)
-        # select SUM(amount) where type='withdraw'
-        w_q = func.coalesce(
-            func.sum(
-                case(
-                    (
-                        loyality_transactions.c.type == "withdraw",
-                        loyality_transactions.c.amount,
-                    )
-                )
-            ),
-            0,
-        ).label("outcome")
-
-        # -----------------------------------------------
-        # Шаг 3. Основной запрос для вычисления баланса
-        # ROUND(CASE WHEN income > outcome THEN income - outcome ELSE 0 END, 2)
-        balance_q = func.round(
-            cast(case((a_q > w_q, a_q - w_q), else_=0), Numeric), literal(2)
-        ).label("balance")
-
-        # -----------------------------------------------
-        # Шаг 4. Объединяем всё в SELECT и фильтруем по условиям
-        query = select(a_q, w_q, balance_q).where(
-            loyality_transactions.c.loyality_card_id == card_id,
-            loyality_transactions.c.status.is_(True),
-            loyality_transactions.c.is_deleted.is_(False),
-        )
-
-        # Выполняем запрос и получаем объект результата
-        result = await session.execute(query)
-        res = result.first()
-        if not res:
-            # Если нет транзакций — выходим
-            return
-
-        # Преобразуем результат в словарь
-        edit_dict = dict(res._mapping)
-
-        # -----------------------------------------------
-        # Шаг 5. Обновляем таблицу loyality_cards на основании расчёта
-        update_stmt = (
-            update(loyality_cards)
-            .where(loyality_cards.c.id == card_id)
-            .values(
-                income=edit_dict["income"],
-                outcome=edit_dict["outcome"],
-                balance=edit_dict["balance"],
-            )
-        )
-
-        # Выполняем UPDATE и фиксируем изменения
-        await session.execute(update_stmt)
-        await session.commit()
-
-
 @router.get("/loyality_transactions/{idx}/", response_model=schemas.LoyalityTransaction)
 async def get_loyality_transaction_by_id(token: str, idx: int):
     """Получение транзакции по ID"""
@@ -202,7 +128,11 @@ async def edit_loyality_transaction(
             )
             .values(loyality_transaction_values)
         )
-        await database.execute(query)
+        async with database.transaction():
+            cards = await apply_transactions([idx], sign=-1)
+            await database.execute(query)
+            cards = [*cards, *await apply_transactions([idx])]
+        await publish_cards_changes(cards)
         loyality_transaction_db = await get_entity_by_id_cashbox(
             loyality_transactions, idx, user.cashbox_id
         )
@@ -218,15 +148,6 @@ async def edit_loyality_transaction(
         },
     )
 
-    card_idx = (
-        select(loyality_transactions.c.loyality_card_id)
-        .where(loyality_transactions.c.id == idx)
-        .limit(1)
-    )
-    card_idx = await database.fetch_val(card_idx, column=0)
-
-    await asyncio.gather(asyncio.create_task(raschet_bonuses(card_idx)))
-
     return {**loyality_transaction_db, **{"data": {"status": "success"}}}
 
 
@@ -247,7 +168,10 @@ async def delete_loyality_transaction(token: str, idx: int):
         )
         .values({"is_deleted": True})
     )
-    await database.execute(query)
+    async with database.transaction():
+        cards = await apply_transactions([idx], sign=-1)
+        await database.execute(query)
+    await publish_cards_changes(cards)
 
     query = loyality_transactions.select().where(
         loyality_transactions.c.id == idx,
@@ -255,8 +179,6 @@ async def delete_loyality_transaction(token: str, idx: int):
     )
     loyality_transaction_db = await database.fetch_one(query)
 
-    loyality_card_id = loyality_transaction_db.loyality_card_id
-
     loyality_transaction_db = datetime_to_timestamp(loyality_transaction_db)
 
     await manager.send_message(
@@ -268,6 +190,4 @@ async def delete_loyality_transaction(token: str, idx: int):
         },
     )
 
-    await asyncio.gather(asyncio.create_task(raschet_bonuses(loyality_card_id)))
-
     return {**loyality_transaction_db, **{"data": {"status": "success"}}}
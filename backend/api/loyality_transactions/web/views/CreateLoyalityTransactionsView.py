@@ -1,9 +1,8 @@
-import asyncio
 from datetime import datetime
 from typing import List, Union
 
 from api.loyality_transactions import schemas
-from api.loyality_transactions.routers import raschet_bonuses
+from api.loyality_transactions.balances import insert_transactions
 from database.db import database, loyality_cards, loyality_transactions
 from fastapi import HTTPException
 from functions.helpers import (
@@ -60,7 +59,6 @@ class CreateLoyalityTransactionsView:
             raise HTTPException(400, "; ".join(errors))
 
         insert_values = []
-        balance_delta = {}
 
         for p in prepared:
             payload = p["raw"].dict()
@@ -90,36 +88,10 @@ class CreateLoyalityTransactionsView:
 
             insert_values.append(payload)
 
-            amt = float(payload["amount"])
-            delta = amt if payload["type"] == "accrual" else -amt
-            balance_delta[card.id] = balance_delta.get(card.id, 0.0) + delta
-
-        query = (
-            loyality_transactions.insert()
-            .values(insert_values)
-            .returning(loyality_transactions.c.id)
-        )
-
-        ids = await database.fetch_all(query=query)
-
-        if balance_delta:
-            update_query = """
-                    UPDATE loyality_cards
-                    SET balance = balance + :delta
-                    WHERE id = :id
-                """
-            await database.execute_many(
-                query=update_query,
-                values=[
-                    {"id": cid, "delta": round(d, 2)}
-                    for cid, d in balance_delta.items()
-                ],
-            )
+        ids = await insert_transactions(insert_values)
 
         lt_rows = await database.fetch_all(
-            select(loyality_transactions).where(
-                loyality_transactions.c.id.in_([k.id for k in ids])
-            )
+            select(loyality_transactions).where(loyality_transactions.c.id.in_(ids))
         )
         lt_rows_ts = [datetime_to_timestamp(r) for r in lt_rows]
 
@@ -128,8 +100,6 @@ class CreateLoyalityTransactionsView:
                 token,
                 {"action": "create", "target": "loyality_transactions", "result": row},
             )
-        for card_id in balance_delta:
-            asyncio.create_task(raschet_bonuses(card_id))
 
         def with_success(payload: dict) -> dict:
             return {**payload, "data": {"status": "success"}}
@@ -15,6 +15,7 @@ from database.db import (
     marketplace_utm_tags,
     nomenclature,
     warehouse_balances,
+    warehouse_stock_current,
     warehouses,
 )
 from fastapi import HTTPException
@@ -375,61 +376,31 @@ class BaseMarketplaceService:
         client_lon: Optional[float] = None,
         limit: int = 50,
     ) -> List[AvailableWarehouse]:
-        from sqlalchemy import func
-
-        wb_ranked = (
+        query = (
             select(
-                warehouse_balances.c.organization_id.label("organization_id"),
-                warehouse_balances.c.warehouse_id.label("warehouse_id"),
-                warehouse_balances.c.nomenclature_id.label("nomenclature_id"),
-                warehouse_balances.c.current_amount.label("current_amount"),
+                warehouse_stock_current.c.warehouse_id,
+                warehouse_stock_current.c.organization_id,
+                warehouse_stock_current.c.current_amount,
                 warehouses.c.name.label("warehouse_name"),
                 warehouses.c.address.label("warehouse_address"),
                 warehouses.c.latitude.label("latitude"),
                 warehouses.c.longitude.label("longitude"),
-                func.row_number()
-                .over(
-                    partition_by=[
-                        warehouse_balances.c.organization_id,
-                        warehouse_balances.c.warehouse_id,
-                        warehouse_balances.c.nomenclature_id,
-                    ],
-                    order_by=[
-                        desc(warehouse_balances.c.created_at),
-                        desc(warehouse_balances.c.id),
-                    ],
-                )
-                .label("rn"),
             )
             .select_from(
-                warehouse_balances.join(
+                warehouse_stock_current.join(
                     warehouses,
                     and_(
-                        warehouses.c.id == warehouse_balances.c.warehouse_id,
+                        warehouses.c.id == warehouse_stock_current.c.warehouse_id,
                         warehouses.c.is_public.is_(True),
                         warehouses.c.status.is_(True),
                         warehouses.c.is_deleted.is_not(True),
                     ),
                 )
             )
-            .where(warehouse_balances.c.nomenclature_id == nomenclature_id)
-            .subquery()
-        )
-
-        query = (
-            select(
-                wb_ranked.c.warehouse_id,
-                wb_ranked.c.organization_id,
-                wb_ranked.c.current_amount,
-                wb_ranked.c.warehouse_name,
-                wb_ranked.c.warehouse_address,
-                wb_ranked.c.latitude,
-                wb_ranked.c.longitude,
-            )
             .where(
                 and_(
-                    wb_ranked.c.rn == 1,
-                    wb_ranked.c.current_amount > 0,
+                    warehouse_stock_current.c.nomenclature_id == nomenclature_id,
+                    warehouse_stock_current.c.current_amount > 0,
                 )
             )
             .limit(limit)
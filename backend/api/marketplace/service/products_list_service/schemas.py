@@ -106,6 +106,7 @@ class MarketplaceProductList(BaseModel):
     detected_city: Optional[str] = None  # Автоматически определенный город по IP
     detected_lat: Optional[float] = None  # Широта определенного города
     detected_lon: Optional[float] = None  # Долгота определенного города
+    next_cursor: Optional[str] = None  # Cursor следующей страницы (None - конец)
 
 
 class MarketplaceSort(Enum):
@@ -124,6 +125,9 @@ class MarketplaceProductsRequest(BaseModel):
     lon: Optional[float] = None
     page: int = 1
     size: int = Field(default=20, le=100)
+    # Непрозрачный cursor из next_cursor предыдущего ответа; если передан,
+    # page игнорируется (бесконечная прокрутка)
+    cursor: Optional[str] = None
     sort_by: Optional[MarketplaceSort] = None
     sort_order: Optional[Literal["asc", "desc"]] = "desc"
     category: Optional[str] = None
@@ -1,5 +1,7 @@
+import base64
+import binascii
 import json
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List, Optional
 
 from api.marketplace.service.base_marketplace_service import BaseMarketplaceService
@@ -13,9 +15,7 @@ from api.marketplace.service.products_list_service.schemas import (
     MarketplaceSort,
     product_buttons_text,
 )
-from api.marketplace.service.public_categories.public_categories_service import (
-    MarketplacePublicCategoriesService,
-)
+from api.marketplace.service.public_categories.closure import subtree_ids
 from common.geocoders.instance import geocoder
 from common.utils.url_helper import get_app_url_for_environment
 from database.db import (
@@ -36,7 +36,7 @@ from database.db import (
     prices,
     units,
     users,
-    warehouse_balances,
+    warehouse_stock_current,
     warehouses,
 )
 from fastapi import HTTPException
@@ -44,11 +44,14 @@ from sqlalchemy import (
     Float,
     and_,
     asc,
+    case,
     desc,
+    false,
     func,
     literal_column,
     or_,
     select,
+    tuple_,
     union_all,
 )
 
@@ -69,8 +72,10 @@ class MarketplaceProductsListService(BaseMarketplaceService):
             return f"https://{base_url}/{photo_path.lstrip('/')}"
 
     @staticmethod
-    def __build_picture_url(picture_id: Optional[int]) -> Optional[str]:
-        """Строит публичный URL для фото по ID"""
+    def __build_picture_url(
+        picture_id: Optional[int], size: Optional[str] = None
+    ) -> Optional[str]:
+        """Строит публичный URL для фото по ID, size - уменьшенная копия"""
         if not picture_id:
             return None
         base_url = get_app_url_for_environment()
@@ -79,7 +84,44 @@ class MarketplaceProductsListService(BaseMarketplaceService):
         # Добавляем протокол, если его нет
         if not base_url.startswith(("http://", "https://")):
             base_url = f"https://{base_url}"
-        return f"{base_url}/api/v1/pictures/{picture_id}/content"
+        url = f"{base_url}/api/v1/pictures/{picture_id}/content"
+        return f"{url}?size={size}" if size else url
+
+    @staticmethod
+    def __encode_cursor(priority: int, sort_value, product_id: int, offset: int) -> str:
+        """
+        Упаковывает позицию keyset-пагинации в непрозрачную строку;
+        offset - сколько товаров выдачи уже отдано до этой позиции
+        """
+        if isinstance(sort_value, datetime):
+            sort_value = sort_value.isoformat()
+        payload = json.dumps(
+            [priority, sort_value, product_id, offset], ensure_ascii=False
+        )
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    @staticmethod
+    def __decode_cursor(cursor: str, is_datetime: bool) -> tuple:
+        """
+        Распаковывает cursor, выданный __encode_cursor. У cursor, выданных
+        до появления offset, он None
+        """
+        try:
+            priority, sort_value, product_id, *rest = json.loads(
+                base64.urlsafe_b64decode(cursor.encode())
+            )
+            offset = int(rest[0]) if rest else None
+            if sort_value is None:
+                # Старые cursor с NULL в ключе: значение, которым его
+                # теперь заменяет coalesce в запросе
+                sort_value = (
+                    datetime.fromtimestamp(0, timezone.utc) if is_datetime else ""
+                )
+            elif is_datetime:
+                sort_value = datetime.fromisoformat(sort_value)
+            return int(priority), sort_value, int(product_id), offset
+        except (binascii.Error, ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Некорректный cursor")
 
     async def get_product(
         self,
@@ -581,22 +623,6 @@ class MarketplaceProductsListService(BaseMarketplaceService):
 
         # Отдельный запрос для получения складов с остатками
         # ОПТИМИЗАЦИЯ: Используем подзапрос с MAX вместо прямого запроса - получаем только последние остатки
-        wb_max_for_product = (
-            select(
-                warehouse_balances.c.organization_id,
-                warehouse_balances.c.warehouse_id,
-                warehouse_balances.c.nomenclature_id,
-                func.max(warehouse_balances.c.id).label("max_id"),
-            )
-            .where(warehouse_balances.c.nomenclature_id == product_id)
-            .group_by(
-                warehouse_balances.c.organization_id,
-                warehouse_balances.c.warehouse_id,
-                warehouse_balances.c.nomenclature_id,
-            )
-            .subquery()
-        )
-
         warehouses_query = (
             select(
                 warehouses.c.id.label("warehouse_id"),
@@ -604,33 +630,22 @@ class MarketplaceProductsListService(BaseMarketplaceService):
                 warehouses.c.address.label("warehouse_address"),
                 warehouses.c.latitude,
                 warehouses.c.longitude,
-                warehouse_balances.c.current_amount,
-                warehouse_balances.c.organization_id,
+                warehouse_stock_current.c.current_amount,
+                warehouse_stock_current.c.organization_id,
             )
             .select_from(
-                warehouse_balances.join(
-                    wb_max_for_product,
-                    and_(
-                        warehouse_balances.c.organization_id
-                        == wb_max_for_product.c.organization_id,
-                        warehouse_balances.c.warehouse_id
-                        == wb_max_for_product.c.warehouse_id,
-                        warehouse_balances.c.nomenclature_id
-                        == wb_max_for_product.c.nomenclature_id,
-                        warehouse_balances.c.id == wb_max_for_product.c.max_id,
-                    ),
-                ).join(
+                warehouse_stock_current.join(
                     warehouses,
                     and_(
-                        warehouses.c.id == warehouse_balances.c.warehouse_id,
+                        warehouses.c.id == warehouse_stock_current.c.warehouse_id,
                         warehouses.c.is_deleted.is_not(True),
                     ),
                 )
             )
             .where(
                 and_(
-                    warehouse_balances.c.nomenclature_id == product_id,
-                    warehouse_balances.c.current_amount
+                    warehouse_stock_current.c.nomenclature_id == product_id,
+                    warehouse_stock_current.c.current_amount
                     > 0,  # Только склады с остатками
                 )
             )
@@ -1231,37 +1246,9 @@ class MarketplaceProductsListService(BaseMarketplaceService):
 
         # --- Балансы по складам ---
 
-        # 1) Берём последнюю запись по каждой паре (организация, склад, номенклатура)
-        wb_ranked = select(
-            warehouse_balances.c.organization_id.label("organization_id"),
-            warehouse_balances.c.warehouse_id.label("warehouse_id"),
-            warehouse_balances.c.nomenclature_id.label("nomenclature_id"),
-            warehouse_balances.c.current_amount.label("current_amount"),
-            func.row_number()
-            .over(
-                partition_by=[
-                    warehouse_balances.c.organization_id,
-                    warehouse_balances.c.warehouse_id,
-                    warehouse_balances.c.nomenclature_id,
-                ],
-                order_by=[
-                    desc(warehouse_balances.c.created_at),
-                    desc(warehouse_balances.c.id),
-                ],
-            )
-            .label("rn"),
-        ).subquery()
-
-        wb_latest = (
-            select(
-                wb_ranked.c.organization_id,
-                wb_ranked.c.warehouse_id,
-                wb_ranked.c.nomenclature_id,
-                wb_ranked.c.current_amount,
-            )
-            .where(wb_ranked.c.rn == 1)
-            .subquery()
-        )
+        # 1) Последняя запись по каждой паре (организация, склад, номенклатура)
+        # поддерживается проекцией warehouse_stock_current
+        wb_latest = warehouse_stock_current.alias("wb_latest")
 
         # 2) Подсчёт суммарного остатка по товару (только положительные остатки)
         stock_subquery = (
@@ -1304,8 +1291,120 @@ class MarketplaceProductsListService(BaseMarketplaceService):
                 .subquery()
             )
 
-        # Приоритетная сортировка будет выполнена в Python после получения данных
-        # Это избегает проблем с типами данных в SQL
+        # 5) Приоритет выдачи считается в SQL, чтобы сортировка и пагинация
+        # не требовали выгрузки всего каталога:
+        # 0 - Город + селлер + совпадение адреса
+        # 1 - Город + селлер
+        # 2 - Город + совпадение адреса
+        # 3 - Только город
+        # 4 - Селлер + совпадение адреса
+        # 5 - Только селлер
+        # 6 - Только совпадение адреса
+        # 7 - Остальные
+        # Если у селлера нет товаров, условие по селлеру просто ни для кого
+        # не выполняется, и выдача не меняется.
+        use_priority = bool(
+            request.city
+            or request.seller_id
+            or (request.address and not request.lat and not request.lon)
+        )
+        join_city_warehouse = use_priority and city_warehouse_subquery is not None
+        sort_priority = literal_column("0")
+        if use_priority:
+            has_city = (
+                func.coalesce(city_warehouse_subquery.c.has_city_warehouse, False)
+                if join_city_warehouse
+                else false()
+            )
+            is_seller = (
+                nomenclature.c.cashbox == request.seller_id
+                if request.seller_id
+                else false()
+            )
+            # Совпадение адреса цены с адресом/городом клиента важно, когда
+            # координаты одинаковые или неточные, поэтому применяется только без них
+            has_address_match = false()
+            if (request.address or request.city) and (
+                not request.lat or not request.lon
+            ):
+                has_address_match = func.coalesce(
+                    func.lower(active_prices_subquery.c.address).contains(
+                        (request.address or request.city).lower(), autoescape=True
+                    ),
+                    False,
+                )
+            sort_priority = (
+                case((has_city, 0), else_=4)
+                + case((is_seller, 0), else_=2)
+                + case((has_address_match, 0), else_=1)
+            )
+
+        # 6) Расстояние до ближайшего склада с остатком (то же, что поле
+        # distance в ответе). Считается в SQL, чтобы сортировка по нему
+        # работала через keyset, а не только внутри страницы; товары без
+        # складов с координатами (и запросы без координат) - в конце
+        distance_sort = literal_column("999999.0")
+        if request.sort_by == MarketplaceSort.distance and request.lat and request.lon:
+            wb_distance = warehouse_stock_current.alias("wb_distance")
+            wh_distance = warehouses.alias("wh_distance")
+            client_lat_rad = func.radians(literal_column(str(float(request.lat))))
+            client_lon_rad = func.radians(literal_column(str(float(request.lon))))
+            warehouse_lat_rad = func.radians(wh_distance.c.latitude)
+            warehouse_lon_rad = func.radians(wh_distance.c.longitude)
+            a = func.pow(
+                func.sin((warehouse_lat_rad - client_lat_rad) / literal_column("2.0")),
+                literal_column("2.0"),
+            ) + func.cos(client_lat_rad) * func.cos(warehouse_lat_rad) * func.pow(
+                func.sin((warehouse_lon_rad - client_lon_rad) / literal_column("2.0")),
+                literal_column("2.0"),
+            )
+            a_safe = func.least(
+                literal_column("1.0"), func.greatest(literal_column("0.0"), a)
+            )
+            warehouse_distance = (
+                literal_column("6371.0")
+                * literal_column("2.0")
+                * func.atan2(
+                    func.sqrt(a_safe), func.sqrt(literal_column("1.0") - a_safe)
+                )
+            )
+            distance_sort = func.coalesce(
+                select(func.min(warehouse_distance))
+                .select_from(
+                    wb_distance.join(
+                        wh_distance,
+                        and_(
+                            wh_distance.c.id == wb_distance.c.warehouse_id,
+                            wh_distance.c.is_public.is_(True),
+                            wh_distance.c.status.is_(True),
+                            wh_distance.c.is_deleted.is_not(True),
+                        ),
+                    )
+                )
+                .where(
+                    wb_distance.c.nomenclature_id == nomenclature.c.id,
+                    wb_distance.c.current_amount > 0,
+                )
+                .scalar_subquery(),
+                literal_column("999999.0"),
+            )
+
+        # 7) Поле сортировки; по умолчанию — по продажам. Ключ не должен
+        # быть NULL: сравнение кортежей в keyset с NULL дает NULL, и такие
+        # товары пропадали бы со следующих страниц
+        total_sold_sort = func.coalesce(total_sold_subquery.c.total_sold, 0)
+        epoch = func.to_timestamp(0)
+        sort_field = {
+            MarketplaceSort.distance: distance_sort,
+            MarketplaceSort.price: active_prices_subquery.c.price,
+            MarketplaceSort.name: func.coalesce(nomenclature.c.name, ""),
+            MarketplaceSort.rating: func.coalesce(
+                marketplace_rating_aggregates.c.avg_rating, 0
+            ),
+            MarketplaceSort.total_sold: total_sold_sort,
+            MarketplaceSort.created_at: func.coalesce(nomenclature.c.created_at, epoch),
+            MarketplaceSort.updated_at: func.coalesce(nomenclature.c.updated_at, epoch),
+        }.get(request.sort_by, total_sold_sort)
 
         # --- Основной запрос по товарам ---
         # Формируем список колонок для select
@@ -1352,8 +1451,10 @@ class MarketplaceProductsListService(BaseMarketplaceService):
             func.coalesce(total_sold_subquery.c.total_sold, 0).label("total_sold"),
             # Склады получаем отдельным запросом после основного - это быстрее
             literal_column("NULL::jsonb[]").label("available_warehouses"),
-            # Добавляем cashbox_id для определения приоритета в Python
             nomenclature.c.cashbox.label("cashbox_id"),
+            # Ключ keyset-пагинации (priority, sort_value, id)
+            sort_priority.label("sort_priority"),
+            sort_field.label("sort_value"),
         ]
 
         query = (
@@ -1410,8 +1511,12 @@ class MarketplaceProductsListService(BaseMarketplaceService):
             )
         )
 
-        # JOIN с подзапросом города не нужен в основном запросе
-        # Будем определять город по складам после получения данных
+        if join_city_warehouse:
+            query = query.join(
+                city_warehouse_subquery,
+                city_warehouse_subquery.c.nomenclature_id == nomenclature.c.id,
+                isouter=True,
+            )
 
         # Не соединяем со складами в основном запросе - получаем их отдельно
         # Это быстрее и избегает дублирования строк
@@ -1508,14 +1613,12 @@ class MarketplaceProductsListService(BaseMarketplaceService):
             conditions.append(nomenclature.c.id == attrs_subquery.c.nomenclature_id)
 
         if request.global_category_id:
-            # Получаем все ID категорий (включая дочерние) рекурсивно
-            all_category_ids = await MarketplacePublicCategoriesService._get_all_category_ids_recursive(
-                request.global_category_id
-            )
-            if all_category_ids:
-                conditions.append(
-                    nomenclature.c.global_category_id.in_(all_category_ids)
+            # Категория и все ее дочерние по замыканию дерева категорий
+            conditions.append(
+                nomenclature.c.global_category_id.in_(
+                    subtree_ids(request.global_category_id)
                 )
+            )
 
         query = query.where(and_(*conditions))
 
@@ -1541,195 +1644,56 @@ class MarketplaceProductsListService(BaseMarketplaceService):
             total_sold_subquery.c.total_sold,
             cboxes.c.id,  # Нужно для проверки seller_id в sort_priority
         ]
+        if join_city_warehouse:
+            group_by_fields.append(city_warehouse_subquery.c.has_city_warehouse)
         query = query.group_by(*group_by_fields)
 
-        # --- Сортировка ---
+        # --- Сортировка и пагинация ---
         order = asc if request.sort_order == "asc" else desc
+        order_by_fields = [order(sort_field), order(nomenclature.c.id)]
+        if use_priority:
+            order_by_fields.insert(0, asc(sort_priority))
+        query = query.order_by(*order_by_fields)
 
-        # Приоритетная сортировка будет выполнена в Python после получения данных
-
-        # Затем по выбранному полю
-        if request.sort_by == MarketplaceSort.price:
-            query = query.order_by(order(active_prices_subquery.c.price))
-        elif request.sort_by == MarketplaceSort.name:
-            query = query.order_by(order(nomenclature.c.name))
-        elif request.sort_by == MarketplaceSort.rating:
-            query = query.order_by(order(marketplace_rating_aggregates.c.avg_rating))
-        elif request.sort_by == MarketplaceSort.total_sold:
-            query = query.order_by(order(total_sold_subquery.c.total_sold))
-        elif request.sort_by == MarketplaceSort.created_at:
-            query = query.order_by(order(nomenclature.c.created_at))
-        elif request.sort_by == MarketplaceSort.updated_at:
-            query = query.order_by(order(nomenclature.c.updated_at))
-        else:
-            # по умолчанию — по продажам
-            query = query.order_by(order(total_sold_subquery.c.total_sold))
-
-        # Получаем все товары без пагинации для сортировки по приоритету в Python
-        # (пагинацию применим после сортировки)
-        products_db = await database.fetch_all(query)
-
-        # --- Сортировка по приоритету в Python (город+селлер, город, селлер, совпадение адреса, остальные) ---
-        # Применяем приоритизацию только если есть параметры city, seller_id или address
-        # Это не должно менять набор товаров, только их порядок
-        if (
-            request.city
-            or request.seller_id
-            or (request.address and not request.lat and not request.lon)
-        ):
-            # Получаем информацию о складах для определения города товара
-            product_ids = [row["id"] for row in products_db]
-            product_city_map = {}  # product_id -> has_city_warehouse (bool)
-
-            if request.city and product_ids:
-                # Проверяем, есть ли у товара склад в указанном городе
-                city_check_query = (
-                    select(
-                        wb_latest.c.nomenclature_id.label("nomenclature_id"),
-                        func.bool_or(
-                            func.lower(wh_bal.c.address).ilike(
-                                f"%{request.city.lower()}%"
-                            )
-                        ).label("has_city_warehouse"),
-                    )
-                    .select_from(
-                        wb_latest.join(
-                            wh_bal,
-                            and_(
-                                wh_bal.c.id == wb_latest.c.warehouse_id,
-                                wh_bal.c.is_deleted.is_not(True),
-                            ),
-                        )
-                    )
-                    .where(
-                        and_(
-                            wb_latest.c.nomenclature_id.in_(product_ids),
-                            wh_bal.c.address.is_not(None),
-                        )
-                    )
-                    .group_by(wb_latest.c.nomenclature_id)
-                )
-                city_rows = await database.fetch_all(city_check_query)
-                product_city_map = {
-                    row["nomenclature_id"]: row["has_city_warehouse"]
-                    for row in city_rows
-                }
-
-            # Проверяем, есть ли у селлера активные товары (если передан seller_id)
-            seller_has_products = True
-            if request.seller_id:
-                seller_product_ids = [
-                    row["id"]
-                    for row in products_db
-                    if (row.get("cashbox_id") or row.get("cashbox"))
-                    == request.seller_id
-                ]
-                seller_has_products = len(seller_product_ids) > 0
-
-            # Функция для определения приоритета товара
-            def get_product_priority(product_row):
-                cashbox_id = product_row.get("cashbox_id") or product_row.get("cashbox")
-                has_city = product_city_map.get(product_row["id"], False)
-                is_seller = (
-                    (cashbox_id == request.seller_id) if request.seller_id else False
+        offset = (request.page - 1) * request.size
+        if request.cursor:
+            # Keyset: продолжаем строго после последнего товара предыдущей страницы
+            cursor_priority, cursor_value, cursor_id, offset = self.__decode_cursor(
+                request.cursor,
+                is_datetime=request.sort_by
+                in (MarketplaceSort.created_at, MarketplaceSort.updated_at),
+            )
+            sort_key = tuple_(sort_field, nomenclature.c.id)
+            cursor_key = tuple_(cursor_value, cursor_id)
+            query = query.where(
+                or_(
+                    sort_priority > cursor_priority,
+                    and_(
+                        sort_priority == cursor_priority,
+                        (
+                            sort_key > cursor_key
+                            if order is asc
+                            else sort_key < cursor_key
+                        ),
+                    ),
                 )
+            )
+        else:
+            query = query.offset(offset)
 
-                # Если у селлера нет товаров - не приоритизируем по seller_id
-                if request.seller_id and not seller_has_products:
-                    is_seller = False
-
-                # Проверяем совпадение адреса цены с адресом/городом клиента
-                # Это важно, когда координаты одинаковые или неточные
-                # Применяем только если нет координат (иначе используем координаты)
-                price_address = product_row.get("price_address", "")
-                has_address_match = False
-                if (
-                    (request.address or request.city)
-                    and price_address
-                    and (not request.lat or not request.lon)
-                ):
-                    search_address_lower = (
-                        request.address or request.city or ""
-                    ).lower()
-                    price_address_lower = price_address.lower()
-                    has_address_match = search_address_lower in price_address_lower
-
-                # Приоритеты:
-                # 0 - Город + селлер + совпадение адреса
-                # 1 - Город + селлер
-                # 2 - Город + совпадение адреса
-                # 3 - Только город
-                # 4 - Селлер + совпадение адреса
-                # 5 - Только селлер
-                # 6 - Только совпадение адреса
-                # 7 - Остальные
-
-                if has_city and is_seller and has_address_match:
-                    return 0  # Город + селлер + совпадение адреса
-                elif has_city and is_seller:
-                    return 1  # Город + селлер
-                elif has_city and has_address_match:
-                    return 2  # Город + совпадение адреса
-                elif has_city:
-                    return 3  # Только город
-                elif is_seller and has_address_match:
-                    return 4  # Селлер + совпадение адреса
-                elif is_seller:
-                    return 5  # Только селлер
-                elif has_address_match:
-                    return 6  # Только совпадение адреса
-                else:
-                    return 7  # Остальные
-
-            # Сортируем по приоритету, затем по выбранному полю
-            products_db = list(products_db)
-            products_db.sort(key=lambda p: get_product_priority(p))
-
-            # Затем применяем обычную сортировку по выбранному полю
-            if request.sort_by == MarketplaceSort.price:
-                products_db.sort(
-                    key=lambda p: p.get("price", 0),
-                    reverse=(request.sort_order != "asc"),
-                )
-            elif request.sort_by == MarketplaceSort.name:
-                products_db.sort(
-                    key=lambda p: p.get("name", ""),
-                    reverse=(request.sort_order != "asc"),
-                )
-            elif request.sort_by == MarketplaceSort.rating:
-                products_db.sort(
-                    key=lambda p: p.get("rating") or 0,
-                    reverse=(request.sort_order != "asc"),
-                )
-            elif request.sort_by == MarketplaceSort.total_sold:
-                products_db.sort(
-                    key=lambda p: p.get("total_sold", 0),
-                    reverse=(request.sort_order != "asc"),
-                )
-            elif request.sort_by == MarketplaceSort.created_at:
-                products_db.sort(
-                    key=lambda p: p.get("created_at") or datetime.min,
-                    reverse=(request.sort_order != "asc"),
-                )
-            elif request.sort_by == MarketplaceSort.updated_at:
-                products_db.sort(
-                    key=lambda p: p.get("updated_at") or datetime.min,
-                    reverse=(request.sort_order != "asc"),
-                )
-            else:
-                # По умолчанию — по продажам
-                products_db.sort(
-                    key=lambda p: p.get("total_sold", 0),
-                    reverse=(request.sort_order != "asc"),
-                )
+        # Берём на одну строку больше, чтобы понять, есть ли следующая страница
+        products_db = await database.fetch_all(query.limit(request.size + 1))
 
-            # Применяем пагинацию после сортировки
-            offset = (request.page - 1) * request.size
-            products_db = products_db[offset : offset + request.size]
-        else:
-            # Если нет параметров city/seller_id, применяем обычную пагинацию
-            offset = (request.page - 1) * request.size
-            products_db = products_db[offset : offset + request.size]
+        next_cursor = None
+        if len(products_db) > request.size:
+            products_db = products_db[: request.size]
+            last_product = products_db[-1]
+            next_cursor = self.__encode_cursor(
+                last_product["sort_priority"],
+                last_product["sort_value"],
+                last_product["id"],
+                offset + request.size if offset is not None else None,
+            )
 
         # Получаем склады отдельным запросом только для тех товаров, которые вернулись
         # Это быстрее, чем делать это в основном запросе (избегаем дублирования строк)
@@ -1825,8 +1789,10 @@ class MarketplaceProductsListService(BaseMarketplaceService):
         products: List[MarketplaceProduct] = []
         for index, product in enumerate(products_db):
             product_dict = dict(product)
-            product_dict["listing_pos"] = (request.page - 1) * request.size + index + 1
-            product_dict["listing_page"] = request.page
+            # Позиция в выдаче: для cursor-страниц - от числа уже отданных товаров
+            if offset is not None:
+                product_dict["listing_pos"] = offset + index + 1
+                product_dict["listing_page"] = offset // request.size + 1
 
             # Images - преобразуем ID фото в публичные URL
             images = product_dict.get("images")
@@ -1837,8 +1803,9 @@ class MarketplaceProductsListService(BaseMarketplaceService):
                     # Фильтруем None значения и преобразуем ID в URL
                     image_ids = [pid for pid in images if pid is not None]
                     if image_ids:
+                        # В списке товаров - уменьшенные копии, не оригиналы
                         product_dict["images"] = [
-                            self.__build_picture_url(picture_id)
+                            self.__build_picture_url(picture_id, size="medium")
                             for picture_id in image_ids
                         ]
                         # Убираем None значения
@@ -1939,26 +1906,12 @@ class MarketplaceProductsListService(BaseMarketplaceService):
         # Преобразуем обратно в список
         deduplicated_products = list(seen_products.values())
 
-        # Отдельная сортировка по distance (после расчёта distance_to_client)
-        if request.sort_by == MarketplaceSort.distance:
-            reverse = request.sort_order == "desc"
-            deduplicated_products.sort(
-                key=lambda x: x.distance if x.distance is not None else float("inf"),
-                reverse=reverse,
-            )
-
-        # Пересчитываем count после дедупликации
-        deduplicated_count = len(deduplicated_products)
-
-        # Применяем пагинацию после дедупликации
-        offset = (request.page - 1) * request.size
-        paginated_products = deduplicated_products[offset : offset + request.size]
-
         return MarketplaceProductList(
-            result=paginated_products,
-            count=deduplicated_count,
+            result=deduplicated_products,
+            count=total_count,
             page=request.page,
             size=request.size,
+            next_cursor=next_cursor,
         )
 
     async def _fetch_available_warehouses(
@@ -1978,7 +1931,7 @@ class MarketplaceProductsListService(BaseMarketplaceService):
             literal_column("'warehouse_id'"),
             warehouses.c.id,
             literal_column("'organization_id'"),
-            warehouse_balances.c.organization_id,
+            warehouse_stock_current.c.organization_id,
             literal_column("'warehouse_name'"),
             warehouses.c.name,
             literal_column("'warehouse_address'"),
@@ -1992,11 +1945,11 @@ class MarketplaceProductsListService(BaseMarketplaceService):
         # Запрос: склады с остатками по указанной номенклатуре
         query = (
             select(json_obj)
-            .select_from(warehouse_balances)
+            .select_from(warehouse_stock_current)
             .join(
                 warehouses,
                 and_(
-                    warehouses.c.id == warehouse_balances.c.warehouse_id,
+                    warehouses.c.id == warehouse_stock_current.c.warehouse_id,
                     warehouses.c.is_public.is_(True),
                     warehouses.c.status.is_(True),
                     warehouses.c.is_deleted.is_not(True),
@@ -2004,9 +1957,9 @@ class MarketplaceProductsListService(BaseMarketplaceService):
             )
             .where(
                 and_(
-                    warehouse_balances.c.nomenclature_id == nomenclature_id,
+                    warehouse_stock_current.c.nomenclature_id == nomenclature_id,
                     # Можно добавить условие на наличие остатка, если нужно:
-                    # warehouse_balances.c.current_amount > 0
+                    # warehouse_stock_current.c.current_amount > 0
                 )
             )
         )
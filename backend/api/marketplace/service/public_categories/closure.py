@@ -0,0 +1,239 @@
+"""
+Замыкание дерева глобальных категорий и свертка товаров по нему.
+
+global_categories_closure хранит пары предок-потомок для каждого пути
+дерева (включая саму категорию, depth = 0), поэтому поддерево
+категории выбирается одним индексированным запросом, без обхода по
+parent_id. Замыкание ведется при создании категории и смене parent_id.
+
+products_count категории - число товаров с ценой chatting в ее видимом
+поддереве, has_products = products_count > 0. Свертка пересчитывается
+для предков затронутых категорий при записи номенклатуры, цен и
+категорий; джоба global_categories_rollup исправляет расхождения от
+записей в обход (импорт, интеграции)
+"""
+
+from typing import Iterable, List, Optional
+
+from database.db import (
+    database,
+    global_categories,
+    global_categories_closure,
+    nomenclature,
+    price_types,
+    prices,
+)
+from fastapi import HTTPException
+from sqlalchemy import and_, exists, func, literal, select, union_all
+from sqlalchemy.sql import Select
+
+# advisory-блокировка изменений структуры дерева категорий
+GLOBAL_CATEGORIES_TREE_LOCK = 7302
+
+# Полная пересборка замыкания по parent_id; циклы в parent_id отсекаются
+REBUILD_CLOSURE_SQL = """
+DELETE FROM global_categories_closure;
+INSERT INTO global_categories_closure (ancestor_id, descendant_id, depth)
+WITH RECURSIVE tree (ancestor_id, descendant_id, depth, path) AS (
+    SELECT id, id, 0, ARRAY[id] FROM global_categories
+    UNION ALL
+    SELECT tree.ancestor_id, gc.id, tree.depth + 1, tree.path || gc.id
+    FROM tree
+    JOIN global_categories gc ON gc.parent_id = tree.descendant_id
+    WHERE NOT gc.id = ANY(tree.path)
+)
+SELECT ancestor_id, descendant_id, min(depth)
+FROM tree
+GROUP BY ancestor_id, descendant_id;
+"""
+
+
+def visible_closure() -> Select:
+    """
+    Пары предок-потомок, путь между которыми не проходит через
+    неактивные категории. Сам предок может быть неактивным
+    """
+    pair = global_categories_closure.alias("pair")
+    up = global_categories_closure.alias("up")
+    down = global_categories_closure.alias("down")
+    hidden = (
+        select(literal(1))
+        .select_from(
+            up.join(down, down.c.ancestor_id == up.c.descendant_id).join(
+                global_categories, global_categories.c.id == up.c.descendant_id
+            )
+        )
+        .where(
+            up.c.ancestor_id == pair.c.ancestor_id,
+            up.c.depth > 0,
+            down.c.descendant_id == pair.c.descendant_id,
+            global_categories.c.is_active.is_not(True),
+        )
+    )
+    return select(pair.c.ancestor_id, pair.c.descendant_id).where(~exists(hidden))
+
+
+def subtree_ids(category_id: int) -> Select:
+    """ID категории и ее активных потомков - для фильтра товаров по поддереву"""
+    visible = visible_closure().subquery("visible")
+    return select(visible.c.descendant_id).where(visible.c.ancestor_id == category_id)
+
+
+async def _lock_tree():
+    await database.execute(
+        select(func.pg_advisory_xact_lock(GLOBAL_CATEGORIES_TREE_LOCK))
+    )
+
+
+async def add_category(category_id: int, parent_id: Optional[int]):
+    """
+    Пути новой категории: от нее самой и от всех предков parent_id.
+    Вызывается в транзакции вместе со вставкой категории
+    """
+    await _lock_tree()
+    paths = union_all(
+        select(literal(category_id), literal(category_id), literal(0)),
+        select(
+            global_categories_closure.c.ancestor_id,
+            literal(category_id),
+            global_categories_closure.c.depth + 1,
+        ).where(global_categories_closure.c.descendant_id == parent_id),
+    )
+    await database.execute(
+        global_categories_closure.insert().from_select(
+            ["ancestor_id", "descendant_id", "depth"], paths
+        )
+    )
+
+
+async def move_category(category_id: int, parent_id: Optional[int]):
+    """
+    Перенос поддерева категории под parent_id. Вызывается в транзакции
+    вместе с обновлением parent_id
+    """
+    await _lock_tree()
+    moved = global_categories_closure.alias("moved")
+    subtree = select(moved.c.descendant_id).where(moved.c.ancestor_id == category_id)
+    if parent_id is not None:
+        is_cycle = await database.fetch_val(
+            select(exists(subtree.where(moved.c.descendant_id == parent_id)))
+        )
+        if is_cycle:
+            raise HTTPException(
+                status_code=400,
+                detail="Категорию нельзя вложить в нее саму или в ее дочернюю категорию",
+            )
+
+    await database.execute(
+        global_categories_closure.delete().where(
+            global_categories_closure.c.descendant_id.in_(subtree),
+            global_categories_closure.c.ancestor_id.not_in(subtree),
+        )
+    )
+    if parent_id is None:
+        return
+
+    above = global_categories_closure.alias("above")
+    below = global_categories_closure.alias("below")
+    await database.execute(
+        global_categories_closure.insert().from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(
+                above.c.ancestor_id,
+                below.c.descendant_id,
+                above.c.depth + below.c.depth + 1,
+            ).where(
+                above.c.descendant_id == parent_id, below.c.ancestor_id == category_id
+            ),
+        )
+    )
+
+
+def _products_by_category(category_ids: Optional[Select] = None) -> Select:
+    """Число товаров с ценой chatting в видимом поддереве каждой категории"""
+    visible = visible_closure().subquery("visible")
+    conditions = [
+        nomenclature.c.is_deleted.is_not(True),
+        price_types.c.name == "chatting",
+        prices.c.is_deleted.is_not(True),
+    ]
+    if category_ids is not None:
+        conditions.append(visible.c.ancestor_id.in_(category_ids))
+    return (
+        select(
+            visible.c.ancestor_id.label("category_id"),
+            func.count(func.distinct(nomenclature.c.id)).label("products_count"),
+        )
+        .select_from(
+            visible.join(
+                nomenclature,
+                nomenclature.c.global_category_id == visible.c.descendant_id,
+            )
+            .join(prices, prices.c.nomenclature == nomenclature.c.id)
+            .join(price_types, price_types.c.id == prices.c.price_type)
+        )
+        .where(and_(*conditions))
+        .group_by(visible.c.ancestor_id)
+    )
+
+
+async def refresh_products_rollup(
+    category_ids: Optional[Iterable[Optional[int]]] = None,
+) -> List[int]:
+    """
+    Пересчет products_count и has_products для категорий category_ids и
+    всех их предков одним запросом; None - для всех категорий.
+    Обновляются только изменившиеся категории, их ID и возвращаются
+    """
+    targets = select(global_categories.c.id.label("category_id"))
+    if category_ids is not None:
+        category_ids = {idx for idx in category_ids if idx}
+        if not category_ids:
+            return []
+        targets = (
+            select(global_categories_closure.c.ancestor_id.label("category_id"))
+            .where(global_categories_closure.c.descendant_id.in_(category_ids))
+            .distinct()
+        )
+
+    counts = _products_by_category(targets).subquery("counts")
+    target = targets.subquery("target")
+    rollup = (
+        select(
+            target.c.category_id,
+            func.coalesce(counts.c.products_count, 0).label("products_count"),
+        )
+        .select_from(
+            target.outerjoin(counts, counts.c.category_id == target.c.category_id)
+        )
+        .subquery("rollup")
+    )
+    has_products = rollup.c.products_count > 0
+    query = (
+        global_categories.update()
+        .where(global_categories.c.id == rollup.c.category_id)
+        .where(
+            global_categories.c.products_count.is_distinct_from(rollup.c.products_count)
+            | global_categories.c.has_products.is_distinct_from(has_products)
+        )
+        .values(products_count=rollup.c.products_count, has_products=has_products)
+        .returning(global_categories.c.id)
+    )
+    rows = await database.fetch_all(query)
+    return [row.id for row in rows]
+
+
+async def refresh_nomenclature_categories(nomenclature_ids: Iterable[int]) -> List[int]:
+    """Свертка категорий товаров после записи номенклатуры или цен"""
+    nomenclature_ids = {idx for idx in nomenclature_ids if idx}
+    if not nomenclature_ids:
+        return []
+    rows = await database.fetch_all(
+        select(nomenclature.c.global_category_id)
+        .where(
+            nomenclature.c.id.in_(nomenclature_ids),
+            nomenclature.c.global_category_id.is_not(None),
+        )
+        .distinct()
+    )
+    return await refresh_products_rollup(row.global_category_id for row in rows)
@@ -38,6 +38,9 @@ class GlobalCategory(GlobalCategoryBase):
     has_products: Optional[bool] = (
         None  # Показывает, есть ли актуальные товары в категории
     )
+    products_count: Optional[int] = (
+        None  # Количество товаров с ценой chatting в категории и дочерних
+    )
 
 
 class GlobalCategoryTree(GlobalCategory):
@@ -6,10 +6,10 @@ from database.db import (
     marketplace_rating_aggregates,
     nomenclature,
     users,
-    warehouse_balances,
+    warehouse_stock_current,
     warehouses,
 )
-from sqlalchemy import Integer, and_, cast, desc, func, select
+from sqlalchemy import Integer, and_, cast, func, select
 
 from .schemas import SellerStatisticsItem, SellerStatisticsResponse
 
@@ -76,38 +76,7 @@ class MarketplaceSellerStatisticsService:
         }
 
         # 3. Кол-во товаров на складах селлера
-        wb = warehouse_balances
-
-        wb_ranked = select(
-            wb.c.organization_id.label("organization_id"),
-            wb.c.warehouse_id.label("warehouse_id"),
-            wb.c.nomenclature_id.label("nomenclature_id"),
-            wb.c.current_amount.label("current_amount"),
-            func.row_number()
-            .over(
-                partition_by=[
-                    wb.c.organization_id,
-                    wb.c.warehouse_id,
-                    wb.c.nomenclature_id,
-                ],
-                order_by=[
-                    desc(wb.c.created_at),
-                    desc(wb.c.id),
-                ],
-            )
-            .label("rn"),
-        ).subquery("wb_ranked")
-
-        wb_latest = (
-            select(
-                wb_ranked.c.organization_id,
-                wb_ranked.c.warehouse_id,
-                wb_ranked.c.nomenclature_id,
-                wb_ranked.c.current_amount,
-            )
-            .where(wb_ranked.c.rn == 1)
-            .subquery("wb_latest")
-        )
+        wb_latest = warehouse_stock_current.alias("wb_latest")
 
         total_products_query = (
             select(
@@ -0,0 +1,250 @@
+"""
+Пакетная загрузка связанных данных номенклатуры.
+
+Каждая связь читается одним запросом по nomenclature_id IN (...),
+поэтому число запросов на страницу не зависит от limit
+"""
+
+import hashlib
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from api.pictures.routers import build_public_url
+from database.db import (
+    database,
+    nomenclature_attributes,
+    nomenclature_attributes_value,
+    nomenclature_hash,
+    pictures,
+    price_types,
+    prices,
+    warehouse_register_movement,
+    warehouses,
+)
+from functions.helpers import datetime_to_timestamp
+from sqlalchemy import case, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+
+def _group_by_nomenclature(
+    rows, key: str = "nomenclature_id", keep_key: bool = False
+) -> Dict[int, list]:
+    grouped: Dict[int, list] = {}
+    for row in rows:
+        row = dict(row)
+        group = row[key] if keep_key else row.pop(key)
+        grouped.setdefault(group, []).append(row)
+    return grouped
+
+
+def build_nomenclature_hash(nomenclature_info: dict) -> str:
+    hash_base = f"{nomenclature_info['id']}:{nomenclature_info.get('name', '')}:{nomenclature_info.get('article', '')}"
+    return "nm_" + hashlib.sha256(hash_base.encode()).hexdigest()[:16]
+
+
+async def load_prices(nomenclature_ids: List[int]) -> Dict[int, list]:
+    if not nomenclature_ids:
+        return {}
+    query = (
+        select(
+            prices.c.nomenclature.label("nomenclature_id"),
+            prices.c.price,
+            price_types.c.name.label("price_type"),
+        )
+        .select_from(prices)
+        .join(price_types, price_types.c.id == prices.c.price_type)
+        .where(prices.c.nomenclature.in_(nomenclature_ids))
+        .order_by(prices.c.nomenclature, prices.c.id)
+    )
+    return _group_by_nomenclature(await database.fetch_all(query))
+
+
+async def load_balances(
+    nomenclature_ids: List[int], cashbox_id: int
+) -> Dict[int, list]:
+    """Остатки по складам из регистра движений"""
+    if not nomenclature_ids:
+        return {}
+    amount = case(
+        [
+            (
+                warehouse_register_movement.c.type_amount == "minus",
+                warehouse_register_movement.c.amount * (-1),
+            )
+        ],
+        else_=warehouse_register_movement.c.amount,
+    )
+    query = (
+        select(
+            warehouses.c.name.label("warehouse_name"),
+            # id и nomenclature_id - как в прежнем ответе
+            warehouse_register_movement.c.nomenclature_id.label("id"),
+            warehouse_register_movement.c.nomenclature_id,
+            func.sum(amount).label("current_amount"),
+        )
+        .select_from(
+            warehouse_register_movement.join(
+                warehouses,
+                warehouse_register_movement.c.warehouse_id == warehouses.c.id,
+            )
+        )
+        .where(
+            warehouse_register_movement.c.nomenclature_id.in_(nomenclature_ids),
+            warehouse_register_movement.c.cashbox_id == cashbox_id,
+        )
+        .group_by(warehouse_register_movement.c.nomenclature_id, warehouses.c.name)
+    )
+    return _group_by_nomenclature(await database.fetch_all(query), keep_key=True)
+
+
+async def load_attributes(nomenclature_ids: List[int]) -> Dict[int, list]:
+    if not nomenclature_ids:
+        return {}
+    query = (
+        select(
+            nomenclature_attributes_value.c.nomenclature_id,
+            nomenclature_attributes_value.c.id,
+            nomenclature_attributes_value.c.attribute_id,
+            nomenclature_attributes.c.name,
+            nomenclature_attributes.c.alias,
+            nomenclature_attributes_value.c.value,
+        )
+        .select_from(nomenclature_attributes_value)
+        .join(
+            nomenclature_attributes,
+            nomenclature_attributes_value.c.attribute_id
+            == nomenclature_attributes.c.id,
+        )
+        .where(nomenclature_attributes_value.c.nomenclature_id.in_(nomenclature_ids))
+        .order_by(
+            nomenclature_attributes_value.c.nomenclature_id,
+            nomenclature_attributes_value.c.id,
+        )
+    )
+    return _group_by_nomenclature(await database.fetch_all(query))
+
+
+async def load_photos(nomenclature_ids: List[int]) -> Dict[int, list]:
+    """Фото номенклатуры: сначала главное, затем по порядку загрузки"""
+    if not nomenclature_ids:
+        return {}
+    query = (
+        select(
+            pictures.c.entity_id.label("nomenclature_id"),
+            pictures.c.id,
+            pictures.c.url,
+            pictures.c.is_main,
+            pictures.c.created_at,
+            pictures.c.updated_at,
+        )
+        .select_from(pictures)
+        .where(
+            pictures.c.entity == "nomenclature",
+            pictures.c.entity_id.in_(nomenclature_ids),
+            pictures.c.is_deleted.is_not(True),
+        )
+        .order_by(pictures.c.entity_id, pictures.c.is_main.desc(), pictures.c.id.asc())
+    )
+    photos = _group_by_nomenclature(await database.fetch_all(query))
+    return {
+        nomenclature_id: [datetime_to_timestamp(photo) for photo in photos_list]
+        for nomenclature_id, photos_list in photos.items()
+    }
+
+
+async def load_hashes(nomenclature_list: Iterable[dict]) -> Dict[int, str]:
+    """
+    QR-хеши номенклатуры. Недостающие хеши генерируются и сохраняются
+    одним INSERT на всю страницу
+    """
+    nomenclature_list = list(nomenclature_list)
+    if not nomenclature_list:
+        return {}
+    query = select(nomenclature_hash.c.nomenclature_id, nomenclature_hash.c.hash).where(
+        nomenclature_hash.c.nomenclature_id.in_(
+            [nomenclature_info["id"] for nomenclature_info in nomenclature_list]
+        )
+    )
+    hashes = {}
+    for row in await database.fetch_all(query):
+        hashes.setdefault(row.nomenclature_id, row.hash)
+
+    missing = []
+    for nomenclature_info in nomenclature_list:
+        if nomenclature_info["id"] in hashes:
+            continue
+        hashes[nomenclature_info["id"]] = build_nomenclature_hash(nomenclature_info)
+        missing.append(
+            {
+                "nomenclature_id": nomenclature_info["id"],
+                "hash": hashes[nomenclature_info["id"]],
+                "created_at": datetime.now(),
+            }
+        )
+    if missing:
+        # Параллельный запрос той же страницы мог уже сохранить тот же хеш
+        # (uq_nomenclature_hash_nomenclature_id_hash)
+        await database.execute(
+            insert(nomenclature_hash).values(missing).on_conflict_do_nothing()
+        )
+    return hashes
+
+
+async def enrich_nomenclature(
+    nomenclature_list: List[dict],
+    cashbox_id: int,
+    with_prices: bool = False,
+    with_balance: bool = False,
+    with_attributes: bool = False,
+    with_photos: bool = False,
+    with_hash: bool = False,
+    base_url: Optional[str] = None,
+    token: Optional[str] = None,
+) -> List[dict]:
+    """Дополняет список номенклатуры (dict) запрошенными связями"""
+    nomenclature_ids = [
+        nomenclature_info["id"] for nomenclature_info in nomenclature_list
+    ]
+
+    if with_prices:
+        prices_map = await load_prices(nomenclature_ids)
+        for nomenclature_info in nomenclature_list:
+            nomenclature_info["prices"] = prices_map.get(nomenclature_info["id"], [])
+
+    if with_balance:
+        balances_map = await load_balances(nomenclature_ids, cashbox_id)
+        for nomenclature_info in nomenclature_list:
+            nomenclature_info["balances"] = balances_map.get(
+                nomenclature_info["id"], []
+            )
+
+    if with_attributes:
+        attributes_map = await load_attributes(nomenclature_ids)
+        for nomenclature_info in nomenclature_list:
+            nomenclature_info["attributes"] = attributes_map.get(
+                nomenclature_info["id"], []
+            )
+
+    if with_photos:
+        photos_map = await load_photos(nomenclature_ids)
+        for nomenclature_info in nomenclature_list:
+            photos_list = photos_map.get(nomenclature_info["id"], [])
+            # Фронтенд формирует /api/v1/photos/{url}/, а endpoint
+            # /photos/{filename:path} сам добавляет префикс "photos/"
+            for photo in photos_list:
+                photo["public_url"] = build_public_url(photo["id"])
+                if photo.get("url") and photo["url"].startswith("photos/"):
+                    photo["url"] = photo["url"][7:]
+            nomenclature_info["photos"] = photos_list
+
+    if with_hash:
+        hashes = await load_hashes(nomenclature_list)
+        for nomenclature_info in nomenclature_list:
+            nomenclature_info["qr_hash"] = (
+                f"NOM:{nomenclature_info['id']}:{hashes[nomenclature_info['id']]}"
+            )
+            nomenclature_info["qr_url"] = (
+                f"{base_url}/nomenclature/{nomenclature_info['id']}/qr?token={token}"
+            )
+
+    return nomenclature_list
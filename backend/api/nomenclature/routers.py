@@ -6,32 +6,29 @@ from typing import List, Optional
 
 import api.nomenclature.schemas as schemas
 import segno
+from api.categories.tree import invalidate_categories_tree
 from api.marketplace.service.public_categories.public_categories_service import (
     MarketplacePublicCategoriesService,
 )
+from api.nomenclature.loaders import enrich_nomenclature, load_hashes
 from api.nomenclature.utils import (
     auto_link_global_category,
     sync_global_category_for_nomenclature,
+    update_categories_has_products,
     update_category_has_products,
 )
-from api.pictures.routers import build_public_url
 from database.db import (
     categories,
     database,
     global_categories,
     manufacturers,
     nomenclature,
-    nomenclature_attributes,
-    nomenclature_attributes_value,
     nomenclature_barcodes,
     nomenclature_groups_value,
     nomenclature_hash,
     pictures,
-    price_types,
     prices,
     units,
-    warehouse_register_movement,
-    warehouses,
 )
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.params import Body, Query
@@ -46,7 +43,7 @@ from functions.helpers import (
     get_user_by_token,
     update_entity_hash,
 )
-from sqlalchemy import and_, case, exists, func, insert, or_, select
+from sqlalchemy import and_, exists, func, insert, or_, select
 from starlette import status
 from ws_manager import manager
 
@@ -198,20 +195,7 @@ async def get_nomenclature_qr(
     user = await get_user_by_token(token)
     nomenclature_db = await get_entity_by_id(nomenclature, idx, user.cashbox_id)
     nomenclature_db_dict = dict(nomenclature_db)
-    hash_query = select(nomenclature_hash.c.hash).where(
-        nomenclature_hash.c.nomenclature_id == idx
-    )
-    hash_record = await database.fetch_one(hash_query)
-    if not hash_record:
-        hash_base = f"{nomenclature_db_dict['id']}:{nomenclature_db_dict.get('name', '')}:{nomenclature_db_dict.get('article', '')}"
-        hash_string = "nm_" + hashlib.sha256(hash_base.encode()).hexdigest()[:16]
-        await database.execute(
-            insert(nomenclature_hash).values(
-                nomenclature_id=idx, hash=hash_string, created_at=datetime.now()
-            )
-        )
-    else:
-        hash_string = hash_record["hash"]
+    hash_string = (await load_hashes([nomenclature_db_dict]))[idx]
     qr_content = f"NOM:{nomenclature_db_dict['id']}:{hash_string}"
     qr = segno.make_qr(qr_content, error="H")
     svg_buffer = io.BytesIO()
@@ -232,20 +216,7 @@ async def get_nomenclature_qr_data(token: str, idx: int):
     user = await get_user_by_token(token)
     nomenclature_db = await get_entity_by_id(nomenclature, idx, user.cashbox_id)
     nomenclature_db_dict = dict(nomenclature_db)
-    hash_query = select(nomenclature_hash.c.hash).where(
-        nomenclature_hash.c.nomenclature_id == idx
-    )
-    hash_record = await database.fetch_one(hash_query)
-    if not hash_record:
-        hash_base = f"{nomenclature_db_dict['id']}:{nomenclature_db_dict.get('name', '')}:{nomenclature_db_dict.get('article', '')}"
-        hash_string = "nm_" + hashlib.sha256(hash_base.encode()).hexdigest()[:16]
-        await database.execute(
-            insert(nomenclature_hash).values(
-                nomenclature_id=idx, hash=hash_string, created_at=datetime.now()
-            )
-        )
-    else:
-        hash_string = hash_record["hash"]
+    hash_string = (await load_hashes([nomenclature_db_dict]))[idx]
     return {
         "nomenclature_id": nomenclature_db_dict["id"],
         "name": nomenclature_db_dict.get("name"),
@@ -297,54 +268,12 @@ async def get_nomenclature_by_ids(
 
     nomenclature_db = await database.fetch_all(query)
     nomenclature_db = [*map(datetime_to_timestamp, nomenclature_db)]
-
-    for nomenclature_info in nomenclature_db:
-        if with_prices:
-            price = await database.fetch_all(
-                select(prices.c.price, price_types.c.name.label("price_type"))
-                .where(prices.c.nomenclature == nomenclature_info["id"])
-                .select_from(prices)
-                .join(price_types, price_types.c.id == prices.c.price_type)
-            )
-            nomenclature_info["prices"] = price
-
-        if with_balance:
-            q = case(
-                [
-                    (
-                        warehouse_register_movement.c.type_amount == "minus",
-                        warehouse_register_movement.c.amount * (-1),
-                    )
-                ],
-                else_=warehouse_register_movement.c.amount,
-            )
-            query = (
-                (
-                    select(
-                        warehouses.c.name.label("warehouse_name"),
-                        nomenclature.c.id,
-                        warehouse_register_movement.c.nomenclature_id,
-                        func.sum(q).label("current_amount"),
-                    ).where(
-                        nomenclature.c.id == nomenclature_info["id"],
-                        warehouse_register_movement.c.cashbox_id == user.cashbox_id,
-                    )
-                )
-                .group_by(
-                    warehouses.c.name,
-                    nomenclature.c.id,
-                    warehouse_register_movement.c.nomenclature_id,
-                )
-                .select_from(
-                    warehouse_register_movement.join(
-                        warehouses,
-                        warehouse_register_movement.c.warehouse_id == warehouses.c.id,
-                    )
-                )
-            )
-
-            balances_list = await database.fetch_all(query)
-            nomenclature_info["balances"] = balances_list
+    await enrich_nomenclature(
+        nomenclature_db,
+        user.cashbox_id,
+        with_prices=with_prices,
+        with_balance=with_balance,
+    )
 
     query = select(func.count(nomenclature.c.id)).where(
         nomenclature.c.cashbox == user.cashbox_id,
@@ -416,12 +345,6 @@ async def get_nomenclature(
             cu_filter_data[f] = datetime.fromtimestamp(filters_data[f])
 
     filters = build_filters(nomenclature, cu_filter_data)
-    hash_subquery = None
-    if with_hash:
-        hash_subquery = select(
-            nomenclature_hash.c.nomenclature_id,
-            nomenclature_hash.c.hash.label("qr_hash"),
-        ).alias("hash_subquery")
     price_subquery = None
     if min_price is not None or max_price is not None:
         price_subquery = (
@@ -448,14 +371,6 @@ async def get_nomenclature(
         )
     )
     query = query.group_by(nomenclature.c.id, units.c.convent_national_view)
-    if with_hash and hash_subquery is not None:
-        query = query.join(
-            hash_subquery,
-            hash_subquery.c.nomenclature_id == nomenclature.c.id,
-            isouter=True,
-        )
-        query = query.add_columns(hash_subquery.c.qr_hash)
-        query = query.group_by(hash_subquery.c.qr_hash)
     if price_subquery is not None:
         query = query.join(
             price_subquery,
@@ -622,138 +537,17 @@ async def get_nomenclature(
 
     nomenclature_db_count = await database.fetch_val(count_query)
 
-    for nomenclature_info in nomenclature_db:
-        if with_prices:
-            price = await database.fetch_all(
-                select(prices.c.price, price_types.c.name.label("price_type"))
-                .where(prices.c.nomenclature == nomenclature_info["id"])
-                .select_from(prices)
-                .join(price_types, price_types.c.id == prices.c.price_type)
-            )
-            nomenclature_info["prices"] = price
-
-        if with_balance:
-            q = case(
-                [
-                    (
-                        warehouse_register_movement.c.type_amount == "minus",
-                        warehouse_register_movement.c.amount * (-1),
-                    )
-                ],
-                else_=warehouse_register_movement.c.amount,
-            )
-            query = (
-                (
-                    select(
-                        warehouses.c.name.label("warehouse_name"),
-                        nomenclature.c.id,
-                        warehouse_register_movement.c.nomenclature_id,
-                        func.sum(q).label("current_amount"),
-                    ).where(
-                        nomenclature.c.id == nomenclature_info["id"],
-                        warehouse_register_movement.c.cashbox_id == user.cashbox_id,
-                    )
-                )
-                .group_by(
-                    warehouses.c.name,
-                    nomenclature.c.id,
-                    warehouse_register_movement.c.nomenclature_id,
-                )
-                .select_from(
-                    warehouse_register_movement.join(
-                        warehouses,
-                        warehouse_register_movement.c.warehouse_id == warehouses.c.id,
-                    )
-                )
-            )
-
-            balances_list = await database.fetch_all(query)
-            nomenclature_info["balances"] = balances_list
-
-        if with_attributes:
-            attributes_query = (
-                select(
-                    nomenclature_attributes_value.c.id,
-                    nomenclature_attributes_value.c.attribute_id,
-                    nomenclature_attributes.c.name,
-                    nomenclature_attributes.c.alias,
-                    nomenclature_attributes_value.c.value,
-                )
-                .select_from(nomenclature_attributes_value)
-                .join(
-                    nomenclature_attributes,
-                    nomenclature_attributes_value.c.attribute_id
-                    == nomenclature_attributes.c.id,
-                )
-                .where(
-                    nomenclature_attributes_value.c.nomenclature_id
-                    == nomenclature_info["id"]
-                )
-            )
-            attributes_list = await database.fetch_all(attributes_query)
-            nomenclature_info["attributes"] = attributes_list
-
-        if with_photos:
-            photos_query = (
-                select(
-                    pictures.c.id,
-                    pictures.c.url,
-                    pictures.c.is_main,
-                    pictures.c.created_at,
-                    pictures.c.updated_at,
-                )
-                .select_from(pictures)
-                .where(
-                    pictures.c.entity == "nomenclature",
-                    pictures.c.entity_id == nomenclature_info["id"],
-                    pictures.c.is_deleted.is_not(True),
-                )
-                .order_by(pictures.c.is_main.desc(), pictures.c.id.asc())
-            )
-            photos_list = await database.fetch_all(photos_query)
-            photos_list = [*map(datetime_to_timestamp, photos_list)]
-            # Добавляем public_url и подготавливаем url для фронтенда
-            # Фронтенд использует url и формирует /api/v1/photos/{url}/
-            # Endpoint /photos/{filename:path} добавит префикс "photos/" автоматически
-            for photo in photos_list:
-                photo["public_url"] = build_public_url(photo["id"])
-                # Убираем префикс "photos/" из url, чтобы фронтенд правильно сформировал путь
-                # В БД: "photos/2026/01/05/1/file.jpg"
-                # Для фронтенда: "2026/01/05/1/file.jpg"
-                # Фронтенд сформирует: /api/v1/photos/2026/01/05/1/file.jpg/
-                # Endpoint получит: "2026/01/05/1/file.jpg" и добавит "photos/" -> "photos/2026/01/05/1/file.jpg"
-                if photo.get("url") and photo["url"].startswith("photos/"):
-                    photo["url"] = photo["url"][7:]  # Убираем "photos/" (7 символов)
-            nomenclature_info["photos"] = photos_list
-        if with_hash:
-            final_hash_string = None
-            if nomenclature_info.get("qr_hash"):
-                final_hash_string = nomenclature_info["qr_hash"]
-            else:
-                hash_query = select(nomenclature_hash.c.hash).where(
-                    nomenclature_hash.c.nomenclature_id == nomenclature_info["id"]
-                )
-                hash_record = await database.fetch_one(hash_query)
-                if hash_record:
-                    final_hash_string = hash_record["hash"]
-                else:
-                    hash_base = f"{nomenclature_info['id']}:{nomenclature_info.get('name', '')}:{nomenclature_info.get('article', '')}"
-                    final_hash_string = (
-                        "nm_" + hashlib.sha256(hash_base.encode()).hexdigest()[:16]
-                    )
-                    await database.execute(
-                        insert(nomenclature_hash).values(
-                            nomenclature_id=nomenclature_info["id"],
-                            hash=final_hash_string,
-                            created_at=datetime.now(),
-                        )
-                    )
-            nomenclature_info["qr_hash"] = (
-                f"NOM:{nomenclature_info['id']}:{final_hash_string}"
-            )
-            nomenclature_info["qr_url"] = (
-                f"{base_url}/nomenclature/{nomenclature_info['id']}/qr?token={token}"
-            )
+    await enrich_nomenclature(
+        nomenclature_db,
+        user.cashbox_id,
+        with_prices=with_prices,
+        with_balance=with_balance,
+        with_attributes=with_attributes,
+        with_photos=with_photos,
+        with_hash=with_hash,
+        base_url=base_url,
+        token=token,
+    )
     return {"result": nomenclature_db, "count": nomenclature_db_count}
 
 
@@ -822,6 +616,7 @@ async def new_nomenclature(
             query = nomenclature.insert().values(nomenclature_values)
             nomenclature_id = await database.execute(query)
             inserted_ids.add(nomenclature_id)
+            invalidate_categories_tree(user.cashbox_id)
 
             # Дополнительная синхронизация после создания
             global_cat_id = None
@@ -943,6 +738,7 @@ async def edit_nomenclature(
             .values(nomenclature_values)
         )
         await database.execute(query)
+        invalidate_categories_tree(user.cashbox_id)
         nomenclature_db = await get_entity_by_id(nomenclature, idx, user.cashbox_id)
         await update_entity_hash(
             table=nomenclature, table_hash=nomenclature_hash, entity=nomenclature_db
@@ -963,11 +759,10 @@ async def edit_nomenclature(
             if new_global_category_id:
                 categories_to_update.add(new_global_category_id)
 
-        for cat_id in categories_to_update:
-            try:
-                await update_category_has_products(cat_id)
-            except Exception:
-                pass  # Игнорируем ошибки обновления
+        try:
+            await update_categories_has_products(categories_to_update)
+        except Exception:
+            pass  # Игнорируем ошибки обновления
 
     nomenclature_db = datetime_to_timestamp(nomenclature_db)
 
@@ -1059,6 +854,7 @@ async def edit_nomenclature_mass(
                 .values(nomenclature_values)
             )
             await database.execute(query)
+            invalidate_categories_tree(user.cashbox_id)
             nomenclature_db = await get_entity_by_id(nomenclature, idx, user.cashbox_id)
             await update_entity_hash(
                 table=nomenclature, table_hash=nomenclature_hash, entity=nomenclature_db
@@ -1085,6 +881,11 @@ async def edit_nomenclature_mass(
 
         response_body.append(nomenclature_db)
 
+    try:
+        await update_categories_has_products(categories_to_update)
+    except Exception:
+        pass  # Игнорируем ошибки обновления
+
     return response_body
 
 
@@ -1093,7 +894,7 @@ async def delete_nomenclature(token: str, idx: int):
     """Удаление категории"""
     user = await get_user_by_token(token)
 
-    await get_entity_by_id(nomenclature, idx, user.cashbox_id)
+    nomenclature_db = await get_entity_by_id(nomenclature, idx, user.cashbox_id)
 
     query = (
         nomenclature.update()
@@ -1101,6 +902,11 @@ async def delete_nomenclature(token: str, idx: int):
         .values({"is_deleted": True})
     )
     await database.execute(query)
+    invalidate_categories_tree(user.cashbox_id)
+    try:
+        await update_category_has_products(nomenclature_db.global_category_id)
+    except Exception:
+        pass  # Игнорируем ошибки обновления
 
     query = nomenclature.select().where(
         nomenclature.c.id == idx, nomenclature.c.cashbox == user.cashbox_id
@@ -1126,9 +932,11 @@ async def delete_nomenclature_mass(token: str, nomenclature_data: List[int]):
     user = await get_user_by_token(token)
 
     response_body = []
+    categories_to_update = set()
 
     for idx in nomenclature_data:
-        await get_entity_by_id(nomenclature, idx, user.cashbox_id)
+        nomenclature_db = await get_entity_by_id(nomenclature, idx, user.cashbox_id)
+        categories_to_update.add(nomenclature_db.global_category_id)
 
         query = (
             nomenclature.update()
@@ -1136,6 +944,7 @@ async def delete_nomenclature_mass(token: str, nomenclature_data: List[int]):
             .values({"is_deleted": True})
         )
         await database.execute(query)
+        invalidate_categories_tree(user.cashbox_id)
 
         query = nomenclature.select().where(
             nomenclature.c.id == idx, nomenclature.c.cashbox == user.cashbox_id
@@ -1154,4 +963,9 @@ async def delete_nomenclature_mass(token: str, nomenclature_data: List[int]):
 
         response_body.append(nomenclature_db)
 
+    try:
+        await update_categories_has_products(categories_to_update)
+    except Exception:
+        pass  # Игнорируем ошибки обновления
+
     return response_body
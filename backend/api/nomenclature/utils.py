@@ -4,18 +4,11 @@
 
 from typing import List, Optional
 
-from api.marketplace.service.public_categories.public_categories_service import (
-    MarketplacePublicCategoriesService,
+from api.marketplace.service.public_categories.closure import (
+    refresh_products_rollup,
 )
-from database.db import (
-    categories,
-    database,
-    global_categories,
-    nomenclature,
-    price_types,
-    prices,
-)
-from sqlalchemy import and_, func, select
+from database.db import categories, database, global_categories, nomenclature
+from sqlalchemy import func, select
 
 
 async def auto_link_global_category(
@@ -131,173 +124,20 @@ async def sync_global_category_for_nomenclature(
 
 async def update_category_has_products(category_id: int) -> None:
     """
-    Обновляет поле has_products для категории и всех родительских категорий.
-    Проверяет наличие актуальных товаров в категории и её дочерних категориях.
+    Обновляет has_products и products_count для категории и всех
+    родительских категорий.
 
     Args:
         category_id: ID глобальной категории
     """
-    # Получаем все дочерние категории (включая саму категорию)
-    all_category_ids = (
-        await MarketplacePublicCategoriesService._get_all_category_ids_recursive(
-            category_id
-        )
-    )
-
-    if not all_category_ids:
-        # Если нет категорий, устанавливаем has_products = False
-        await database.execute(
-            "UPDATE global_categories SET has_products = FALSE WHERE id = :cat_id",
-            values={"cat_id": category_id},
-        )
-        return
-
-    # Проверяем наличие товаров с price_type = "chatting" (приоритет)
-    chatting_count = await database.fetch_val(
-        select(func.count(func.distinct(nomenclature.c.id)))
-        .select_from(
-            nomenclature.join(prices, prices.c.nomenclature == nomenclature.c.id).join(
-                price_types, price_types.c.id == prices.c.price_type
-            )
-        )
-        .where(
-            and_(
-                nomenclature.c.global_category_id.is_not(None),
-                nomenclature.c.global_category_id.in_(all_category_ids),
-                nomenclature.c.is_deleted.is_not(True),
-                price_types.c.name == "chatting",
-                prices.c.is_deleted.is_not(True),
-            )
-        )
-    )
-
-    if chatting_count and chatting_count > 0:
-        has_products = True
-    else:
-        # Если товаров с chatting нет, проверяем любые товары
-        any_count = await database.fetch_val(
-            select(func.count(nomenclature.c.id)).where(
-                and_(
-                    nomenclature.c.global_category_id.is_not(None),
-                    nomenclature.c.global_category_id.in_(all_category_ids),
-                    nomenclature.c.is_deleted.is_not(True),
-                )
-            )
-        )
-        has_products = any_count > 0 if any_count else False
-
-    # Обновляем has_products для категории
-    await database.execute(
-        "UPDATE global_categories SET has_products = :has_products WHERE id = :cat_id",
-        values={"has_products": has_products, "cat_id": category_id},
-    )
-
-    # Обновляем все родительские категории
-    # Получаем parent_id текущей категории
-    parent = await database.fetch_one(
-        "SELECT parent_id FROM global_categories WHERE id = :cat_id",
-        values={"cat_id": category_id},
-    )
-
-    if parent and parent.parent_id:
-        # Рекурсивно обновляем родительскую категорию
-        await update_category_has_products(parent.parent_id)
-
-
-async def update_categories_has_products(category_ids: List[int]) -> None:
-    """
-    Обновляет has_products для нескольких категорий.
-
-    Args:
-        category_ids: Список ID глобальных категорий
-    """
-    for category_id in category_ids:
-        if category_id:
-            await update_category_has_products(category_id)
-
-
-async def update_category_has_products(category_id: int) -> None:
-    """
-    Обновляет поле has_products для категории и всех родительских категорий.
-    Проверяет наличие актуальных товаров в категории и её дочерних категориях.
-
-    Args:
-        category_id: ID глобальной категории
-    """
-    # Получаем все дочерние категории (включая саму категорию)
-    all_category_ids = (
-        await MarketplacePublicCategoriesService._get_all_category_ids_recursive(
-            category_id
-        )
-    )
-
-    if not all_category_ids:
-        # Если нет категорий, устанавливаем has_products = False
-        await database.execute(
-            "UPDATE global_categories SET has_products = FALSE WHERE id = :cat_id",
-            values={"cat_id": category_id},
-        )
-        return
-
-    # Проверяем наличие товаров с price_type = "chatting" (приоритет)
-    chatting_count = await database.fetch_val(
-        select(func.count(func.distinct(nomenclature.c.id)))
-        .select_from(
-            nomenclature.join(prices, prices.c.nomenclature == nomenclature.c.id).join(
-                price_types, price_types.c.id == prices.c.price_type
-            )
-        )
-        .where(
-            and_(
-                nomenclature.c.global_category_id.is_not(None),
-                nomenclature.c.global_category_id.in_(all_category_ids),
-                nomenclature.c.is_deleted.is_not(True),
-                price_types.c.name == "chatting",
-                prices.c.is_deleted.is_not(True),
-            )
-        )
-    )
-
-    if chatting_count and chatting_count > 0:
-        has_products = True
-    else:
-        # Если товаров с chatting нет, проверяем любые товары
-        any_count = await database.fetch_val(
-            select(func.count(nomenclature.c.id)).where(
-                and_(
-                    nomenclature.c.global_category_id.is_not(None),
-                    nomenclature.c.global_category_id.in_(all_category_ids),
-                    nomenclature.c.is_deleted.is_not(True),
-                )
-            )
-        )
-        has_products = any_count > 0 if any_count else False
-
-    # Обновляем has_products для категории
-    await database.execute(
-        "UPDATE global_categories SET has_products = :has_products WHERE id = :cat_id",
-        values={"has_products": has_products, "cat_id": category_id},
-    )
-
-    # Обновляем все родительские категории
-    # Получаем parent_id текущей категории
-    parent = await database.fetch_one(
-        "SELECT parent_id FROM global_categories WHERE id = :cat_id",
-        values={"cat_id": category_id},
-    )
-
-    if parent and parent.parent_id:
-        # Рекурсивно обновляем родительскую категорию
-        await update_category_has_products(parent.parent_id)
+    await refresh_products_rollup([category_id])
 
 
 async def update_categories_has_products(category_ids: List[int]) -> None:
     """
-    Обновляет has_products для нескольких категорий.
+    Обновляет has_products для нескольких категорий одним запросом.
 
     Args:
         category_ids: Список ID глобальных категорий
     """
-    for category_id in category_ids:
-        if category_id:
-            await update_category_has_products(category_id)
+    await refresh_products_rollup(category_ids)
@@ -26,6 +26,7 @@ from database.db import (
     users_cboxes_relation,
 )
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from functions.auth_cache import resolve_token
 from functions.helpers import (
     build_sql_filters,
     check_user_permission,
@@ -162,8 +163,7 @@ async def read_payments_list(
             payments_list.append(pay_dict)
         return payments_list
 
-    query = users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if not user or not user.status:
         raise HTTPException(status_code=403, detail="Вы ввели некорректный токен!")
@@ -294,8 +294,7 @@ async def read_payments_list(
 @router.post("/payments/")
 async def create_payment(token: str, payment: pay_schemas.PaymentCreate):
     """Создание платежа"""
-    query = users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if not user or not user.status:
         raise HTTPException(status_code=403, detail="Вы ввели некорректный токен!")
@@ -551,8 +550,7 @@ async def create_payment(token: str, payment: pay_schemas.PaymentCreate):
 @router.get("/payment/{id}/", response_model=pay_schemas.PaymentInList)
 async def read_payment(token: str, id: int):
     """Просмотр платежа по ID"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             query = (
@@ -621,8 +619,7 @@ async def update_payment(
 
         to stop repeats set repeat_period to null
     """
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if user:
         if user.status:
@@ -800,8 +797,7 @@ async def update_payment(
 @router.delete("/payments/{payment_id}/")
 async def delete_payment(token: str, payment_id: int):
     """Удаление платежа по ID"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             q = payments.select().where(payments.c.id == payment_id)
@@ -964,8 +960,7 @@ async def raspil_platezha(
     bg_tasks: BackgroundTasks,
 ):
     """Распил платежа по ID"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             query = payments.select().filter(
@@ -1036,8 +1031,7 @@ async def update_childs_payments(
     token: str, payments_list: List[pay_schemas.ChildrenEdit], bg_tasks: BackgroundTasks
 ):
     """Обновление дочерних платежей если родительский распилен"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if user:
         if user.status:
@@ -1093,8 +1087,7 @@ async def update_childs_payments(
 @router.delete("/payments_split/{id}/", response_model=pay_schemas.PaymentInList)
 async def split_payment(token: str, id: int, bg_tasks: BackgroundTasks):
     """Отмена распила платежа"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if user:
         if user.status:
@@ -1142,8 +1135,7 @@ async def split_payment(token: str, id: int, bg_tasks: BackgroundTasks):
 @router.get("/payments/{id}/childs/", response_model=pay_schemas.GetPayments)
 async def read_payments_childs(token: str, id: int, offset: int = 0, limit: int = 100):
     """Получение дочерних платежей по ID родительского"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             query = (
@@ -1178,8 +1170,7 @@ async def read_payments_childs(token: str, id: int, offset: int = 0, limit: int
 @router.get("/payments_meta/")
 async def read_payments_meta(token: str, limit: int = 100, offset: int = 0):
     """Мета платежей"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             q = "SELECT DISTINCT payments.name, payments.tags, payments.article FROM payments WHERE payments.cashbox = :cashbox LIMIT :limit OFFSET :offset"
@@ -1196,8 +1187,7 @@ async def read_payments_meta(token: str, limit: int = 100, offset: int = 0):
 async def attach_payment(token: str, id: int, sale_id: int = 0, purchase_id: int = 0):
     """Прикрепление платежа к документам продажи и закупки"""
 
-    query = users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if not user or not user.status:
         raise HTTPException(status_code=403, detail="Вы ввели некорректный токен!")
 
@@ -1308,8 +1298,7 @@ async def attach_payment(token: str, id: int, sale_id: int = 0, purchase_id: int
 async def detach_payment(token: str, id: int, sale_id: int):
     """Открепление платежа от документа продажи"""
 
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if not user or not user.status:
         raise HTTPException(status_code=403, detail="Вы ввели некорректный токен!")
@@ -9,9 +9,9 @@ from database.db import (
     payments,
     pboxes,
     user_permissions,
-    users_cboxes_relation,
 )
 from fastapi import APIRouter, Depends, HTTPException
+from functions.auth_cache import resolve_token
 from functions.helpers import (
     check_user_permission,
     get_filters_pboxes,
@@ -34,8 +34,7 @@ async def read_payboxes_meta(
     filters: filter_schemas.PayboxesFiltersQuery = Depends(),
 ):
     """Получение счетов"""
-    query = users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if not user or not user.status:
         raise HTTPException(status_code=403, detail="Вы ввели некорректный токен!")
@@ -115,8 +114,7 @@ async def read_payboxes_meta(
 @router.get("/payboxes/{id}/")
 async def get_paybox_by_id(token: str, id: int):
     """Получение счета по ID"""
-    query = users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if not user or not user.status:
         raise HTTPException(status_code=403, detail="Вы ввели некорректный токен!")
@@ -150,8 +148,7 @@ async def get_paybox_by_id(token: str, id: int):
 @router.post("/payboxes/", response_model=pboxes_schemas.Payboxes)
 async def create_paybox(token: str, paybox_data: pboxes_schemas.PayboxesCreate):
     """Создание счета"""
-    query = users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if not user or not user.status:
         raise HTTPException(status_code=403, detail="Вы ввели некорректный токен!")
@@ -190,8 +187,7 @@ async def create_paybox(token: str, paybox_data: pboxes_schemas.PayboxesCreate):
 @router.put("/payboxes/", response_model=pboxes_schemas.Payboxes)
 async def update_paybox_data(token: str, pbox_data: pboxes_schemas.PayboxesEdit):
     """Обновление счета"""
-    query = users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if not user or not user.status:
         raise HTTPException(status_code=403, detail="Вы ввели некорректный токен!")
@@ -336,8 +332,7 @@ async def read_payboxes_short(
     filters: filter_schemas.PayboxesFiltersQuery = Depends(),
 ):
     """Получение краткой информации по всем счетам"""
-    query = users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if not user or not user.status:
         raise HTTPException(status_code=403, detail="Вы ввели некорректный токен!")
@@ -395,8 +390,7 @@ async def read_payboxes_short(
 @router.delete("/payboxes/{id}/")
 async def delete_paybox(token: str, id: int):
     """Мягкое удаление счета"""
-    query = users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if not user or not user.status:
         raise HTTPException(status_code=403, detail="Вы ввели некорректный токен!")
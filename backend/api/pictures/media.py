@@ -0,0 +1,322 @@
+"""
+Раздача фото из S3.
+
+Один долгоживущий клиент S3 на процесс вместо клиента на запрос. Тело
+объекта отдается потоком по MEDIA_CHUNK_SIZE, с ETag и Last-Modified
+из S3; If-None-Match/If-Modified-Since проверяет сам S3 и отвечает 304.
+Имена вида <uuid4 hex>.<ext> (новые загрузки) не перезаписываются,
+поэтому кэшируются браузером и CDN на год.
+
+Уменьшенные копии (VARIANT_SIZES, WebP или JPEG по Accept) создаются
+при первом запросе и сохраняются в S3 под VARIANTS_PREFIX; одновременные
+запросы одной копии ждут одну генерацию. Ключ копии старого
+(перезаписываемого) имени включает ETag оригинала, так что после
+перезаписи создается новая копия, а кэшируется она, как и оригинал, на час
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from io import BytesIO
+from os import environ
+from typing import Dict, Optional
+
+import aioboto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from PIL import Image, ImageOps, UnidentifiedImageError
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+MEDIA_CHUNK_SIZE = int(os.getenv("MEDIA_CHUNK_SIZE", 64 * 1024))
+MEDIA_S3_MAX_CONNECTIONS = int(os.getenv("MEDIA_S3_MAX_CONNECTIONS", 50))
+MEDIA_VARIANT_QUALITY = int(os.getenv("MEDIA_VARIANT_QUALITY", 80))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MEDIA_CACHE_CONTROL = "public, max-age=3600"
+
+# Наибольшая сторона уменьшенной копии, px
+VARIANT_SIZES = {"thumb": 320, "medium": 800}
+VARIANTS_PREFIX = "photos/_variants"
+VARIANT_SOURCE_EXTENSIONS = ("jpg", "jpeg", "png", "gif")
+
+MEDIA_TYPES = {
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "gif": "image/gif",
+    "pdf": "application/pdf",
+    "webp": "image/webp",
+}
+
+CONTENT_ADDRESSED_NAME = re.compile(r"(^|/)[0-9a-f]{32}\.[a-z]+$")
+
+bucket_name = "5075293c-docs_generated"
+
+
+def extension(key: str) -> str:
+    return key.rsplit(".", 1)[-1].lower() if "." in key else ""
+
+
+def media_type(key: str) -> str:
+    return MEDIA_TYPES.get(extension(key), "image/jpeg")
+
+
+def cache_control(key: str) -> str:
+    if CONTENT_ADDRESSED_NAME.search(key):
+        return IMMUTABLE_CACHE_CONTROL
+    return MEDIA_CACHE_CONTROL
+
+
+def variant_format(accept: Optional[str]) -> str:
+    return "webp" if accept and "image/webp" in accept else "jpeg"
+
+
+def variant_key(key: str, size: str, fmt: str, version: Optional[str] = None) -> str:
+    name = key[len("photos/") :] if key.startswith("photos/") else key
+    name = name.rsplit(".", 1)[0]
+    if version:
+        name = f"{name}.{version}"
+    return f"{VARIANTS_PREFIX}/{size}/{name}.{fmt}"
+
+
+def _status(error: ClientError) -> Optional[int]:
+    return error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+
+
+def _http_date(value) -> Optional[str]:
+    if value is None:
+        return None
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+class SharedS3Client:
+    """Клиент S3, открываемый при первом обращении и живущий до остановки"""
+
+    def __init__(self):
+        self.session = aioboto3.Session()
+        self.context = None
+        self.client = None
+        self.lock: Optional[asyncio.Lock] = None
+
+    async def get(self):
+        if self.client is None:
+            if self.lock is None:
+                self.lock = asyncio.Lock()
+            async with self.lock:
+                if self.client is None:
+                    self.context = self.session.client(
+                        service_name="s3",
+                        endpoint_url=environ.get("S3_URL"),
+                        aws_access_key_id=environ.get("S3_ACCESS"),
+                        aws_secret_access_key=environ.get("S3_SECRET"),
+                        config=Config(max_pool_connections=MEDIA_S3_MAX_CONNECTIONS),
+                    )
+                    self.client = await self.context.__aenter__()
+        return self.client
+
+    async def close(self):
+        if self.context is not None:
+            await self.context.__aexit__(None, None, None)
+        self.context = None
+        self.client = None
+
+
+media_s3 = SharedS3Client()
+
+
+async def serve_object(key: str, headers) -> Response:
+    """Потоковая отдача объекта S3 с учетом условного запроса"""
+    s3 = await media_s3.get()
+    params = {"Bucket": bucket_name, "Key": key}
+    if headers.get("if-none-match"):
+        params["IfNoneMatch"] = headers["if-none-match"]
+    elif headers.get("if-modified-since"):
+        try:
+            params["IfModifiedSince"] = parsedate_to_datetime(
+                headers["if-modified-since"]
+            )
+        except (TypeError, ValueError):
+            pass
+
+    try:
+        s3_obj = await s3.get_object(**params)
+    except ClientError as e:
+        status = _status(e)
+        if status == 304:
+            s3_headers = e.response["ResponseMetadata"].get("HTTPHeaders", {})
+            response_headers = {"Cache-Control": cache_control(key)}
+            if s3_headers.get("etag"):
+                response_headers["ETag"] = s3_headers["etag"]
+            return Response(status_code=304, headers=response_headers)
+        if status in (403, 404):
+            raise HTTPException(status_code=404, detail="Файл не найден")
+        logger.warning(f"S3 error for {key}: {e}")
+        raise HTTPException(status_code=502, detail="Хранилище недоступно")
+
+    body = s3_obj["Body"]
+
+    async def stream():
+        try:
+            while True:
+                chunk = await body.read(MEDIA_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            # Соединение возвращается в пул клиента и при обрыве клиента
+            body.close()
+
+    response_headers = {
+        "Cache-Control": cache_control(key),
+        "Content-Length": str(s3_obj["ContentLength"]),
+    }
+    if s3_obj.get("ETag"):
+        response_headers["ETag"] = s3_obj["ETag"]
+    if s3_obj.get("LastModified"):
+        response_headers["Last-Modified"] = _http_date(s3_obj["LastModified"])
+    return StreamingResponse(
+        stream(), media_type=media_type(key), headers=response_headers
+    )
+
+
+def _render_variant(data: bytes, max_side: int, fmt: str) -> bytes:
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side))
+        if fmt == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif fmt == "webp" and image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        output = BytesIO()
+        image.save(output, format=fmt.upper(), quality=MEDIA_VARIANT_QUALITY)
+        return output.getvalue()
+
+
+class VariantsBuilder:
+    def __init__(self):
+        self.inflight: Dict[str, asyncio.Task] = {}
+
+    async def _build(self, key: str, size: str, fmt: str, target: str) -> bytes:
+        try:
+            s3 = await media_s3.get()
+            try:
+                s3_obj = await s3.get_object(Bucket=bucket_name, Key=key)
+                data = await s3_obj["Body"].read()
+            except ClientError as e:
+                if _status(e) in (403, 404):
+                    raise HTTPException(status_code=404, detail="Файл не найден")
+                logger.warning(f"S3 error for {key}: {e}")
+                raise HTTPException(status_code=502, detail="Хранилище недоступно")
+
+            variant = await run_in_threadpool(
+                _render_variant, data, VARIANT_SIZES[size], fmt
+            )
+            try:
+                await s3.put_object(
+                    Bucket=bucket_name,
+                    Key=target,
+                    Body=variant,
+                    ContentType=MEDIA_TYPES[fmt],
+                    CacheControl=cache_control(target),
+                )
+            except ClientError as e:
+                # Копия все равно отдается, сохранится при следующем запросе
+                logger.warning(f"Failed to store {target}: {e}")
+            return variant
+        finally:
+            self.inflight.pop(target, None)
+
+    async def build(self, key: str, size: str, fmt: str, target: str) -> bytes:
+        """Создает копию размера size и сохраняет ее в S3 под ключом target"""
+        task = self.inflight.get(target)
+        if task is None:
+            task = asyncio.ensure_future(self._build(key, size, fmt, target))
+            self.inflight[target] = task
+        return await asyncio.shield(task)
+
+    async def exists(self, key: str) -> bool:
+        s3 = await media_s3.get()
+        try:
+            await s3.head_object(Bucket=bucket_name, Key=key)
+        except ClientError as e:
+            if _status(e) in (403, 404):
+                return False
+            raise
+        return True
+
+
+variants_builder = VariantsBuilder()
+
+
+async def variant_target(key: str, size: str, fmt: str) -> str:
+    """
+    Ключ S3 копии. Имена <uuid4 hex>.<ext> не перезаписываются, для
+    остальных в ключ входит ETag оригинала
+    """
+    if CONTENT_ADDRESSED_NAME.search(key):
+        return variant_key(key, size, fmt)
+
+    s3 = await media_s3.get()
+    try:
+        source = await s3.head_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if _status(e) in (403, 404):
+            raise HTTPException(status_code=404, detail="Файл не найден")
+        logger.warning(f"S3 error for {key}: {e}")
+        raise HTTPException(status_code=502, detail="Хранилище недоступно")
+    version = re.sub(r"[^0-9a-zA-Z-]", "", source.get("ETag") or "")
+    return variant_key(key, size, fmt, version=version or None)
+
+
+def supports_variants(key: str) -> bool:
+    return extension(key) in VARIANT_SOURCE_EXTENSIONS
+
+
+async def serve_variant(key: str, size: str, headers) -> Response:
+    """Уменьшенная копия фото; при первом запросе создается из оригинала"""
+    fmt = variant_format(headers.get("accept"))
+    target = await variant_target(key, size, fmt)
+    try:
+        response = await serve_object(target, headers)
+    except HTTPException as e:
+        if e.status_code != 404:
+            raise
+        try:
+            variant = await variants_builder.build(key, size, fmt, target)
+        except (UnidentifiedImageError, OSError) as error:
+            # Не картинка или битый файл - отдаем оригинал как есть
+            logger.warning(f"Failed to build {target}: {error}")
+            return await serve_object(key, headers)
+        response = Response(
+            content=variant,
+            media_type=MEDIA_TYPES[fmt],
+            headers={
+                "Cache-Control": cache_control(target),
+                # Совпадает с ETag, который S3 вернет для сохраненной копии
+                "ETag": f'"{hashlib.md5(variant).hexdigest()}"',
+            },
+        )
+    # Формат копии зависит от Accept
+    response.headers["Vary"] = "Accept"
+    return response
+
+
+async def variant_file_key(key: str, size: str, accept: Optional[str]) -> str:
+    """Ключ S3 уменьшенной копии, созданной при необходимости"""
+    fmt = variant_format(accept)
+    target = await variant_target(key, size, fmt)
+    if not await variants_builder.exists(target):
+        try:
+            await variants_builder.build(key, size, fmt, target)
+        except (UnidentifiedImageError, OSError) as error:
+            logger.warning(f"Failed to build {target}: {error}")
+            return key
+    return target
@@ -2,16 +2,18 @@ import io
 import re
 from datetime import datetime
 from os import environ
+from typing import Optional
 from uuid import uuid4
 from zoneinfo import ZoneInfo
 
 import aioboto3
 import api.pictures.schemas as schemas
+from api.pictures import media
 from common.utils.url_helper import get_app_url_for_environment
 from database import db
 from database.db import database, pictures
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
-from fastapi.responses import RedirectResponse, Response
+from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile
+from fastapi.responses import RedirectResponse
 from functions.filter_schemas import PicturesFiltersQuery
 from functions.helpers import (
     datetime_to_timestamp,
@@ -78,8 +80,13 @@ async def get_picture_by_id(token: str, idx: int):
 
 
 @router.get("/photos/{filename:path}")
-async def get_picture_by_filename(filename: str):
-    """Публичный доступ к фото по имени файла (обратная совместимость со старыми URL)"""
+async def get_picture_by_filename(
+    filename: str, request: Request, size: Optional[schemas.PictureSize] = None
+):
+    """
+    Публичный доступ к фото по имени файла (обратная совместимость со старыми URL).
+    size - уменьшенная копия (thumb, medium) для списков и превью
+    """
     # Поддерживаем как старый формат (nomenclature_39663_78d9b9b5.jpg),
     # так и новый формат с путями (2025/12/21/4/938bd650df9248aabc21c0be8edc35e2.jpg)
 
@@ -96,25 +103,9 @@ async def get_picture_by_filename(filename: str):
     else:
         file_key = f"photos/{filename}"
 
-    async with s3_session.client(**s3_data) as s3:
-        try:
-            s3_obj = await s3.get_object(Bucket=bucket_name, Key=file_key)
-            body = await s3_obj["Body"].read()
-        except Exception as e:
-            print(f"S3 error for {file_key}: {e}")
-            raise HTTPException(status_code=404, detail="Файл не найден")
-
-    # Определяем MIME-type
-    if filename.lower().endswith(".png"):
-        media_type = "image/png"
-    elif filename.lower().endswith(".gif"):
-        media_type = "image/gif"
-    elif filename.lower().endswith(".pdf"):
-        media_type = "application/pdf"
-    else:
-        media_type = "image/jpeg"
-
-    return Response(content=body, media_type=media_type)
+    if size is not None and media.supports_variants(file_key):
+        return await media.serve_variant(file_key, size.value, request.headers)
+    return await media.serve_object(file_key, request.headers)
 
 
 @router.get("/photos/link/{filename}/")
@@ -323,8 +314,10 @@ async def edit_picture(
 
 
 @router.get("/pictures/{picture_id}/content")
-async def get_picture_content(picture_id: int):
-    """Публичный доступ к фото товара (без токена)"""
+async def get_picture_content(
+    picture_id: int, request: Request, size: Optional[schemas.PictureSize] = None
+):
+    """Публичный доступ к фото товара (без токена), size - уменьшенная копия"""
     query = pictures.select().where(
         pictures.c.id == picture_id,
         pictures.c.is_deleted.is_not(True),
@@ -333,13 +326,23 @@ async def get_picture_content(picture_id: int):
     if not picture:
         raise HTTPException(404, "Фотография не найдена")
 
+    file_key = picture["url"]
+    if size is not None and media.supports_variants(file_key):
+        file_key = await media.variant_file_key(
+            file_key, size.value, request.headers.get("accept")
+        )
+
     async with s3_session.client(**s3_data) as s3:
         presigned_url = await s3.generate_presigned_url(
             "get_object",
-            Params={"Bucket": bucket_name, "Key": picture["url"]},
+            Params={"Bucket": bucket_name, "Key": file_key},
             ExpiresIn=3600,  # 1 час — достаточно для кэширования
         )
-    return RedirectResponse(presigned_url)
+    response = RedirectResponse(presigned_url)
+    if size is not None:
+        # Ссылка ведет на копию в формате, выбранном по Accept
+        response.headers["Vary"] = "Accept"
+    return response
 
 
 @router.delete("/pictures/{idx}/", response_model=schemas.Picture)
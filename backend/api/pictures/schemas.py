@@ -1,8 +1,14 @@
+from enum import Enum
 from typing import List, Optional
 
 from pydantic import BaseModel
 
 
+class PictureSize(str, Enum):
+    thumb = "thumb"
+    medium = "medium"
+
+
 class PictureEdit(BaseModel):
     is_main: bool
 
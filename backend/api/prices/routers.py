@@ -2,13 +2,16 @@ import logging
 from typing import List, Optional
 
 import api.prices.schemas as schemas
+from api.marketplace.service.public_categories.closure import (
+    refresh_nomenclature_categories,
+)
+from api.nomenclature.loaders import load_photos
 from common.geocoders.instance import geocoder
 from database.db import (
     categories,
     database,
     manufacturers,
     nomenclature,
-    pictures,
     price_types,
     prices,
     units,
@@ -29,6 +32,14 @@ from ws_manager import manager
 router = APIRouter(tags=["prices"])
 
 
+async def refresh_price_categories(nomenclature_ids):
+    """Наличие товаров в глобальных категориях зависит от цен chatting"""
+    try:
+        await refresh_nomenclature_categories(nomenclature_ids)
+    except Exception:
+        logging.exception("Failed to refresh global categories products rollup")
+
+
 @router.get("/prices/{idx}/", response_model=schemas.Price)
 async def get_price_by_id(token: str, idx: int):
     """Получение цены по ID"""
@@ -312,47 +323,9 @@ async def get_prices(
             )
         )
 
-        if nomenclature_ids:
-            # Загружаем все фото одним запросом
-            photos_query = (
-                select(
-                    pictures.c.entity_id.label("nomenclature_id"),
-                    pictures.c.id,
-                    pictures.c.url,
-                    pictures.c.is_main,
-                    pictures.c.created_at,
-                    pictures.c.updated_at,
-                )
-                .select_from(pictures)
-                .where(
-                    pictures.c.entity == "nomenclature",
-                    pictures.c.entity_id.in_(nomenclature_ids),
-                    pictures.c.is_deleted.is_not(True),
-                )
-                .order_by(
-                    pictures.c.entity_id, pictures.c.is_main.desc(), pictures.c.id.asc()
-                )
-            )
-            photos_list = await database.fetch_all(photos_query)
-
-            # Группируем фото по nomenclature_id
-            photos_dict = {}
-            for photo in photos_list:
-                nom_id = photo["nomenclature_id"]
-                if nom_id not in photos_dict:
-                    photos_dict[nom_id] = []
-                photo_dict = dict(photo)
-                del photo_dict["nomenclature_id"]
-                photos_dict[nom_id].append(datetime_to_timestamp(photo_dict))
-
-            # Добавляем фото к ценам
-            for price in prices_db:
-                nom_id = price.get("nomenclature_id")
-                price["photos"] = photos_dict.get(nom_id, [])
-        else:
-            # Если нет nomenclature_id, добавляем пустые массивы
-            for price in prices_db:
-                price["photos"] = []
+        photos_dict = await load_photos(nomenclature_ids)
+        for price in prices_db:
+            price["photos"] = photos_dict.get(price.get("nomenclature_id"), [])
 
     count_query = (
         select(func.count(prices.c.id).label("count_prices"))
@@ -480,6 +453,7 @@ async def new_price(token: str, prices_data: schemas.PriceCreateMass):
         prices.c.cashbox == user.cashbox_id, prices.c.id.in_(inserted_ids)
     )
     prices_db = await database.fetch_all(query)
+    await refresh_price_categories(price.nomenclature for price in prices_db)
     # prices_db = [*map(datetime_to_timestamp, prices_db)]
     # prices_db = [*map(rem_owner_is_deleted, prices_db)]
 
@@ -652,6 +626,7 @@ async def edit_price(
                     detail="Цена с таким адресом уже существует для этого товара",
                 )
 
+        old_nomenclature_id = price_db.nomenclature
         query = (
             prices.update()
             .where(prices.c.id == idx, prices.c.cashbox == user.cashbox_id)
@@ -659,6 +634,7 @@ async def edit_price(
         )
         await database.execute(query)
         price_db = await get_entity_by_id(prices, price_db.id, user.cashbox_id)
+        await refresh_price_categories({old_nomenclature_id, price_db.nomenclature})
 
     if price_db:
         response_body = {**dict(price_db)}
@@ -736,6 +712,7 @@ async def edit_price(
     """Редактирование цены пачкой"""
     user = await get_user_by_token(token)
     response_body_list = []
+    nomenclature_ids = set()
     for price in prices_list:
         dates_filters = []
         if date_from and not date_to:
@@ -768,6 +745,7 @@ async def edit_price(
             #     if ex_price:
             #         raise HTTPException(403, "Цена с таким типом уже существует")
 
+            nomenclature_ids.add(price_db.nomenclature)
             query = (
                 prices.update()
                 .where(prices.c.id == price_db.id, prices.c.cashbox == user.cashbox_id)
@@ -775,6 +753,7 @@ async def edit_price(
             )
             await database.execute(query)
             price_db = await get_entity_by_id(prices, price_db.id, user.cashbox_id)
+            nomenclature_ids.add(price_db.nomenclature)
 
         response_body = {**dict(price_db)}
 
@@ -832,6 +811,8 @@ async def edit_price(
         response_body = datetime_to_timestamp(response_body)
         response_body_list.append(response_body)
 
+    await refresh_price_categories(nomenclature_ids)
+
     websocket_body = parse_obj_as(
         Optional[List[schemas.PriceInList]], response_body_list
     )
@@ -877,6 +858,7 @@ async def delete_price(
         .values({"is_deleted": True})
     )
     await database.execute(query)
+    await refresh_price_categories([price_db.nomenclature])
 
     response_body = {**dict(price_db)}
 
@@ -955,6 +937,7 @@ async def delete_price_mass(
     user = await get_user_by_token(token)
 
     response_body_list = []
+    nomenclature_ids = set()
 
     for price_id in ids.split(","):
         dates_filters = []
@@ -980,6 +963,7 @@ async def delete_price_mass(
             prices.c.id == int(price_id), prices.c.cashbox == user.cashbox_id
         )
         price_db = await database.fetch_one(query)
+        nomenclature_ids.add(price_db.nomenclature)
 
         response_body = {**dict(price_db)}
 
@@ -1037,6 +1021,8 @@ async def delete_price_mass(
         response_body = datetime_to_timestamp(response_body)
         response_body_list.append(response_body)
 
+    await refresh_price_categories(nomenclature_ids)
+
     websocket_body = parse_obj_as(
         Optional[List[schemas.PriceInList]], response_body_list
     )
@@ -3,8 +3,9 @@ from datetime import datetime
 import aiofiles
 import api.projects.schemas as proj_schemas
 import functions.filter_schemas as filter_schemas
-from database.db import database, projects, users_cboxes_relation
+from database.db import database, projects
 from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from functions.auth_cache import resolve_token
 from functions.helpers import get_filters_projects
 from sqlalchemy import asc, desc, func, select
 from ws_manager import manager
@@ -15,8 +16,7 @@ router = APIRouter(tags=["projects"])
 @router.get("/projects/{id}/", response_model=proj_schemas.Project)
 async def get_project_by_id(token: str, id: int):
     """Получение проекта по ID"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             query = projects.select().where(
@@ -40,8 +40,7 @@ async def get_projects(
     filters: filter_schemas.ProjectsFiltersQuery = Depends(),
 ):
     """Получение проектов кассы"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             filters = get_filters_projects(projects, filters)
@@ -91,8 +90,7 @@ async def get_projects(
 @router.post("/projects/")
 async def new_project(token: str, proj: proj_schemas.ProjectCreate):
     """Создание проекта"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             created = int(datetime.utcnow().timestamp())
@@ -128,8 +126,7 @@ async def new_project(token: str, proj: proj_schemas.ProjectCreate):
 @router.put("/projects/")
 async def edit_project(token: str, proj: proj_schemas.ProjectEdit):
     """Обновление проекта"""
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         if user.status:
             query = projects.select().where(
@@ -182,8 +179,7 @@ async def edit_project(token: str, proj: proj_schemas.ProjectEdit):
 async def add_icon_to_project(
     token: str, proj_id: int, icon_file: UploadFile = File(...)
 ):
-    query = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
 
     if user:
         if user.status:
@@ -11,6 +11,7 @@ from database.db import (
 )
 from fastapi import APIRouter, HTTPException
 from functions import users as func
+from functions.auth_cache import invalidate_token_cache, resolve_token
 from functions.helpers import raise_wrong_token
 from sqlalchemy import (
     and_,
@@ -34,13 +35,11 @@ async def get_user_by_token_route(token: str):
 async def get_user_list(
     token: str, name: str = None, limit: int = 100, offset: int = 0
 ):
-    cashbox_query = (
-        select(users_cboxes_relation.c.cashbox_id)
-        .where(users_cboxes_relation.c.token == token)
-        .subquery("cashbox_query")
-    )
+    user = await resolve_token(token)
+    if not user:
+        return {"result": [], "count": 0}
 
-    filters = [users_cboxes_relation.c.cashbox_id == cashbox_query.c.cashbox_id]
+    filters = [users_cboxes_relation.c.cashbox_id == user.cashbox_id]
 
     if name:
         filters.append(
@@ -74,10 +73,7 @@ async def get_user_list(
 async def set_user_permissions(token: str, data: schemas.UserPermissionUpdate):
     """Установка прав для пользователя"""
 
-    user_relation_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    user_relation = await database.fetch_one(user_relation_query)
+    user_relation = await resolve_token(token)
 
     if not user_relation or not user_relation.is_owner:
         raise HTTPException(
@@ -152,10 +148,7 @@ async def set_user_permissions(token: str, data: schemas.UserPermissionUpdate):
 async def get_user_permissions(token: str, user_id: int):
     """Получение прав пользователя"""
 
-    user_relation_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    user_relation = await database.fetch_one(user_relation_query)
+    user_relation = await resolve_token(token)
 
     if not user_relation or not user_relation.is_owner:
         raise HTTPException(
@@ -298,10 +291,7 @@ async def get_user_permissions(token: str, user_id: int):
 async def get_my_permissions(token: str):
     """Получение прав текущего пользователя"""
 
-    user_relation_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    user_relation = await database.fetch_one(user_relation_query)
+    user_relation = await resolve_token(token)
 
     if not user_relation or not user_relation.status:
         raise HTTPException(status_code=403, detail="Некорректный токен")
@@ -488,10 +478,7 @@ async def update_user_shift_settings(
 ):
     """Включить/выключить работу по сменам для пользователя"""
 
-    current_user_query = users_cboxes_relation.select().where(
-        users_cboxes_relation.c.token == token
-    )
-    current_user = await database.fetch_one(current_user_query)
+    current_user = await resolve_token(token)
 
     if not current_user or not current_user.is_owner:
         raise HTTPException(
@@ -517,6 +504,7 @@ async def update_user_shift_settings(
         .where(users_cboxes_relation.c.user == user_id)
         .values(shift_work_enabled=settings.shift_work_enabled)
     )
+    await invalidate_token_cache(user_id=user_id)
 
     # Если отключаем смены - завершаем активную смену
     if not settings.shift_work_enabled:
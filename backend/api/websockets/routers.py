@@ -1,7 +1,7 @@
 import json
 
-from database.db import database, users, users_cboxes_relation
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from functions.auth_cache import resolve_token
 from ws_manager import manager
 
 router = APIRouter(tags=["ws"])
@@ -10,8 +10,7 @@ router = APIRouter(tags=["ws"])
 @router.websocket("/ws/{ws_token}/")
 async def websocket(ws_token: str, websocket: WebSocket):
     """Вебсокет"""
-    query = users.select().where(users_cboxes_relation.c.token == ws_token)
-    user = await database.fetch_one(query=query)
+    user = await resolve_token(ws_token)
     if user:
         await manager.connect(ws_token, websocket)
         try:
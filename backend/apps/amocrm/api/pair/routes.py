@@ -12,6 +12,7 @@ from database.db import (
     users_cboxes_relation,
 )
 from fastapi import APIRouter, HTTPException
+from functions.auth_cache import resolve_token
 from functions.helpers import gen_token
 from ws_manager import manager
 
@@ -186,8 +187,7 @@ async def sc_l(token: str):
 
 @router.get("/integration_unpair/")
 async def sc_l(token: str):
-    query = users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if user:
         query = (
             amo_install_table_cashboxes.update()
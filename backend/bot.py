@@ -23,6 +23,7 @@ from api.payments.schemas import PaymentCreate
 from api.pboxes.routers import create_paybox
 from api.pboxes.schemas import PayboxesCreate
 from bot_routes.bills import get_bill_route
+from bot_routes.functions.ocr_queue import ocr_queue
 from common.s3_service.impl.S3ServiceFactory import S3ServiceFactory
 from common.s3_service.models.S3SettingsModel import S3SettingsModel
 from const import DEMO, cheque_service_url
@@ -40,10 +41,12 @@ from database.db import (
     users,
     users_cboxes_relation,
 )
+from functions.auth_cache import invalidate_token_cache
 from functions.cboxes import create_cbox, join_cbox
 from functions.helpers import gen_token
 from producer import produce_message
 from sqlalchemy import and_
+from ws_manager import bus as ws_bus
 
 logging.basicConfig(level=logging.INFO)
 bot = Bot(os.environ.get("TG_TOKEN"), parse_mode="HTML")
@@ -246,6 +249,7 @@ async def generate_new_user_access_token_for_cashbox(
         .values({"token": token})
     )
     await database.execute(query)
+    await invalidate_token_cache(cashbox_id=cashbox_id, user_id=user_id)
     return token
 
 
@@ -737,6 +741,9 @@ async def cmd_id_groups(message: types.Message, state: FSMContext):
                     )
 
                     await database.execute(query)
+                    await invalidate_token_cache(
+                        cashbox_id=cbox.id, user_id=user_and_chat.id
+                    )
                     answer_1 = texts.change_token_1
                     answer_2 = texts.change_token_2.format(token=new_token, url=app_url)
                     msg_id = (
@@ -1340,6 +1347,12 @@ async def main():
     dp = Dispatcher()
 
     await database.connect()
+    try:
+        # Функции API, вызываемые ботом, разрешают токены через кеш:
+        # подписка доставляет ему сбросы кеша от воркеров API
+        await ws_bus.start()
+    except Exception as e:
+        logging.warning(f"WebSocket bus subscription failed: {e}")
     asyncio.create_task(telegram_polling_worker.run_polling_forever(manage_db=False))
     router = get_bill_route(bot, s3_client)
     # Register handlers
@@ -1351,7 +1364,11 @@ async def main():
     # await set_bot_commands(bot)
 
     # Run bot
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    try:
+        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        ocr_queue.shutdown()
+        await ws_bus.stop()
 
 
 if __name__ == "__main__":
@@ -11,6 +11,7 @@ from bot_routes.functions.callbacks import (
     create_select_account_payment_callback,
 )
 from bot_routes.functions.keyboards import *
+from bot_routes.functions.ocr_queue import ocr_queue
 from bot_routes.functions.TgBillsFuncions import (
     get_chat_owner,
     get_tochka_bank_accounts_by_chat_owner,
@@ -387,8 +388,21 @@ def get_bill_route(bot, s3_client):
             file_id = message.document.file_id
             file_name = message.document.file_name
             file_info = await bot.get_file(file_id)
+
+            async def notify_queued(job):
+                position = ocr_queue.position(job)
+                text = "Счёт принят, идёт распознавание."
+                if position > 1:
+                    text += f" Перед ним в очереди: {position - 1}."
+                await message.reply(text)
+
             bill, msg = await tg_bill_service.process_and_save_bill(
-                file_id, file_name, str(user_id), bot.token, file_info.file_path
+                file_id,
+                file_name,
+                str(user_id),
+                bot.token,
+                file_info.file_path,
+                on_queued=notify_queued,
             )
             if not bill:
                 await bot.send_message(chat_id=chat_id, text=msg)
@@ -0,0 +1,171 @@
+"""
+Очередь распознавания PDF-счетов.
+
+Задачи (OcrJob) ставятся в asyncio-очередь и разбираются OCR_WORKERS
+обработчиками, каждый отдает PDF в пул из OCR_WORKERS процессов, так
+что pdf2image и tesseract не блокируют event loop бота. Результат
+кэшируется по sha256 содержимого файла (последние OCR_CACHE_SIZE);
+повторная отправка того же файла, в том числе пока он распознается,
+не запускает распознавание заново. Статус задачи - ocr_queue.get(job_id)
+"""
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+from uuid import uuid4
+
+from bot_routes.functions.pdf_reader import extract_text_from_pdf_images
+
+logger = logging.getLogger(__name__)
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", 2))
+OCR_QUEUE_SIZE = int(os.getenv("OCR_QUEUE_SIZE", 100))
+OCR_CACHE_SIZE = int(os.getenv("OCR_CACHE_SIZE", 256))
+OCR_JOBS_KEEP = int(os.getenv("OCR_JOBS_KEEP", 1000))
+
+
+class OcrJobStatus:
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class OcrJob:
+    def __init__(self, file_hash: str, file_bytes: Optional[bytes]):
+        self.id = uuid4().hex
+        self.file_hash = file_hash
+        self.file_bytes = file_bytes
+        self.status = OcrJobStatus.QUEUED
+        self.text: Optional[str] = None
+        self.error: Optional[str] = None
+        self.done = asyncio.get_running_loop().create_future()
+
+    def finish(self, text: Optional[str] = None, error: Optional[str] = None):
+        self.file_bytes = None
+        self.text = text
+        self.error = error
+        self.status = OcrJobStatus.FAILED if error else OcrJobStatus.DONE
+        if not self.done.done():
+            self.done.set_result(text)
+
+    async def wait(self) -> Optional[str]:
+        """Текст после распознавания, None - если распознать не удалось"""
+        return await asyncio.shield(self.done)
+
+
+class OcrQueue:
+    def __init__(self, workers: int = OCR_WORKERS):
+        self.workers = workers
+        self.queue: Optional[asyncio.Queue] = None
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.tasks = []
+        self.cache: "OrderedDict[str, str]" = OrderedDict()
+        self.inflight: Dict[str, OcrJob] = {}
+        self.jobs: "OrderedDict[str, OcrJob]" = OrderedDict()
+
+    def _create_pool(self) -> ProcessPoolExecutor:
+        # spawn: процессы пула не наследуют event loop и соединения бота
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def _start(self):
+        if self.queue is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=OCR_QUEUE_SIZE)
+        self.pool = self._create_pool()
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def _remember(self, job: OcrJob) -> OcrJob:
+        self.jobs[job.id] = job
+        while len(self.jobs) > OCR_JOBS_KEEP:
+            self.jobs.popitem(last=False)
+        return job
+
+    async def submit(self, file_bytes: bytes) -> OcrJob:
+        """Задача распознавания PDF; ждет места, если очередь заполнена"""
+        self._start()
+        file_hash = hashlib.sha256(file_bytes).hexdigest()
+
+        if file_hash in self.cache:
+            self.cache.move_to_end(file_hash)
+            job = OcrJob(file_hash, None)
+            job.finish(self.cache[file_hash])
+            return self._remember(job)
+
+        job = self.inflight.get(file_hash)
+        if job is not None:
+            return job
+
+        job = OcrJob(file_hash, file_bytes)
+        self.inflight[file_hash] = job
+        self._remember(job)
+        await self.queue.put(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[OcrJob]:
+        return self.jobs.get(job_id)
+
+    def position(self, job: OcrJob) -> int:
+        """Сколько задач в очереди впереди (0 - уже распознается)"""
+        if job.status != OcrJobStatus.QUEUED:
+            return 0
+        for index, queued in enumerate(self.queue._queue):
+            if queued is job:
+                return index + 1
+        return 0
+
+    async def _recognize(self, file_bytes: bytes) -> str:
+        loop = asyncio.get_running_loop()
+        pool = self.pool
+        try:
+            return await loop.run_in_executor(
+                pool, extract_text_from_pdf_images, file_bytes
+            )
+        except BrokenProcessPool:
+            # Упавший процесс (например, по памяти) ломает весь пул
+            if self.pool is pool:
+                self.pool = self._create_pool()
+            raise
+
+    async def _worker(self):
+        queue = self.queue
+        while True:
+            job = await queue.get()
+            job.status = OcrJobStatus.RUNNING
+            try:
+                text = await self._recognize(job.file_bytes)
+            except asyncio.CancelledError:
+                job.finish(error="Распознавание остановлено")
+                raise
+            except Exception as e:
+                logger.exception(f"OCR job {job.id} failed")
+                job.finish(error=str(e))
+            else:
+                self.cache[job.file_hash] = text
+                while len(self.cache) > OCR_CACHE_SIZE:
+                    self.cache.popitem(last=False)
+                job.finish(text)
+            finally:
+                self.inflight.pop(job.file_hash, None)
+                queue.task_done()
+
+    def shutdown(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        self.queue = None
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+
+ocr_queue = OcrQueue()
@@ -1,18 +1,27 @@
+import os
+
 import pytesseract
 from pdf2image import convert_from_bytes
 
 # TRY https://github.com/loadlost/PP-Parser/blob/master/pdf_parser.py
 
+# Языки распознаются за один проход tesseract
+OCR_LANGUAGES = os.getenv("OCR_LANGUAGES", "rus+eng")
 
-def extract_text_from_pdf_images(file_bytes: bytes, lang=None) -> str:
 
+def extract_text_from_pdf_images(file_bytes: bytes, lang=OCR_LANGUAGES) -> str:
+    """
+    Текст PDF: каждая страница растеризуется один раз и распознается
+    сразу всеми языками lang. Выполняется в процессах пула OCR (ocr_queue)
+    """
     images = convert_from_bytes(file_bytes)
     # images  = convert_from_path(temp_pdf.name)  # This will raise an exception if the file is not a valid PDF
     extracted_text = ""
-    for i, image in enumerate(images):
+    for image in images:
         if lang:
             text = pytesseract.image_to_string(image, lang=lang)
         else:
             text = pytesseract.image_to_string(image)
         extracted_text += text
+        image.close()
     return extracted_text
@@ -5,7 +5,7 @@ import re
 from datetime import datetime
 
 import aiohttp
-from bot_routes.functions.pdf_reader import extract_text_from_pdf_images
+from bot_routes.functions.ocr_queue import OcrJobStatus, ocr_queue
 from bot_routes.functions.TgBillsFuncions import get_user_from_db
 from bot_routes.functions.tochka_api import (
     TochkaBankError,
@@ -517,9 +517,13 @@ class TgBillsService:
         return bill_data
 
     async def process_and_save_bill(
-        self, file_id, file_name, tg_id_updated_by, bot_token, file_path
+        self, file_id, file_name, tg_id_updated_by, bot_token, file_path, on_queued=None
     ):
-        """Processes the uploaded PDF bill and saves it."""
+        """
+        Processes the uploaded PDF bill and saves it.
+        OCR runs in the ocr_queue process pool; on_queued(job) is awaited
+        when the file is not recognized yet, so the bot can reply at once.
+        """
         try:
             file_bytes = await self.download_telegram_file(file_path, bot_token)
             await self.s3_client.upload_file_object(
@@ -531,8 +535,14 @@ class TgBillsService:
                 f'{os.getenv("S3_URL")}/{self.s3_bucket_name}/tg-bills/{file_id}.pdf'
             )
 
-            bill_text = extract_text_from_pdf_images(file_bytes)
-            bill_text_rus = extract_text_from_pdf_images(file_bytes, lang="rus")
+            job = await ocr_queue.submit(file_bytes)
+            if on_queued is not None and job.status != OcrJobStatus.DONE:
+                await on_queued(job)
+            # Один проход rus+eng: цифровые реквизиты и русский текст
+            bill_text = await job.wait()
+            if bill_text is None:
+                return None, "Не удалось распознать счёт."
+            bill_text_rus = bill_text
 
             bill_data = self.extract_bill_data(bill_text, bill_text_rus)
 
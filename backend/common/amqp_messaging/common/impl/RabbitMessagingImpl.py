@@ -1,4 +1,5 @@
 import asyncio
+import time
 import traceback
 from asyncio import create_task
 from json import loads
@@ -8,6 +9,11 @@ import aio_pika
 import aiormq
 from aio_pika import IncomingMessage, Message
 from aio_pika.abc import AbstractQueue, AbstractRobustChannel
+from common.metrics import (
+    RABBITMQ_CONSUMED,
+    RABBITMQ_HANDLE_DURATION,
+    RABBITMQ_PUBLISHED,
+)
 
 from ...amqp_channels.core.IRabbitChannel import IRabbitChannel
 from ...common.core.EventHandler import IEventHandler
@@ -125,7 +131,7 @@ class RabbitMessagingImpl(IRabbitMessaging):
             arguments={"x-max-priority": 10},
         )
 
-        return await publication_channel.default_exchange.publish(
+        confirmation = await publication_channel.default_exchange.publish(
             Message(
                 body=BasePublishMessage(
                     event_name=message.__class__.__name__, event=message
@@ -142,6 +148,8 @@ class RabbitMessagingImpl(IRabbitMessaging):
             ),
             routing_key=routing_key,
         )
+        RABBITMQ_PUBLISHED.labels(routing_key).inc()
+        return confirmation
 
     async def subscribe(
         self, event_type: Type[BaseModelMessage], event_handler: IEventHandler
@@ -168,7 +176,15 @@ class RabbitMessagingImpl(IRabbitMessaging):
                 )
                 return
 
+            event_name = message_json["event_name"]
+            start = time.perf_counter()
             try:
                 await create_task(event_handler(event, message))
+                RABBITMQ_CONSUMED.labels(event_name, "success").inc()
             except Exception as e:
+                RABBITMQ_CONSUMED.labels(event_name, "error").inc()
                 print("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+            finally:
+                RABBITMQ_HANDLE_DURATION.labels(event_name).observe(
+                    time.perf_counter() - start
+                )
@@ -0,0 +1,130 @@
+"""
+Локальное определение города по IP.
+
+База GeoLite2-City (GEOIP_CITY_DB) читается через mmap, последние
+GEOIP_CACHE_SIZE адресов кэшируются. Раз в GEOIP_RELOAD_CHECK_SECONDS
+проверяется файл базы: после его замены (обновление базы) читатель
+переоткрывается и кэш сбрасывается. Без файла резолвер ничего не
+находит, и геокодер уходит в удаленный сервис. Файл загружает
+scripts/download_geoip.py (docker-entrypoint.sh при старте API)
+"""
+
+import ipaddress
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import maxminddb
+from common.geocoders.schemas import GeocoderSearchResponse
+
+logger = logging.getLogger(__name__)
+
+GEOIP_CITY_DB = os.getenv("GEOIP_CITY_DB", "/usr/share/GeoIP/GeoLite2-City.mmdb")
+GEOIP_CACHE_SIZE = int(os.getenv("GEOIP_CACHE_SIZE", 10000))
+GEOIP_RELOAD_CHECK_SECONDS = int(os.getenv("GEOIP_RELOAD_CHECK_SECONDS", 60))
+GEOIP_LANGUAGES = ("ru", "en")
+
+
+def _name(item: Optional[dict]) -> Optional[str]:
+    names = (item or {}).get("names") or {}
+    for language in GEOIP_LANGUAGES:
+        if names.get(language):
+            return names[language]
+    return None
+
+
+class GeoIPResolver:
+    def __init__(
+        self,
+        path: str = GEOIP_CITY_DB,
+        cache_size: int = GEOIP_CACHE_SIZE,
+        reload_check_seconds: int = GEOIP_RELOAD_CHECK_SECONDS,
+    ):
+        self.path = path
+        self.cache_size = cache_size
+        self.reload_check_seconds = reload_check_seconds
+        self.cache: "OrderedDict[str, Optional[GeocoderSearchResponse]]" = OrderedDict()
+        self.reader = None
+        self.file_id = None
+        self.checked_at = time.monotonic()
+        self.reload()
+        if self.reader is None:
+            logger.warning(
+                f"GeoIP database {self.path} is not available, IP lookups "
+                "fall back to the remote geocoder. Set MAXMIND_ACCOUNT_ID and "
+                "MAXMIND_LICENSE_KEY or run python -m scripts.download_geoip"
+            )
+
+    def _file_id(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def reload(self):
+        """Переоткрывает файл базы, например после его замены"""
+        file_id = self._file_id()
+        reader = None
+        if file_id is not None:
+            try:
+                reader = maxminddb.open_database(self.path, maxminddb.MODE_MMAP)
+            except (OSError, ValueError, maxminddb.InvalidDatabaseError) as e:
+                logger.warning(f"Failed to open GeoIP database {self.path}: {e}")
+
+        previous, self.reader = self.reader, reader
+        self.file_id = file_id
+        self.cache.clear()
+        if previous is not None:
+            previous.close()
+
+    def _reload_if_replaced(self):
+        now = time.monotonic()
+        if now - self.checked_at < self.reload_check_seconds:
+            return
+        self.checked_at = now
+        if self._file_id() != self.file_id:
+            logger.info(f"GeoIP database {self.path} changed, reloading")
+            self.reload()
+
+    def _parse(self, record: Optional[dict]) -> Optional[GeocoderSearchResponse]:
+        if not record:
+            return None
+        location = record.get("location") or {}
+        subdivisions = record.get("subdivisions") or [None]
+        return GeocoderSearchResponse(
+            country=_name(record.get("country")),
+            state=_name(subdivisions[0]),
+            city=_name(record.get("city")),
+            street=None,
+            housenumber=None,
+            timezone=location.get("time_zone"),
+            postcode=(record.get("postal") or {}).get("code"),
+            latitude=location.get("latitude"),
+            longitude=location.get("longitude"),
+        )
+
+    def lookup(self, ip: str) -> Optional[GeocoderSearchResponse]:
+        self._reload_if_replaced()
+        if self.reader is None:
+            return None
+
+        if ip in self.cache:
+            self.cache.move_to_end(ip)
+            return self.cache[ip]
+
+        try:
+            record = self.reader.get(str(ipaddress.ip_address(ip)))
+        except ValueError:
+            record = None
+        location = self._parse(record)
+
+        self.cache[ip] = location
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return location
+
+
+geoip_resolver = GeoIPResolver()
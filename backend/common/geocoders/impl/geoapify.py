@@ -1,10 +1,29 @@
 import asyncio
+import os
 from typing import Union
 
 import aiohttp
 from common.geocoders.core.base_instance import BaseGeocoder
+from common.geocoders.geoip import geoip_resolver
 from common.geocoders.schemas import GeocoderSearchResponse
-from common.geocoders.utils import AsyncLRU
+from common.geocoders.utils import AsyncLRU, PostgresCacheStore
+
+# Ответы геокодера в geocoder_cache: общие для воркеров, переживают рестарт
+GEOCODER_PERSISTENT_CACHE = os.getenv("GEOCODER_PERSISTENT_CACHE", "true") == "true"
+
+
+def _cache_key(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _response_store(namespace: str) -> Union[PostgresCacheStore, None]:
+    if not GEOCODER_PERSISTENT_CACHE:
+        return None
+    return PostgresCacheStore(
+        namespace,
+        encode=lambda value: value.dict(),
+        decode=lambda value: GeocoderSearchResponse(**value),
+    )
 
 
 class Geoapify(BaseGeocoder):
@@ -23,8 +42,8 @@ class Geoapify(BaseGeocoder):
             )
             cls._instance.search_url = "https://api.geoapify.com/v1/geocode/search"
             cls._instance.autocomplete_cache = AsyncLRU()
-            cls._instance.search_cache = AsyncLRU()
-            cls._instance.ip_cache = AsyncLRU()
+            cls._instance.search_cache = AsyncLRU(store=_response_store("search"))
+            cls._instance.ip_cache = AsyncLRU(store=_response_store("ip"))
         return cls._instance
 
     async def _get_session(self):
@@ -35,7 +54,7 @@ class Geoapify(BaseGeocoder):
 
     async def autocomplete(self, text: str, limit=5) -> Union[list[str], list]:
         return await self.autocomplete_cache.get(
-            key=text, func=self._autocomplete, text=text, limit=limit
+            (_cache_key(text), limit), func=self._autocomplete, text=text, limit=limit
         )
 
     async def _autocomplete(self, text, limit=5) -> Union[list[str], list]:
@@ -58,7 +77,10 @@ class Geoapify(BaseGeocoder):
         self, address: str, limit=1
     ) -> Union[GeocoderSearchResponse, None]:
         return await self.search_cache.get(
-            address, func=self._validate_address, address=address, limit=limit
+            _cache_key(address),
+            func=self._validate_address,
+            address=address,
+            limit=limit,
         )
 
     async def _validate_address(
@@ -98,7 +120,13 @@ class Geoapify(BaseGeocoder):
             return None
 
     async def get_location_by_ip(self, ip: str) -> Union[GeocoderSearchResponse, None]:
-        """Определение местоположения по IP адресу"""
+        """
+        Определение местоположения по IP адресу: по локальной базе GeoIP,
+        удаленный сервис - только если город в ней не найден
+        """
+        location = geoip_resolver.lookup(ip)
+        if location and location.city:
+            return location
         return await self.ip_cache.get(key=ip, func=self._get_location_by_ip, ip=ip)
 
     async def _get_location_by_ip(self, ip: str) -> Union[GeocoderSearchResponse, None]:
@@ -1,20 +1,146 @@
 import asyncio
+import logging
+import os
+import time
 from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from database.db import database, geocoder_cache
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+logger = logging.getLogger(__name__)
+
+GEOCODER_CACHE_SIZE = int(os.getenv("GEOCODER_CACHE_SIZE", 4096))
+GEOCODER_CACHE_TTL_SECONDS = int(os.getenv("GEOCODER_CACHE_TTL_SECONDS", 86400))
+# Пустые ответы (адрес не найден, ошибка сети) кэшируются ненадолго
+GEOCODER_NEGATIVE_TTL_SECONDS = int(os.getenv("GEOCODER_NEGATIVE_TTL_SECONDS", 300))
+
+
+def is_empty(value) -> bool:
+    return value is None or value == []
 
 
 class AsyncLRU:
-    def __init__(self, maxsize=128):
-        self.cache = OrderedDict()
+    """
+    LRU-кэш результатов корутин с TTL.
+
+    Вызовы с одинаковым ключом, пришедшие во время загрузки, ждут одну
+    загрузку (single-flight); разные ключи загружаются параллельно.
+    Пустые результаты живут negative_ttl. store - необязательный
+    общий для воркеров уровень (PostgresCacheStore) под in-memory кэшем
+    """
+
+    def __init__(
+        self,
+        maxsize: int = GEOCODER_CACHE_SIZE,
+        ttl: int = GEOCODER_CACHE_TTL_SECONDS,
+        negative_ttl: int = GEOCODER_NEGATIVE_TTL_SECONDS,
+        store: Optional["PostgresCacheStore"] = None,
+    ):
+        self.cache: "OrderedDict[Any, tuple]" = OrderedDict()
+        self.inflight: dict = {}
         self.maxsize = maxsize
-        self.lock = asyncio.Lock()
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.store = store
+
+    def _get_cached(self, key):
+        item = self.cache.get(key)
+        if item is None:
+            return False, None
+        expires_at, value = item
+        if time.monotonic() >= expires_at:
+            del self.cache[key]
+            return False, None
+        self.cache.move_to_end(key)
+        return True, value
+
+    def _set_cached(self, key, value):
+        ttl = self.negative_ttl if is_empty(value) else self.ttl
+        self.cache[key] = (time.monotonic() + ttl, value)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+
+    async def _load(self, key, func: Callable, *args, **kwargs):
+        try:
+            if self.store is not None:
+                found, value = await self.store.get(key)
+                if found:
+                    self._set_cached(key, value)
+                    return value
 
-    async def get(self, key, func, *args, **kwargs):
-        async with self.lock:
-            if key in self.cache:
-                self.cache.move_to_end(key)
-                return self.cache[key]
             value = await func(*args, **kwargs)
-            self.cache[key] = value
-            if len(self.cache) > self.maxsize:
-                self.cache.popitem(last=False)
+            self._set_cached(key, value)
+            if self.store is not None and not is_empty(value):
+                await self.store.set(key, value, self.ttl)
             return value
+        finally:
+            self.inflight.pop(key, None)
+
+    async def get(self, key, func, *args, **kwargs):
+        found, value = self._get_cached(key)
+        if found:
+            return value
+
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, func, *args, **kwargs))
+            self.inflight[key] = task
+        # Отмена одного из ожидающих не отменяет общую загрузку
+        return await asyncio.shield(task)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class PostgresCacheStore:
+    """
+    Уровень кэша в таблице geocoder_cache: переживает рестарты и общий
+    для воркеров. Ошибки БД не ломают геокодирование - ключ просто
+    загружается из сети
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        encode: Callable[[Any], Any] = lambda value: value,
+        decode: Callable[[Any], Any] = lambda value: value,
+    ):
+        self.namespace = namespace
+        self.encode = encode
+        self.decode = decode
+
+    async def get(self, key):
+        try:
+            value = await database.fetch_val(
+                select(geocoder_cache.c.value).where(
+                    geocoder_cache.c.namespace == self.namespace,
+                    geocoder_cache.c.key == str(key),
+                    geocoder_cache.c.expires_at > func.now(),
+                )
+            )
+        except Exception as e:
+            logger.warning(f"Geocoder cache read failed: {e}")
+            return False, None
+        if value is None:
+            return False, None
+        return True, self.decode(value)
+
+    async def set(self, key, value, ttl: int):
+        expires_at = func.now() + func.make_interval(0, 0, 0, 0, 0, 0, ttl)
+        query = insert(geocoder_cache).values(
+            namespace=self.namespace,
+            key=str(key),
+            value=self.encode(value),
+            expires_at=expires_at,
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[geocoder_cache.c.namespace, geocoder_cache.c.key],
+            set_={"value": query.excluded.value, "expires_at": expires_at},
+        )
+        try:
+            await database.execute(query)
+        except Exception as e:
+            logger.warning(f"Geocoder cache write failed: {e}")
@@ -0,0 +1,300 @@
+"""
+Метрики Prometheus: HTTP (golden signals), запросы к БД, RabbitMQ и джобы
+APScheduler. Имена и метки HTTP-метрик совпадают с запросами дашборда
+monitoring/grafana/dashboards/golden-signals.json.
+
+API отдает метрики на /metrics. Процессы без HTTP-сервера (джобы,
+консьюмеры) поднимают отдельный порт через start_metrics_server.
+При запуске uvicorn с несколькими воркерами нужно задать
+PROMETHEUS_MULTIPROC_DIR
+"""
+
+import functools
+import os
+import time
+from typing import Dict
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Match
+
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+HTTP_REQUESTS_TOTAL = Counter(
+    "http_requests_total",
+    "Количество HTTP-запросов",
+    ["method", "handler", "status"],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ["method", "handler"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_INPROGRESS = Gauge(
+    "http_requests_inprogress",
+    "HTTP-запросы в обработке",
+    ["method", "handler"],
+    multiprocess_mode="livesum",
+)
+
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Время выполнения запроса к БД через databases",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_QUERY_ERRORS = Counter(
+    "db_query_errors_total",
+    "Ошибки запросов к БД",
+    ["operation"],
+)
+
+RABBITMQ_PUBLISHED = Counter(
+    "rabbitmq_messages_published_total",
+    "Опубликованные сообщения RabbitMQ",
+    ["queue"],
+)
+RABBITMQ_CONSUMED = Counter(
+    "rabbitmq_messages_consumed_total",
+    "Обработанные сообщения RabbitMQ",
+    ["event", "status"],
+)
+RABBITMQ_HANDLE_DURATION = Histogram(
+    "rabbitmq_message_handle_duration_seconds",
+    "Время обработки сообщения RabbitMQ",
+    ["event"],
+    buckets=LATENCY_BUCKETS,
+)
+
+JOB_DURATION = Histogram(
+    "scheduler_job_duration_seconds",
+    "Время выполнения джобы APScheduler",
+    ["job"],
+    buckets=LATENCY_BUCKETS + (60.0, 300.0, 900.0),
+)
+JOB_RUNS = Counter(
+    "scheduler_job_runs_total",
+    "Запуски джоб APScheduler",
+    ["job", "status"],
+)
+
+SEGMENTS_QUEUE_DEPTH = Gauge(
+    "segments_queue_depth",
+    "Сегменты, ожидающие пересчета",
+    multiprocess_mode="livesum",
+)
+SEGMENTS_RUNNING = Gauge(
+    "segments_running",
+    "Сегменты в пересчете",
+    multiprocess_mode="livesum",
+)
+SEGMENT_RECALC_DURATION = Histogram(
+    "segment_recalc_duration_seconds",
+    "Время пересчета сегмента",
+    ["status"],
+    buckets=LATENCY_BUCKETS + (60.0, 300.0, 900.0, 1800.0),
+)
+
+AUTOBURN_CARDS = Counter(
+    "loyality_autoburn_cards_total",
+    "Карты лояльности, по которым сгорели баллы",
+)
+AUTOBURN_TRANSACTIONS = Counter(
+    "loyality_autoburn_transactions_total",
+    "Сгоревшие начисления",
+)
+AUTOBURN_AMOUNT = Counter(
+    "loyality_autoburn_amount_total",
+    "Сумма сгоревших баллов",
+)
+
+# Метка handler для запросов, не попавших ни в один маршрут:
+# сырой путь дал бы неограниченную кардинальность
+UNMATCHED_HANDLER = "none"
+
+
+class _RuntimeCollector:
+    """Пулы соединений и очередь журнала событий снимаются в момент сбора"""
+
+    def collect(self):
+        from database.pool import pool_stats
+        from functions.events import event_writer
+
+        pool = GaugeMetricFamily(
+            "db_pool_connections",
+            "Соединения в пулах БД",
+            labels=["pool", "state"],
+        )
+        try:
+            stats = pool_stats()
+        except Exception:
+            stats = {}
+        for pool_name, values in stats.items():
+            for state, value in values.items():
+                pool.add_metric([pool_name, state], value)
+        yield pool
+
+        events = GaugeMetricFamily(
+            "events_writer",
+            "Очередь журнала событий",
+            labels=["state"],
+        )
+        for state, value in event_writer.stats().items():
+            events.add_metric([state], value)
+        yield events
+
+
+REGISTRY.register(_RuntimeCollector())
+
+
+class PrometheusMiddleware:
+    """
+    ASGI-middleware HTTP-метрик. handler - шаблон пути маршрута
+    (/nomenclature/{idx}/), а не фактический URL
+    """
+
+    def __init__(self, app, skip_paths=("/metrics",)):
+        self.app = app
+        self.skip_paths = skip_paths
+
+    @staticmethod
+    def _handler(scope) -> str:
+        for route in getattr(scope.get("app"), "routes", []):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return UNMATCHED_HANDLER
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        handler = self._handler(scope)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        inprogress = HTTP_REQUESTS_INPROGRESS.labels(method, handler)
+        inprogress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            inprogress.dec()
+            HTTP_REQUEST_DURATION.labels(method, handler).observe(
+                time.perf_counter() - start
+            )
+            HTTP_REQUESTS_TOTAL.labels(method, handler, str(status_code)).inc()
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def start_metrics_server(port_env: str) -> None:
+    """Отдельный HTTP-сервер метрик для процессов без API, порт из port_env"""
+    port = os.getenv(port_env)
+    if port:
+        start_http_server(int(port))
+
+
+def instrument_database(database) -> None:
+    """Оборачивает fetch_*/execute* клиента databases замером времени"""
+    for operation in (
+        "fetch_all",
+        "fetch_one",
+        "fetch_val",
+        "execute",
+        "execute_many",
+    ):
+        method = getattr(database, operation)
+        if getattr(method, "__instrumented__", False):
+            continue
+        setattr(database, operation, _timed(method, operation))
+
+
+def _timed(method, operation: str):
+    histogram = DB_QUERY_DURATION.labels(operation)
+    errors = DB_QUERY_ERRORS.labels(operation)
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def instrument_scheduler(scheduler) -> None:
+    """Длительность и исход джоб APScheduler по событиям планировщика"""
+    from apscheduler.events import (
+        EVENT_JOB_ERROR,
+        EVENT_JOB_EXECUTED,
+        EVENT_JOB_MISSED,
+        EVENT_JOB_SUBMITTED,
+    )
+
+    started: Dict[tuple, float] = {}
+
+    def listener(event):
+        if event.code == EVENT_JOB_SUBMITTED:
+            for run_time in event.scheduled_run_times:
+                started[(event.job_id, run_time)] = time.perf_counter()
+            return
+        if event.code == EVENT_JOB_MISSED:
+            JOB_RUNS.labels(event.job_id, "missed").inc()
+            return
+        start = started.pop((event.job_id, event.scheduled_run_time), None)
+        if start is not None:
+            JOB_DURATION.labels(event.job_id).observe(time.perf_counter() - start)
+        status = "error" if event.code == EVENT_JOB_ERROR else "success"
+        JOB_RUNS.labels(event.job_id, status).inc()
+
+    scheduler.add_listener(
+        listener,
+        EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED,
+    )
@@ -0,0 +1,33 @@
+"""loyality transactions pending autoburn index
+Revision ID: autoburn_pending_001
+Revises: loyality_balance_delta_001
+Create Date: 2026-10-18 18:00:00.000000
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "autoburn_pending_001"
+down_revision = "loyality_balance_delta_001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Несгоревшие начисления по карте в порядке создания для автосгорания"""
+    op.create_index(
+        "ix_loyality_transactions_autoburn_pending",
+        "loyality_transactions",
+        ["loyality_card_id", "created_at"],
+        postgresql_where=sa.text(
+            "type = 'accrual' AND amount > 0 AND autoburned = false"
+        ),
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "ix_loyality_transactions_autoburn_pending",
+        table_name="loyality_transactions",
+    )
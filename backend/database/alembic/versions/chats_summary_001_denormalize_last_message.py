@@ -0,0 +1,99 @@
+"""chats unread count and last message denormalization
+Revision ID: chats_summary_001
+Revises: fifo_lots_001
+Create Date: 2026-10-18 15:00:00.000000
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "chats_summary_001"
+down_revision = "fifo_lots_001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Счетчик непрочитанных и последнее сообщение хранятся в chats,
+    список чатов больше не агрегирует chat_messages
+    """
+    op.add_column(
+        "chats",
+        sa.Column("unread_count", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.add_column("chats", sa.Column("last_message_id", sa.Integer(), nullable=True))
+    op.add_column(
+        "chats", sa.Column("last_message_preview", sa.String(100), nullable=True)
+    )
+    op.add_column(
+        "chats", sa.Column("last_message_file_url", sa.String(), nullable=True)
+    )
+
+    op.create_index(
+        "ix_chat_messages_chat_created", "chat_messages", ["chat_id", "created_at"]
+    )
+    op.create_index(
+        "ix_chat_messages_unread",
+        "chat_messages",
+        ["chat_id"],
+        postgresql_where=sa.text("sender_type = 'CLIENT' AND status <> 'READ'"),
+    )
+    op.create_index(
+        "ix_chats_cashbox_last_message_time",
+        "chats",
+        ["cashbox_id", "last_message_time"],
+    )
+    op.create_index("ix_chats_last_message_id", "chats", ["last_message_id"])
+
+    op.execute(
+        """
+        UPDATE chats
+        SET unread_count = unread.cnt
+        FROM (
+            SELECT chat_id, count(*) AS cnt
+            FROM chat_messages
+            WHERE sender_type = 'CLIENT' AND status <> 'READ'
+            GROUP BY chat_id
+        ) unread
+        WHERE chats.id = unread.chat_id
+        """
+    )
+    op.execute(
+        """
+        UPDATE chats
+        SET last_message_id = last.id,
+            last_message_preview = left(COALESCE(last.content, ''), 100)
+        FROM (
+            SELECT DISTINCT ON (chat_id) chat_id, id, content
+            FROM chat_messages
+            ORDER BY chat_id, created_at DESC, id DESC
+        ) last
+        WHERE chats.id = last.chat_id
+        """
+    )
+    op.execute(
+        """
+        UPDATE chats
+        SET last_message_file_url = pic.url
+        FROM (
+            SELECT DISTINCT ON (entity_id) entity_id, url
+            FROM pictures
+            WHERE entity = 'messages' AND is_deleted IS NOT TRUE
+            ORDER BY entity_id, created_at ASC
+        ) pic
+        WHERE chats.last_message_id = pic.entity_id
+        """
+    )
+
+
+def downgrade():
+    op.drop_index("ix_chats_last_message_id", table_name="chats")
+    op.drop_index("ix_chats_cashbox_last_message_time", table_name="chats")
+    op.drop_index("ix_chat_messages_unread", table_name="chat_messages")
+    op.drop_index("ix_chat_messages_chat_created", table_name="chat_messages")
+    op.drop_column("chats", "last_message_file_url")
+    op.drop_column("chats", "last_message_preview")
+    op.drop_column("chats", "last_message_id")
+    op.drop_column("chats", "unread_count")
@@ -0,0 +1,33 @@
+"""distribution_fifo_operations fifo_lot
+Revision ID: distribution_fifo_lot_001
+Revises: nomenclature_hash_unique_001
+Create Date: 2026-10-19 00:00:00.000000
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "distribution_fifo_lot_001"
+down_revision = "nomenclature_hash_unique_001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Ссылка операции распределения на лот журнала, чтобы превью заменяло
+    устаревшие снимки лотов. Журнал сбрасывается: старые превью без ссылок
+    удалит полная пересборка при следующем запуске
+    """
+    op.add_column(
+        "distribution_fifo_operations",
+        sa.Column("fifo_lot", sa.Integer(), nullable=True),
+    )
+    op.execute(
+        "UPDATE fifo_settings SET ledger_period_start = NULL, ledger_dated = NULL"
+    )
+
+
+def downgrade():
+    op.drop_column("distribution_fifo_operations", "fifo_lot")
@@ -0,0 +1,54 @@
+"""doc_regenerate_jobs
+Revision ID: doc_regenerate_jobs_001
+Revises: distribution_fifo_lot_001
+Create Date: 2026-10-19 01:00:00.000000
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "doc_regenerate_jobs_001"
+down_revision = "distribution_fifo_lot_001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Прогресс пакетной перегенерации документов, общий для воркеров API"""
+    op.create_table(
+        "doc_regenerate_jobs",
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column(
+            "cashbox_id",
+            sa.Integer(),
+            sa.ForeignKey("cashboxes.id"),
+            nullable=True,
+        ),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("total", sa.Integer(), nullable=False),
+        sa.Column("done", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("failed", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("results", sa.JSON(), nullable=False),
+        sa.Column("errors", sa.JSON(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+    )
+    op.create_index(
+        "ix_doc_regenerate_jobs_cashbox_id", "doc_regenerate_jobs", ["cashbox_id"]
+    )
+
+
+def downgrade():
+    op.drop_index("ix_doc_regenerate_jobs_cashbox_id", table_name="doc_regenerate_jobs")
+    op.drop_table("doc_regenerate_jobs")
@@ -0,0 +1,120 @@
+"""incremental fifo lots ledger
+Revision ID: fifo_lots_001
+Revises: warehouse_stock_current_001
+Create Date: 2026-10-18 13:00:00.000000
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "fifo_lots_001"
+down_revision = "warehouse_stock_current_001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Журнал FIFO-лотов для инкрементального распределения себестоимости.
+    Таблицы заполняются при первом запуске distribute (полная пересборка)
+    """
+    op.add_column(
+        "fifo_settings", sa.Column("ledger_period_start", sa.Integer(), nullable=True)
+    )
+    op.add_column(
+        "fifo_settings", sa.Column("ledger_dated", sa.Integer(), nullable=True)
+    )
+
+    op.create_table(
+        "fifo_lots",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column(
+            "organization_id",
+            sa.Integer(),
+            sa.ForeignKey("organizations.id"),
+            nullable=False,
+        ),
+        sa.Column(
+            "nomenclature_id",
+            sa.Integer(),
+            sa.ForeignKey("nomenclature.id"),
+            nullable=False,
+        ),
+        sa.Column(
+            "document_purchase",
+            sa.Integer(),
+            sa.ForeignKey("docs_purchases.id"),
+            nullable=True,
+        ),
+        sa.Column(
+            "document_warehouse",
+            sa.Integer(),
+            sa.ForeignKey("docs_warehouse.id"),
+            nullable=True,
+        ),
+        sa.Column("dated", sa.Integer(), nullable=False),
+        sa.Column("goods_created", sa.Integer(), nullable=False),
+        sa.Column("start_amount", sa.Float(), nullable=False),
+        sa.Column("start_price", sa.Float(), nullable=False),
+        sa.Column("outgoing_amount", sa.Float(), server_default="0", nullable=False),
+        sa.Column("outgoing_price", sa.Float(), server_default="0", nullable=False),
+        sa.Column("end_amount", sa.Float(), nullable=False),
+        sa.Column("end_price", sa.Float(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+    )
+    op.create_index("ix_fifo_lots_id", "fifo_lots", ["id"])
+    op.create_index(
+        "ix_fifo_lots_open",
+        "fifo_lots",
+        ["organization_id", "nomenclature_id", "dated"],
+        postgresql_where=sa.text("end_amount > 0"),
+    )
+
+    op.create_table(
+        "fifo_ledger_documents",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column(
+            "organization_id",
+            sa.Integer(),
+            sa.ForeignKey("organizations.id"),
+            nullable=False,
+        ),
+        sa.Column("document_type", sa.String(), nullable=False),
+        sa.Column("document_id", sa.Integer(), nullable=False),
+        sa.Column("dated", sa.Integer(), nullable=True),
+        sa.Column("version", sa.DateTime(timezone=True), nullable=True),
+        sa.UniqueConstraint(
+            "document_type", "document_id", name="uq_fifo_ledger_documents_document"
+        ),
+    )
+    op.create_index("ix_fifo_ledger_documents_id", "fifo_ledger_documents", ["id"])
+    op.create_index(
+        "ix_fifo_ledger_documents_organization_id",
+        "fifo_ledger_documents",
+        ["organization_id"],
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "ix_fifo_ledger_documents_organization_id", table_name="fifo_ledger_documents"
+    )
+    op.drop_index("ix_fifo_ledger_documents_id", table_name="fifo_ledger_documents")
+    op.drop_table("fifo_ledger_documents")
+    op.drop_index("ix_fifo_lots_open", table_name="fifo_lots")
+    op.drop_index("ix_fifo_lots_id", table_name="fifo_lots")
+    op.drop_table("fifo_lots")
+    op.drop_column("fifo_settings", "ledger_dated")
+    op.drop_column("fifo_settings", "ledger_period_start")
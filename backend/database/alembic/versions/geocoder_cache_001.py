@@ -0,0 +1,37 @@
+"""geocoder cache
+Revision ID: geocoder_cache_001
+Revises: tg_accounts_phone_normalized_001
+Create Date: 2026-10-18 21:00:00.000000
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "geocoder_cache_001"
+down_revision = "tg_accounts_phone_normalized_001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Общий для воркеров кэш ответов геокодера"""
+    op.create_table(
+        "geocoder_cache",
+        sa.Column("namespace", sa.String(), nullable=False),
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("value", postgresql.JSONB(), nullable=False),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+        sa.PrimaryKeyConstraint("namespace", "key"),
+    )
+
+
+def downgrade():
+    op.drop_table("geocoder_cache")
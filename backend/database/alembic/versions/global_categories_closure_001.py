@@ -0,0 +1,103 @@
+"""global categories closure table and products rollup
+Revision ID: global_categories_closure_001
+Revises: autoburn_pending_001
+Create Date: 2026-10-18 19:00:00.000000
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "global_categories_closure_001"
+down_revision = "autoburn_pending_001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Замыкание дерева global_categories и свертка количества товаров с
+    ценой chatting по поддереву категории
+    """
+    op.create_table(
+        "global_categories_closure",
+        sa.Column("ancestor_id", sa.Integer(), nullable=False),
+        sa.Column("descendant_id", sa.Integer(), nullable=False),
+        sa.Column("depth", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["ancestor_id"], ["global_categories.id"], ondelete="CASCADE"
+        ),
+        sa.ForeignKeyConstraint(
+            ["descendant_id"], ["global_categories.id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("ancestor_id", "descendant_id"),
+    )
+    op.create_index(
+        "ix_global_categories_closure_descendant_id",
+        "global_categories_closure",
+        ["descendant_id"],
+    )
+    op.add_column(
+        "global_categories",
+        sa.Column("products_count", sa.Integer(), nullable=False, server_default="0"),
+    )
+
+    op.execute(
+        """
+        INSERT INTO global_categories_closure (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE tree (ancestor_id, descendant_id, depth, path) AS (
+            SELECT id, id, 0, ARRAY[id] FROM global_categories
+            UNION ALL
+            SELECT tree.ancestor_id, gc.id, tree.depth + 1, tree.path || gc.id
+            FROM tree
+            JOIN global_categories gc ON gc.parent_id = tree.descendant_id
+            WHERE NOT gc.id = ANY(tree.path)
+        )
+        SELECT ancestor_id, descendant_id, min(depth)
+        FROM tree
+        GROUP BY ancestor_id, descendant_id
+        """
+    )
+    op.execute(
+        """
+        UPDATE global_categories gc
+        SET products_count = rollup.products_count,
+            has_products = rollup.products_count > 0
+        FROM (
+            SELECT g.id, COALESCE(counts.products_count, 0) AS products_count
+            FROM global_categories g
+            LEFT JOIN (
+                SELECT pair.ancestor_id, count(DISTINCT n.id) AS products_count
+                FROM global_categories_closure pair
+                JOIN nomenclature n ON n.global_category_id = pair.descendant_id
+                JOIN prices p ON p.nomenclature = n.id
+                JOIN price_types pt ON pt.id = p.price_type
+                WHERE n.is_deleted IS NOT TRUE
+                  AND p.is_deleted IS NOT TRUE
+                  AND pt.name = 'chatting'
+                  AND NOT EXISTS (
+                      SELECT 1
+                      FROM global_categories_closure up
+                      JOIN global_categories_closure down
+                        ON down.ancestor_id = up.descendant_id
+                      JOIN global_categories m ON m.id = up.descendant_id
+                      WHERE up.ancestor_id = pair.ancestor_id
+                        AND up.depth > 0
+                        AND down.descendant_id = pair.descendant_id
+                        AND m.is_active IS NOT TRUE
+                  )
+                GROUP BY pair.ancestor_id
+            ) counts ON counts.ancestor_id = g.id
+        ) rollup
+        WHERE gc.id = rollup.id
+        """
+    )
+
+
+def downgrade():
+    op.drop_column("global_categories", "products_count")
+    op.drop_index(
+        "ix_global_categories_closure_descendant_id",
+        table_name="global_categories_closure",
+    )
+    op.drop_table("global_categories_closure")
@@ -0,0 +1,85 @@
+"""loyality cards precise income and outcome for delta balances
+Revision ID: loyality_balance_delta_001
+Revises: segment_objects_active_001
+Create Date: 2026-10-18 17:00:00.000000
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "loyality_balance_delta_001"
+down_revision = "segment_objects_active_001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Баланс карты ведется дельтами от income и outcome, поэтому суммы
+    хранятся без округления до целых
+    """
+    op.alter_column(
+        "loyality_cards",
+        "income",
+        type_=sa.Float(),
+        existing_type=sa.Integer(),
+        postgresql_using="income::double precision",
+    )
+    op.alter_column(
+        "loyality_cards",
+        "outcome",
+        type_=sa.Float(),
+        existing_type=sa.Integer(),
+        postgresql_using="outcome::double precision",
+    )
+    op.create_index(
+        "ix_loyality_transactions_updated_at", "loyality_transactions", ["updated_at"]
+    )
+
+    op.execute(
+        """
+        UPDATE loyality_cards
+        SET income = actual.income,
+            outcome = actual.outcome,
+            balance = ROUND(
+                CASE WHEN actual.income > actual.outcome
+                     THEN actual.income - actual.outcome ELSE 0 END::numeric,
+                2
+            )
+        FROM (
+            SELECT c.id,
+                   COALESCE(SUM(t.amount) FILTER (WHERE t.type = 'accrual'), 0)
+                       AS income,
+                   COALESCE(SUM(t.amount) FILTER (WHERE t.type = 'withdraw'), 0)
+                       AS outcome
+            FROM loyality_cards c
+            LEFT JOIN loyality_transactions t
+                ON t.loyality_card_id = c.id
+               AND t.status IS TRUE
+               AND t.is_deleted IS FALSE
+            GROUP BY c.id
+        ) actual
+        WHERE loyality_cards.id = actual.id
+        """
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "ix_loyality_transactions_updated_at", table_name="loyality_transactions"
+    )
+    op.alter_column(
+        "loyality_cards",
+        "outcome",
+        type_=sa.Integer(),
+        existing_type=sa.Float(),
+        postgresql_using="round(outcome)::integer",
+    )
+    op.alter_column(
+        "loyality_cards",
+        "income",
+        type_=sa.Integer(),
+        existing_type=sa.Float(),
+        postgresql_using="round(income)::integer",
+    )
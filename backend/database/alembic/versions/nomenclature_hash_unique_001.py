@@ -0,0 +1,39 @@
+"""nomenclature_hash unique nomenclature_id, hash
+Revision ID: nomenclature_hash_unique_001
+Revises: segments_actions_at_001
+Create Date: 2026-10-18 23:00:00.000000
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "nomenclature_hash_unique_001"
+down_revision = "segments_actions_at_001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Уникальность хеша номенклатуры; одинаковые дубли удаляются"""
+    op.execute(
+        """
+        DELETE FROM nomenclature_hash duplicate
+        USING nomenclature_hash original
+        WHERE duplicate.nomenclature_id = original.nomenclature_id
+          AND duplicate.hash = original.hash
+          AND duplicate.id > original.id
+        """
+    )
+    op.create_unique_constraint(
+        "uq_nomenclature_hash_nomenclature_id_hash",
+        "nomenclature_hash",
+        ["nomenclature_id", "hash"],
+    )
+
+
+def downgrade():
+    op.drop_constraint(
+        "uq_nomenclature_hash_nomenclature_id_hash",
+        "nomenclature_hash",
+        type_="unique",
+    )
@@ -0,0 +1,27 @@
+"""segment objects active membership index
+Revision ID: segment_objects_active_001
+Revises: chats_summary_001
+Create Date: 2026-10-18 16:00:00.000000
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "segment_objects_active_001"
+down_revision = "chats_summary_001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_svo_segment_active",
+        "segment_objects",
+        ["segment_id", "object_type", "object_id"],
+        postgresql_where=sa.text("valid_to IS NULL"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_svo_segment_active", table_name="segment_objects")
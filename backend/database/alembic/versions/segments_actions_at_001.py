@@ -0,0 +1,26 @@
+"""segments actions_at
+Revision ID: segments_actions_at_001
+Revises: geocoder_cache_001
+Create Date: 2026-10-18 22:00:00.000000
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "segments_actions_at_001"
+down_revision = "geocoder_cache_001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Метка инкрементального запуска actions отдельно от updated_at"""
+    op.add_column(
+        "segments",
+        sa.Column("actions_at", sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_column("segments", "actions_at")
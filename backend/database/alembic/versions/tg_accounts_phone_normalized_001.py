@@ -0,0 +1,49 @@
+"""tg accounts normalized phone
+Revision ID: tg_accounts_phone_normalized_001
+Revises: global_categories_closure_001
+Create Date: 2026-10-18 20:00:00.000000
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "tg_accounts_phone_normalized_001"
+down_revision = "global_categories_closure_001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Цифры телефона аккаунта для поиска по тегу USERPHONE_ карты лояльности"""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.add_column(
+        "tg_accounts",
+        sa.Column(
+            "phone_normalized",
+            sa.BigInteger(),
+            sa.Computed(
+                "CASE WHEN regexp_replace(phone_number, '\\D', '', 'g') ~ '^[0-9]{1,18}$' "
+                "THEN regexp_replace(phone_number, '\\D', '', 'g')::bigint END",
+                persisted=True,
+            ),
+        ),
+    )
+    op.create_index(
+        "ix_tg_accounts_phone_normalized", "tg_accounts", ["phone_normalized"]
+    )
+    op.execute(
+        "CREATE INDEX ix_tg_accounts_phone_suffix "
+        "ON tg_accounts ((phone_normalized % 10000000000))"
+    )
+    op.execute(
+        "CREATE INDEX ix_tg_accounts_phone_number_trgm "
+        "ON tg_accounts USING gin (phone_number gin_trgm_ops)"
+    )
+
+
+def downgrade():
+    op.drop_index("ix_tg_accounts_phone_number_trgm", table_name="tg_accounts")
+    op.drop_index("ix_tg_accounts_phone_suffix", table_name="tg_accounts")
+    op.drop_index("ix_tg_accounts_phone_normalized", table_name="tg_accounts")
+    op.drop_column("tg_accounts", "phone_normalized")
@@ -0,0 +1,97 @@
+"""create warehouse_stock_current projection
+Revision ID: warehouse_stock_current_001
+Revises: 76d4216e5d87
+Create Date: 2026-10-18 12:00:00.000000
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "warehouse_stock_current_001"
+down_revision = "76d4216e5d87"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Создает проекцию текущих остатков warehouse_stock_current и заполняет ее
+    последней записью warehouse_balances по (организация, склад, номенклатура).
+    Дальше таблица поддерживается functions.warehouse_stock.insert_warehouse_balances,
+    пересборка: python -m scripts.rebuild_warehouse_stock_current
+    """
+    op.create_table(
+        "warehouse_stock_current",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column(
+            "organization_id",
+            sa.Integer(),
+            sa.ForeignKey("organizations.id"),
+            nullable=True,
+        ),
+        sa.Column(
+            "warehouse_id", sa.Integer(), sa.ForeignKey("warehouses.id"), nullable=False
+        ),
+        sa.Column(
+            "nomenclature_id",
+            sa.Integer(),
+            sa.ForeignKey("nomenclature.id"),
+            nullable=False,
+        ),
+        sa.Column(
+            "cashbox_id", sa.Integer(), sa.ForeignKey("cashboxes.id"), nullable=True
+        ),
+        sa.Column("warehouse_balance_id", sa.Integer(), nullable=False),
+        sa.Column("incoming_amount", sa.Integer(), nullable=True),
+        sa.Column("outgoing_amount", sa.Integer(), nullable=True),
+        sa.Column("current_amount", sa.Integer(), nullable=False),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+    )
+    op.create_index("ix_warehouse_stock_current_id", "warehouse_stock_current", ["id"])
+    op.create_index(
+        "ix_warehouse_stock_current_nomenclature_id",
+        "warehouse_stock_current",
+        ["nomenclature_id"],
+    )
+    # NULL-организация (записи техкарт) сводится к 0, иначе ключ не уникален
+    op.execute(
+        """
+        CREATE UNIQUE INDEX uq_warehouse_stock_current_key
+        ON warehouse_stock_current (
+            COALESCE(organization_id, 0), warehouse_id, nomenclature_id
+        )
+        """
+    )
+
+    op.execute(
+        """
+        INSERT INTO warehouse_stock_current (
+            organization_id, warehouse_id, nomenclature_id, cashbox_id,
+            warehouse_balance_id, incoming_amount, outgoing_amount, current_amount
+        )
+        SELECT DISTINCT ON (COALESCE(organization_id, 0), warehouse_id, nomenclature_id)
+            organization_id, warehouse_id, nomenclature_id, cashbox_id,
+            id, incoming_amount, outgoing_amount, current_amount
+        FROM warehouse_balances
+        WHERE warehouse_id IS NOT NULL
+          AND nomenclature_id IS NOT NULL
+        ORDER BY COALESCE(organization_id, 0), warehouse_id, nomenclature_id,
+                 created_at DESC, id DESC
+        """
+    )
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS uq_warehouse_stock_current_key")
+    op.drop_index(
+        "ix_warehouse_stock_current_nomenclature_id",
+        table_name="warehouse_stock_current",
+    )
+    op.drop_index("ix_warehouse_stock_current_id", table_name="warehouse_stock_current")
+    op.drop_table("warehouse_stock_current")
@@ -13,6 +13,11 @@ from database.enums import (
     TriggerTime,
     TriggerType,
 )
+from database.pool import (
+    async_engine_options,
+    databases_options,
+    sync_engine_options,
+)
 from dotenv import load_dotenv
 from sqlalchemy import (
     ARRAY,
@@ -36,7 +41,6 @@ from sqlalchemy import (
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy.pool import NullPool
 from sqlalchemy.sql import func
 
 load_dotenv()
@@ -1139,6 +1143,17 @@ users = sqlalchemy.Table(
     sqlalchemy.Column("chat_id", String, unique=True),
     sqlalchemy.Column("owner_id", String),
     sqlalchemy.Column("phone_number", String),
+    # Цифры phone_number, как в clear_phone_number
+    sqlalchemy.Column(
+        "phone_normalized",
+        BigInteger,
+        sqlalchemy.Computed(
+            "CASE WHEN regexp_replace(phone_number, '\\D', '', 'g') ~ '^[0-9]{1,18}$' "
+            "THEN regexp_replace(phone_number, '\\D', '', 'g')::bigint END",
+            persisted=True,
+        ),
+        index=True,
+    ),
     sqlalchemy.Column("external_id", String),
     sqlalchemy.Column("photo", String),
     sqlalchemy.Column("first_name", String),
@@ -1147,8 +1162,25 @@ users = sqlalchemy.Table(
     sqlalchemy.Column("created_at", Integer),
     sqlalchemy.Column("updated_at", Integer),
     sqlalchemy.Column("ref_id", String),
+    sqlalchemy.Index(
+        "ix_tg_accounts_phone_number_trgm",
+        "phone_number",
+        postgresql_using="gin",
+        postgresql_ops={"phone_number": "gin_trgm_ops"},
+    ),
+)
+
+# Последние 10 цифр номера: 8XXXXXXXXXX и 7XXXXXXXXXX - один телефон
+PHONE_SUFFIX_MODULO = 10_000_000_000
+
+# Модуль встраивается в SQL литералом: с параметром ($1) выражение не
+# совпадает с выражением индекса ix_tg_accounts_phone_suffix
+users_phone_suffix = users.c.phone_normalized % sqlalchemy.literal_column(
+    str(PHONE_SUFFIX_MODULO)
 )
 
+Index("ix_tg_accounts_phone_suffix", users_phone_suffix)
+
 events = sqlalchemy.Table(
     "events",
     metadata,
@@ -1906,6 +1938,7 @@ distribution_docs_operations = sqlalchemy.Table(
     sqlalchemy.Column("document_sale", Integer, ForeignKey("docs_sales.id")),
     sqlalchemy.Column("document_purchase", Integer, ForeignKey("docs_purchases.id")),
     sqlalchemy.Column("document_warehouse", Integer, ForeignKey("docs_warehouse.id")),
+    sqlalchemy.Column("fifo_lot", Integer),
     sqlalchemy.Column("nomenclature", Integer, ForeignKey("nomenclature.id")),
     sqlalchemy.Column("dated", Integer, nullable=False),
     sqlalchemy.Column("start_amount", Integer, nullable=False),
@@ -1990,6 +2023,10 @@ fifo_settings = sqlalchemy.Table(
         unique=True,
     ),
     sqlalchemy.Column("in_progress", Boolean),
+    # Состояние журнала fifo_lots: начало периода, с которого он собран,
+    # и дата последнего учтенного документа
+    sqlalchemy.Column("ledger_period_start", Integer),
+    sqlalchemy.Column("ledger_dated", Integer),
     sqlalchemy.Column("created_at", DateTime(timezone=True), server_default=func.now()),
     sqlalchemy.Column(
         "updated_at",
@@ -1999,6 +2036,62 @@ fifo_settings = sqlalchemy.Table(
     ),
 )
 
+fifo_lots = sqlalchemy.Table(
+    "fifo_lots",
+    metadata,
+    sqlalchemy.Column("id", Integer, primary_key=True, index=True),
+    sqlalchemy.Column(
+        "organization_id", Integer, ForeignKey("organizations.id"), nullable=False
+    ),
+    sqlalchemy.Column(
+        "nomenclature_id", Integer, ForeignKey("nomenclature.id"), nullable=False
+    ),
+    sqlalchemy.Column("document_purchase", Integer, ForeignKey("docs_purchases.id")),
+    sqlalchemy.Column("document_warehouse", Integer, ForeignKey("docs_warehouse.id")),
+    sqlalchemy.Column("dated", Integer, nullable=False),
+    sqlalchemy.Column("goods_created", Integer, nullable=False),
+    sqlalchemy.Column("start_amount", Float, nullable=False),
+    sqlalchemy.Column("start_price", Float, nullable=False),
+    sqlalchemy.Column("outgoing_amount", Float, nullable=False, server_default="0"),
+    sqlalchemy.Column("outgoing_price", Float, nullable=False, server_default="0"),
+    sqlalchemy.Column("end_amount", Float, nullable=False),
+    sqlalchemy.Column("end_price", Float, nullable=False),
+    sqlalchemy.Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    sqlalchemy.Column(
+        "updated_at",
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+    ),
+    Index(
+        "ix_fifo_lots_open",
+        "organization_id",
+        "nomenclature_id",
+        "dated",
+        postgresql_where=text("end_amount > 0"),
+    ),
+)
+
+fifo_ledger_documents = sqlalchemy.Table(
+    "fifo_ledger_documents",
+    metadata,
+    sqlalchemy.Column("id", Integer, primary_key=True, index=True),
+    sqlalchemy.Column(
+        "organization_id",
+        Integer,
+        ForeignKey("organizations.id"),
+        nullable=False,
+        index=True,
+    ),
+    sqlalchemy.Column("document_type", String, nullable=False),
+    sqlalchemy.Column("document_id", Integer, nullable=False),
+    sqlalchemy.Column("dated", Integer),
+    sqlalchemy.Column("version", DateTime(timezone=True)),
+    UniqueConstraint(
+        "document_type", "document_id", name="uq_fifo_ledger_documents_document"
+    ),
+)
+
 warehouse_balances = sqlalchemy.Table(
     "warehouse_balances",
     metadata,
@@ -2024,6 +2117,45 @@ warehouse_balances = sqlalchemy.Table(
     ),
 )
 
+# Проекция последней записи warehouse_balances по (организация, склад, номенклатура).
+# Обновляется в той же транзакции, что и вставка в историю
+# (functions.warehouse_stock.insert_warehouse_balances)
+warehouse_stock_current = sqlalchemy.Table(
+    "warehouse_stock_current",
+    metadata,
+    sqlalchemy.Column("id", Integer, primary_key=True, index=True),
+    sqlalchemy.Column("organization_id", Integer, ForeignKey("organizations.id")),
+    sqlalchemy.Column(
+        "warehouse_id", Integer, ForeignKey("warehouses.id"), nullable=False
+    ),
+    sqlalchemy.Column(
+        "nomenclature_id",
+        Integer,
+        ForeignKey("nomenclature.id"),
+        nullable=False,
+        index=True,
+    ),
+    sqlalchemy.Column("cashbox_id", Integer, ForeignKey("cashboxes.id")),
+    sqlalchemy.Column("warehouse_balance_id", Integer, nullable=False),
+    sqlalchemy.Column("incoming_amount", Integer),
+    sqlalchemy.Column("outgoing_amount", Integer),
+    sqlalchemy.Column("current_amount", Integer, nullable=False),
+    sqlalchemy.Column(
+        "updated_at",
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+    ),
+)
+
+Index(
+    "uq_warehouse_stock_current_key",
+    func.coalesce(warehouse_stock_current.c.organization_id, 0),
+    warehouse_stock_current.c.warehouse_id,
+    warehouse_stock_current.c.nomenclature_id,
+    unique=True,
+)
+
 messages = sqlalchemy.Table(
     "messages",
     metadata,
@@ -2043,8 +2175,8 @@ loyality_cards = sqlalchemy.Table(
     sqlalchemy.Column("card_number", BigInteger),
     sqlalchemy.Column("tags", String),
     sqlalchemy.Column("balance", Float),
-    sqlalchemy.Column("income", Integer),
-    sqlalchemy.Column("outcome", Integer),
+    sqlalchemy.Column("income", Float),
+    sqlalchemy.Column("outcome", Float),
     sqlalchemy.Column("cashback_percent", Integer),
     sqlalchemy.Column("minimal_checque_amount", Integer),
     sqlalchemy.Column("start_period", DateTime),
@@ -2103,6 +2235,13 @@ loyality_transactions = sqlalchemy.Table(
         server_default=func.now(),
         onupdate=func.now(),
     ),
+    sqlalchemy.Index("ix_loyality_transactions_updated_at", "updated_at"),
+    sqlalchemy.Index(
+        "ix_loyality_transactions_autoburn_pending",
+        "loyality_card_id",
+        "created_at",
+        postgresql_where=text("type = 'accrual' AND amount > 0 AND autoburned = false"),
+    ),
 )
 
 loyality_settings = sqlalchemy.Table(
@@ -2158,6 +2297,28 @@ doc_templates = sqlalchemy.Table(
     sqlalchemy.Column("type", Integer, ForeignKey("type_template.id"), nullable=True),
 )
 
+# Прогресс пакетной перегенерации документов: пакет выполняется одним
+# воркером API, а опрашивать его можно через любой
+doc_regenerate_jobs = sqlalchemy.Table(
+    "doc_regenerate_jobs",
+    metadata,
+    sqlalchemy.Column("id", String, primary_key=True),
+    sqlalchemy.Column("cashbox_id", Integer, ForeignKey("cashboxes.id"), index=True),
+    sqlalchemy.Column("status", String, nullable=False),
+    sqlalchemy.Column("total", Integer, nullable=False),
+    sqlalchemy.Column("done", Integer, nullable=False, server_default="0"),
+    sqlalchemy.Column("failed", Integer, nullable=False, server_default="0"),
+    sqlalchemy.Column("results", JSON, nullable=False),
+    sqlalchemy.Column("errors", JSON, nullable=False),
+    sqlalchemy.Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    sqlalchemy.Column(
+        "updated_at",
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+    ),
+)
+
 tag_templates = sqlalchemy.Table(
     "tag_template",
     metadata,
@@ -2635,6 +2796,9 @@ segments = sqlalchemy.Table(
     sqlalchemy.Column("type_of_update", String, nullable=False),
     sqlalchemy.Column("update_settings", JSON, nullable=True),
     sqlalchemy.Column("previous_update_at", DateTime(timezone=True)),
+    # Время последнего инкрементального запуска actions по событиям.
+    # updated_at остается меткой полного пересчета для планировщика
+    sqlalchemy.Column("actions_at", DateTime(timezone=True)),
     sqlalchemy.Column(
         "status",
         Enum(SegmentStatus),
@@ -2688,6 +2852,14 @@ Index(
 Index(
     "ix_svo_segment_valid_to", segment_objects.c.segment_id, segment_objects.c.valid_to
 )
+# Активный состав сегмента для сверки при пересчете
+Index(
+    "ix_svo_segment_active",
+    segment_objects.c.segment_id,
+    segment_objects.c.object_type,
+    segment_objects.c.object_id,
+    postgresql_where=segment_objects.c.valid_to.is_(None),
+)
 
 user_permissions = sqlalchemy.Table(
     "user_permissions",
@@ -2861,17 +3033,12 @@ amo_webhooks = sqlalchemy.Table(
 SQLALCHEMY_DATABASE_URL = f"postgresql://{os.environ.get('POSTGRES_USER')}:{os.environ.get('POSTGRES_PASS')}@{os.environ.get('POSTGRES_HOST')}:{os.environ.get('POSTGRES_PORT')}/cash_2"
 SQLALCHEMY_DATABASE_URL_ASYNC = f"postgresql+asyncpg://{os.environ.get('POSTGRES_USER')}:{os.environ.get('POSTGRES_PASS')}@{os.environ.get('POSTGRES_HOST')}:{os.environ.get('POSTGRES_PORT')}/cash_2"
 SQLALCHEMY_DATABASE_URL_JOB_STORE = f"postgresql://{os.environ.get('POSTGRES_USER')}:{os.environ.get('POSTGRES_PASS')}@{os.environ.get('POSTGRES_HOST')}:{os.environ.get('POSTGRES_PORT')}/cash_job_store"
-database = databases.Database(
-    SQLALCHEMY_DATABASE_URL,
-    # min_size=1,
-    # max_size=10,
-    # statement_cache_size=0
-)
-engine = sqlalchemy.create_engine(SQLALCHEMY_DATABASE_URL)
+database = databases.Database(SQLALCHEMY_DATABASE_URL, **databases_options())
+engine = sqlalchemy.create_engine(SQLALCHEMY_DATABASE_URL, **sync_engine_options())
 engine_job_store = sqlalchemy.create_engine(SQLALCHEMY_DATABASE_URL_JOB_STORE)
 
 async_engine = create_async_engine(
-    SQLALCHEMY_DATABASE_URL_ASYNC, pool_pre_ping=True, poolclass=NullPool
+    SQLALCHEMY_DATABASE_URL_ASYNC, **async_engine_options()
 )
 async_session_maker = sessionmaker(
     async_engine, class_=AsyncSession, expire_on_commit=False
@@ -2980,6 +3147,11 @@ nomenclature_hash = sqlalchemy.Table(
         default=datetime.datetime.now,
         onupdate=datetime.datetime.now,
     ),
+    # Повторная генерация того же хеша (параллельные запросы страницы)
+    # пропускается через ON CONFLICT DO NOTHING
+    sqlalchemy.UniqueConstraint(
+        "nomenclature_id", "hash", name="uq_nomenclature_hash_nomenclature_id_hash"
+    ),
 )
 
 warehouse_hash = sqlalchemy.Table(
@@ -3279,6 +3451,7 @@ global_categories = sqlalchemy.Table(
     sqlalchemy.Column("image_url", String),
     sqlalchemy.Column("is_active", Boolean, default=True),
     sqlalchemy.Column("has_products", Boolean, nullable=True, server_default="false"),
+    sqlalchemy.Column("products_count", Integer, nullable=False, server_default="0"),
     sqlalchemy.Column("created_at", DateTime(timezone=True), server_default=func.now()),
     sqlalchemy.Column(
         "updated_at",
@@ -3288,6 +3461,27 @@ global_categories = sqlalchemy.Table(
     ),
 )
 
+# Замыкание дерева global_categories: пара предок-потомок на каждый
+# путь, включая саму категорию с depth = 0
+global_categories_closure = sqlalchemy.Table(
+    "global_categories_closure",
+    metadata,
+    sqlalchemy.Column(
+        "ancestor_id",
+        Integer,
+        ForeignKey("global_categories.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    sqlalchemy.Column(
+        "descendant_id",
+        Integer,
+        ForeignKey("global_categories.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    sqlalchemy.Column("depth", Integer, nullable=False),
+    sqlalchemy.Index("ix_global_categories_closure_descendant_id", "descendant_id"),
+)
+
 channels = sqlalchemy.Table(
     "channels",
     metadata,
@@ -3383,6 +3577,11 @@ chats = sqlalchemy.Table(
     sqlalchemy.Column("last_response_time_seconds", Integer, nullable=True),
     sqlalchemy.Column("metadata", JSON, nullable=True),
     sqlalchemy.Column("name", String(100), nullable=True),
+    # Денормализованные поля для списка чатов, ведутся в api/chats/crud.py
+    sqlalchemy.Column("unread_count", Integer, nullable=False, server_default="0"),
+    sqlalchemy.Column("last_message_id", Integer, nullable=True),
+    sqlalchemy.Column("last_message_preview", String(100), nullable=True),
+    sqlalchemy.Column("last_message_file_url", String, nullable=True),
     sqlalchemy.Column(
         "created_at", DateTime, nullable=False, server_default=func.now()
     ),
@@ -3395,6 +3594,8 @@ chats = sqlalchemy.Table(
         "cashbox_id",
         name="uq_chats_channel_external_cashbox",
     ),
+    Index("ix_chats_cashbox_last_message_time", "cashbox_id", "last_message_time"),
+    Index("ix_chats_last_message_id", "last_message_id"),
 )
 
 chat_messages = sqlalchemy.Table(
@@ -3425,6 +3626,12 @@ chat_messages = sqlalchemy.Table(
     sqlalchemy.Column(
         "updated_at", DateTime, nullable=False, server_default=func.now()
     ),
+    Index("ix_chat_messages_chat_created", "chat_id", "created_at"),
+    Index(
+        "ix_chat_messages_unread",
+        "chat_id",
+        postgresql_where=text("sender_type = 'CLIENT' AND status <> 'READ'"),
+    ),
 )
 
 channel_credentials = sqlalchemy.Table(
@@ -3550,3 +3757,14 @@ marketplace_view_events = sqlalchemy.Table(
     sqlalchemy.Column("event", String, nullable=False, server_default="view"),
     sqlalchemy.Column("created_at", DateTime(timezone=True), server_default=func.now()),
 )
+
+# Общий для воркеров кэш ответов геокодера (common/geocoders/utils.py)
+geocoder_cache = sqlalchemy.Table(
+    "geocoder_cache",
+    metadata,
+    sqlalchemy.Column("namespace", String, primary_key=True),
+    sqlalchemy.Column("key", String, primary_key=True),
+    sqlalchemy.Column("value", JSONB, nullable=False),
+    sqlalchemy.Column("expires_at", DateTime(timezone=True), nullable=False),
+    sqlalchemy.Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
@@ -1,8 +1,10 @@
 import json
 
+from api.marketplace.service.public_categories.closure import REBUILD_CLOSURE_SQL
 from database.db import (
     entity_or_function,
     global_categories,
+    global_categories_closure,
     payments,
     units,
 )
@@ -18,6 +20,11 @@ def prepopulate_global_categories(target, connection, **kwargs):
         connection.execute(target.insert(), *values)
 
 
+def build_global_categories_closure(target, connection, **kwargs):
+    print("Building global_categories_closure...")
+    connection.execute(text(REBUILD_CLOSURE_SQL))
+
+
 def prepopulate_units(target, connection, **kwargs):
     print("Populating units...")
     with open("database/initial_data/units.json", "r", encoding="UTF-8") as file:
@@ -43,3 +50,6 @@ def init_db():
     event.listen(entity_or_function, "after_create", prepopulate_functions)
     event.listen(payments, "after_create", create_raschet_func)
     event.listen(global_categories, "after_create", prepopulate_global_categories)
+    event.listen(
+        global_categories_closure, "after_create", build_global_categories_closure
+    )
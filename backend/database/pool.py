@@ -0,0 +1,100 @@
+"""
+Общие настройки пула соединений с PostgreSQL.
+
+Одни и те же параметры получают клиент databases, синхронный и асинхронный
+движки SQLAlchemy, поэтому API, джобы и консьюмеры настраиваются одинаково:
+
+    DB_POOL_MIN_SIZE               минимум соединений (databases/asyncpg)
+    DB_POOL_MAX_SIZE               максимум соединений в каждом пуле
+    DB_POOL_MAX_OVERFLOW           сверх max_size для движков SQLAlchemy
+    DB_POOL_ACQUIRE_TIMEOUT        ожидание свободного соединения, сек
+    DB_POOL_RECYCLE                пересоздание соединения, сек
+    DB_POOL_MAX_INACTIVE_LIFETIME  закрытие простаивающего соединения, сек
+    DB_STATEMENT_CACHE_SIZE        кеш подготовленных выражений asyncpg
+    DB_PGBOUNCER                   режим pgbouncer (transaction pooling):
+                                   кеш подготовленных выражений отключается
+"""
+
+import os
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", 5))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", 300))
+DB_PGBOUNCER = _env_bool("DB_PGBOUNCER")
+DB_STATEMENT_CACHE_SIZE = (
+    0 if DB_PGBOUNCER else int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+)
+
+
+def databases_options() -> dict:
+    """Параметры asyncpg.create_pool для databases.Database"""
+    return {
+        "min_size": DB_POOL_MIN_SIZE,
+        "max_size": DB_POOL_MAX_SIZE,
+        "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        "max_inactive_connection_lifetime": DB_POOL_MAX_INACTIVE_LIFETIME,
+        # Таймаут установки соединения: databases не передает таймаут
+        # в pool.acquire
+        "timeout": DB_POOL_ACQUIRE_TIMEOUT,
+    }
+
+
+def sync_engine_options() -> dict:
+    return {
+        "pool_size": DB_POOL_MAX_SIZE,
+        "max_overflow": DB_POOL_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_ACQUIRE_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def async_engine_options() -> dict:
+    return {
+        **sync_engine_options(),
+        "connect_args": {
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        },
+    }
+
+
+def _sqlalchemy_pool_stats(engine) -> dict:
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {}
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_size": pool.size() + DB_POOL_MAX_OVERFLOW,
+    }
+
+
+def pool_stats() -> dict:
+    """Заполненность пулов соединений текущего процесса"""
+    from database.db import async_engine, database, engine
+
+    stats = {}
+    raw_pool = getattr(database._backend, "_pool", None)
+    if raw_pool is not None:
+        size = raw_pool.get_size()
+        idle = raw_pool.get_idle_size()
+        stats["databases"] = {
+            "size": size,
+            "checked_out": size - idle,
+            "idle": idle,
+            "max_size": raw_pool.get_max_size(),
+        }
+    stats["engine"] = _sqlalchemy_pool_stats(engine)
+    stats["async_engine"] = _sqlalchemy_pool_stats(async_engine.sync_engine)
+    return stats
@@ -17,6 +17,12 @@ case "$CMD" in
         log "Running Alembic migrations..."
         alembic upgrade head
 
+        GEOIP_CITY_DB=${GEOIP_CITY_DB:-/usr/share/GeoIP/GeoLite2-City.mmdb}
+        if [ ! -f "$GEOIP_CITY_DB" ]; then
+            log "GeoLite2-City database not found, downloading..."
+            python -m scripts.download_geoip || log "GeoLite2-City download failed, IP lookups will use the remote geocoder"
+        fi
+
         CMD_LINE="uvicorn main:app --host 0.0.0.0 --port 8000"
         CMD_LINE="$CMD_LINE --log-level ${LOG_LEVEL}"
 
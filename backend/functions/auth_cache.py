@@ -0,0 +1,170 @@
+"""
+Кеш разрешения токена в запись users_cboxes_relation.
+
+Почти каждый запрос начинается с поиска пользователя кассы по токену,
+а middleware записи событий ищет его повторно. Кеш живет в памяти процесса:
+положительные записи хранятся AUTH_CACHE_TTL секунд, отсутствующие токены -
+AUTH_CACHE_NEGATIVE_TTL. При изменении статуса или токена пользователя кассы
+нужно вызывать invalidate_token_cache: сброс рассылается всем процессам
+через шину ws_manager (fanout-обменник RabbitMQ), в том числе из бота.
+Если RabbitMQ недоступен, другие воркеры увидят изменение не позже чем
+через AUTH_CACHE_TTL.
+
+В пределах HTTP-запроса разрешенные пользователи запоминаются в
+request_users (открывается middleware записи событий), и middleware
+берет пользователя оттуда, не обращаясь к кешу повторно
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from database.db import database, users_cboxes_relation
+from databases.backends.postgres import Record
+from ws_manager import bus
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 60))
+AUTH_CACHE_NEGATIVE_TTL = float(os.getenv("AUTH_CACHE_NEGATIVE_TTL", 5))
+AUTH_CACHE_MAXSIZE = int(os.getenv("AUTH_CACHE_MAXSIZE", 10000))
+
+# Токен -> пользователь, разрешенные в текущем запросе. Словарь создается
+# до вызова обработчика, поэтому его изменения видны middleware и после
+# выполнения обработчика в дочерней задаче
+request_users: ContextVar[Optional[Dict[str, Optional[Record]]]] = ContextVar(
+    "request_users", default=None
+)
+
+
+class TokenCache:
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float):
+        self.cache: "OrderedDict[str, Tuple[float, Optional[Record]]]" = OrderedDict()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # Параллельные запросы с одним токеном ждут один запрос в БД
+        self.pending: Dict[str, asyncio.Future] = {}
+
+    def get(self, token: str) -> Tuple[bool, Optional[Record]]:
+        entry = self.cache.get(token)
+        if entry is None:
+            return False, None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            del self.cache[token]
+            return False, None
+        self.cache.move_to_end(token)
+        return True, user
+
+    def set(self, token: str, user: Optional[Record]) -> None:
+        ttl = self.ttl if user is not None else self.negative_ttl
+        self.cache[token] = (time.monotonic() + ttl, user)
+        self.cache.move_to_end(token)
+        while len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+
+    async def resolve(self, token: str) -> Optional[Record]:
+        found, user = self.get(token)
+        if found:
+            return user
+
+        future = self.pending.get(token)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[token] = future
+        try:
+            query = users_cboxes_relation.select().where(
+                users_cboxes_relation.c.token == token
+            )
+            user = await database.fetch_one(query)
+            self.set(token, user)
+            future.set_result(user)
+            return user
+        except BaseException as e:
+            future.set_exception(e)
+            # Исключение уже передано текущему вызывающему
+            future.exception()
+            raise
+        finally:
+            self.pending.pop(token, None)
+
+    def invalidate(
+        self,
+        token: Optional[str] = None,
+        cashbox_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+    ) -> None:
+        if token is None and cashbox_id is None and user_id is None:
+            self.cache.clear()
+            return
+        if token is not None:
+            self.cache.pop(token, None)
+        if cashbox_id is None and user_id is None:
+            return
+        for cached_token, (_, user) in list(self.cache.items()):
+            if user is None:
+                continue
+            if cashbox_id is not None and user.cashbox_id != cashbox_id:
+                continue
+            if user_id is not None and user.user != user_id:
+                continue
+            self.cache.pop(cached_token, None)
+
+
+token_cache = TokenCache(
+    maxsize=AUTH_CACHE_MAXSIZE,
+    ttl=AUTH_CACHE_TTL,
+    negative_ttl=AUTH_CACHE_NEGATIVE_TTL,
+)
+
+
+async def resolve_token(token: Optional[str]) -> Optional[Record]:
+    """Запись users_cboxes_relation по токену или None"""
+    if not token:
+        return None
+    user = await token_cache.resolve(token)
+    resolved = request_users.get()
+    if resolved is not None:
+        resolved[token] = user
+    return user
+
+
+def request_user(token: Optional[str]) -> Tuple[bool, Optional[Record]]:
+    """Пользователь, уже разрешенный по токену в текущем запросе"""
+    resolved = request_users.get()
+    if not token or resolved is None or token not in resolved:
+        return False, None
+    return True, resolved[token]
+
+
+async def invalidate_token_cache(
+    token: Optional[str] = None,
+    cashbox_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+) -> None:
+    """
+    Сбрасывает кеш для токена и/или пользователя кассы во всех процессах.
+    Без аргументов очищает кеш целиком
+    """
+    # Свой кеш сбрасываем сразу, не дожидаясь сообщения из обменника
+    token_cache.invalidate(token=token, cashbox_id=cashbox_id, user_id=user_id)
+    await bus.publish(
+        "auth_cache",
+        None,
+        {"token": token, "cashbox_id": cashbox_id, "user_id": user_id},
+    )
+
+
+async def _on_invalidate(key, message: dict):
+    token_cache.invalidate(
+        token=message.get("token"),
+        cashbox_id=message.get("cashbox_id"),
+        user_id=message.get("user_id"),
+    )
+
+
+bus.register("auth_cache", _on_invalidate)
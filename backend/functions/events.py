@@ -1,7 +1,30 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Optional
+
 from database.db import database, events
+from functions.auth_cache import resolve_token
 from sqlalchemy import desc, func, select
 from ws_manager import manager
 
+logger = logging.getLogger(__name__)
+
+# Очередь событий аудита: запрос только кладет событие в очередь,
+# фоновая задача пишет их в events пачками
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", 10000))
+EVENTS_BATCH_SIZE = int(os.getenv("EVENTS_BATCH_SIZE", 500))
+EVENTS_FLUSH_INTERVAL_MS = int(os.getenv("EVENTS_FLUSH_INTERVAL_MS", 1000))
+# Тело запроса больше этого размера не читается ради журнала
+EVENTS_MAX_BODY_BYTES = int(os.getenv("EVENTS_MAX_BODY_BYTES", 64 * 1024))
+# Пути (подстроки), запросы к которым не пишутся в журнал, через запятую
+EVENTS_SKIP_PATHS = [
+    path.strip()
+    for path in os.getenv("EVENTS_SKIP_PATHS", "openapi.json").split(",")
+    if path.strip()
+]
+
 
 async def get_events(token: str, limit: int, offset: int):
     query_result = (
@@ -24,6 +47,149 @@ async def write_event(**event):
     if event["token"]:
         await manager.send_message(
             event["token"],
-            {"action": "create", "target": "events", "result": {**events}},
+            {"action": "create", "target": "events", "result": {**event}},
         )
     return event_id
+
+
+def skip_event_log(endpoint):
+    """Декоратор эндпоинта: запросы к нему не пишутся в журнал событий"""
+    endpoint.skip_event_log = True
+    return endpoint
+
+
+class EventWriter:
+    def __init__(
+        self,
+        queue_size: int = EVENTS_QUEUE_SIZE,
+        batch_size: int = EVENTS_BATCH_SIZE,
+        flush_interval_ms: int = EVENTS_FLUSH_INTERVAL_MS,
+    ):
+        self.queue: Optional[asyncio.Queue] = None
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        if self.task is None:
+            self.queue = asyncio.Queue(maxsize=self.queue_size)
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновую задачу и дописывает остаток очереди"""
+        if self.task is None:
+            return
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+        while not self.queue.empty():
+            await self._flush([e for e in self._drain() if e is not None])
+
+    def put(self, **event) -> bool:
+        """
+        Ставит событие в очередь без ожидания. При переполненной очереди
+        событие отбрасывается, запрос не ждет записи журнала
+        """
+        if self.queue is None:
+            self.dropped += 1
+            return False
+        # Время запроса, а не записи пачки
+        event.setdefault("created_at", datetime.now(timezone.utc))
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Events queue is full, dropped: {self.dropped}")
+            return False
+        self.enqueued += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+    def _drain(self) -> list:
+        batch = []
+        while len(batch) < self.batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            event = await self.queue.get()
+            if event is None:
+                return
+            batch = [event]
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if event is None:
+                    stopping = True
+                    break
+                batch.append(event)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: list):
+        if not batch:
+            return
+        try:
+            for event in batch:
+                # Пользователь разрешается здесь, а не в запросе; токены кешируются
+                if "user_id" not in event:
+                    user = await resolve_token(event.get("token"))
+                    event["user_id"] = user.user if user else None
+                    event["cashbox_id"] = user.cashbox_id if user else None
+
+            # Многострочный INSERT требует одинаковый набор колонок во всех строках
+            columns = set().union(*batch)
+            values = [
+                {column: event.get(column) for column in columns} for event in batch
+            ]
+            await database.execute(events.insert().values(values))
+            self.written += len(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception(f"Failed to write {len(batch)} events")
+            return
+
+        for event in batch:
+            if not event.get("token"):
+                continue
+            try:
+                await manager.send_message(
+                    event["token"],
+                    {
+                        "action": "create",
+                        "target": "events",
+                        "result": {
+                            **event,
+                            "created_at": int(event["created_at"].timestamp()),
+                        },
+                    },
+                )
+            except Exception:
+                pass
+
+
+event_writer = EventWriter()
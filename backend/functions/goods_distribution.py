@@ -1 +1 @@
-import jsonfrom datetime import datetime, timedeltafrom os import environimport aio_pikafrom const import SaleOperations, WarehouseOperations, report_queue_namefrom database.db import (    database,    distribution_docs,    distribution_docs_operations,    docs_purchases,    docs_purchases_goods,    docs_sales,    docs_sales_goods,    docs_warehouse,    docs_warehouse_goods,    fifo_settings,    organizations,)async def distribute(    organization_id: int,    period_start: int = 0,    period_end: int = None,    mode: str = "closing",):    if await is_organization_in_progress(organization_id):        return    query = organizations.select().where(organizations.c.id == organization_id)    organization = await database.fetch_one(query)    if not organization:        raise Exception(f"No such organization: {organization_id}")    await set_organization_in_progress(organization_id)    try:        query = docs_sales.select().where(            docs_sales.c.organization == organization_id,            docs_sales.c.operation != SaleOperations.order,            docs_sales.c.dated > period_start,            docs_sales.c.dated < period_end if period_end else True,        )        sale_docs = await database.fetch_all(query)        query = docs_purchases.select().where(            docs_purchases.c.organization == organization_id,            docs_purchases.c.dated > period_start,            docs_purchases.c.dated < period_end if period_end else True,        )        purchase_docs = await database.fetch_all(query)        query = docs_warehouse.select().where(            docs_warehouse.c.organization == organization_id,            docs_warehouse.c.dated > period_start,            docs_warehouse.c.dated < period_end if period_end else True,            docs_warehouse.c.operation.in_(                (                    WarehouseOperations.movement_in,                    WarehouseOperations.surplus_posting,                )            ),        )        warehouse_docs_added = await database.fetch_all(query)        query = docs_warehouse.select().where(            docs_warehouse.c.organization == organization_id,            docs_warehouse.c.dated > period_start,            docs_warehouse.c.dated < period_end if period_end else True,            docs_warehouse.c.operation.in_(                (                    WarehouseOperations.movement_out,                    WarehouseOperations.internal_consumption,                    WarehouseOperations.write_off,                )            ),        )        warehouse_docs_left = await database.fetch_all(query)        sale_docs_ids = [doc.id for doc in sale_docs]        purchase_docs_ids = [doc.id for doc in purchase_docs]        warehouse_docs_added_ids = [doc.id for doc in warehouse_docs_added]        warehouse_docs_left_ids = [doc.id for doc in warehouse_docs_left]        query = docs_sales_goods.select().where(            docs_sales_goods.c.docs_sales_id.in_(sale_docs_ids)        )        sold_items = await database.fetch_all(query)        query = docs_purchases_goods.select().where(            docs_purchases_goods.c.docs_purchases_id.in_(purchase_docs_ids)        )        purchased_items = await database.fetch_all(query)        query = docs_warehouse_goods.select().where(            docs_warehouse_goods.c.docs_warehouse_id.in_(warehouse_docs_left_ids),        )        warehouse_left_items = await database.fetch_all(query)        query = docs_warehouse_goods.select().where(            docs_warehouse_goods.c.docs_warehouse_id.in_(warehouse_docs_added_ids),        )        warehouse_added_items = await database.fetch_all(query)        distribution_doc = {            "organization": organization_id,            "period_start": period_start,            "period_end": period_end or datetime.utcnow().timestamp(),        }        query = distribution_docs.insert().values(distribution_doc)        distribution_doc_id = await database.execute(query)        table: list[dict] = []        for item in purchased_items + warehouse_added_items:            result = {                "distribution_fifo": distribution_doc_id,                "nomenclature": item.nomenclature,                "dated": item.created_at.timestamp(),                "start_amount": item.quantity,                "start_price": item.price,                "outgoing_amount": 0,                "outgoing_price": 0,                "end_amount": item.quantity,                "end_price": item.price,            }            if hasattr(item, "docs_purchases_id"):                result["document_purchase"] = item.docs_purchases_id            elif hasattr(item, "docs_warehouse_id"):                result["document_warehouse"] = item.docs_warehouse_id            else:                raise Exception("No docs_purchases_id or docs_warehouse_id attribute")            table.append(result)        table.sort(key=lambda x: x["dated"])        added_items = {}        for item in table:            if added_items.get(item["nomenclature"]):                added_items[item["nomenclature"]].append(item)            else:                added_items[item["nomenclature"]] = [item]        for item in sold_items + warehouse_left_items:            nomenclature_items = added_items.get(item.nomenclature)            if not nomenclature_items:                continue            item_amount = item.quantity            for record in nomenclature_items:                if record["end_amount"] == 0:                    continue                elif item_amount > record["end_amount"]:                    difference_amount = item_amount - record["end_amount"]                    part_price = item.price / item.quantity * difference_amount                    item_amount -= difference_amount                    record["end_amount"] = 0                    record["end_price"] -= part_price                    record["outgoing_amount"] += difference_amount                    record["outgoing_price"] += part_price                else:                    part_price = item.price / item.quantity * item_amount                    record["end_amount"] -= item_amount                    record["end_price"] -= part_price                    record["outgoing_amount"] += item_amount                    record["outgoing_price"] += part_price                    break            result = {                "distribution_fifo": distribution_doc_id,                "nomenclature": item.nomenclature,                "dated": item.created_at.timestamp(),                "start_amount": item.quantity,                "start_price": item.price,                "end_amount": item.quantity,                "end_price": item.price,            }            if hasattr(item, "docs_sales_id"):                result["document_sale"] = item.docs_sales_id            elif hasattr(item, "docs_warehouse_id"):                result["document_warehouse"] = item.docs_warehouse_id            else:                raise Exception("No docs_sales_id or docs_warehouse_id attribute")            table.append(result)        query = distribution_docs_operations.insert()        await database.execute_many(query, table)        if mode == "preview":            if distribution_doc_id is None:                return            query = (                fifo_settings.update()                .where(fifo_settings.c.organization_id == organization_id)                .values({"temporary_closed_date": period_end})            )            await database.execute(query)            query = distribution_docs.delete().where(                distribution_docs.c.is_preview == True,                distribution_docs.c.organization == organization_id,                distribution_docs.c.id != distribution_doc_id,            )            await database.execute(query)            query = (                distribution_docs.update()                .where(distribution_docs.c.id == distribution_doc_id)                .values({"is_preview": True})            )            await database.execute(query)        elif mode == "closing":            query = (                fifo_settings.update()                .where(fifo_settings.c.organization_id == organization_id)                .values(                    {                        "fully_closed_date": period_end,                        "blocked_date": period_end,                    }                )            )            await database.execute(query)    finally:        await set_organization_in_progress(organization_id, False)async def process_distribution():    query = fifo_settings.select()    settings = await database.fetch_all(query)    for setting in settings:        first_day = datetime(datetime.utcnow().year, datetime.utcnow().month, 1)        if setting.month_closing_delay_days:            first_day += timedelta(days=setting.month_closing_delay_days)        if setting.fully_closed_date < first_day.timestamp():            first_day_timestamp = int(first_day.timestamp())            await produce_distribution(                organization_id=setting.organization_id,                period_start=setting.fully_closed_date,                period_end=int(first_day_timestamp),            )            continue        previous_close_time = (            int(datetime.utcnow().timestamp()) - setting.preview_close_period_seconds        )        if (            not setting.temporary_closed_date            or setting.temporary_closed_date <= previous_close_time        ):            now_timestamp = int(datetime.utcnow().timestamp())            await produce_distribution(                organization_id=setting.organization_id,                period_start=setting.fully_closed_date,                period_end=now_timestamp,            )async def is_organization_in_progress(org_id: int):    query = fifo_settings.select().where(        fifo_settings.c.organization_id == org_id,        fifo_settings.c.in_progress == True,    )    if await database.fetch_one(query):        return True    else:        return Falseasync def set_organization_in_progress(org_id: int, status: bool = True):    query = (        fifo_settings.update()        .where(fifo_settings.c.organization_id == org_id)        .values({"in_progress": status})    )    await database.execute(query)async def produce_distribution(**body) -> None:    connection = await aio_pika.connect_robust(        host=environ.get("RABBITMQ_HOST"), port=int(environ.get("RABBITMQ_PORT"))    )    async with connection:        routing_key = report_queue_name        channel = await connection.channel()        body["func_name"] = distribute.__name__        message = aio_pika.Message(body=json.dumps(body).encode())        await channel.default_exchange.publish(message=message, routing_key=routing_key)
+import jsonfrom datetime import datetime, timedeltafrom os import environimport aio_pikafrom const import SaleOperations, WarehouseOperations, report_queue_namefrom database.db import (    database,    distribution_docs,    distribution_docs_operations,    docs_purchases,    docs_purchases_goods,    docs_sales,    docs_sales_goods,    docs_warehouse,    docs_warehouse_goods,    fifo_ledger_documents,    fifo_lots,    fifo_settings,    organizations,)from sqlalchemy import (    and_,    bindparam,    func,    literal,    or_,    select,    tuple_,    union_all,)# Размер страницы потока товаров и пачки записи лотов/операцийGOODS_CHUNK_SIZE = 1000INCOMING_WAREHOUSE_OPERATIONS = (    WarehouseOperations.movement_in,    WarehouseOperations.surplus_posting,)OUTGOING_WAREHOUSE_OPERATIONS = (    WarehouseOperations.movement_out,    WarehouseOperations.internal_consumption,    WarehouseOperations.write_off,)DOCUMENT_FIELDS = {    "sale": "document_sale",    "purchase": "document_purchase",    "warehouse": "document_warehouse",}def _period_documents(organization_id: int, period_start: int, period_end: int):    """    Документы организации за период. version - последнее изменение документа    или любой его строки: строки товаров при редактировании пересоздаются    """    def versioned(document_type, docs, goods, goods_fk, *conditions):        return (            select(                literal(document_type).label("document_type"),                docs.c.id.label("document_id"),                docs.c.dated,                func.greatest(docs.c.updated_at, func.max(goods.c.updated_at)).label(                    "version"                ),            )            .select_from(docs.outerjoin(goods, goods_fk == docs.c.id))            .where(                docs.c.organization == organization_id,                docs.c.dated > period_start,                docs.c.dated < period_end if period_end else True,                *conditions,            )            .group_by(docs.c.id)        )    return union_all(        versioned(            "sale",            docs_sales,            docs_sales_goods,            docs_sales_goods.c.docs_sales_id,            docs_sales.c.operation != SaleOperations.order,        ),        versioned(            "purchase",            docs_purchases,            docs_purchases_goods,            docs_purchases_goods.c.docs_purchases_id,        ),        versioned(            "warehouse",            docs_warehouse,            docs_warehouse_goods,            docs_warehouse_goods.c.docs_warehouse_id,            docs_warehouse.c.operation.in_(                INCOMING_WAREHOUSE_OPERATIONS + OUTGOING_WAREHOUSE_OPERATIONS            ),        ),    ).subquery("period_documents")def _goods_stream(    organization_id: int,    period_start: int,    period_end: int,    document_ids: dict = None,):    """    Строки товаров в порядке FIFO: по дате документа, приход раньше расхода.    document_ids - {тип документа: [id]} для инкрементального прохода,    None - весь период    """    def goods_lines(document_type, direction, docs, goods, goods_fk, *conditions):        if document_ids is not None:            conditions += (docs.c.id.in_(document_ids.get(document_type) or [-1]),)        return (            select(                literal(direction).label("direction"),                literal(document_type).label("document_type"),                docs.c.id.label("document_id"),                docs.c.dated,                goods.c.id.label("goods_id"),                goods.c.nomenclature,                goods.c.quantity,                goods.c.price,                goods.c.created_at,            )            .select_from(goods.join(docs, docs.c.id == goods_fk))            .where(                docs.c.organization == organization_id,                docs.c.dated > period_start,                docs.c.dated < period_end if period_end else True,                *conditions,            )        )    stream = union_all(        goods_lines(            "purchase",            "in",            docs_purchases,            docs_purchases_goods,            docs_purchases_goods.c.docs_purchases_id,        ),        goods_lines(            "warehouse",            "in",            docs_warehouse,            docs_warehouse_goods,            docs_warehouse_goods.c.docs_warehouse_id,            docs_warehouse.c.operation.in_(INCOMING_WAREHOUSE_OPERATIONS),        ),        goods_lines(            "sale",            "out",            docs_sales,            docs_sales_goods,            docs_sales_goods.c.docs_sales_id,            docs_sales.c.operation != SaleOperations.order,        ),        goods_lines(            "warehouse",            "out",            docs_warehouse,            docs_warehouse_goods,            docs_warehouse_goods.c.docs_warehouse_id,            docs_warehouse.c.operation.in_(OUTGOING_WAREHOUSE_OPERATIONS),        ),    ).subquery("goods_stream")async def _iterate_goods(stream):    """    Постраничное чтение потока товаров по ключу сортировки. Курсор    database.iterate держит соединение, а между страницами нужно писать лоты    """    order = [        stream.c.dated,        stream.c.direction,  # "in" < "out": приход дня раньше расхода        stream.c.created_at,        stream.c.document_type,        stream.c.goods_id,    ]    last = None    while True:        query = select(stream).order_by(*order).limit(GOODS_CHUNK_SIZE)        if last is not None:            query = query.where(tuple_(*order) > tuple_(*last))        rows = await database.fetch_all(query)        yield rows        if len(rows) < GOODS_CHUNK_SIZE:            return        last = [rows[-1][column.name] for column in order]class FifoLedger:    """    Журнал FIFO-лотов организации (fifo_lots). Держит в памяти только    открытые лоты, изменения пишет в БД пачками по GOODS_CHUNK_SIZE    """    LOT_FIELDS = (        "document_purchase",        "document_warehouse",        "start_amount",        "start_price",        "outgoing_amount",        "outgoing_price",        "end_amount",        "end_price",    )    def __init__(self, organization_id: int, distribution_doc_id: int):        self.organization_id = organization_id        self.distribution_doc_id = distribution_doc_id        self.open_lots: dict[int, list[dict]] = {}        self.new_lots: list[dict] = []        self.dirty_lots: dict[int, dict] = {}        self.touched_lot_ids: set[int] = set()        self.operations: list[dict] = []        self.max_dated = None    async def load_open_lots(self):        query = (            fifo_lots.select()            .where(                fifo_lots.c.organization_id == self.organization_id,                fifo_lots.c.end_amount > 0,            )            .order_by(fifo_lots.c.dated, fifo_lots.c.goods_created, fifo_lots.c.id)        )        async for row in database.iterate(query):            lot = dict(row)            self.open_lots.setdefault(lot["nomenclature_id"], []).append(lot)    def apply(self, item):        if self.max_dated is None or item.dated > self.max_dated:            self.max_dated = item.dated        if item.direction == "in":            self._add_lot(item)        else:            self._consume(item)    def _add_lot(self, item):        lot = {            "id": None,            "organization_id": self.organization_id,            "nomenclature_id": item.nomenclature,            "document_purchase": None,            "document_warehouse": None,            "dated": item.dated,            "goods_created": int(item.created_at.timestamp()),            "start_amount": item.quantity,            "start_price": item.price,            "outgoing_amount": 0,            "outgoing_price": 0,            "end_amount": item.quantity,            "end_price": item.price,        }        lot[DOCUMENT_FIELDS[item.document_type]] = item.document_id        self.new_lots.append(lot)        if lot["end_amount"] > 0:            self.open_lots.setdefault(item.nomenclature, []).append(lot)    def _consume(self, item):        lots = self.open_lots.get(item.nomenclature)        remaining = item.quantity        consumed_amount = 0        consumed_price = 0        while lots and remaining > 0:            lot = lots[0]            amount = min(remaining, lot["end_amount"])            part_price = item.price / item.quantity * amount            lot["end_amount"] -= amount            lot["end_price"] -= part_price            lot["outgoing_amount"] += amount            lot["outgoing_price"] += part_price            remaining -= amount            consumed_amount += amount            consumed_price += part_price            if lot["id"] is not None:                self.dirty_lots[lot["id"]] = lot            if lot["end_amount"] <= 0:                lots.pop(0)        self.operations.append(            {                "distribution_fifo": self.distribution_doc_id,                "document_sale": None,                "document_warehouse": None,                DOCUMENT_FIELDS[item.document_type]: item.document_id,                "nomenclature": item.nomenclature,                "dated": int(item.created_at.timestamp()),                "start_amount": item.quantity,                "start_price": item.price,                "outgoing_amount": consumed_amount,                "outgoing_price": consumed_price,                "end_amount": item.quantity,                "end_price": item.price,            }        )    async def flush(self, final: bool = False):        # Новые лоты пишем сразу, чтобы дальнейший расход обновлял их по id        if self.new_lots:            values = [                {key: value for key, value in lot.items() if key != "id"}                for lot in self.new_lots            ]            rows = await database.fetch_all(                fifo_lots.insert().values(values).returning(fifo_lots.c.id)            )            for lot, row in zip(self.new_lots, rows):                lot["id"] = row.id                self.touched_lot_ids.add(row.id)            self.new_lots = []        if self.dirty_lots:            await database.execute_many(                fifo_lots.update()                .where(fifo_lots.c.id == bindparam("lot_id"))                .values(                    outgoing_amount=bindparam("outgoing_amount"),                    outgoing_price=bindparam("outgoing_price"),                    end_amount=bindparam("end_amount"),                    end_price=bindparam("end_price"),                    updated_at=func.now(),                ),                [                    {                        "lot_id": lot["id"],                        "outgoing_amount": lot["outgoing_amount"],                        "outgoing_price": lot["outgoing_price"],                        "end_amount": lot["end_amount"],                        "end_price": lot["end_price"],                    }                    for lot in self.dirty_lots.values()                ],            )            self.touched_lot_ids.update(self.dirty_lots)            self.dirty_lots = {}        if self.operations:            await database.execute_many(                distribution_docs_operations.insert(), self.operations            )            self.operations = []        if final and self.touched_lot_ids:            await self._write_lot_operations()    async def _write_lot_operations(self):        """Итоговое состояние затронутых лотов попадает в документ распределения"""        lot_ids = sorted(self.touched_lot_ids)        for offset in range(0, len(lot_ids), GOODS_CHUNK_SIZE):            source = select(                literal(self.distribution_doc_id),                fifo_lots.c.id,                fifo_lots.c.nomenclature_id,                fifo_lots.c.goods_created,                *[fifo_lots.c[field] for field in self.LOT_FIELDS],            ).where(fifo_lots.c.id.in_(lot_ids[offset : offset + GOODS_CHUNK_SIZE]))            await database.execute(                distribution_docs_operations.insert().from_select(                    [                        "distribution_fifo",                        "fifo_lot",                        "nomenclature",                        "dated",                        *self.LOT_FIELDS,                    ],                    source,                )            )        self.touched_lot_ids = set()    async def process(self, stream):        async for rows in _iterate_goods(stream):            for item in rows:                if item.quantity is None or item.quantity <= 0:                    continue                self.apply(item)            await self.flush()        await self.flush(final=True)async def _fetch_pending_documents(    organization_id: int, period_start: int, period_end: int):    """Документы периода, которых нет в журнале или которые изменились после учета"""    documents = _period_documents(organization_id, period_start, period_end)    query = (        select(documents, fifo_ledger_documents.c.id.label("ledger_id"))        .select_from(            documents.outerjoin(                fifo_ledger_documents,                and_(                    fifo_ledger_documents.c.document_type == documents.c.document_type,                    fifo_ledger_documents.c.document_id == documents.c.document_id,                ),            )        )        .where(            or_(                fifo_ledger_documents.c.id.is_(None),                documents.c.version > fifo_ledger_documents.c.version,            )        )    )    return await database.fetch_all(query)async def _reset_ledger(organization_id: int):    # Сбрасываем период журнала первым: если пересборка упадет,    # следующий запуск снова начнет с полной пересборки    await database.execute(        fifo_settings.update()        .where(fifo_settings.c.organization_id == organization_id)        .values({"ledger_period_start": None, "ledger_dated": None})    )    await database.execute(        fifo_lots.delete().where(fifo_lots.c.organization_id == organization_id)    )    await database.execute(        fifo_ledger_documents.delete().where(            fifo_ledger_documents.c.organization_id == organization_id        )    )async def _register_documents(organization_id: int, documents: list):    if not documents:        return    await database.execute_many(        fifo_ledger_documents.insert(),        [            {                "organization_id": organization_id,                "document_type": document.document_type,                "document_id": document.document_id,                "dated": document.dated,                "version": document.version,            }            for document in documents        ],    )async def _supersede_previews(    organization_id: int, distribution_doc_id: int, rebuild: bool):    """    Документ становится единственным превью организации. После инкрементального    запуска в нем только новые операции, поэтому операции прошлых превью    переносятся в него, кроме снимков лотов, записанных заново    """    previous = select(distribution_docs.c.id).where(        distribution_docs.c.is_preview == True,        distribution_docs.c.organization == organization_id,        distribution_docs.c.id != distribution_doc_id,    )    async with database.transaction():        if not rebuild:            rewritten_lots = select(distribution_docs_operations.c.fifo_lot).where(                distribution_docs_operations.c.distribution_fifo == distribution_doc_id,                distribution_docs_operations.c.fifo_lot.isnot(None),            )            await database.execute(                distribution_docs_operations.delete().where(                    distribution_docs_operations.c.distribution_fifo.in_(previous),                    distribution_docs_operations.c.fifo_lot.in_(rewritten_lots),                )            )            await database.execute(                distribution_docs_operations.update()                .where(distribution_docs_operations.c.distribution_fifo.in_(previous))                .values({"distribution_fifo": distribution_doc_id})            )        await database.execute(            distribution_docs.delete().where(distribution_docs.c.id.in_(previous))        )        await database.execute(            distribution_docs.update()            .where(distribution_docs.c.id == distribution_doc_id)            .values({"is_preview": True})        )async def distribute(    organization_id: int,    period_start: int = 0,    period_end: int = None,    mode: str = "closing",    full_rebuild: bool = False,):    """    FIFO-распределение себестоимости. Журнал лотов (fifo_lots) ведется    инкрементально: обрабатываются только документы, появившиеся после    прошлого запуска. Если изменился уже учтенный документ, пришел документ    задним числом или сменился период - журнал пересобирается целиком.    Закрытие всегда пересобирает журнал, чтобы документ закрытия содержал    все операции периода. Превью у организации одно: новое превью забирает    операции прошлого, снимки перезаписанных лотов заменяются свежими    """    if await is_organization_in_progress(organization_id):        return    query = organizations.select().where(organizations.c.id == organization_id)    organization = await database.fetch_one(query)    if not organization:        raise Exception(f"No such organization: {organization_id}")    await set_organization_in_progress(organization_id)    try:        setting = await database.fetch_one(            fifo_settings.select().where(                fifo_settings.c.organization_id == organization_id            )        )        ledger_period_start = setting.ledger_period_start if setting else None        ledger_dated = setting.ledger_dated if setting else None        pending = await _fetch_pending_documents(            organization_id, period_start, period_end        )        rebuild = (            full_rebuild            or mode == "closing"            or ledger_period_start is None            or ledger_period_start != period_start            or (period_end and ledger_dated is not None and ledger_dated >= period_end)            or any(document.ledger_id is not None for document in pending)            or (                ledger_dated is not None                and any(document.dated < ledger_dated for document in pending)            )        )        distribution_doc_id = None        if rebuild or pending:            distribution_doc = {                "organization": organization_id,                "period_start": period_start,                "period_end": period_end or datetime.utcnow().timestamp(),            }            query = distribution_docs.insert().values(distribution_doc)            distribution_doc_id = await database.execute(query)            ledger = FifoLedger(organization_id, distribution_doc_id)            if rebuild:                await _reset_ledger(organization_id)                await ledger.process(                    _goods_stream(organization_id, period_start, period_end)                )                documents = _period_documents(organization_id, period_start, period_end)                await database.execute(                    fifo_ledger_documents.insert().from_select(                        [                            "organization_id",                            "document_type",                            "document_id",                            "dated",                            "version",                        ],                        select(                            literal(organization_id),                            documents.c.document_type,                            documents.c.document_id,                            documents.c.dated,                            documents.c.version,                        ),                    )                )            else:                document_ids = {}                for document in pending:                    document_ids.setdefault(document.document_type, []).append(                        document.document_id                    )                async with database.transaction():                    await ledger.load_open_lots()                    await ledger.process(                        _goods_stream(                            organization_id, period_start, period_end, document_ids                        )                    )                    await _register_documents(organization_id, pending)            values = {"ledger_period_start": period_start}            if ledger.max_dated is not None:                values["ledger_dated"] = max(ledger.max_dated, ledger_dated or 0)            await database.execute(                fifo_settings.update()                .where(fifo_settings.c.organization_id == organization_id)                .values(values)            )        if mode == "preview":            query = (                fifo_settings.update()                .where(fifo_settings.c.organization_id == organization_id)                .values({"temporary_closed_date": period_end})            )            await database.execute(query)            if distribution_doc_id is None:                # Новых документов нет - прошлое превью по-прежнему полное                query = (                    distribution_docs.update()                    .where(                        distribution_docs.c.is_preview == True,                        distribution_docs.c.organization == organization_id,                    )                    .values({"period_end": period_end or datetime.utcnow().timestamp()})                )                await database.execute(query)                return            await _supersede_previews(organization_id, distribution_doc_id, rebuild)        elif mode == "closing":            query = (                fifo_settings.update()                .where(fifo_settings.c.organization_id == organization_id)                .values(                    {                        "fully_closed_date": period_end,                        "blocked_date": period_end,                    }                )            )            await database.execute(query)    finally:        await set_organization_in_progress(organization_id, False)async def process_distribution():    query = fifo_settings.select()    settings = await database.fetch_all(query)    for setting in settings:        # Пока идет распределение, новое сообщение все равно будет пропущено        if setting.in_progress:            continue        first_day = datetime(datetime.utcnow().year, datetime.utcnow().month, 1)        if setting.month_closing_delay_days:            first_day += timedelta(days=setting.month_closing_delay_days)        if setting.fully_closed_date < first_day.timestamp():            first_day_timestamp = int(first_day.timestamp())            await produce_distribution(                organization_id=setting.organization_id,                period_start=setting.fully_closed_date,                period_end=int(first_day_timestamp),            )            continue        previous_close_time = (            int(datetime.utcnow().timestamp()) - setting.preview_close_period_seconds        )        if (            not setting.temporary_closed_date            or setting.temporary_closed_date <= previous_close_time        ):            now_timestamp = int(datetime.utcnow().timestamp())            await produce_distribution(                organization_id=setting.organization_id,                period_start=setting.fully_closed_date,                period_end=now_timestamp,            )async def is_organization_in_progress(org_id: int):    query = fifo_settings.select().where(        fifo_settings.c.organization_id == org_id,        fifo_settings.c.in_progress == True,    )    if await database.fetch_one(query):        return True    else:        return Falseasync def set_organization_in_progress(org_id: int, status: bool = True):    query = (        fifo_settings.update()        .where(fifo_settings.c.organization_id == org_id)        .values({"in_progress": status})    )    await database.execute(query)async def produce_distribution(**body) -> None:    connection = await aio_pika.connect_robust(        host=environ.get("RABBITMQ_HOST"), port=int(environ.get("RABBITMQ_PORT"))    )    async with connection:        routing_key = report_queue_name        channel = await connection.channel()        body["func_name"] = distribute.__name__        message = aio_pika.Message(body=json.dumps(body).encode())        await channel.default_exchange.publish(message=message, routing_key=routing_key)
@@ -29,6 +29,7 @@ from database.db import (
 )
 from databases.backends.postgres import Record
 from fastapi import HTTPException
+from functions.auth_cache import resolve_token
 from sqlalchemy import String, Table, and_, cast, func, or_
 from sqlalchemy.sql import ColumnElement
 
@@ -624,8 +625,7 @@ def add_status(instance: Optional[Record]) -> Optional[dict]:
 
 
 async def get_user_by_token(token: str) -> Record:
-    query = users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await resolve_token(token)
     if not user or not user.status:
         raise_wrong_token()
     return user
@@ -1,5 +1,6 @@
 from asyncpg.exceptions import UniqueViolationError
-from database.db import database, installs, links, users_cboxes_relation
+from database.db import database, installs, links
+from functions.auth_cache import resolve_token
 
 
 async def get_install(**kwargs):
@@ -27,9 +28,7 @@ async def add_md5_to_install(install_id: int, md5key: str) -> bool:
 
 
 async def install_bundle_user(tg_token: str, md5key: str) -> bool:
-    user_cbox = await database.fetch_one(
-        users_cboxes_relation.select().where(users_cboxes_relation.c.token == tg_token)
-    )
+    user_cbox = await resolve_token(tg_token)
     install = await database.fetch_one(
         installs.select().where(installs.c.md5key == md5key)
     )
@@ -1,28 +1,22 @@
 from datetime import datetime
 
-from database.db import database, pboxes, projects, users, users_cboxes_relation
+from database.db import database, pboxes, projects, users
+from functions.auth_cache import resolve_token
 from sqlalchemy import select
 from ws_manager import manager
 
 
 async def get_user_id_cashbox_id_by_token(token: str):
-    user_cbox = await database.fetch_one(
-        users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    )
+    user_cbox = await resolve_token(token)
 
     if user_cbox:
-        user = await database.fetch_one(
-            users.select().where(users.c.id == user_cbox.user)
-        )
-        return user.id, user_cbox.cashbox_id
+        return user_cbox.user, user_cbox.cashbox_id
     else:
         return None, None
 
 
 async def get_user_by_token(token: str):
-    user_cbox = await database.fetch_one(
-        users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    )
+    user_cbox = await resolve_token(token)
 
     user_dict = None
     if user_cbox:
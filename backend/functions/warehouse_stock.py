@@ -0,0 +1,175 @@
+from typing import Iterable, List, Mapping, Optional, Union
+
+from database.db import database, warehouse_balances, warehouse_stock_current
+from sqlalchemy import desc, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+# Записи техкарт пишутся без организации, поэтому ключ проекции сводит
+# NULL к 0 так же, как уникальный индекс uq_warehouse_stock_current_key
+STOCK_KEY = [
+    func.coalesce(warehouse_stock_current.c.organization_id, 0),
+    warehouse_stock_current.c.warehouse_id,
+    warehouse_stock_current.c.nomenclature_id,
+]
+
+STOCK_COLUMNS = [
+    "organization_id",
+    "warehouse_id",
+    "nomenclature_id",
+    "cashbox_id",
+    "warehouse_balance_id",
+    "incoming_amount",
+    "outgoing_amount",
+    "current_amount",
+]
+
+
+def _upsert_query(stmt, only_newer: bool = True):
+    return stmt.on_conflict_do_update(
+        index_elements=STOCK_KEY,
+        set_={
+            **{
+                column: stmt.excluded[column]
+                for column in STOCK_COLUMNS
+                if column not in ("warehouse_id", "nomenclature_id")
+            },
+            "updated_at": func.now(),
+        },
+        # Не откатываем проекцию на более старую запись при гонке вставок
+        where=(
+            warehouse_stock_current.c.warehouse_balance_id
+            <= stmt.excluded.warehouse_balance_id
+            if only_newer
+            else None
+        ),
+    )
+
+
+async def insert_warehouse_balances(
+    rows: Union[Mapping, Iterable[Mapping]],
+) -> List[int]:
+    """
+    Добавляет записи в историю warehouse_balances и в той же транзакции
+    обновляет текущие остатки в warehouse_stock_current
+    """
+    rows = [dict(rows)] if isinstance(rows, Mapping) else [dict(r) for r in rows]
+    if not rows:
+        return []
+
+    # Многострочный INSERT требует одинаковый набор колонок во всех строках
+    columns = set().union(*rows)
+    values = [{column: row.get(column) for column in columns} for row in rows]
+
+    async with database.transaction():
+        inserted = await database.fetch_all(
+            warehouse_balances.insert()
+            .values(values)
+            .returning(
+                warehouse_balances.c.id,
+                warehouse_balances.c.organization_id,
+                warehouse_balances.c.warehouse_id,
+                warehouse_balances.c.nomenclature_id,
+                warehouse_balances.c.cashbox_id,
+                warehouse_balances.c.incoming_amount,
+                warehouse_balances.c.outgoing_amount,
+                warehouse_balances.c.current_amount,
+            )
+        )
+
+        # Для каждого ключа в проекцию попадает последняя вставленная запись
+        latest = {}
+        for row in sorted(inserted, key=lambda r: r.id):
+            if row.warehouse_id is None or row.nomenclature_id is None:
+                continue
+            key = (row.organization_id or 0, row.warehouse_id, row.nomenclature_id)
+            latest[key] = {
+                "organization_id": row.organization_id,
+                "warehouse_id": row.warehouse_id,
+                "nomenclature_id": row.nomenclature_id,
+                "cashbox_id": row.cashbox_id,
+                "warehouse_balance_id": row.id,
+                "incoming_amount": row.incoming_amount,
+                "outgoing_amount": row.outgoing_amount,
+                "current_amount": row.current_amount,
+            }
+
+        if latest:
+            await database.execute(
+                _upsert_query(
+                    insert(warehouse_stock_current).values(list(latest.values()))
+                )
+            )
+
+    return [row.id for row in inserted]
+
+
+async def replace_warehouse_balances(row: Mapping) -> List[int]:
+    """
+    Заменяет историю warehouse_balances по ключу (организация, склад,
+    номенклатура) записью row. Удаление истории и обновление
+    warehouse_stock_current выполняются в одной транзакции
+    """
+    async with database.transaction():
+        await database.execute(
+            warehouse_balances.delete().where(
+                warehouse_balances.c.warehouse_id == row["warehouse_id"],
+                warehouse_balances.c.nomenclature_id == row["nomenclature_id"],
+                warehouse_balances.c.organization_id == row["organization_id"],
+            )
+        )
+        return await insert_warehouse_balances(row)
+
+
+async def rebuild_warehouse_stock_current(cashbox_id: Optional[int] = None) -> int:
+    """
+    Пересобирает warehouse_stock_current из истории warehouse_balances.
+    Без cashbox_id проекция пересоздается целиком, иначе обновляются
+    только ключи, последняя запись которых принадлежит кабинету
+    """
+    wb = warehouse_balances
+    latest = (
+        select(
+            wb.c.organization_id,
+            wb.c.warehouse_id,
+            wb.c.nomenclature_id,
+            wb.c.cashbox_id,
+            wb.c.id.label("warehouse_balance_id"),
+            wb.c.incoming_amount,
+            wb.c.outgoing_amount,
+            wb.c.current_amount,
+        )
+        .distinct(
+            func.coalesce(wb.c.organization_id, 0),
+            wb.c.warehouse_id,
+            wb.c.nomenclature_id,
+        )
+        .where(wb.c.warehouse_id.is_not(None), wb.c.nomenclature_id.is_not(None))
+        .order_by(
+            func.coalesce(wb.c.organization_id, 0),
+            wb.c.warehouse_id,
+            wb.c.nomenclature_id,
+            desc(wb.c.created_at),
+            desc(wb.c.id),
+        )
+        .subquery()
+    )
+    source = select(*[latest.c[column] for column in STOCK_COLUMNS])
+    if cashbox_id is not None:
+        source = source.where(latest.c.cashbox_id == cashbox_id)
+
+    query = _upsert_query(
+        insert(warehouse_stock_current).from_select(STOCK_COLUMNS, source),
+        only_newer=False,
+    )
+
+    async with database.transaction():
+        if cashbox_id is None:
+            await database.execute(warehouse_stock_current.delete())
+        await database.execute(query)
+
+    count_query = select(func.count(warehouse_stock_current.c.id))
+    if cashbox_id is not None:
+        count_query = count_query.where(
+            warehouse_stock_current.c.cashbox_id == cashbox_id
+        )
+    return await database.fetch_val(count_query)
@@ -1,155 +1,207 @@
-from datetime import datetime, timedelta
-from typing import List
-
-from api.loyality_transactions.routers import raschet_bonuses
+"""
+Автосгорание начислений по картам лояльности.
+
+Начисление сгорает через lifetime секунд карты: оно помечается
+autoburned и по нему создается списание на ту же сумму. Тик
+обрабатывает истекшие начисления всех карт пачками по
+AUTOBURN_BATCH_SIZE: одним запросом начисления помечаются и для них
+вставляются списания, вторым обновляются балансы карт.
+
+Тик смотрит только начисления, истекшие после предыдущего тика
+(водяной знак). Пропущенные им начисления (карта была с нулевым
+балансом, lifetime уменьшили) подбирает полный проход - при старте
+процесса и раз в AUTOBURN_FULL_SWEEP_MINUTES
+"""
+
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+from api.loyality_transactions.balances import (
+    apply_transactions,
+    publish_cards_changes,
+)
 from common.decorators import ensure_db_connection
+from common.metrics import AUTOBURN_AMOUNT, AUTOBURN_CARDS, AUTOBURN_TRANSACTIONS
 from database.db import database, loyality_cards, loyality_transactions
-from databases.backends.postgres import Record
-from sqlalchemy import and_, select, text
-
-
-class AutoBurn:
-    def __init__(self, card: Record) -> None:
-        self.card: Record = card
-        self.card_balance: float = card.balance
-        self.expired_accruals: List[dict] = []
-        self.burned_list: List[int] = []
-        self.autoburn_operation_list: List[dict] = []
-
-    @staticmethod
-    async def get_cards() -> List[Record]:
-        """Получаем только те карты, у которых есть истёкшие начисления"""
-
-        # Подзапрос для нахождения карт с истёкшими начислениями
-        expired_subquery = (
-            select(loyality_transactions.c.loyality_card_id)
-            .select_from(
-                loyality_transactions.join(
-                    loyality_cards,
-                    loyality_cards.c.id == loyality_transactions.c.loyality_card_id,
-                )
+from sqlalchemy import Numeric, String, and_, case, cast, func, literal, select
+from sqlalchemy.sql import Select
+
+logger = logging.getLogger(__name__)
+
+AUTOBURN_BATCH_SIZE = int(os.getenv("AUTOBURN_BATCH_SIZE", 5000))
+AUTOBURN_FULL_SWEEP_MINUTES = int(os.getenv("AUTOBURN_FULL_SWEEP_MINUTES", 60))
+
+
+def _lifetime():
+    return func.make_interval(0, 0, 0, 0, 0, 0, loyality_cards.c.lifetime)
+
+
+def build_burn_query(until: datetime, since: Optional[datetime] = None) -> Select:
+    """
+    Пачка начислений, истекших в (since, until]: пометка autoburned и
+    вставка списаний одним запросом. Возвращает созданные списания
+    """
+    conditions = [
+        loyality_transactions.c.type == "accrual",
+        loyality_transactions.c.amount > 0,
+        loyality_transactions.c.autoburned == False,
+        loyality_cards.c.balance > 0,
+        loyality_cards.c.lifetime > 0,
+        loyality_cards.c.is_deleted == False,
+        # Интервал прибавляется к колонке: у "$1 - interval" PostgreSQL
+        # выводит тип параметра как interval, и datetime не кодируется
+        loyality_transactions.c.created_at + _lifetime() <= until,
+    ]
+    if since is not None:
+        conditions.append(loyality_transactions.c.created_at + _lifetime() > since)
+
+    batch = (
+        select(loyality_transactions.c.id)
+        .select_from(
+            loyality_transactions.join(
+                loyality_cards,
+                loyality_cards.c.id == loyality_transactions.c.loyality_card_id,
             )
-            .where(
-                and_(
-                    loyality_transactions.c.type == "accrual",
-                    loyality_transactions.c.amount > 0,
-                    loyality_transactions.c.autoburned == False,
-                    # Сравниваем created_at + lifetime с текущим временем
-                    # Используем выражение INTERVAL
-                    loyality_transactions.c.created_at
-                    + text("INTERVAL '1 second' * loyality_cards.lifetime")
-                    < datetime.utcnow(),
-                )
-            )
-            .distinct()
         )
-
-        # Основной запрос
-        cards_query = loyality_cards.select().where(
+        .where(and_(*conditions))
+        .order_by(loyality_transactions.c.created_at)
+        .limit(AUTOBURN_BATCH_SIZE)
+    )
+
+    expired = (
+        loyality_transactions.update()
+        .where(
             and_(
-                loyality_cards.c.balance > 0,
-                loyality_cards.c.lifetime.is_not(None),
-                loyality_cards.c.lifetime > 0,
-                loyality_cards.c.is_deleted == False,
-                loyality_cards.c.id.in_(expired_subquery),
+                loyality_transactions.c.id.in_(batch),
+                loyality_cards.c.id == loyality_transactions.c.loyality_card_id,
             )
         )
-
-        return await database.fetch_all(cards_query)
-
-    async def _get_expired_accruals(self) -> None:
-        """Получаем все истёкшие начисления по карте"""
-        expiry_threshold = datetime.utcnow() - timedelta(seconds=self.card.lifetime)
-
-        query = (
-            loyality_transactions.select()
-            .where(
-                and_(
-                    loyality_transactions.c.loyality_card_id == self.card.id,
-                    loyality_transactions.c.type == "accrual",
-                    loyality_transactions.c.amount > 0,
-                    loyality_transactions.c.autoburned == False,
-                    loyality_transactions.c.created_at <= expiry_threshold,
-                )
-            )
-            .order_by(loyality_transactions.c.created_at)
+        .values(autoburned=True)
+        .returning(
+            loyality_transactions.c.amount,
+            loyality_transactions.c.created_at,
+            loyality_transactions.c.loyality_card_id,
+            loyality_cards.c.card_number,
+            loyality_cards.c.created_by_id.label("card_created_by_id"),
+            loyality_cards.c.cashbox_id,
+            loyality_cards.c.balance,
         )
+        .cte("expired")
+    )
+
+    # Название как у прежнего расчета в Python: дата в UTC (asyncpg отдает
+    # timestamptz в UTC), сумма как str(float) - у целых ".0"
+    amount_text = case(
+        (
+            expired.c.amount == func.trunc(expired.c.amount),
+            cast(cast(expired.c.amount, Numeric), String) + literal(".0"),
+        ),
+        else_=cast(expired.c.amount, String),
+    )
+    name = (
+        literal("Автосгорание от ")
+        + func.to_char(func.timezone("UTC", expired.c.created_at), "DD.MM.YYYY")
+        + literal(" по сумме ")
+        + amount_text
+    )
+    burned = (
+        loyality_transactions.insert()
+        .from_select(
+            [
+                "type",
+                "amount",
+                "loyality_card_id",
+                "loyality_card_number",
+                "created_by_id",
+                "cashbox",
+                "tags",
+                "name",
+                "status",
+                "is_deleted",
+                "autoburned",
+                "card_balance",
+            ],
+            select(
+                literal("withdraw"),
+                expired.c.amount,
+                expired.c.loyality_card_id,
+                expired.c.card_number,
+                expired.c.card_created_by_id,
+                expired.c.cashbox_id,
+                literal(""),
+                name,
+                literal(True),
+                literal(False),
+                literal(True),
+                expired.c.balance,
+            ),
+        )
+        .returning(
+            loyality_transactions.c.id,
+            loyality_transactions.c.loyality_card_id,
+            loyality_transactions.c.amount,
+        )
+        .cte("burned")
+    )
 
-        expired_transactions = await database.fetch_all(query)
-        self.expired_accruals = [dict(tx) for tx in expired_transactions]
+    return select(burned.c.id, burned.c.loyality_card_id, burned.c.amount)
 
-    @database.transaction()
-    async def _burn(self) -> None:
-        """Выполняем автосгорание"""
-        if not self.burned_list:
-            return
 
-        # Помечаем транзакции как сожженные
-        update_query = (
-            loyality_transactions.update()
-            .where(loyality_transactions.c.id.in_(self.burned_list))
-            .values({"autoburned": True})
-        )
-        await database.execute(update_query)
-
-        # Создаем транзакции автосгорания
-        if self.autoburn_operation_list:
-            insert_query = loyality_transactions.insert()
-            await database.execute_many(insert_query, self.autoburn_operation_list)
-
-    def _get_autoburned_operation_dict(self, amount: float, original_tx: dict) -> dict:
-        return {
-            "type": "withdraw",
-            "amount": amount,
-            "loyality_card_id": self.card.id,
-            "loyality_card_number": self.card.card_number,
-            "created_by_id": self.card.created_by_id,
-            "cashbox": self.card.cashbox_id,
-            "tags": "",
-            "name": f"Автосгорание от {original_tx['created_at'].strftime('%d.%m.%Y')} по сумме {original_tx['amount']}",
-            "description": None,
-            "status": True,
-            "external_id": None,
-            "cashier_name": None,
-            "dead_at": None,
-            "is_deleted": False,
-            "autoburned": True,
-            "card_balance": self.card_balance,
-        }
-
-    @database.transaction()
-    async def start(self) -> None:
-        """Выполняем автосгорание в одной транзакции"""
-        print(
-            f"[AutoBurn] Обрабатываю карту {self.card.id}, баланс: {self.card_balance}"
+class AutoBurn:
+    def __init__(self):
+        self.watermark: Optional[datetime] = None
+        self.swept_at: Optional[float] = None
+
+    def _full_sweep_due(self) -> bool:
+        return (
+            self.watermark is None
+            or self.swept_at is None
+            or time.monotonic() - self.swept_at >= AUTOBURN_FULL_SWEEP_MINUTES * 60
         )
-        await self._get_expired_accruals()
-        total_burned: float = 0.0
-        for accrual in self.expired_accruals:
-            self.burned_list.append(accrual["id"])
-            total_burned += accrual["amount"]
-            # Создаем запись об автосгорании
-            self.autoburn_operation_list.append(
-                self._get_autoburned_operation_dict(accrual["amount"], accrual)
+
+    async def _burn_batch(self, until: datetime, since: Optional[datetime]):
+        async with database.transaction():
+            rows = await database.fetch_all(build_burn_query(until, since))
+            cards = await apply_transactions([row.id for row in rows])
+        await publish_cards_changes(cards)
+        return rows
+
+    async def tick(self):
+        until = await database.fetch_val(select(func.now()))
+        full_sweep = self._full_sweep_due()
+        since = None if full_sweep else self.watermark
+
+        burned_cards = set()
+        burned_count = 0
+        burned_amount = 0.0
+        while True:
+            rows = await self._burn_batch(until, since)
+            burned_count += len(rows)
+            burned_amount += sum(row.amount or 0 for row in rows)
+            burned_cards.update(row.loyality_card_id for row in rows)
+            if len(rows) < AUTOBURN_BATCH_SIZE:
+                break
+
+        self.watermark = until
+        if full_sweep:
+            self.swept_at = time.monotonic()
+
+        if burned_count:
+            AUTOBURN_CARDS.inc(len(burned_cards))
+            AUTOBURN_TRANSACTIONS.inc(burned_count)
+            AUTOBURN_AMOUNT.inc(burned_amount)
+            logger.info(
+                f"[AutoBurn] Сожжено {burned_count} начислений на {burned_amount:.2f} "
+                f"по {len(burned_cards)} картам"
             )
-        # Уменьшаем баланс карты
-        self.card_balance = max(0.0, self.card_balance - total_burned)
-        # Выполняем сжигание
-        await self._burn()
-        print(
-            f"[AutoBurn] Сожжено {len(self.burned_list)} транзакций, новый баланс: {self.card_balance}"
-        )
+
+
+auto_burn = AutoBurn()
 
 
 @ensure_db_connection
 async def autoburn():
-    print("Запуск AutoBurn")
-    card_list = await AutoBurn.get_cards()
-    for card in card_list:
-        try:
-            auto_burn = AutoBurn(card=card)
-            await auto_burn.start()
-            await raschet_bonuses(card.id)
-        except Exception as e:
-            print(f"Ошибка при обработке карты {card.id}: {e}")
-            # Можно добавить логирование в БД
+    await auto_burn.tick()
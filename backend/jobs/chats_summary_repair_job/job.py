@@ -0,0 +1,31 @@
+import logging
+import os
+from datetime import datetime, timedelta
+
+from api.chats.crud import repair_chat_summaries
+from common.decorators import ensure_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Проверяются чаты, обновленные за последние N часов; 0 - все чаты
+CHATS_SUMMARY_REPAIR_WINDOW_HOURS = int(
+    os.getenv("CHATS_SUMMARY_REPAIR_WINDOW_HOURS", 24)
+)
+
+
+@ensure_db_connection
+async def repair_chats_summary():
+    """
+    Сверяет unread_count и last_message_* в chats с сообщениями.
+    Поля ведутся при записи сообщений, джоба исправляет пропущенные
+    обновления (прямые UPDATE, сбои между записью сообщения и чата)
+    """
+    updated_since = None
+    if CHATS_SUMMARY_REPAIR_WINDOW_HOURS > 0:
+        updated_since = datetime.utcnow() - timedelta(
+            hours=CHATS_SUMMARY_REPAIR_WINDOW_HOURS
+        )
+
+    repaired = await repair_chat_summaries(updated_since=updated_since)
+    if repaired:
+        logger.warning(f"Repaired denormalized fields of {repaired} chats")
@@ -0,0 +1,20 @@
+import logging
+
+from api.marketplace.service.public_categories.closure import refresh_products_rollup
+from common.decorators import ensure_db_connection
+
+logger = logging.getLogger(__name__)
+
+
+@ensure_db_connection
+async def refresh_global_categories_rollup():
+    """
+    Сверяет products_count и has_products глобальных категорий с
+    товарами. Свертка ведется при записи номенклатуры и цен через API,
+    джоба исправляет расхождения от записей в обход (импорт, интеграции)
+    """
+    category_ids = await refresh_products_rollup()
+    if category_ids:
+        logger.warning(
+            f"Repaired products rollup of {len(category_ids)} global categories"
+        )
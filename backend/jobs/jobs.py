@@ -11,7 +11,10 @@ from database.db import (
 from jobs.autoburn_job.job import autoburn
 from jobs.avito_auto_sync_chats_job.job import sync_avito_chats_and_messages
 from jobs.avito_status_check_job.job import check_avito_accounts_status
+from jobs.chats_summary_repair_job.job import repair_chats_summary
 from jobs.check_account.job import check_account
+from jobs.global_categories_rollup_job.job import refresh_global_categories_rollup
+from jobs.loyality_balance_job.job import verify_loyality_balances
 from jobs.module_bank_job.job import module_bank_update_transaction
 from jobs.segment_jobs.job import segment_update
 from jobs.tochka_bank_job.job import tochka_update_transaction
@@ -122,6 +125,35 @@ try:
         max_instances=1,
         replace_existing=True,
     )
+
+    # Сверка денормализованных полей списка чатов
+    scheduler.add_job(
+        func=repair_chats_summary,
+        trigger="interval",
+        minutes=int(os.getenv("CHATS_SUMMARY_REPAIR_INTERVAL_MINUTES", 30)),
+        id="chats_summary_repair",
+        max_instances=1,
+        replace_existing=True,
+    )
+
+    # Сверка балансов карт лояльности, которые ведутся дельтами
+    scheduler.add_job(
+        func=verify_loyality_balances,
+        trigger="interval",
+        minutes=int(os.getenv("LOYALITY_BALANCE_VERIFY_INTERVAL_MINUTES", 60)),
+        id="loyality_balance_verify",
+        max_instances=1,
+        replace_existing=True,
+    )
+    # Сверка свертки товаров по дереву глобальных категорий
+    scheduler.add_job(
+        func=refresh_global_categories_rollup,
+        trigger="interval",
+        minutes=int(os.getenv("GLOBAL_CATEGORIES_ROLLUP_INTERVAL_MINUTES", 30)),
+        id="global_categories_rollup",
+        max_instances=1,
+        replace_existing=True,
+    )
 except DatabaseError:
     # В тестовом окружении таблица apscheduler_jobs может отсутствовать.
     # В этом случае просто не регистрируем джобы, но не роняем приложение.
@@ -0,0 +1,36 @@
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from api.loyality_transactions.balances import (
+    publish_cards_changes,
+    recalculate_cards,
+)
+from common.decorators import ensure_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Проверяются карты с операциями за последние N часов; 0 - все карты
+LOYALITY_BALANCE_VERIFY_WINDOW_HOURS = int(
+    os.getenv("LOYALITY_BALANCE_VERIFY_WINDOW_HOURS", 24)
+)
+
+
+@ensure_db_connection
+async def verify_loyality_balances():
+    """
+    Сверяет income, outcome и balance карт с историей операций.
+    Балансы ведутся дельтами при записи операций, джоба исправляет
+    расхождения (прямые UPDATE, записи в обход apply_transactions)
+    """
+    updated_since = None
+    if LOYALITY_BALANCE_VERIFY_WINDOW_HOURS > 0:
+        # updated_at - timestamptz, поэтому время с часовым поясом
+        updated_since = datetime.now(timezone.utc) - timedelta(
+            hours=LOYALITY_BALANCE_VERIFY_WINDOW_HOURS
+        )
+
+    cards = await recalculate_cards(updated_since=updated_since)
+    if cards:
+        logger.warning(f"Repaired balances of {len(cards)} loyality cards")
+        await publish_cards_changes(cards)
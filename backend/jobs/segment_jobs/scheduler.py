@@ -0,0 +1,197 @@
+"""
+Планировщик пересчета сегментов.
+
+Каждый тик джобы segment_update выбирает сегменты, у которых истек
+interval_minutes, и ставит их в очередь по убыванию просрочки. Пересчет
+идет в фоне пулом из SEGMENTS_WORKERS задач, не более
+SEGMENTS_CASHBOX_CONCURRENCY одновременно на кассу, поэтому большой
+сегмент одной кассы не задерживает сегменты остальных.
+
+Сегмент захватывается переводом в SegmentStatus.in_process: уже
+пересчитываемые (в том числе запущенные из API) пропускаются. Статус
+in_process, висящий дольше SEGMENTS_RUN_TIMEOUT_MINUTES сверх интервала,
+считается брошенным (процесс упал посреди пересчета)
+"""
+
+import asyncio
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from common.metrics import (
+    SEGMENT_RECALC_DURATION,
+    SEGMENTS_QUEUE_DEPTH,
+    SEGMENTS_RUNNING,
+)
+from database.db import SegmentStatus, database, segments
+from segments.logger import logger
+from segments.main import update_segment_task
+from sqlalchemy import Integer, and_, cast, func, or_, select
+from sqlalchemy.dialects.postgresql import JSONB
+
+SEGMENTS_WORKERS = int(os.getenv("SEGMENTS_WORKERS", 4))
+SEGMENTS_CASHBOX_CONCURRENCY = int(os.getenv("SEGMENTS_CASHBOX_CONCURRENCY", 1))
+SEGMENTS_RUN_TIMEOUT_MINUTES = int(os.getenv("SEGMENTS_RUN_TIMEOUT_MINUTES", 180))
+
+
+def _interval_minutes():
+    # Приведение update_settings к JSONB и извлечение interval_minutes
+    jsonb_field = cast(segments.c.update_settings, JSONB)
+    return cast(func.jsonb_extract_path_text(jsonb_field, "interval_minutes"), Integer)
+
+
+def _overdue_seconds():
+    """Сколько секунд назад сегмент должен был пересчитаться"""
+    due_at = segments.c.updated_at + func.make_interval(
+        0, 0, 0, 0, 0, _interval_minutes()
+    )
+    return func.extract("epoch", func.now() - due_at)
+
+
+def _stale_in_process():
+    return and_(
+        segments.c.status == SegmentStatus.in_process.value,
+        _overdue_seconds() > SEGMENTS_RUN_TIMEOUT_MINUTES * 60,
+    )
+
+
+async def get_due_segments() -> List[dict]:
+    """Сегменты к пересчету, самые просроченные первыми"""
+    overdue = _overdue_seconds()
+    query = (
+        select(
+            segments.c.id,
+            segments.c.cashbox_id,
+            overdue.label("overdue_seconds"),
+        )
+        .where(
+            and_(
+                segments.c.type_of_update == "cron",
+                segments.c.is_archived.isnot(True),
+                segments.c.is_deleted.isnot(True),
+                segments.c.update_settings["interval_minutes"].isnot(None),
+                or_(segments.c.updated_at.is_(None), overdue >= 0),
+                or_(
+                    segments.c.status != SegmentStatus.in_process.value,
+                    _stale_in_process(),
+                ),
+            )
+        )
+        .order_by(overdue.desc().nulls_first())
+    )
+    rows = await database.fetch_all(query)
+    return [dict(row) for row in rows]
+
+
+async def claim_segment(segment_id: int) -> bool:
+    """Переводит сегмент в in_process, если его не пересчитывает кто-то еще"""
+    row = await database.fetch_one(
+        segments.update()
+        .where(
+            and_(
+                segments.c.id == segment_id,
+                or_(
+                    segments.c.status != SegmentStatus.in_process.value,
+                    _stale_in_process(),
+                ),
+            )
+        )
+        .values(status=SegmentStatus.in_process.value)
+        .returning(segments.c.id)
+    )
+    return row is not None
+
+
+async def release_segment(segment_id: int):
+    """Снимает in_process после сбоя до начала пересчета"""
+    try:
+        await database.execute(
+            segments.update()
+            .where(
+                and_(
+                    segments.c.id == segment_id,
+                    segments.c.status == SegmentStatus.in_process.value,
+                )
+            )
+            .values(status=SegmentStatus.calculated.value)
+        )
+    except Exception:
+        pass
+
+
+class SegmentScheduler:
+    def __init__(
+        self,
+        workers: int = SEGMENTS_WORKERS,
+        cashbox_concurrency: int = SEGMENTS_CASHBOX_CONCURRENCY,
+    ):
+        self.workers = workers
+        self.cashbox_concurrency = cashbox_concurrency
+        self.queue: List[dict] = []
+        self.running: Dict[int, asyncio.Task] = {}
+        self.running_by_cashbox: Dict[Optional[int], int] = defaultdict(int)
+
+    async def tick(self):
+        """Обновляет очередь и запускает пересчеты на свободные места пула"""
+        self.queue = [
+            segment
+            for segment in await get_due_segments()
+            if segment["id"] not in self.running
+        ]
+        self._dispatch()
+        self._report()
+        if self.queue or self.running:
+            logger.info(
+                f"Segments scheduler: running {len(self.running)}, "
+                f"queued {len(self.queue)}"
+            )
+
+    def _next_segment(self) -> Optional[dict]:
+        for index, segment in enumerate(self.queue):
+            cashbox_id = segment["cashbox_id"]
+            if self.running_by_cashbox.get(cashbox_id, 0) < self.cashbox_concurrency:
+                return self.queue.pop(index)
+        return None
+
+    def _dispatch(self):
+        while len(self.running) < self.workers:
+            segment = self._next_segment()
+            if segment is None:
+                break
+            self.running_by_cashbox[segment["cashbox_id"]] += 1
+            self.running[segment["id"]] = asyncio.create_task(self._run(segment))
+
+    def _report(self):
+        SEGMENTS_QUEUE_DEPTH.set(len(self.queue))
+        SEGMENTS_RUNNING.set(len(self.running))
+
+    async def _run(self, segment: dict):
+        segment_id = segment["id"]
+        start = time.perf_counter()
+        status = "skipped"
+        try:
+            if await claim_segment(segment_id):
+                success = await update_segment_task(segment_id)
+                status = "error" if success is False else "success"
+        except Exception as e:
+            status = "error"
+            logger.exception(f"Segment {segment_id} recalculation failed: {e}")
+            await release_segment(segment_id)
+        finally:
+            duration = time.perf_counter() - start
+            if status != "skipped":
+                SEGMENT_RECALC_DURATION.labels(status).observe(duration)
+                logger.info(
+                    f"Segment {segment_id} (cashbox {segment['cashbox_id']}) "
+                    f"recalculated in {duration:.2f}s, status {status}"
+                )
+            self.running.pop(segment_id, None)
+            self.running_by_cashbox[segment["cashbox_id"]] -= 1
+            if self.running_by_cashbox[segment["cashbox_id"]] <= 0:
+                del self.running_by_cashbox[segment["cashbox_id"]]
+            self._dispatch()
+            self._report()
+
+
+segment_scheduler = SegmentScheduler()
@@ -34,6 +34,7 @@ from api.contracts.routers import router as contracts_router
 from api.contragents.routers import router as contragents_router
 from api.contragents.web.InstallContragentsWeb import InstallContragentsWeb
 from api.distribution_docs.routers import router as distribution_docs_router
+from api.docs_generate.rendering import document_renderer
 from api.docs_generate.routers import router as doc_generate_router
 from api.docs_purchases.routers import router as docs_purchases_router
 from api.docs_reconciliation.routers import router as docs_reconciliation_router
@@ -139,6 +140,7 @@ from api.payments.routers import (
     router as payments_router,
 )
 from api.pboxes.routers import router as pboxes_router
+from api.pictures.media import media_s3
 from api.pictures.routers import router as pictures_router
 from api.price_types.routers import router as price_types_router
 from api.prices.routers import router as prices_router
@@ -239,6 +241,11 @@ from botocore.exceptions import ClientError
 from common.amqp_messaging.common.core.IRabbitFactory import IRabbitFactory
 from common.amqp_messaging.common.impl.RabbitFactory import RabbitFactory
 from common.amqp_messaging.models.RabbitMqSettings import RabbitMqSettings
+from common.metrics import (
+    PrometheusMiddleware,
+    instrument_database,
+    metrics_endpoint,
+)
 from common.s3_service.core.IS3ServiceFactory import IS3ServiceFactory
 from common.s3_service.impl.S3ServiceFactory import S3ServiceFactory
 from common.s3_service.models.S3SettingsModel import S3SettingsModel
@@ -249,13 +256,19 @@ from database.fixtures import init_db
 from fastapi import FastAPI, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-from functions.events import write_event
+from functions.auth_cache import request_user, request_users
+from functions.events import (
+    EVENTS_MAX_BODY_BYTES,
+    EVENTS_SKIP_PATHS,
+    event_writer,
+    skip_event_log,
+)
 
 # import sentry_sdk
-from functions.users import get_user_id_cashbox_id_by_token
 from jobs.jobs import scheduler
 from scripts.upload_default_apple_wallet_images import DefaultImagesUploader
 from starlette.types import Message
+from ws_manager import bus as ws_bus
 
 logger = logging.getLogger(__name__)
 
@@ -374,10 +387,14 @@ app.include_router(telegram_router)
 
 
 @app.get("/health")
+@skip_event_log
 async def check_health_app():
     return {"status": "ok"}
 
 
+app.add_route("/metrics", skip_event_log(metrics_endpoint), include_in_schema=False)
+
+
 @app.post("/api/v1/payments/tinkoff/callback")
 @app.get("/api/v1/payments/tinkoff/callback")
 async def tinkoff_callback_direct(request: Request):
@@ -513,55 +530,75 @@ async def write_event_middleware(request: Request, call_next):
 
         request._receive = receive
 
-    async def get_body(request: Request) -> bytes:
-        body = await request.body()
-        await set_body(request, body)
-        return body
+    def is_logged(request: Request) -> bool:
+        if any(path in request.url.path for path in EVENTS_SKIP_PATHS):
+            return False
+        endpoint = request.scope.get("endpoint")
+        return not getattr(endpoint, "skip_event_log", False)
+
+    def should_read_body(request: Request) -> bool:
+        # Тело читается только ради журнала, поэтому большие и
+        # не-JSON тела (файлы, потоковые загрузки) не буферизуются
+        if request.method in ("GET", "HEAD", "OPTIONS", "DELETE"):
+            return False
+        if not request.headers.get("content-type", "").startswith("application/json"):
+            return False
+        content_length = request.headers.get("content-length")
+        return (
+            content_length is not None
+            and content_length.isdigit()
+            and int(content_length) <= EVENTS_MAX_BODY_BYTES
+        )
 
-    async def _write_event(
+    def _write_event(
         request: Request, body: bytes, time_start: float, status_code: int = 500
     ) -> None:
         try:
-            if "openapi.json" not in request.url.path:
-                token = request.query_params.get("token")
-                token = token if token else request.path_params.get("token")
-
-                user_id, cashbox_id = await get_user_id_cashbox_id_by_token(token=token)
-                type = "cashevent"
-                payload = (
-                    {}
-                    if not body
-                    and request.headers.get("content-type") != "application/json"
-                    else json.loads(body)
-                )
-                name = (
-                    ""
-                    if request.scope.get("endpoint") != create_payment
-                    else payload.get("type")
-                )
-
-                await write_event(
-                    type=type,
-                    name=name,
-                    method=request.method,
-                    url=request.url.__str__(),
-                    payload=payload,
-                    cashbox_id=cashbox_id,
-                    user_id=user_id,
-                    token=token,
-                    ip=request.headers.get("X-Forwarded-For"),
-                    status_code=status_code,
-                    request_time=time.time() - time_start,
-                )
-        except:
-            pass
+            if not is_logged(request):
+                return
+            token = request.query_params.get("token")
+            token = token if token else request.path_params.get("token")
+
+            try:
+                payload = json.loads(body) if body else {}
+            except ValueError:
+                payload = {}
+            name = (
+                ""
+                if request.scope.get("endpoint") != create_payment
+                or not isinstance(payload, dict)
+                else payload.get("type")
+            )
+            event = dict(
+                type="cashevent",
+                name=name,
+                method=request.method,
+                url=request.url.__str__(),
+                payload=payload,
+                token=token,
+                ip=request.headers.get("X-Forwarded-For"),
+                status_code=status_code,
+                request_time=time.time() - time_start,
+            )
+            # Пользователь, уже разрешенный обработчиком запроса;
+            # иначе его разрешит фоновая запись журнала
+            found, user = request_user(token)
+            if found:
+                event["user_id"] = user.user if user else None
+                event["cashbox_id"] = user.cashbox_id if user else None
+            event_writer.put(**event)
+        except Exception:
+            logger.exception("Failed to enqueue event")
 
     time_start = time.time()
-    await set_body(request, await request.body())
-    body = await get_body(request)
+    body = b""
+    if should_read_body(request):
+        body = await request.body()
+        await set_body(request, body)
+    resolved_users = request_users.set({})
     try:
         response = await call_next(request)
-        await _write_event(
+        _write_event(
             request=request,
             body=body,
             time_start=time_start,
@@ -573,6 +610,13 @@ async def write_event_middleware(request: Request, call_next):
             log_quota_exceeded()
         else:
             logger.exception("S3 ClientError")
+    finally:
+        request_users.reset(resolved_users)
+
+
+# Внешний слой: метрики учитывают время всех остальных middleware
+app.add_middleware(PrometheusMiddleware)
+instrument_database(database)
 
 
 @app.on_event("startup")
@@ -645,6 +689,13 @@ async def startup():
 
     init_db()
     await database.connect()
+    event_writer.start()
+
+    try:
+        # Доставка веб-сокет сообщений, отправленных другими процессами
+        await ws_bus.start()
+    except Exception as e:
+        logger.warning(f"WebSocket bus subscription failed: {e}")
 
     if os.getenv("ENABLE_AVITO_ENV_INIT", "false").lower() == "true":
         try:
@@ -686,9 +737,14 @@ async def startup():
 
 @app.on_event("shutdown")
 async def shutdown():
+    # Дописываем журнал событий, пока соединение с БД еще открыто
+    await event_writer.stop()
+    await ws_bus.stop()
     await database.disconnect()
     await chat_consumer.stop()
     await avito_consumer.stop()
+    document_renderer.shutdown()
+    await media_s3.close()
 
     try:
         if scheduler.running:
@@ -0,0 +1,86 @@
+"""
+Загрузка базы GeoLite2-City для локального определения города по IP.
+
+    python -m scripts.download_geoip
+    python -m scripts.download_geoip --force
+
+Нужны MAXMIND_ACCOUNT_ID и MAXMIND_LICENSE_KEY (бесплатная учетная
+запись MaxMind). База сохраняется в GEOIP_CITY_DB заменой файла, так что
+запущенный API подхватывает ее без перезапуска
+"""
+
+import argparse
+import os
+import sys
+import tarfile
+import tempfile
+
+import requests
+
+GEOIP_CITY_DB = os.getenv("GEOIP_CITY_DB", "/usr/share/GeoIP/GeoLite2-City.mmdb")
+GEOIP_DOWNLOAD_URL = os.getenv(
+    "GEOIP_DOWNLOAD_URL",
+    "https://download.maxmind.com/geoip/databases/GeoLite2-City/download"
+    "?suffix=tar.gz",
+)
+
+
+def download(path: str = GEOIP_CITY_DB) -> bool:
+    account_id = os.getenv("MAXMIND_ACCOUNT_ID")
+    license_key = os.getenv("MAXMIND_LICENSE_KEY")
+    if not account_id or not license_key:
+        print("MAXMIND_ACCOUNT_ID/MAXMIND_LICENSE_KEY are not set, skipping")
+        return False
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.TemporaryFile() as archive:
+        with requests.get(
+            GEOIP_DOWNLOAD_URL,
+            auth=(account_id, license_key),
+            stream=True,
+            timeout=60,
+        ) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                archive.write(chunk)
+        archive.seek(0)
+
+        with tarfile.open(fileobj=archive, mode="r:gz") as tar:
+            member = next(
+                (m for m in tar.getmembers() if m.name.endswith(".mmdb")), None
+            )
+            if member is None:
+                raise RuntimeError("No .mmdb file in the GeoLite2 archive")
+            source = tar.extractfile(member)
+
+            # Новый файл рядом и os.replace: читатель видит либо старую,
+            # либо полностью записанную базу
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".mmdb")
+            try:
+                with os.fdopen(fd, "wb") as target:
+                    while True:
+                        chunk = source.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        target.write(chunk)
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    print(f"GeoLite2-City saved to {path}")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--force", action="store_true", help="загрузить, даже если база уже есть"
+    )
+    args = parser.parse_args()
+    if os.path.exists(GEOIP_CITY_DB) and not args.force:
+        print(f"{GEOIP_CITY_DB} already exists")
+        sys.exit(0)
+    download()
@@ -0,0 +1,29 @@
+"""
+Пересборка проекции warehouse_stock_current из истории warehouse_balances.
+
+    python -m scripts.rebuild_warehouse_stock_current
+    python -m scripts.rebuild_warehouse_stock_current --cashbox-id 42
+"""
+
+import argparse
+import asyncio
+from typing import Optional
+
+from database.db import database
+from functions.warehouse_stock import rebuild_warehouse_stock_current
+
+
+async def main(cashbox_id: Optional[int] = None):
+    await database.connect()
+    try:
+        rows = await rebuild_warehouse_stock_current(cashbox_id)
+        print(f"warehouse_stock_current rebuilt: {rows} rows")
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cashbox-id", type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(main(args.cashbox_id))
@@ -4,7 +4,7 @@ import logging
 from datetime import datetime
 from typing import List
 
-from api.loyality_transactions.routers import raschet_bonuses
+from api.loyality_transactions.balances import insert_transactions
 from common.apple_wallet_service.impl.WalletNotificationService import (
     WalletNotificationService,
 )
@@ -20,7 +20,6 @@ from database.db import (
     docs_sales_tags,
     employee_shifts,
     loyality_cards,
-    loyality_transactions,
     segments,
     tags,
     users,
@@ -128,6 +127,34 @@ class SegmentActions:
                 await self.run(k, ids, v)
         return
 
+    async def start_change_actions(self, changes: dict):
+        """
+        Запуск actions по изменениям инкрементального обновления: объекты
+        берутся из diff, а не из segment_objects. Действия над активными
+        участниками применяются к вошедшим в сегмент
+        """
+        await self.refresh_segment_obj()
+        if self.segment_obj.actions is None:
+            return
+        actions = json.loads(self.segment_obj.actions)
+        if not actions or not isinstance(actions, dict):
+            return
+        for k, v in actions.items():
+            if k not in self.ACTIONS:
+                continue
+            obj_changes = changes.get(self.ACTIONS[k]["obj_type"], {})
+            if v.get("trigger_on_new"):
+                del v["trigger_on_new"]
+                items = obj_changes.get(SegmentChangeType.new.value, [])
+            elif v.get("trigger_on_removed"):
+                del v["trigger_on_removed"]
+                items = obj_changes.get(SegmentChangeType.removed.value, [])
+            else:
+                items = obj_changes.get(SegmentChangeType.new.value, [])
+            ids = [item["id"] if isinstance(item, dict) else item for item in items]
+            if ids:
+                await self.run(k, ids, v)
+
     async def add_existed_tags(self, contragents_ids: List[int], data: dict):
         tag_names = data.get("name", [])
         query = select(tags.c.id).where(
@@ -505,8 +532,13 @@ class SegmentActions:
             loyality_cards.c.cashbox_id == self.segment_obj.cashbox_id,
         )
         cards = await database.fetch_all(query)
-        for card in cards:
-            insert_data["loyality_card_id"] = card.id
-            insert_data["loyality_card_number"] = card.card_number
-            await database.execute(loyality_transactions.insert().values(insert_data))
-            await asyncio.gather(asyncio.create_task(raschet_bonuses(card.id)))
+        await insert_transactions(
+            [
+                {
+                    **insert_data,
+                    "loyality_card_id": card.id,
+                    "loyality_card_number": card.card_number,
+                }
+                for card in cards
+            ]
+        )
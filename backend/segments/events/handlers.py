@@ -0,0 +1,20 @@
+from typing import Any, Mapping, Optional
+
+from aio_pika import IncomingMessage
+from common.amqp_messaging.common.core.EventHandler import IEventHandler
+from segments.events.maintainer import apply_segment_changes
+from segments.events.messages import SegmentChangeMessage
+
+
+class SegmentChangeHandler(IEventHandler[SegmentChangeMessage]):
+
+    async def __call__(
+        self, event: Mapping[str, Any], message: Optional[IncomingMessage] = None
+    ):
+        segment_change_message = SegmentChangeMessage(**event)
+
+        await apply_segment_changes(
+            cashbox_id=segment_change_message.cashbox_id,
+            contragent_ids=segment_change_message.contragent_ids,
+            docs_sales_ids=segment_change_message.docs_sales_ids,
+        )
@@ -0,0 +1,117 @@
+"""
+Инкрементальное обновление сегментов по событиям изменения данных.
+
+Запись документов продаж и транзакций лояльности публикует
+SegmentChangeMessage с затронутыми контрагентами и документами. Для
+каждого планового сегмента кассы критерии пересчитываются только по
+документам этих контрагентов, и actions срабатывают сразу, не дожидаясь
+interval_minutes. Изменения тегов события не публикуют - критерии по
+тегам подхватывает плановый полный пересчет, срок которого считается от
+segments.updated_at и инкрементальными запусками не сдвигается.
+
+Сегменты с критериями относительно текущего времени ("N дней назад",
+"истекает через N дней") меняют состав и без событий, для них по
+событию запускается полный пересчет
+"""
+
+import asyncio
+from typing import Iterable, List, Set
+
+from database.db import database, docs_sales, segments
+from jobs.segment_jobs.scheduler import claim_segment, release_segment
+from segments.logger import logger
+from segments.main import Segments, update_segment_task
+from sqlalchemy import and_, or_, select
+
+# Полные пересчеты идут в фоне, чтобы не задерживать очередь событий
+_full_recalculations: Set[asyncio.Task] = set()
+
+
+async def get_maintained_segments(cashbox_id: int) -> List[int]:
+    rows = await database.fetch_all(
+        select(segments.c.id).where(
+            and_(
+                segments.c.cashbox_id == cashbox_id,
+                segments.c.type_of_update == "cron",
+                segments.c.is_archived.isnot(True),
+                segments.c.is_deleted.isnot(True),
+            )
+        )
+    )
+    return [row.id for row in rows]
+
+
+async def resolve_scope_contragents(
+    contragent_ids: Iterable[int], docs_sales_ids: Iterable[int]
+) -> Set[int]:
+    """Контрагенты события и контрагенты затронутых документов"""
+    scope = set(contragent_ids)
+    docs_sales_ids = list(docs_sales_ids)
+    if docs_sales_ids:
+        rows = await database.fetch_all(
+            select(docs_sales.c.contragent)
+            .where(
+                and_(
+                    docs_sales.c.id.in_(docs_sales_ids),
+                    docs_sales.c.contragent.isnot(None),
+                )
+            )
+            .distinct()
+        )
+        scope.update(row.contragent for row in rows)
+    return scope
+
+
+def build_scope_docs(cashbox_id: int, docs_sales_ids, scope_contragents):
+    """
+    Все документы кассы затронутых контрагентов: критерии по контрагенту
+    (теги, лояльность) меняют членство каждого его документа. Удаленные
+    документы входят в охват, чтобы выбыть из сегмента
+    """
+    return select(docs_sales.c.id).where(
+        and_(
+            docs_sales.c.cashbox == cashbox_id,
+            or_(
+                docs_sales.c.id.in_(list(docs_sales_ids)),
+                docs_sales.c.contragent.in_(list(scope_contragents)),
+            ),
+        )
+    )
+
+
+async def _full_recalculation(segment_id: int):
+    try:
+        await update_segment_task(segment_id)
+    except Exception as e:
+        logger.exception(f"Segment {segment_id} recalculation failed: {e}")
+        await release_segment(segment_id)
+
+
+async def apply_segment_changes(
+    cashbox_id: int, contragent_ids: List[int], docs_sales_ids: List[int]
+):
+    segment_ids = await get_maintained_segments(cashbox_id)
+    if not segment_ids:
+        return
+
+    scope_contragents = await resolve_scope_contragents(contragent_ids, docs_sales_ids)
+    scope_docs = build_scope_docs(cashbox_id, docs_sales_ids, scope_contragents)
+
+    for segment_id in segment_ids:
+        segment = Segments(segment_id)
+        await segment.async_init()
+        if segment.query.is_time_relative():
+            # Уже пересчитывающийся сегмент пропускаем
+            if await claim_segment(segment_id):
+                task = asyncio.create_task(_full_recalculation(segment_id))
+                _full_recalculations.add(task)
+                task.add_done_callback(_full_recalculations.discard)
+            continue
+        try:
+            if await segment.update_segment_incremental(scope_docs, scope_contragents):
+                logger.info(
+                    f"Segment {segment_id} updated incrementally: "
+                    f"contragents {sorted(scope_contragents)}, docs {docs_sales_ids}"
+                )
+        except Exception as e:
+            logger.exception(f"Incremental update of segment {segment_id} failed: {e}")
@@ -0,0 +1,10 @@
+from typing import List
+
+from common.amqp_messaging.models.BaseModelMessage import BaseModelMessage
+
+
+class SegmentChangeMessage(BaseModelMessage):
+    cashbox_id: int
+    contragent_ids: List[int] = []
+    docs_sales_ids: List[int] = []
+    source: str = ""
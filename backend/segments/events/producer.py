@@ -0,0 +1,41 @@
+import uuid
+from typing import Iterable, Optional
+
+from common.amqp_messaging.common.core.IRabbitFactory import IRabbitFactory
+from common.amqp_messaging.common.core.IRabbitMessaging import IRabbitMessaging
+from common.utils.ioc.ioc import ioc
+from segments.events.messages import SegmentChangeMessage
+from segments.logger import logger
+
+SEGMENT_CHANGES_ROUTING_KEY = "segments.changes"
+
+
+async def publish_segment_changes(
+    cashbox_id: int,
+    contragent_ids: Optional[Iterable[int]] = None,
+    docs_sales_ids: Optional[Iterable[int]] = None,
+    source: str = "",
+):
+    """
+    Событие об изменении данных, от которых зависит состав сегментов.
+    Ошибка публикации не должна ломать запись: сегменты догонит
+    плановый пересчет
+    """
+    contragent_ids = sorted({i for i in contragent_ids or [] if i})
+    docs_sales_ids = sorted({i for i in docs_sales_ids or [] if i})
+    if not cashbox_id or not (contragent_ids or docs_sales_ids):
+        return
+    try:
+        rabbit_messaging: IRabbitMessaging = await ioc.get(IRabbitFactory)()
+        await rabbit_messaging.publish(
+            message=SegmentChangeMessage(
+                message_id=uuid.uuid4(),
+                cashbox_id=cashbox_id,
+                contragent_ids=contragent_ids,
+                docs_sales_ids=docs_sales_ids,
+                source=source,
+            ),
+            routing_key=SEGMENT_CHANGES_ROUTING_KEY,
+        )
+    except Exception as e:
+        logger.warning(f"Failed to publish segment changes ({source}): {e}")
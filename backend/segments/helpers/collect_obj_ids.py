@@ -1,6 +1,6 @@
 from database.db import SegmentObjectType, database, segment_objects, segments
 from segments.constants import SegmentChangeType
-from sqlalchemy import and_, or_, select
+from sqlalchemy import and_, func, or_, select
 
 
 async def collect_objects(segment_id, obj_type: SegmentObjectType, mode: str):
@@ -8,6 +8,9 @@ async def collect_objects(segment_id, obj_type: SegmentObjectType, mode: str):
     Получение списка id объектов в сегменте.
     """
 
+    # Объекты до инкрементального запуска actions уже обработаны
+    handled_at = func.greatest(segments.c.updated_at, segments.c.actions_at)
+
     base_condition = [
         segment_objects.c.segment_id == segment_id,
         segment_objects.c.object_type == obj_type,
@@ -17,7 +20,7 @@ async def collect_objects(segment_id, obj_type: SegmentObjectType, mode: str):
         base_condition.append(
             or_(
                 segments.c.updated_at.is_(None),
-                segment_objects.c.valid_from >= segments.c.updated_at,
+                segment_objects.c.valid_from >= handled_at,
             )
         )
 
@@ -26,7 +29,7 @@ async def collect_objects(segment_id, obj_type: SegmentObjectType, mode: str):
 
     elif mode == SegmentChangeType.removed.value:
         base_condition.append(segment_objects.c.valid_to.isnot(None))
-        base_condition.append(segment_objects.c.valid_to >= segments.c.updated_at)
+        base_condition.append(segment_objects.c.valid_to >= handled_at)
 
     query = (
         select(segment_objects.c.object_id)
@@ -1,10 +1,27 @@
 from datetime import datetime
+from typing import Iterable, Optional
 
-from database.db import SegmentObjectType, database, segment_objects
+from database.db import SegmentObjectType, contragents, database, segment_objects
 from segments.constants import SegmentChangeType
-from segments.helpers.batch_insert import insert_in_batches
-from segments.helpers.collect_obj_ids import collect_objects
-from sqlalchemy import and_, update
+from sqlalchemy import (
+    and_,
+    cast,
+    exists,
+    func,
+    literal,
+    literal_column,
+    or_,
+    select,
+    union_all,
+)
+from sqlalchemy.sql import Select
+
+# Пространство advisory-блокировок сверки состава сегментов
+SEGMENT_LOCK_NAMESPACE = 7301
+
+
+def _object_type(value: str):
+    return cast(literal(value), segment_objects.c.object_type.type)
 
 
 class SegmentLogic:
@@ -15,94 +32,182 @@ class SegmentLogic:
     def __init__(self, segment_obj):
         self.segment_obj = segment_obj
 
-    async def collect_id_changes(self, new_ids: dict):
-        """Сбор всех изменений относительно последнего среза"""
-
-        docs_sales_id_to_update = new_ids.get("docs_sales", [])
-        contragents_id_to_update = new_ids.get("contragents", [])
-
-        docs_sales_ids = await collect_objects(
-            self.segment_obj.id,
-            SegmentObjectType.docs_sales.value,
-            SegmentChangeType.active.value,
+    def build_changes_query(
+        self,
+        members: Select,
+        now: datetime,
+        scope_docs: Optional[Select] = None,
+        scope_contragents: Optional[Iterable[int]] = None,
+    ) -> Select:
+        """
+        Сверка нового состава сегмента с активными segment_objects одним
+        запросом. members - запрос пар (docs_sales.id, contragent).
+
+        Выбывшие объекты закрываются (valid_to), новые открываются одним
+        INSERT ... SELECT; запрос возвращает изменившиеся объекты, для
+        контрагентов сразу с именем и телефоном.
+
+        При инкрементальном обновлении members посчитан только по
+        scope_docs, поэтому закрываются лишь объекты из scope_docs и
+        scope_contragents
+        """
+        segment_id = self.segment_obj.id
+        member_rows = members.cte("segment_members")
+        member_objects = union_all(
+            select(
+                member_rows.c.id.label("object_id"),
+                _object_type(SegmentObjectType.docs_sales.value).label("object_type"),
+            ),
+            select(
+                member_rows.c.contragent,
+                _object_type(SegmentObjectType.contragents.value),
+            )
+            .where(member_rows.c.contragent.isnot(None))
+            .distinct(),
+        ).cte("member_objects")
+
+        closed_conditions = [
+            segment_objects.c.segment_id == segment_id,
+            segment_objects.c.valid_to.is_(None),
+            segment_objects.c.object_type.in_(
+                [
+                    SegmentObjectType.docs_sales.value,
+                    SegmentObjectType.contragents.value,
+                ]
+            ),
+            ~exists().where(
+                and_(
+                    member_objects.c.object_id == segment_objects.c.object_id,
+                    member_objects.c.object_type == segment_objects.c.object_type,
+                )
+            ),
+        ]
+        if scope_docs is not None:
+            closed_conditions.append(
+                or_(
+                    and_(
+                        segment_objects.c.object_type
+                        == SegmentObjectType.docs_sales.value,
+                        segment_objects.c.object_id.in_(scope_docs),
+                    ),
+                    and_(
+                        segment_objects.c.object_type
+                        == SegmentObjectType.contragents.value,
+                        segment_objects.c.object_id.in_(list(scope_contragents or [])),
+                    ),
+                )
+            )
+
+        closed = (
+            segment_objects.update()
+            .where(and_(*closed_conditions))
+            .values(valid_to=now)
+            .returning(segment_objects.c.object_id, segment_objects.c.object_type)
+            .cte("closed")
         )
 
-        contragents_ids = await collect_objects(
-            self.segment_obj.id,
-            SegmentObjectType.contragents.value,
-            SegmentChangeType.active.value,
-        )
-
-        changes = {
-            SegmentObjectType.docs_sales.value: {},
-            SegmentObjectType.contragents.value: {},
-        }
-
-        # собираем изменения документов продаж
-        changes[SegmentObjectType.docs_sales.value][SegmentChangeType.new.value] = list(
-            set(docs_sales_id_to_update) - set(docs_sales_ids)
-        )
-        changes[SegmentObjectType.docs_sales.value][SegmentChangeType.removed.value] = (
-            list(set(docs_sales_ids) - set(docs_sales_id_to_update))
+        active = segment_objects.alias("active")
+        opened = (
+            segment_objects.insert()
+            .from_select(
+                ["segment_id", "object_id", "object_type", "valid_from"],
+                select(
+                    literal(segment_id),
+                    member_objects.c.object_id,
+                    member_objects.c.object_type,
+                    literal(now),
+                ).where(
+                    ~exists().where(
+                        and_(
+                            active.c.segment_id == segment_id,
+                            active.c.valid_to.is_(None),
+                            active.c.object_id == member_objects.c.object_id,
+                            active.c.object_type == member_objects.c.object_type,
+                        )
+                    )
+                ),
+            )
+            .returning(segment_objects.c.object_id, segment_objects.c.object_type)
+            .cte("opened")
         )
-        changes[SegmentObjectType.docs_sales.value][
-            SegmentChangeType.active.value
-        ] = docs_sales_id_to_update
 
-        # собираем изменения контрагентов
-        changes[SegmentObjectType.contragents.value][SegmentChangeType.new.value] = (
-            list(set(contragents_id_to_update) - set(contragents_ids))
+        changed = union_all(
+            select(
+                literal_column(f"'{SegmentChangeType.new.value}'").label("change"),
+                opened.c.object_id,
+                opened.c.object_type,
+            ),
+            select(
+                literal_column(f"'{SegmentChangeType.removed.value}'"),
+                closed.c.object_id,
+                closed.c.object_type,
+            ),
+        ).subquery("changed")
+
+        return select(
+            changed.c.change,
+            changed.c.object_id,
+            changed.c.object_type,
+            contragents.c.name,
+            contragents.c.phone,
+        ).select_from(
+            changed.outerjoin(
+                contragents,
+                and_(
+                    changed.c.object_type == SegmentObjectType.contragents.value,
+                    contragents.c.id == changed.c.object_id,
+                ),
+            )
         )
-        changes[SegmentObjectType.contragents.value][
-            SegmentChangeType.removed.value
-        ] = list(set(contragents_ids) - set(contragents_id_to_update))
-        changes[SegmentObjectType.contragents.value][
-            SegmentChangeType.active.value
-        ] = contragents_id_to_update
 
-        return changes
+    async def update_segment_data_in_db(
+        self,
+        members: Select,
+        scope_docs: Optional[Select] = None,
+        scope_contragents: Optional[Iterable[int]] = None,
+    ):
+        """
+        Обновление в БД. Возвращаем changes чтобы верхний уровень мог использовать diff:
+        {
+            "contragents": {"new": [{"id", "name", "phone"}], "removed": [...]},
+            "docs_sales": {"new": [id, ...], "removed": [...]},
+        }
 
-    async def update_data(self, changes: dict):
-        """Метод для записи среза (изменненых id объектов) в сегменте."""
-
-        for object_type, value_data in changes.items():
-            if value_data.get(SegmentChangeType.new.value):
-                added_data = []
-                for id in value_data[SegmentChangeType.new.value]:
-                    added_data.append(
-                        {
-                            "segment_id": self.segment_obj.id,
-                            "object_id": id,
-                            "object_type": object_type,
-                            "valid_from": datetime.now(),
-                        }
-                    )
-                if added_data:
-                    await insert_in_batches(
-                        segment_objects, added_data, batch_size=3000
-                    )
+        Полный пересчет и инкрементальные обновления одного сегмента
+        сверяются по очереди под advisory-блокировкой
+        """
+        changes = {
+            object_type.value: {
+                SegmentChangeType.new.value: [],
+                SegmentChangeType.removed.value: [],
+            }
+            for object_type in (
+                SegmentObjectType.docs_sales,
+                SegmentObjectType.contragents,
+            )
+        }
 
-            if ids := value_data.get(SegmentChangeType.removed.value):
-                batch_size = 30000  # чуть меньше лимита
-                for i in range(0, len(ids), batch_size):
-                    chunk = ids[i : i + batch_size]
-                    query = (
-                        update(segment_objects)
-                        .where(
-                            and_(
-                                segment_objects.c.object_id.in_(chunk),
-                                segment_objects.c.object_type == object_type,
-                                segment_objects.c.valid_to.is_(None),
-                            )
-                        )
-                        .values(valid_to=datetime.now())
+        async with database.transaction():
+            await database.execute(
+                select(
+                    func.pg_advisory_xact_lock(
+                        SEGMENT_LOCK_NAMESPACE, self.segment_obj.id
                     )
-                    await database.execute(query)
-        return
-
-    async def update_segment_data_in_db(self, new_ids: dict):
-        """Обновление в БД. Возвращаем changes чтобы верхний уровень мог использовать diff."""
-        changes = await self.collect_id_changes(new_ids)
-        await self.update_data(changes)
+                )
+            )
+            rows = await database.fetch_all(
+                self.build_changes_query(
+                    members, datetime.now(), scope_docs, scope_contragents
+                )
+            )
+        for row in rows:
+            object_type = row.object_type
+            if isinstance(object_type, SegmentObjectType):
+                object_type = object_type.value
+            if object_type == SegmentObjectType.contragents.value:
+                item = {"id": row.object_id, "name": row.name, "phone": row.phone}
+            else:
+                item = row.object_id
+            changes[object_type][row.change].append(item)
 
         return changes
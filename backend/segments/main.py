@@ -1,6 +1,7 @@
 import asyncio
 import json
 from datetime import datetime
+from typing import Iterable
 
 from database.db import (
     SegmentObjectType,
@@ -13,12 +14,9 @@ from segments.helpers.functions import format_contragent_text_notifications
 from segments.logger import logger
 from segments.logic.collect_data import ContragentsData
 from segments.logic.logic import SegmentLogic
-from segments.query.queries import (
-    SegmentCriteriaQuery,
-    fetch_contragent_by_id,
-    get_token_by_segment_id,
-)
+from segments.query.queries import SegmentCriteriaQuery, get_token_by_segment_id
 from segments.websockets import notify
+from sqlalchemy.sql import Select
 
 
 class Segments:
@@ -55,6 +53,14 @@ class Segments:
         )
         await self.async_init()
 
+    async def update_actions_datetime(self):
+        await database.execute(
+            segments.update()
+            .where(segments.c.id == self.segment_id)
+            .values(actions_at=datetime.now())
+        )
+        await self.async_init()
+
     async def set_status_in_progress(self):
         await database.execute(
             segments.update()
@@ -69,83 +75,75 @@ class Segments:
             .values(status=SegmentStatus.calculated.value)
         )
 
+    async def notify_changes(self, changes: dict):
+        """Уведомления по WS о вошедших в сегмент и выбывших контрагентах"""
+        # получаем token для отправки WS
+        token = await get_token_by_segment_id(self.segment_id)
+
+        # собираем задачи по уведомлениям
+        notify_tasks = []
+
+        contr_changes = changes.get(SegmentObjectType.contragents.value, {})
+        # добавленные
+        for contragent in contr_changes.get("new", []):
+            name = contragent["name"]
+            phone = contragent["phone"]
+            text = format_contragent_text_notifications(
+                "new_contragent", self.segment_obj.name, name or "", phone or ""
+            )
+            payload = {
+                "type": "contragent_added",
+                "text": text,
+                "contragent": contragent,
+            }
+            notify_tasks.append(
+                notify(
+                    ws_token=token,
+                    event="segment_member_added",
+                    segment_id=self.segment_id,
+                    payload=payload,
+                )
+            )
+
+        # удалённые
+        for contragent in contr_changes.get("removed", []):
+            # Если контрагент был удалён из справочника — всё равно отправим базовый текст
+            name = contragent["name"]
+            phone = contragent["phone"]
+            text = format_contragent_text_notifications(
+                "removed_contragent",
+                self.segment_obj.name,
+                name or "Неизвестно",
+                phone or "Неизвестно",
+            )
+            payload = {
+                "type": "contragent_removed",
+                "text": text,
+                "contragent": contragent,
+            }
+            notify_tasks.append(
+                notify(
+                    ws_token=token,
+                    event="segment_member_removed",
+                    segment_id=self.segment_id,
+                    payload=payload,
+                )
+            )
+
+        if notify_tasks:
+            # параллельно отправляем все уведомления
+            await asyncio.gather(*notify_tasks)
+
     async def update_segment(self):
         try:
             start = datetime.now()
             await self.set_status_in_progress()
-            new_ids = await self.query.collect_ids()
-
-            # теперь update_segment_data_in_db возвращает changes
-            changes = await self.logic.update_segment_data_in_db(new_ids)
-            # changes пример:
-            # {
-            #   "contragents": {"new": [...], "removed": [...], "active": [...]},
-            #   "docs_sales": {...}
-            # }
-
-            # получаем token для отправки WS
-            token = await get_token_by_segment_id(self.segment_id)
-
-            # собираем задачи по уведомлениям
-            notify_tasks = []
-
-            contr_changes = changes.get(SegmentObjectType.contragents.value, {})
-            # добавленные
-            for cid in contr_changes.get("new", []):
-                row = await fetch_contragent_by_id(cid)
-                if not row:
-                    continue
-                name = getattr(row, "name", None) or row.get("name")
-                phone = getattr(row, "phone", None) or row.get("phone")
-                text = format_contragent_text_notifications(
-                    "new_contragent", self.segment_obj.name, name or "", phone or ""
-                )
-                payload = {
-                    "type": "contragent_added",
-                    "text": text,
-                    "contragent": {"id": cid, "name": name, "phone": phone},
-                }
-                notify_tasks.append(
-                    notify(
-                        ws_token=token,
-                        event="segment_member_added",
-                        segment_id=self.segment_id,
-                        payload=payload,
-                    )
-                )
-
-            # удалённые
-            for cid in contr_changes.get("removed", []):
-                row = await fetch_contragent_by_id(cid)
-                # Если контрагент был удалён из справочника — всё равно отправим базовый текст
-                name = None
-                phone = None
-                if row:
-                    name = getattr(row, "name", None) or row.get("name")
-                    phone = getattr(row, "phone", None) or row.get("phone")
-                text = format_contragent_text_notifications(
-                    "removed_contragent",
-                    self.segment_obj.name,
-                    name or "Неизвестно",
-                    phone or "Неизвестно",
-                )
-                payload = {
-                    "type": "contragent_removed",
-                    "text": text,
-                    "contragent": {"id": cid, "name": name, "phone": phone},
-                }
-                notify_tasks.append(
-                    notify(
-                        ws_token=token,
-                        event="segment_member_removed",
-                        segment_id=self.segment_id,
-                        payload=payload,
-                    )
-                )
+            # состав сегмента сверяется с segment_objects одним запросом в БД
+            changes = await self.logic.update_segment_data_in_db(
+                self.query.build_query()
+            )
 
-            if notify_tasks:
-                # параллельно отправляем все уведомления
-                await asyncio.gather(*notify_tasks)
+            await self.notify_changes(changes)
 
             # далее стандартная логика
             await self.actions.start_actions()
@@ -154,10 +152,41 @@ class Segments:
             logger.info(
                 f"Segment {self.segment_id} updated successfully. Start - {start}. Took {datetime.now() - start}"
             )
+            return True
         except Exception as e:
             logger.exception(
                 f"Ошибка при обновлении сегмента {self.segment_obj.id}: {e}"
             )
+            # Состав сегмента не изменился: статус in_process не должен
+            # блокировать следующие пересчеты
+            try:
+                await self.set_status_calculated()
+            except Exception:
+                pass
+            return False
+
+    async def update_segment_incremental(
+        self, scope_docs: Select, scope_contragents: Iterable[int]
+    ) -> bool:
+        """
+        Пересчет сегмента только по затронутым документам и контрагентам.
+        Возвращает True, если состав сегмента изменился
+        """
+        changes = await self.logic.update_segment_data_in_db(
+            self.query.build_query(scope_docs=scope_docs),
+            scope_docs=scope_docs,
+            scope_contragents=scope_contragents,
+        )
+        if not any(items for change in changes.values() for items in change.values()):
+            return False
+
+        await self.notify_changes(changes)
+        await self.actions.start_change_actions(changes)
+        # Новые объекты уже обработаны actions, следующий полный пересчет
+        # не должен считать их новыми повторно. updated_at не трогаем:
+        # по нему планировщик назначает полный пересчет
+        await self.update_actions_datetime()
+        return True
 
     async def collect_data(self):
         data_obj = ContragentsData(self.segment_obj)
@@ -196,7 +225,7 @@ async def update_segment_task(segment_id: int):
         return
 
     if segment.segment_obj:
-        await segment.update_segment()
+        success = await segment.update_segment()
         payload = {
             "type": "recalc_finish",
             "segment_name": segment.segment_obj.name,
@@ -208,6 +237,7 @@ async def update_segment_task(segment_id: int):
             segment_id=segment_id,
             payload=payload,
         )
+        return success
     else:
         payload = {
             "type": "recalc_fail_404",
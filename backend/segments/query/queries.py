@@ -1,8 +1,8 @@
 from collections import defaultdict
+from typing import Optional
 
 from database.db import (
     SegmentObjectType,
-    contragents,
     contragents_tags,
     database,
     docs_sales,
@@ -14,6 +14,7 @@ from database.db import (
 from segments.logger import logger
 from segments.query import filters as filter_query
 from sqlalchemy import select
+from sqlalchemy.sql import Select
 
 FILTER_PRIORYTY_TAGS = {
     "self": 1,
@@ -24,11 +25,26 @@ FILTER_PRIORYTY_TAGS = {
     "loyality": 6,
 }
 
+# Критерии, результат которых меняется со временем без изменения данных:
+# такие сегменты нельзя поддерживать инкрементально по событиям
+TIME_RELATIVE_KEYS = {
+    "gte_seconds_ago",
+    "lte_seconds_ago",
+    "last_purchase_days_ago",
+    "expires_in_days",
+    "photos_not_added_minutes",
+}
+
 
-def chunk_list(lst, chunk_size=30000):
-    """Разбивает список на части заданного размера"""
-    for i in range(0, len(lst), chunk_size):
-        yield lst[i : i + chunk_size]
+def _has_time_relative_keys(data) -> bool:
+    if isinstance(data, dict):
+        return any(
+            key in TIME_RELATIVE_KEYS or _has_time_relative_keys(value)
+            for key, value in data.items()
+        )
+    if isinstance(data, list):
+        return any(_has_time_relative_keys(item) for item in data)
+    return False
 
 
 class SegmentCriteriaQuery:
@@ -36,7 +52,6 @@ class SegmentCriteriaQuery:
     def __init__(self, cashbox_id, criteria_data: dict):
         self.criteria_data = criteria_data
         self.cashbox_id = cashbox_id
-        self.docs_sales_ids = []
         self.filters = filter_query
         self.criteria_config = {
             "picker": {
@@ -124,6 +139,10 @@ class SegmentCriteriaQuery:
         # сортируем по приоритету и собираем как list[set]
         return [grouped[p] for p in sorted(grouped.keys())]
 
+    def is_time_relative(self) -> bool:
+        """Зависит ли состав сегмента от текущего времени"""
+        return _has_time_relative_keys(self.criteria_data)
+
     def _add_table_join(self, subquery, tag):
         query = select(subquery.c.id, subquery.c.contragent)
         config = self.filter_tag_dependencies.get(tag)
@@ -138,86 +157,71 @@ class SegmentCriteriaQuery:
         elif join_type == "join":
             return query.join(table_obj, condition)
 
-    async def calculate(self):
-        """Собираем Id документов продаж"""
-        docs_sales_rows = await database.fetch_all(
-            select(docs_sales.c.id).where(
-                docs_sales.c.cashbox == self.cashbox_id,
-                docs_sales.c.is_deleted == False,
-            )
-        )
-        self.docs_sales_ids = [row.id for row in docs_sales_rows]
-        groups = self.group_criteria_by_priority()
-        for group in groups:
-            if not self.docs_sales_ids:
-                return []
-
-            tag = self.criteria_config.get(list(group)[0]).get("filter_tag", "self")
-
-            # Обрабатываем ID частями
-            all_filtered_rows = []
-
-            for chunk_num, chunk_ids in enumerate(
-                chunk_list(self.docs_sales_ids, 30000)
-            ):
-                # Создаем подзапрос для текущей части
-                subq = (
+    def _apply_group(self, sub, group) -> Select:
+        tag = self.criteria_config.get(list(group)[0]).get("filter_tag", "self")
+        query = self._add_table_join(sub, tag)
+        for criteria in group:
+            data = self.criteria_data.get(criteria)
+            handler = self.criteria_config.get(criteria, {}).get("handler")
+            if handler:
+                query = handler(query, data, sub)
+        return query
+
+    def build_query(self, scope_docs: Optional[Select] = None) -> Select:
+        """
+        Запрос членов сегмента: пары (документ продажи, контрагент).
+
+        Группы критериев выстраиваются в цепочку CTE, каждая следующая
+        группа фильтрует документы, прошедшие предыдущую. Весь расчет
+        выполняется в PostgreSQL одним запросом.
+
+        scope_docs - запрос id документов, которыми ограничивается расчет
+        при инкрементальном обновлении
+        """
+        conditions = [
+            docs_sales.c.cashbox == self.cashbox_id,
+            docs_sales.c.is_deleted == False,
+        ]
+        if scope_docs is not None:
+            conditions.append(docs_sales.c.id.in_(scope_docs))
+        sub = select(docs_sales).where(*conditions).subquery("sub_0")
+        stage_ids = select(sub.c.id)
+
+        for index, group in enumerate(self.group_criteria_by_priority()):
+            if index:
+                sub = (
                     select(docs_sales)
-                    .where(docs_sales.c.id.in_(chunk_ids))
-                    .subquery("sub")
+                    .where(docs_sales.c.id.in_(stage_ids))
+                    .subquery(f"sub_{index}")
                 )
+            stage = self._apply_group(sub, group).cte(f"segment_stage_{index}")
+            stage_ids = select(stage.c.id)
 
-                # Добавляем джоины
-                query = self._add_table_join(subq, tag)
-
-                # Применяем обработчики критериев
-                for criteria in group:
-                    data = self.criteria_data.get(criteria)
-                    handler = self.criteria_config.get(criteria, {}).get("handler")
-                    if handler:
-                        query = handler(query, data, subq)
-                # Выполняем запрос для части
-                try:
-                    chunk_rows = await database.fetch_all(query)
-                    all_filtered_rows.extend(chunk_rows)
-                except Exception as e:
-                    logger.error(f"Error processing chunk {chunk_num + 1}: {e}")
-                    raise
-
-            # Обновляем список ID результатами из всех частей
-            docs_sales_rows = all_filtered_rows
-            self.docs_sales_ids = [row.id for row in docs_sales_rows]
-
-        return self.docs_sales_ids
+        return select(docs_sales.c.id, docs_sales.c.contragent).where(
+            docs_sales.c.id.in_(stage_ids)
+        )
 
-    async def collect_ids(self):
-        docs_sales_ids = await self.calculate()
+    async def calculate(self):
+        """Собираем Id документов продаж"""
+        rows = await database.fetch_all(self.build_query())
+        return [row.id for row in rows]
 
+    async def collect_ids(self):
         data = {
             SegmentObjectType.docs_sales.value: set(),
             SegmentObjectType.contragents.value: set(),
         }
 
-        # Обрабатываем ID частями
-        for chunk_num, chunk_ids in enumerate(chunk_list(docs_sales_ids, 30000)):
-
-            # Создаем запрос для текущей части
-            query = select(docs_sales.c.id, docs_sales.c.contragent).where(
-                docs_sales.c.id.in_(chunk_ids)
-            )
+        try:
+            rows = await database.fetch_all(self.build_query())
+        except Exception as e:
+            logger.error(f"Error calculating segment members: {e}")
+            raise
 
-            try:
-                chunk_rows = await database.fetch_all(query)
-
-                # Обрабатываем результаты части
-                for row in chunk_rows:
-                    data[SegmentObjectType.docs_sales.value].add(row.id)
-                    if row.contragent:
-                        data[SegmentObjectType.contragents.value].add(row.contragent)
-
-            except Exception as e:
-                logger.error(f"Error processing chunk {chunk_num + 1}: {e}")
-                raise
+        for row in rows:
+            data[SegmentObjectType.docs_sales.value].add(row.id)
+            if row.contragent:
+                data[SegmentObjectType.contragents.value].add(row.contragent)
 
         return data
 
@@ -231,10 +235,3 @@ async def get_token_by_segment_id(segment_id: int) -> str:
     )
     row = await database.fetch_one(query)
     return row.token if row else None
-
-
-async def fetch_contragent_by_id(cid):
-    row = await database.fetch_one(
-        select([contragents.c.name, contragents.c.phone]).where(contragents.c.id == cid)
-    )
-    return row
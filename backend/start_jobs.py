@@ -1,8 +1,14 @@
 import asyncio
 import logging
 
+from common.metrics import (
+    instrument_database,
+    instrument_scheduler,
+    start_metrics_server,
+)
 from database.db import database  # Импорт базы данных
 from jobs.jobs import scheduler  # Импорт настроенного планировщика
+from ws_manager import bus as ws_bus
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,6 +21,10 @@ async def main():
     if not database.is_connected:
         await database.connect()
         logger.info("Database connected globally.")
+    instrument_database(database)
+    instrument_scheduler(scheduler)
+    # Метрики джоб отдаются отдельным портом, API-процесс их не видит
+    start_metrics_server("JOBS_METRICS_PORT")
     scheduler.start()
 
     try:
@@ -24,6 +34,8 @@ async def main():
         logger.info("Stopping scheduler...")
         scheduler.shutdown()
     finally:
+        # Соединение публикации в шину веб-сокетов открывается при первой отправке
+        await ws_bus.stop()
         if database.is_connected:
             await database.disconnect()
             logger.info("Database disconnected.")
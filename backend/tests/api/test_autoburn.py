@@ -0,0 +1,215 @@
+import datetime
+import hashlib
+import random
+import string
+import sys
+
+import pytest
+import pytest_asyncio
+
+sys.path.insert(0, "/backend")
+from api.loyality_transactions.balances import insert_transactions
+from database.db import (
+    cboxes,
+    database,
+    loyality_cards,
+    loyality_transactions,
+    organizations,
+    users,
+    users_cboxes_relation,
+)
+from jobs.autoburn_job.job import AutoBurn
+from sqlalchemy import func, select
+
+from backend.main import app
+
+LIFETIME = 3600
+
+
+def generate_random_string(length=8):
+    return "".join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+
+def accrual(card, amount):
+    return {
+        "type": "accrual",
+        "amount": amount,
+        "loyality_card_id": card["card_id"],
+        "cashbox": card["cashbox_id"],
+        "created_by_id": card["relation_id"],
+        "status": True,
+        "is_deleted": False,
+        "autoburned": False,
+    }
+
+
+async def backdate(transaction_id, seconds):
+    """Сдвигает начисление в прошлое на seconds по часам БД"""
+    await database.execute(
+        loyality_transactions.update()
+        .where(loyality_transactions.c.id == transaction_id)
+        .values(created_at=func.now() - func.make_interval(0, 0, 0, 0, 0, 0, seconds))
+    )
+
+
+async def old_autoburn_operations(card_id):
+    """Списания, которые создал бы прежний покарточный расчет"""
+    card = await database.fetch_one(
+        loyality_cards.select().where(loyality_cards.c.id == card_id)
+    )
+    threshold = await database.fetch_val(
+        select(func.now() - func.make_interval(0, 0, 0, 0, 0, 0, card.lifetime))
+    )
+    accruals = await database.fetch_all(
+        loyality_transactions.select().where(
+            loyality_transactions.c.loyality_card_id == card_id,
+            loyality_transactions.c.type == "accrual",
+            loyality_transactions.c.amount > 0,
+            loyality_transactions.c.autoburned == False,
+            loyality_transactions.c.created_at <= threshold,
+        )
+    )
+    return sorted(
+        (
+            row.amount,
+            f"Автосгорание от {row.created_at.strftime('%d.%m.%Y')} "
+            f"по сумме {row.amount}",
+            card.balance,
+        )
+        for row in accruals
+    )
+
+
+async def autoburn_operations(card_id):
+    rows = await database.fetch_all(
+        loyality_transactions.select().where(
+            loyality_transactions.c.loyality_card_id == card_id,
+            loyality_transactions.c.type == "withdraw",
+            loyality_transactions.c.autoburned == True,
+        )
+    )
+    return sorted((row.amount, row.name, row.card_balance) for row in rows)
+
+
+async def burned_ids(card_id):
+    rows = await database.fetch_all(
+        loyality_transactions.select().where(
+            loyality_transactions.c.loyality_card_id == card_id,
+            loyality_transactions.c.type == "accrual",
+            loyality_transactions.c.autoburned == True,
+        )
+    )
+    return {row.id for row in rows}
+
+
+async def card_balance(card_id):
+    return await database.fetch_val(
+        select(loyality_cards.c.balance).where(loyality_cards.c.id == card_id)
+    )
+
+
+class TestAutoBurn:
+    @pytest_asyncio.fixture(scope="function")
+    async def card(self):
+        await app.router.startup()
+        now = int(datetime.datetime.now().timestamp())
+        chat_id = str(random.randint(100000000, 999999999))
+
+        user_id = await database.execute(
+            users.insert()
+            .values(
+                chat_id=chat_id,
+                first_name=f"TestUser_{generate_random_string(4)}",
+                username=f"user_{chat_id}",
+                created_at=now,
+                updated_at=now,
+            )
+            .returning(users.c.id)
+        )
+        cashbox_id = await database.execute(
+            cboxes.insert()
+            .values(name="Касса сгорания", balance=0.0, created_at=now, updated_at=now)
+            .returning(cboxes.c.id)
+        )
+        relation_id = await database.execute(
+            users_cboxes_relation.insert()
+            .values(
+                user=user_id,
+                cashbox_id=cashbox_id,
+                token=hashlib.sha256(f"{chat_id}{now}".encode()).hexdigest(),
+                is_owner=True,
+                status=True,
+                created_at=now,
+                updated_at=now,
+            )
+            .returning(users_cboxes_relation.c.id)
+        )
+        organization_id = await database.execute(
+            organizations.insert()
+            .values(
+                type="OOO",
+                short_name=f"TestOrg{generate_random_string(4)}",
+                owner=relation_id,
+                cashbox=cashbox_id,
+            )
+            .returning(organizations.c.id)
+        )
+        card_id = await database.execute(
+            loyality_cards.insert()
+            .values(
+                card_number=random.randint(10**10, 10**11),
+                organization_id=organization_id,
+                cashbox_id=cashbox_id,
+                created_by_id=relation_id,
+                balance=0.0,
+                income=0.0,
+                outcome=0.0,
+                lifetime=LIFETIME,
+                status_card=True,
+                is_deleted=False,
+            )
+            .returning(loyality_cards.c.id)
+        )
+
+        yield {
+            "card_id": card_id,
+            "cashbox_id": cashbox_id,
+            "relation_id": relation_id,
+        }
+        await app.router.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_batch_matches_per_card_burn(self, card):
+        ids = await insert_transactions(
+            [accrual(card, 100), accrual(card, 50.5), accrual(card, 20)]
+        )
+        await backdate(ids[0], LIFETIME * 2)
+        await backdate(ids[1], LIFETIME + 100)
+        expected = await old_autoburn_operations(card["card_id"])
+        assert len(expected) == 2
+
+        await AutoBurn().tick()
+
+        assert await autoburn_operations(card["card_id"]) == expected
+        assert await burned_ids(card["card_id"]) == {ids[0], ids[1]}
+        assert await card_balance(card["card_id"]) == pytest.approx(20)
+
+    @pytest.mark.asyncio
+    async def test_watermark_and_full_sweep(self, card):
+        auto_burn = AutoBurn()
+        # Первый тик - полный проход, он ставит водяной знак
+        await auto_burn.tick()
+
+        ids = await insert_transactions([accrual(card, 40), accrual(card, 25)])
+        # Истекло до водяного знака: обычный тик его не видит
+        await backdate(ids[0], LIFETIME * 2)
+        # Истекает сейчас, после водяного знака
+        await backdate(ids[1], LIFETIME)
+
+        await auto_burn.tick()
+        assert await burned_ids(card["card_id"]) == {ids[1]}
+
+        auto_burn.swept_at = None
+        await auto_burn.tick()
+        assert await burned_ids(card["card_id"]) == {ids[0], ids[1]}
+        assert await card_balance(card["card_id"]) == pytest.approx(0)
@@ -0,0 +1,247 @@
+import datetime
+import hashlib
+import random
+import string
+import sys
+
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+
+sys.path.insert(0, "/backend")
+from api.marketplace.service.public_categories.closure import (
+    refresh_nomenclature_categories,
+)
+from api.marketplace.service.public_categories.public_categories_service import (
+    MarketplacePublicCategoriesService,
+)
+from api.marketplace.service.public_categories.schema import (
+    GlobalCategoryCreate,
+    GlobalCategoryUpdate,
+)
+from database.db import (
+    cboxes,
+    database,
+    global_categories,
+    global_categories_closure,
+    nomenclature,
+    price_types,
+    prices,
+    users,
+    users_cboxes_relation,
+)
+from sqlalchemy import select
+
+from backend.main import app
+
+
+def generate_random_string(length=8):
+    return "".join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+
+async def closure_pairs(category_ids):
+    rows = await database.fetch_all(
+        global_categories_closure.select().where(
+            global_categories_closure.c.descendant_id.in_(category_ids)
+        )
+    )
+    return {(row.ancestor_id, row.descendant_id, row.depth) for row in rows}
+
+
+async def parent_walk_pairs(category_ids):
+    """Пути по parent_id - как обходили дерево до замыкания"""
+    pairs = set()
+    for category_id in category_ids:
+        current, depth = category_id, 0
+        while current is not None:
+            pairs.add((current, category_id, depth))
+            current = await database.fetch_val(
+                select(global_categories.c.parent_id).where(
+                    global_categories.c.id == current
+                )
+            )
+            depth += 1
+    return pairs
+
+
+async def parent_walk_products(category_id):
+    """Товары с ценой chatting в активном поддереве - обходом по parent_id"""
+    subtree, level = {category_id}, [category_id]
+    while level:
+        rows = await database.fetch_all(
+            select(global_categories.c.id).where(
+                global_categories.c.parent_id.in_(level),
+                global_categories.c.is_active.is_(True),
+            )
+        )
+        level = [row.id for row in rows]
+        subtree.update(level)
+    rows = await database.fetch_all(
+        select(nomenclature.c.id)
+        .select_from(
+            nomenclature.join(prices, prices.c.nomenclature == nomenclature.c.id).join(
+                price_types, price_types.c.id == prices.c.price_type
+            )
+        )
+        .where(
+            nomenclature.c.global_category_id.in_(subtree),
+            nomenclature.c.is_deleted.is_not(True),
+            prices.c.is_deleted.is_not(True),
+            price_types.c.name == "chatting",
+        )
+        .distinct()
+    )
+    return len(rows)
+
+
+async def stored_products(category_id):
+    return await database.fetch_val(
+        select(global_categories.c.products_count).where(
+            global_categories.c.id == category_id
+        )
+    )
+
+
+class TestGlobalCategoriesClosure:
+    @pytest_asyncio.fixture(scope="function")
+    async def service(self):
+        await app.router.startup()
+        yield MarketplacePublicCategoriesService()
+        await app.router.shutdown()
+
+    async def create(self, service, parent_id=None):
+        category = await service.create_global_category(
+            GlobalCategoryCreate(
+                name=f"TestCategory{generate_random_string(6)}", parent_id=parent_id
+            )
+        )
+        return category["id"]
+
+    @pytest.mark.asyncio
+    async def test_move_matches_parent_walk(self, service):
+        root = await self.create(service)
+        child = await self.create(service, root)
+        grandchild = await self.create(service, child)
+        other_root = await self.create(service)
+        ids = [root, child, grandchild, other_root]
+        assert await closure_pairs(ids) == await parent_walk_pairs(ids)
+
+        await service.update_global_category(
+            child, GlobalCategoryUpdate(parent_id=other_root)
+        )
+        assert await closure_pairs(ids) == await parent_walk_pairs(ids)
+        assert (other_root, grandchild, 2) in await closure_pairs([grandchild])
+
+        await service.update_global_category(
+            child, GlobalCategoryUpdate(parent_id=None)
+        )
+        assert await closure_pairs(ids) == await parent_walk_pairs(ids)
+
+    @pytest.mark.asyncio
+    async def test_cycle_is_rejected(self, service):
+        root = await self.create(service)
+        child = await self.create(service, root)
+        grandchild = await self.create(service, child)
+        ids = [root, child, grandchild]
+        before = await closure_pairs(ids)
+
+        for parent_id in (grandchild, root):
+            with pytest.raises(HTTPException) as error:
+                await service.update_global_category(
+                    root, GlobalCategoryUpdate(parent_id=parent_id)
+                )
+            assert error.value.status_code == 400
+
+        assert await closure_pairs(ids) == before
+        assert before == await parent_walk_pairs(ids)
+
+    @pytest.mark.asyncio
+    async def test_products_rollup_matches_subtree_count(self, service):
+        now = int(datetime.datetime.now().timestamp())
+        chat_id = str(random.randint(100000000, 999999999))
+        user_id = await database.execute(
+            users.insert()
+            .values(
+                chat_id=chat_id,
+                first_name=f"TestUser_{generate_random_string(4)}",
+                username=f"user_{chat_id}",
+                created_at=now,
+                updated_at=now,
+            )
+            .returning(users.c.id)
+        )
+        cashbox_id = await database.execute(
+            cboxes.insert()
+            .values(name="Касса категорий", balance=0.0, created_at=now, updated_at=now)
+            .returning(cboxes.c.id)
+        )
+        relation_id = await database.execute(
+            users_cboxes_relation.insert()
+            .values(
+                user=user_id,
+                cashbox_id=cashbox_id,
+                token=hashlib.sha256(f"{chat_id}{now}".encode()).hexdigest(),
+                is_owner=True,
+                status=True,
+                created_at=now,
+                updated_at=now,
+            )
+            .returning(users_cboxes_relation.c.id)
+        )
+        price_type_id = await database.execute(
+            price_types.insert()
+            .values(name="chatting", owner=relation_id, cashbox=cashbox_id)
+            .returning(price_types.c.id)
+        )
+
+        root = await self.create(service)
+        child = await self.create(service, root)
+        other_root = await self.create(service)
+        nomenclature_ids = []
+        for category_id in (root, child, child):
+            nomenclature_id = await database.execute(
+                nomenclature.insert()
+                .values(
+                    name=f"Товар {generate_random_string(4)}",
+                    owner=relation_id,
+                    cashbox=cashbox_id,
+                    global_category_id=category_id,
+                    is_deleted=False,
+                )
+                .returning(nomenclature.c.id)
+            )
+            await database.execute(
+                prices.insert().values(
+                    price_type=price_type_id,
+                    price=100,
+                    nomenclature=nomenclature_id,
+                    owner=relation_id,
+                    cashbox=cashbox_id,
+                    is_deleted=False,
+                )
+            )
+            nomenclature_ids.append(nomenclature_id)
+        await refresh_nomenclature_categories(nomenclature_ids)
+
+        async def assert_rollup():
+            for category_id in (root, child, other_root):
+                assert await stored_products(category_id) == (
+                    await parent_walk_products(category_id)
+                )
+
+        await assert_rollup()
+        assert await stored_products(root) == 3
+
+        # Поддерево переезжает: товары уходят из свертки старого предка
+        await service.update_global_category(
+            child, GlobalCategoryUpdate(parent_id=other_root)
+        )
+        await assert_rollup()
+        assert await stored_products(other_root) == 2
+
+        # Неактивная категория скрывает свои товары из поддерева предка
+        await service.update_global_category(
+            child, GlobalCategoryUpdate(is_active=False)
+        )
+        await assert_rollup()
+        assert await stored_products(other_root) == 0
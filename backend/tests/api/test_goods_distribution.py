@@ -0,0 +1,243 @@
+import datetime
+import hashlib
+import random
+import string
+import sys
+from collections import Counter
+
+import pytest
+import pytest_asyncio
+
+sys.path.insert(0, "/backend")
+from const import SaleOperations
+from database.db import (
+    cboxes,
+    database,
+    distribution_docs,
+    distribution_docs_operations,
+    docs_purchases,
+    docs_purchases_goods,
+    docs_sales,
+    docs_sales_goods,
+    fifo_settings,
+    nomenclature,
+    organizations,
+    users,
+    users_cboxes_relation,
+)
+from functions.goods_distribution import distribute
+
+from backend.main import app
+
+
+def generate_random_string(length=8):
+    return "".join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+
+async def create_purchase(setup, dated, quantity, price):
+    doc_id = await database.execute(
+        docs_purchases.insert()
+        .values(
+            dated=dated,
+            organization=setup["organization_id"],
+            cashbox=setup["cashbox_id"],
+            created_by=setup["relation_id"],
+            is_deleted=False,
+        )
+        .returning(docs_purchases.c.id)
+    )
+    await database.execute(
+        docs_purchases_goods.insert().values(
+            docs_purchases_id=doc_id,
+            nomenclature=setup["nomenclature_id"],
+            quantity=quantity,
+            price=price,
+        )
+    )
+    return doc_id
+
+
+async def create_sale(setup, dated, quantity, price):
+    doc_id = await database.execute(
+        docs_sales.insert()
+        .values(
+            dated=dated,
+            operation=SaleOperations.realization,
+            organization=setup["organization_id"],
+            cashbox=setup["cashbox_id"],
+            created_by=setup["relation_id"],
+            is_deleted=False,
+        )
+        .returning(docs_sales.c.id)
+    )
+    await database.execute(
+        docs_sales_goods.insert().values(
+            docs_sales_id=doc_id,
+            nomenclature=setup["nomenclature_id"],
+            quantity=quantity,
+            price=price,
+        )
+    )
+    return doc_id
+
+
+async def fetch_docs(organization_id):
+    return await database.fetch_all(
+        distribution_docs.select()
+        .where(distribution_docs.c.organization == organization_id)
+        .order_by(distribution_docs.c.id)
+    )
+
+
+async def fetch_operations(distribution_doc_id):
+    """Операции документа без служебных полей: для сравнения двух прогонов"""
+    rows = await database.fetch_all(
+        distribution_docs_operations.select().where(
+            distribution_docs_operations.c.distribution_fifo == distribution_doc_id
+        )
+    )
+    return Counter(
+        (
+            row.document_sale,
+            row.document_purchase,
+            row.nomenclature,
+            row.outgoing_amount,
+            row.end_amount,
+            round(row.end_price, 6),
+        )
+        for row in rows
+    )
+
+
+class TestGoodsDistribution:
+    @pytest_asyncio.fixture(scope="function")
+    async def setup(self):
+        await app.router.startup()
+        now = int(datetime.datetime.now().timestamp())
+        chat_id = str(random.randint(100000000, 999999999))
+
+        user_id = await database.execute(
+            users.insert()
+            .values(
+                chat_id=chat_id,
+                first_name=f"TestUser_{generate_random_string(4)}",
+                username=f"user_{chat_id}",
+                created_at=now,
+                updated_at=now,
+            )
+            .returning(users.c.id)
+        )
+        cashbox_id = await database.execute(
+            cboxes.insert()
+            .values(name="Касса FIFO", balance=0.0, created_at=now, updated_at=now)
+            .returning(cboxes.c.id)
+        )
+        relation_id = await database.execute(
+            users_cboxes_relation.insert()
+            .values(
+                user=user_id,
+                cashbox_id=cashbox_id,
+                token=hashlib.sha256(f"{chat_id}{now}".encode()).hexdigest(),
+                is_owner=True,
+                status=True,
+                created_at=now,
+                updated_at=now,
+            )
+            .returning(users_cboxes_relation.c.id)
+        )
+        organization_id = await database.execute(
+            organizations.insert()
+            .values(
+                type="OOO",
+                short_name=f"TestOrg{generate_random_string(4)}",
+                owner=relation_id,
+                cashbox=cashbox_id,
+            )
+            .returning(organizations.c.id)
+        )
+        nomenclature_id = await database.execute(
+            nomenclature.insert()
+            .values(
+                name=f"FIFO {generate_random_string(4)}",
+                owner=relation_id,
+                cashbox=cashbox_id,
+            )
+            .returning(nomenclature.c.id)
+        )
+        period_start = now - 3600
+        await database.execute(
+            fifo_settings.insert().values(
+                organization_id=organization_id,
+                fully_closed_date=period_start,
+                preview_close_period_seconds=600,
+                in_progress=False,
+            )
+        )
+
+        yield {
+            "cashbox_id": cashbox_id,
+            "relation_id": relation_id,
+            "organization_id": organization_id,
+            "nomenclature_id": nomenclature_id,
+            "period_start": period_start,
+            "period_end": period_start + 100,
+        }
+        await app.router.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_close_after_preview_without_new_documents(self, setup):
+        organization_id = setup["organization_id"]
+        period = {
+            "period_start": setup["period_start"],
+            "period_end": setup["period_end"],
+        }
+        purchase_id = await create_purchase(setup, period["period_start"] + 1, 10, 1000)
+        sale_id = await create_sale(setup, period["period_start"] + 2, 4, 600)
+
+        await distribute(organization_id, mode="preview", **period)
+        # Новых документов нет, но закрытие все равно дает полный документ
+        await distribute(organization_id, mode="closing", **period)
+
+        closing = [
+            doc for doc in await fetch_docs(organization_id) if not doc.is_preview
+        ]
+        assert len(closing) == 1
+        operations = await fetch_operations(closing[0].id)
+        sales = [key for key in operations if key[0] == sale_id]
+        lots = [key for key in operations if key[1] == purchase_id]
+        assert [key[3] for key in sales] == [4]
+        assert [key[4] for key in lots] == [6]
+
+        setting = await database.fetch_one(
+            fifo_settings.select().where(
+                fifo_settings.c.organization_id == organization_id
+            )
+        )
+        assert setting.fully_closed_date == period["period_end"]
+        assert setting.blocked_date == period["period_end"]
+
+    @pytest.mark.asyncio
+    async def test_incremental_preview_matches_rebuild(self, setup):
+        organization_id = setup["organization_id"]
+        period = {
+            "period_start": setup["period_start"],
+            "period_end": setup["period_end"],
+        }
+        purchase_id = await create_purchase(setup, period["period_start"] + 1, 10, 1000)
+        first_sale_id = await create_sale(setup, period["period_start"] + 2, 4, 600)
+        await distribute(organization_id, mode="preview", **period)
+
+        second_sale_id = await create_sale(setup, period["period_start"] + 3, 3, 450)
+        await distribute(organization_id, mode="preview", **period)
+
+        # Прошлое превью заменено: остается одно полное превью
+        docs = await fetch_docs(organization_id)
+        assert len(docs) == 1 and docs[0].is_preview
+        incremental = await fetch_operations(docs[0].id)
+        assert {key[0] for key in incremental} == {None, first_sale_id, second_sale_id}
+        assert [key[4] for key in incremental if key[1] == purchase_id] == [3]
+
+        await distribute(organization_id, mode="preview", full_rebuild=True, **period)
+        docs = await fetch_docs(organization_id)
+        assert len(docs) == 1 and docs[0].is_preview
+        assert await fetch_operations(docs[0].id) == incremental
@@ -0,0 +1,189 @@
+import asyncio
+import datetime
+import hashlib
+import random
+import string
+import sys
+
+import pytest
+import pytest_asyncio
+
+sys.path.insert(0, "/backend")
+from api.loyality_transactions.balances import (
+    apply_transactions,
+    insert_transactions,
+    recalculate_cards,
+)
+from database.db import (
+    cboxes,
+    database,
+    loyality_cards,
+    loyality_transactions,
+    organizations,
+    users,
+    users_cboxes_relation,
+)
+
+from backend.main import app
+
+
+def generate_random_string(length=8):
+    return "".join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+
+async def full_recompute(card_id):
+    """Баланс карты по всей истории операций - как до ведения дельтами"""
+    rows = await database.fetch_all(
+        loyality_transactions.select().where(
+            loyality_transactions.c.loyality_card_id == card_id,
+            loyality_transactions.c.status.is_(True),
+            loyality_transactions.c.is_deleted.is_(False),
+        )
+    )
+    income = sum(row.amount for row in rows if row.type == "accrual")
+    outcome = sum(row.amount for row in rows if row.type == "withdraw")
+    return income, outcome, round(max(income - outcome, 0), 2)
+
+
+async def card_totals(card_id):
+    card = await database.fetch_one(
+        loyality_cards.select().where(loyality_cards.c.id == card_id)
+    )
+    return card.income, card.outcome, card.balance
+
+
+def transaction(card, type_, amount):
+    return {
+        "type": type_,
+        "amount": amount,
+        "loyality_card_id": card["card_id"],
+        "cashbox": card["cashbox_id"],
+        "created_by_id": card["relation_id"],
+        "status": True,
+        "is_deleted": False,
+    }
+
+
+class TestLoyalityBalances:
+    @pytest_asyncio.fixture(scope="function")
+    async def card(self):
+        await app.router.startup()
+        now = int(datetime.datetime.now().timestamp())
+        chat_id = str(random.randint(100000000, 999999999))
+
+        user_id = await database.execute(
+            users.insert()
+            .values(
+                chat_id=chat_id,
+                first_name=f"TestUser_{generate_random_string(4)}",
+                username=f"user_{chat_id}",
+                created_at=now,
+                updated_at=now,
+            )
+            .returning(users.c.id)
+        )
+        cashbox_id = await database.execute(
+            cboxes.insert()
+            .values(name="Касса баланса", balance=0.0, created_at=now, updated_at=now)
+            .returning(cboxes.c.id)
+        )
+        relation_id = await database.execute(
+            users_cboxes_relation.insert()
+            .values(
+                user=user_id,
+                cashbox_id=cashbox_id,
+                token=hashlib.sha256(f"{chat_id}{now}".encode()).hexdigest(),
+                is_owner=True,
+                status=True,
+                created_at=now,
+                updated_at=now,
+            )
+            .returning(users_cboxes_relation.c.id)
+        )
+        organization_id = await database.execute(
+            organizations.insert()
+            .values(
+                type="OOO",
+                short_name=f"TestOrg{generate_random_string(4)}",
+                owner=relation_id,
+                cashbox=cashbox_id,
+            )
+            .returning(organizations.c.id)
+        )
+        card_id = await database.execute(
+            loyality_cards.insert()
+            .values(
+                card_number=random.randint(10**10, 10**11),
+                organization_id=organization_id,
+                cashbox_id=cashbox_id,
+                created_by_id=relation_id,
+                balance=0.0,
+                income=0.0,
+                outcome=0.0,
+                status_card=True,
+                is_deleted=False,
+            )
+            .returning(loyality_cards.c.id)
+        )
+
+        yield {
+            "card_id": card_id,
+            "cashbox_id": cashbox_id,
+            "relation_id": relation_id,
+        }
+        await app.router.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_deltas_match_full_recompute(self, card):
+        ids = await insert_transactions(
+            [
+                transaction(card, "accrual", 100),
+                transaction(card, "accrual", 50.5),
+                transaction(card, "withdraw", 30.25),
+            ]
+        )
+
+        # Удаление операции: дельта вычитается до изменения строки
+        async with database.transaction():
+            await apply_transactions([ids[1]], sign=-1)
+            await database.execute(
+                loyality_transactions.update()
+                .where(loyality_transactions.c.id == ids[1])
+                .values(is_deleted=True)
+            )
+
+        assert await card_totals(card["card_id"]) == pytest.approx(
+            await full_recompute(card["card_id"])
+        )
+        # Накопленные дельты не расходятся с полным пересчетом
+        assert await recalculate_cards([card["card_id"]]) == []
+
+    @pytest.mark.asyncio
+    async def test_recalculate_repairs_drift(self, card):
+        await insert_transactions([transaction(card, "accrual", 70)])
+        await database.execute(
+            loyality_cards.update()
+            .where(loyality_cards.c.id == card["card_id"])
+            .values(balance=1.0)
+        )
+
+        repaired = await recalculate_cards([card["card_id"]])
+
+        assert [row.id for row in repaired] == [card["card_id"]]
+        assert await card_totals(card["card_id"]) == pytest.approx(
+            await full_recompute(card["card_id"])
+        )
+
+    @pytest.mark.asyncio
+    async def test_recalculate_keeps_concurrent_deltas(self, card):
+        await asyncio.gather(
+            *[
+                insert_transactions([transaction(card, "accrual", 10)])
+                for _ in range(10)
+            ],
+            *[recalculate_cards([card["card_id"]]) for _ in range(5)],
+        )
+
+        assert await card_totals(card["card_id"]) == pytest.approx(
+            await full_recompute(card["card_id"])
+        )
@@ -0,0 +1,151 @@
+import datetime
+import hashlib
+import random
+import string
+import sys
+
+import pytest
+import pytest_asyncio
+
+sys.path.insert(0, "/backend")
+from api.marketplace.service.products_list_service.schemas import (
+    MarketplaceProductsRequest,
+    MarketplaceSort,
+)
+from api.marketplace.service.products_list_service.service import (
+    MarketplaceProductsListService,
+)
+from database.db import (
+    cboxes,
+    database,
+    nomenclature,
+    price_types,
+    prices,
+    users,
+    users_cboxes_relation,
+)
+
+from backend.main import app
+
+PAGE_SIZE = 2
+
+
+def generate_random_string(length=8):
+    return "".join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+
+async def walk_pages(service, **params):
+    """Выдача постранично через page - как до keyset-пагинации"""
+    ids, page = [], 1
+    while True:
+        result = await service.get_products(
+            MarketplaceProductsRequest(page=page, size=PAGE_SIZE, **params)
+        )
+        if not result.result:
+            return ids
+        ids += [product.id for product in result.result]
+        page += 1
+
+
+async def walk_cursor(service, **params):
+    ids, cursor = [], None
+    while True:
+        result = await service.get_products(
+            MarketplaceProductsRequest(size=PAGE_SIZE, cursor=cursor, **params)
+        )
+        ids += [product.id for product in result.result]
+        cursor = result.next_cursor
+        if cursor is None:
+            return ids
+
+
+class TestMarketplaceProductsPagination:
+    @pytest_asyncio.fixture(scope="function")
+    async def seller(self):
+        await app.router.startup()
+        now = int(datetime.datetime.now().timestamp())
+        chat_id = str(random.randint(100000000, 999999999))
+        seller_name = f"TestSeller{generate_random_string(8)}"
+
+        user_id = await database.execute(
+            users.insert()
+            .values(
+                chat_id=chat_id,
+                first_name=f"TestUser_{generate_random_string(4)}",
+                username=f"user_{chat_id}",
+                created_at=now,
+                updated_at=now,
+            )
+            .returning(users.c.id)
+        )
+        cashbox_id = await database.execute(
+            cboxes.insert()
+            .values(name=seller_name, balance=0.0, created_at=now, updated_at=now)
+            .returning(cboxes.c.id)
+        )
+        relation_id = await database.execute(
+            users_cboxes_relation.insert()
+            .values(
+                user=user_id,
+                cashbox_id=cashbox_id,
+                token=hashlib.sha256(f"{chat_id}{now}".encode()).hexdigest(),
+                is_owner=True,
+                status=True,
+                created_at=now,
+                updated_at=now,
+            )
+            .returning(users_cboxes_relation.c.id)
+        )
+        price_type_id = await database.execute(
+            price_types.insert()
+            .values(name="chatting", owner=relation_id, cashbox=cashbox_id)
+            .returning(price_types.c.id)
+        )
+
+        # Половина товаров без дат: их ключ сортировки был NULL
+        for index in range(5):
+            nomenclature_id = await database.execute(
+                nomenclature.insert()
+                .values(
+                    name=f"Товар {index % 3}",
+                    owner=relation_id,
+                    cashbox=cashbox_id,
+                    is_deleted=False,
+                )
+                .returning(nomenclature.c.id)
+            )
+            if index % 2:
+                await database.execute(
+                    nomenclature.update()
+                    .where(nomenclature.c.id == nomenclature_id)
+                    .values(created_at=None, updated_at=None)
+                )
+            await database.execute(
+                prices.insert().values(
+                    price_type=price_type_id,
+                    price=100 + index,
+                    nomenclature=nomenclature_id,
+                    owner=relation_id,
+                    cashbox=cashbox_id,
+                    is_deleted=False,
+                )
+            )
+
+        yield seller_name
+        await app.router.shutdown()
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "sort_by",
+        [MarketplaceSort.created_at, MarketplaceSort.updated_at, MarketplaceSort.name],
+    )
+    @pytest.mark.parametrize("sort_order", ["asc", "desc"])
+    async def test_cursor_walk_matches_pages(self, seller, sort_by, sort_order):
+        service = MarketplaceProductsListService()
+        params = {"seller_name": seller, "sort_by": sort_by, "sort_order": sort_order}
+
+        by_pages = await walk_pages(service, **params)
+        by_cursor = await walk_cursor(service, **params)
+
+        assert len(by_pages) == 5
+        assert by_cursor == by_pages
@@ -51,6 +51,8 @@ from common.amqp_messaging.common.impl.models.QueueSettingsModel import (
 from common.amqp_messaging.common.impl.RabbitFactory import RabbitFactory
 from common.amqp_messaging.models.RabbitMqSettings import RabbitMqSettings
 from database.db import database
+from segments.events.handlers import SegmentChangeHandler
+from segments.events.messages import SegmentChangeMessage
 
 
 async def startup():
@@ -94,6 +96,7 @@ async def startup():
     await rabbitmq_messaging.subscribe(
         CreatePurchaseAutoExpenseMessage, CreatePurchaseAutoExpenseHandler()
     )
+    await rabbitmq_messaging.subscribe(SegmentChangeMessage, SegmentChangeHandler())
 
     await rabbitmq_messaging.install(
         [
@@ -107,6 +110,7 @@ async def startup():
             QueueSettingsModel(queue_name="apple_wallet_card_update", prefetch_count=1),
             QueueSettingsModel(queue_name="create_marketplace_order", prefetch_count=1),
             QueueSettingsModel(queue_name="purchase.auto_expense", prefetch_count=1),
+            QueueSettingsModel(queue_name="segments.changes", prefetch_count=1),
         ]
     )
     await asyncio.Future()
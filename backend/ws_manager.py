@@ -1,27 +1,205 @@
-from typing import Dict, List
+"""
+Рассылка сообщений по веб-сокетам.
 
+Соединения живут в памяти конкретного воркера uvicorn, а отправлять
+сообщения могут любые процессы: API, джобы (start_jobs.py), консьюмеры
+(worker.py). Поэтому отправка идет через fanout-обменник RabbitMQ
+(WS_BUS_EXCHANGE): каждый воркер API подписан на него своей временной
+очередью и доставляет сообщение тем сокетам, что подключены к нему.
+
+Процесс без подписки (джобы, консьюмеры) только публикует. Если RabbitMQ
+недоступен или шина отключена (WS_BUS_ENABLED=false), сообщение
+доставляется локально, как раньше.
+
+Через ту же шину воркеры получают сброс кеша токенов (functions/auth_cache.py)
+"""
+
+import asyncio
+import json
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Optional
+
+import aio_pika
 from fastapi import WebSocket
 
+logger = logging.getLogger(__name__)
+
+WS_BUS_ENABLED = os.getenv("WS_BUS_ENABLED", "true").lower() in ("1", "true", "yes")
+WS_BUS_EXCHANGE = os.getenv("WS_BUS_EXCHANGE", "ws.fanout")
+# Пауза перед повторным подключением публикующего процесса после ошибки
+WS_BUS_RETRY_SECONDS = float(os.getenv("WS_BUS_RETRY_SECONDS", 30))
+
+Handler = Callable[[object, dict], Awaitable[None]]
+
+
+class WebSocketBus:
+    def __init__(self, exchange_name: str = WS_BUS_EXCHANGE):
+        self.exchange_name = exchange_name
+        self.handlers: Dict[str, Handler] = {}
+        self.subscribed = False
+        self._connection = None
+        self._channel = None
+        self._exchange = None
+        self._queue = None
+        self._consumer_tag = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._retry_at = 0.0
+
+    def register(self, target: str, handler: Handler):
+        """handler(key, message) доставляет сообщение локальным сокетам"""
+        self.handlers[target] = handler
+
+    @property
+    def enabled(self) -> bool:
+        return WS_BUS_ENABLED and bool(os.getenv("RABBITMQ_HOST"))
+
+    async def _connect(self):
+        self._connection = await aio_pika.connect_robust(
+            host=os.getenv("RABBITMQ_HOST"),
+            port=int(os.getenv("RABBITMQ_PORT", 5672)),
+            login=os.getenv("RABBITMQ_USER", "guest"),
+            password=os.getenv("RABBITMQ_PASS", "guest"),
+            virtualhost=os.getenv("RABBITMQ_VHOST", "/"),
+        )
+        self._channel = await self._connection.channel()
+        self._exchange = await self._channel.declare_exchange(
+            self.exchange_name, aio_pika.ExchangeType.FANOUT, durable=True
+        )
+
+    async def _ensure_exchange(self):
+        if self._exchange is not None:
+            return self._exchange
+        loop = asyncio.get_running_loop()
+        if loop.time() < self._retry_at:
+            return None
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._exchange is None and loop.time() >= self._retry_at:
+                try:
+                    await self._connect()
+                except Exception as e:
+                    self._retry_at = loop.time() + WS_BUS_RETRY_SECONDS
+                    logger.warning(f"WebSocket bus is unavailable: {e}")
+                    await self._close()
+        return self._exchange
+
+    async def start(self):
+        """Подписка воркера API: временная очередь, привязанная к обменнику"""
+        if self.subscribed or not self.enabled:
+            return
+        if await self._ensure_exchange() is None:
+            return
+        self._queue = await self._channel.declare_queue(
+            exclusive=True, auto_delete=True
+        )
+        await self._queue.bind(self._exchange)
+        self._consumer_tag = await self._queue.consume(self._on_message, no_ack=True)
+        self.subscribed = True
+
+    async def stop(self):
+        if self._queue is not None and self._consumer_tag is not None:
+            try:
+                await self._queue.cancel(self._consumer_tag)
+            except Exception:
+                pass
+        self.subscribed = False
+        await self._close()
+
+    async def _close(self):
+        connection = self._connection
+        self._connection = None
+        self._channel = None
+        self._exchange = None
+        self._queue = None
+        self._consumer_tag = None
+        if connection is not None:
+            try:
+                await connection.close()
+            except Exception:
+                pass
+
+    async def publish(self, target: str, key, message: dict):
+        """
+        Подписанный воркер только публикует: сообщение вернется к нему
+        из обменника вместе со всеми остальными. Без подписки сообщение
+        публикуется для воркеров API и доставляется локально
+        """
+        published = False
+        if self.enabled:
+            published = await self._publish(target, key, message)
+        if not (published and self.subscribed):
+            await self.deliver(target, key, message)
+
+    async def _publish(self, target: str, key, message: dict) -> bool:
+        exchange = await self._ensure_exchange()
+        if exchange is None:
+            return False
+        body = json.dumps(
+            {"target": target, "key": key, "message": message}, default=str
+        ).encode()
+        try:
+            await exchange.publish(aio_pika.Message(body=body), routing_key="")
+        except Exception as e:
+            logger.warning(f"Failed to publish to WebSocket bus: {e}")
+            return False
+        return True
+
+    async def deliver(self, target: str, key, message: dict):
+        handler = self.handlers.get(target)
+        if handler is None:
+            return
+        try:
+            await handler(key, message)
+        except Exception as e:
+            logger.warning(f"Failed to deliver WebSocket message: {e}")
+
+    async def _on_message(self, incoming):
+        try:
+            payload = json.loads(incoming.body)
+        except ValueError:
+            return
+        await self.deliver(
+            payload.get("target"), payload.get("key"), payload["message"]
+        )
+
+
+bus = WebSocketBus()
+
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[Dict] = []
+        # token -> {id(socket): socket}; WebSocket в Starlette - Mapping
+        # и не хешируется
+        self.active_connections: Dict[str, Dict[int, WebSocket]] = {}
+        bus.register("token", self.deliver)
 
     async def connect(self, token: str, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append({"token": token, "socket": websocket})
+        self.active_connections.setdefault(token, {})[id(websocket)] = websocket
 
     async def disconnect(self, token: str, ws: WebSocket):
         # await ws.close()
-        self.active_connections.remove({"token": token, "socket": ws})
+        sockets = self.active_connections.get(token)
+        if sockets is None:
+            return
+        sockets.pop(id(ws), None)
+        if not sockets:
+            del self.active_connections[token]
 
     async def send_message(self, token: str, message: dict):
-        try:
-            matches = [x for x in self.active_connections if x["token"] == token]
-            for ws in matches:
-                await ws["socket"].send_json(message)
-        except Exception as e:
-            print(e)
+        await bus.publish("token", token, message)
+
+    async def deliver(self, token: str, message: dict):
+        for ws in list(self.active_connections.get(token, {}).values()):
+            try:
+                await ws.send_json(message)
+            except Exception:
+                # Сокет закрыт без disconnect (обрыв соединения) - убираем
+                # его, чтобы следующие сообщения не отправлялись в мертвый сокет
+                logger.exception("Failed to send WebSocket message, dropping socket")
+                await self.disconnect(token, ws)
 
 
 manager = ConnectionManager()